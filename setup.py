@@ -13,6 +13,7 @@ console_scripts = [
     "dials.swirly_eyes=dlstbx.cli.swirly_eyes:run",
     "dlstbx.align_crystal=dlstbx.cli.align_crystal:run",
     "dlstbx.archive_ancient_visits=dlstbx.cli.archive_ancient_visits:run",
+    "dlstbx.dc_sim_load=dlstbx.cli.dc_sim_load:run",
     "dlstbx.dc_sim_verify=dlstbx.cli.dc_sim_verify:run",
     "dlstbx.ep_predict_phase=dlstbx.cli.ep_predict_phase:run",
     "dlstbx.ep_predict_results=dlstbx.cli.ep_predict_results:runmain",
@@ -26,6 +27,8 @@ console_scripts = [
     "dlstbx.gridscan3d=dlstbx.cli.gridscan3d:run",
     "dlstbx.h5rewrite=dlstbx.cli.h5rewrite:cli",
     "dlstbx.hdf5_missing_frames=dlstbx.cli.hdf5_missing_frames:run",
+    "dlstbx.import_profile=dlstbx.cli.import_profile:run",
+    "dlstbx.message_benchmark=dlstbx.cli.message_benchmark:run",
     "dlstbx.mimas=dlstbx.cli.mimas:run",
     "dlstbx.mmcif_gen_dls_json=dlstbx.cli.mmcif_gen_dls_json:run",
     "dlstbx.mr_predict_results=dlstbx.cli.mr_predict_results:runmain",
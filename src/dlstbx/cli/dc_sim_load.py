@@ -0,0 +1,121 @@
+#
+# dlstbx.dc_sim_load
+#   Write synthetic grid scans at detector frame rates, process them with the
+#   filewatcher, per-image-analysis and X-ray centering services in this
+#   process, and report the processing latencies
+#
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import pathlib
+import sys
+import tempfile
+
+from dlstbx.dc_sim.load import LoadGenerator, LoadParameters
+from dlstbx.util.latency import format_table
+
+
+def run(args=None):
+    parser = argparse.ArgumentParser(
+        usage="dlstbx.dc_sim_load [options]",
+        description="Write synthetic SWMR grid scans at a fixed frame rate and "
+        "measure the latency of the processing pipeline.",
+    )
+    parser.add_argument("-?", action="help", help=argparse.SUPPRESS)
+    parser.add_argument(
+        "--directory",
+        type=pathlib.Path,
+        help="Directory to write the collections to (default: a temporary directory)",
+    )
+    parser.add_argument(
+        "--collections",
+        type=int,
+        default=1,
+        help="Number of concurrent collections (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=100,
+        help="Frame rate of each collection in Hz (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--grid",
+        type=int,
+        nargs=2,
+        default=(20, 10),
+        metavar=("X", "Y"),
+        help="Number of grid scan images along x and y (default: 20 10)",
+    )
+    parser.add_argument(
+        "--shape",
+        type=int,
+        nargs=2,
+        default=(512, 512),
+        metavar=("SLOW", "FAST"),
+        help="Image dimensions (default: 512 512)",
+    )
+    parser.add_argument(
+        "--compression",
+        choices=("gzip", "lzf", "bitshuffle"),
+        default="gzip",
+        help="Compression of the image data (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--pia",
+        choices=("synthetic", "dials"),
+        default="synthetic",
+        help="Run the DIALS per-image-analysis service, or a stand-in that "
+        "only reads the images (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--pia-instances",
+        type=int,
+        default=1,
+        help="Number of per-image-analysis services (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=60,
+        help="Seconds to wait for processing after the last image (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--json", type=pathlib.Path, help="Write the report to a JSON file"
+    )
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(args)
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING, format="%(message)s"
+    )
+    logging.getLogger("dlstbx.dc_sim.load").setLevel(logging.INFO)
+
+    with tempfile.TemporaryDirectory(prefix="dc_sim_load_") as tmpdir:
+        parameters = LoadParameters(
+            directory=args.directory or pathlib.Path(tmpdir),
+            collections=args.collections,
+            frame_rate=args.rate,
+            grid=tuple(args.grid),
+            shape=tuple(args.shape),
+            compression=args.compression,
+            timeout=args.timeout,
+            pia=args.pia,
+            pia_instances=args.pia_instances,
+        )
+        report = LoadGenerator(parameters).run()
+
+    print(
+        f"\n{report.images_written} images in {parameters.collections} collections "
+        f"at {parameters.frame_rate:g} Hz, {report.collections_completed} "
+        f"centering results in {report.seconds:.1f}s\n"
+    )
+    print(format_table(report.latencies))
+    if args.json:
+        args.json.write_text(json.dumps(report.as_dict(), indent=2))
+        print(f"\nReport written to {args.json}")
+    if report.collections_completed < parameters.collections:
+        sys.exit(1)
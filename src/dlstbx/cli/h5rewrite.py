@@ -21,6 +21,20 @@ def cli(args=None):
     parser.add_argument(
         "--delay", type=float, help="time delay (in seconds) between writing each image"
     )
+    parser.add_argument(
+        "--no-direct-chunks",
+        dest="direct_chunks",
+        action="store_false",
+        help="always decompress and recompress images, even if their compressed "
+        "chunks could be copied directly",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="number of processes writing VDS block files in parallel "
+        "(default: %(default)s)",
+    )
     parser.add_argument("-v", "--verbose", dest="verbose", action="store_true")
 
     args = parser.parse_args(args=args)
@@ -35,6 +49,8 @@ def cli(args=None):
         zeros=args.zeros,
         image_range=args.range,
         delay=args.delay,
+        direct_chunks=args.direct_chunks,
+        processes=args.processes,
     )
 
 
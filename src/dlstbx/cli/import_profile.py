@@ -0,0 +1,104 @@
+#
+# dlstbx.import_profile
+#   Report how long it takes to import each zocalo service
+#
+
+from __future__ import annotations
+
+import argparse
+import collections
+import re
+import subprocess
+import sys
+from typing import NamedTuple, Optional
+
+from dlstbx.util.plugins import entry_points
+
+_IMPORTTIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+# Load a single service class in a fresh interpreter and print the time taken
+_LOAD_SERVICE = """
+import sys, time
+start = time.perf_counter()
+from importlib.metadata import entry_points
+(service,) = [e for e in entry_points(group="workflows.services") if e.name == sys.argv[1]]
+service.load()
+print(time.perf_counter() - start)
+"""
+
+
+class ImportProfile(NamedTuple):
+    service: str
+    seconds: Optional[float]
+    packages: dict[str, float]
+    error: Optional[str] = None
+
+
+def profile_service(service: str) -> ImportProfile:
+    """
+    Import a service class in a new Python process with -X importtime, and
+    add up the time spent importing each top level package.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _LOAD_SERVICE, service],
+        capture_output=True,
+        text=True,
+    )
+    packages: collections.Counter[str] = collections.Counter()
+    other_output = []
+    for line in result.stderr.splitlines():
+        if m := _IMPORTTIME.match(line):
+            packages[m.group(4).split(".")[0]] += int(m.group(1)) / 1e6
+        elif not line.startswith("import time:"):
+            other_output.append(line)
+    if result.returncode:
+        error = other_output[-1] if other_output else f"exit code {result.returncode}"
+        return ImportProfile(service, None, dict(packages), error=error)
+    return ImportProfile(service, float(result.stdout.split()[-1]), dict(packages))
+
+
+def run(args=None):
+    parser = argparse.ArgumentParser(
+        usage="dlstbx.import_profile [options] [SERVICE ...]",
+        description="Measure the time taken to import zocalo services, "
+        "and show which packages contribute most to it.",
+    )
+    parser.add_argument(
+        "services",
+        nargs="*",
+        metavar="SERVICE",
+        help="Services to profile (default: all known services)",
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=5,
+        help="Number of packages to show for each service (default: %(default)s)",
+    )
+    args = parser.parse_args(args)
+
+    known_services = sorted(e.name for e in entry_points("workflows.services"))
+    unknown = set(args.services) - set(known_services)
+    if unknown:
+        sys.exit(f"Unknown services: {', '.join(sorted(unknown))}")
+
+    profiles = []
+    for service in args.services or known_services:
+        profile = profile_service(service)
+        profiles.append(profile)
+        if profile.error:
+            print(f"{service:30s}      failed: {profile.error}", flush=True)
+        else:
+            print(f"{service:30s} {profile.seconds:8.2f}s", flush=True)
+
+    print("\nSlowest services:")
+    for profile in sorted(
+        (p for p in profiles if not p.error), key=lambda p: p.seconds, reverse=True
+    ):
+        heaviest = sorted(profile.packages.items(), key=lambda p: p[1], reverse=True)
+        print(
+            f"{profile.service:30s} {profile.seconds:8.2f}s  "
+            + ", ".join(
+                f"{name} {seconds:.2f}s" for name, seconds in heaviest[: args.top]
+            )
+        )
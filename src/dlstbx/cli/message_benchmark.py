@@ -0,0 +1,248 @@
+#
+# dlstbx.message_benchmark
+#   Measure message throughput and latency through the load producer and
+#   receiver services, for a range of message sizes, prefetch counts and
+#   acknowledgement modes
+#
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import logging
+import pathlib
+import sys
+import time
+from typing import Any, Optional
+
+from workflows.transport.offline_transport import OfflineTransport
+
+from dlstbx.services.load_producer import LoadProducer
+from dlstbx.services.load_receiver import LoadReceiver
+from dlstbx.util.memory_transport import MemoryBroker, MemoryTransport, running_service
+from dlstbx.util.message_benchmark import MODES, new_run_id
+
+QUEUE = "transient.benchmark"
+
+# Fields identifying a benchmark case in a report
+CASE = ("transport", "message_size", "prefetch_count", "mode")
+
+
+def benchmark(
+    transport: str = "memory",
+    message_size: int = 1024,
+    count: int = 10000,
+    prefetch_count: int = 0,
+    mode: str = "none",
+    transaction_size: int = 10,
+    timeout: float = 60,
+) -> dict[str, Any]:
+    """
+    Send count messages from a LoadProducer to a LoadReceiver service, and
+    return the producer and receiver statistics.
+
+    With the 'memory' transport both services are connected to an in-process
+    broker. The 'offline' transport does not deliver messages, so only the
+    producer is run, to measure the cost of serialising and sending messages.
+    In 'transaction' mode the producer sends messages in transactions of
+    transaction_size messages, and the receiver acknowledges every message
+    in a transaction of its own.
+    """
+    run = new_run_id()
+    result: dict[str, Any] = {
+        "transport": transport,
+        "message_size": message_size,
+        "prefetch_count": prefetch_count,
+        "mode": mode,
+        "count": count,
+    }
+    producer_environment = {
+        "destination": QUEUE,
+        "message-size": message_size,
+        "count": count,
+        "transaction-size": transaction_size if mode == "transaction" else 0,
+        "run": run,
+    }
+    receiver_environment = {
+        "destination": QUEUE,
+        "mode": mode,
+        "prefetch-count": prefetch_count,
+    }
+
+    if transport == "offline":
+        with running_service(
+            LoadProducer, OfflineTransport(), producer_environment
+        ) as producer:
+            result["sent_per_second"] = producer.sent / producer.seconds
+        return result
+
+    broker = MemoryBroker()
+    try:
+        with running_service(
+            LoadReceiver, MemoryTransport(broker), receiver_environment
+        ) as receiver:
+            with running_service(
+                LoadProducer, MemoryTransport(broker), producer_environment
+            ) as producer:
+                result["sent_per_second"] = producer.sent / producer.seconds
+            deadline = time.time() + timeout
+            while run not in receiver.reports and time.time() < deadline:
+                time.sleep(0.01)
+            if run in receiver.reports:
+                report = receiver.reports[run]
+            elif run in receiver.runs:
+                report = receiver.runs[run].summary()
+            else:
+                report = {"received": 0, "lost": count}
+            result.update(
+                (key, value)
+                for key, value in report.items()
+                if key not in ("run", "mode", "prefetch_count")
+            )
+    finally:
+        broker.stop()
+    return result
+
+
+def _format(result: dict[str, Any]) -> str:
+    latency = result.get("latency", {})
+
+    def rate(key):
+        return f"{result[key]:10.0f}" if result.get(key) else f"{'-':>10s}"
+
+    def ms(key):
+        return f"{latency[key] * 1000:8.2f}" if key in latency else f"{'-':>8s}"
+
+    return (
+        f"{result['message_size']:>8d} {result['prefetch_count']:>8d} "
+        f"{result['mode']:>11s} {rate('sent_per_second')} "
+        f"{rate('messages_per_second')} {ms('p50')} {ms('p95')} {ms('p99')} "
+        f"{result.get('lost', 0):>6d} {result.get('reordered', 0):>9d}"
+    )
+
+
+def compare(results: list[dict], baseline: list[dict]) -> list[str]:
+    """Describe the change in throughput and latency against a baseline"""
+    previous = {tuple(r.get(k) for k in CASE): r for r in baseline}
+    lines = []
+    for result in results:
+        case = tuple(result.get(k) for k in CASE)
+        if case not in previous:
+            continue
+        changes = []
+        for name, value, before in (
+            (
+                "throughput",
+                result.get("messages_per_second") or result.get("sent_per_second"),
+                previous[case].get("messages_per_second")
+                or previous[case].get("sent_per_second"),
+            ),
+            (
+                "p99 latency",
+                result.get("latency", {}).get("p99"),
+                previous[case].get("latency", {}).get("p99"),
+            ),
+        ):
+            if value and before:
+                changes.append(f"{name} {(value - before) / before:+.1%}")
+        if changes:
+            lines.append(
+                f"{result['message_size']}B, prefetch {result['prefetch_count']}, "
+                f"{result['mode']}: " + ", ".join(changes)
+            )
+    return lines
+
+
+def run(args=None):
+    parser = argparse.ArgumentParser(
+        usage="dlstbx.message_benchmark [options]",
+        description="Measure message throughput and latency between the load "
+        "producer and receiver services, without a message broker.",
+    )
+    parser.add_argument("-?", action="help", help=argparse.SUPPRESS)
+    parser.add_argument(
+        "--transport",
+        choices=("memory", "offline"),
+        default="memory",
+        help="Deliver messages through an in-process broker, or only send them "
+        "with the offline transport (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--count",
+        type=int,
+        default=10000,
+        help="Number of messages in each run (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--size",
+        type=int,
+        nargs="+",
+        default=[1024],
+        help="Message sizes in bytes (default: 1024)",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        nargs="+",
+        default=[0],
+        help="Prefetch counts, 0 for no limit (default: 0)",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=MODES,
+        nargs="+",
+        default=["none"],
+        help="Acknowledgement modes (default: none)",
+    )
+    parser.add_argument(
+        "--transaction-size",
+        type=int,
+        default=10,
+        help="Messages per producer transaction in transaction mode "
+        "(default: %(default)s)",
+    )
+    parser.add_argument("--json", type=pathlib.Path, help="Write results to a file")
+    parser.add_argument(
+        "--compare",
+        type=pathlib.Path,
+        help="Compare against the results of a previous run",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(args)
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING, format="%(message)s"
+    )
+    baseline: Optional[list[dict]] = None
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())["results"]
+
+    print(
+        f"{'size':>8s} {'prefetch':>8s} {'mode':>11s} {'sent/s':>10s} "
+        f"{'recv/s':>10s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} "
+        f"{'lost':>6s} {'reordered':>9s}"
+    )
+    results = []
+    for size, prefetch, mode in itertools.product(args.size, args.prefetch, args.mode):
+        result = benchmark(
+            transport=args.transport,
+            message_size=size,
+            count=args.count,
+            prefetch_count=prefetch,
+            mode=mode,
+            transaction_size=args.transaction_size,
+        )
+        results.append(result)
+        print(_format(result), flush=True)
+
+    if args.json:
+        args.json.write_text(
+            json.dumps({"transport": args.transport, "results": results}, indent=2)
+        )
+        print(f"\nResults written to {args.json}")
+    if baseline is not None:
+        print(f"\nChange against {args.compare}:")
+        print("\n".join(compare(results, baseline)) or "No matching results")
+    if any(result.get("lost") for result in results):
+        sys.exit(1)
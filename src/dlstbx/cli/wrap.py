@@ -7,7 +7,6 @@ from __future__ import annotations
 
 import argparse
 import faulthandler
-import importlib.metadata
 import json
 import logging
 import signal
@@ -23,6 +22,7 @@ import zocalo.wrapper
 
 from dlstbx.util import DowngradeErrorsFilter
 from dlstbx.util.colorstreamhandler import ColorStreamHandler
+from dlstbx.util.plugins import LazyPlugins
 
 
 def _enable_faulthandler():
@@ -62,9 +62,7 @@ def run():
     zc = zocalo.configuration.from_file()
     zc.activate()
 
-    known_wrappers = {
-        e.name: e.load for e in importlib.metadata.entry_points(group="zocalo.wrappers")
-    }
+    known_wrappers = LazyPlugins("zocalo.wrappers")
 
     # Set up parser
     parser = argparse.ArgumentParser(usage="dlstbx.wrap [options]")
@@ -128,7 +126,7 @@ def run():
     environment = {"config": zc}
 
     # Instantiate chosen wrapper
-    instance = known_wrappers[args.wrapper]()(environment=environment)
+    instance = known_wrappers[args.wrapper](environment=environment)
     instance.status_thread = st
 
     log = getattr(instance, "log", logging.getLogger("dlstbx.wrap"))
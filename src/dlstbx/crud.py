@@ -1,12 +1,141 @@
 from __future__ import annotations
 
+import collections
 import os
-from typing import List
+import threading
+import time
+from typing import Any, Callable, Hashable, Iterable, List, Optional
 
 import ispyb.sqlalchemy as models
 import sqlalchemy.orm
+from sqlalchemy.dialects import mysql
 
 from dlstbx import schemas
+from dlstbx.util.prometheus_metrics import BasePrometheusMetrics, NoMetrics
+
+
+class EntityCache:
+    """
+    A bounded, time limited cache for ISPyB rows that rarely change.
+
+    Functions in this module that accept a `cache` argument look the entity up
+    here before querying the database. ORM instances are held as detached
+    snapshots and merged into the caller's session on a hit without emitting
+    any SQL, so callers get an attached instance either way. Lookups that find
+    nothing are not cached.
+
+    Entries expire after ttl seconds, and the least recently used entries are
+    dropped once more than maxsize are held. Callers that change one of the
+    few mutable fields (eg. a protein sequence or sample name) should call
+    invalidate(). Hits and misses are recorded with the given metrics object,
+    which must then define a counter metric_name labelled by entity and result.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 4096,
+        ttl: float = 600,
+        metrics: BasePrometheusMetrics | None = None,
+        metric_name: str = "zocalo_ispyb_cache_requests_total",
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.metric_name = metric_name
+        self._metrics = metrics or NoMetrics()
+        self._entries: collections.OrderedDict[tuple[str, Hashable], tuple] = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self,
+        entity: str,
+        key: Hashable,
+        session: sqlalchemy.orm.session.Session,
+        load: Callable[[], Any],
+    ) -> Any:
+        """
+        Return the cached value for (entity, key), calling load() to fetch it
+        from the database if it is not cached or has expired.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((entity, key))
+            if entry is not None and entry[0] <= now:
+                del self._entries[(entity, key)]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end((entity, key))
+                self.hits += 1
+            else:
+                self.misses += 1
+        self._metrics.record_metric(
+            self.metric_name, [entity, "miss" if entry is None else "hit"]
+        )
+        if entry is not None:
+            return _attach(entry[1], session)
+
+        value = load()
+        if value is not None:
+            with self._lock:
+                self._entries[(entity, key)] = (now + self.ttl, _detach(value))
+                self._entries.move_to_end((entity, key))
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, entity: str, key: Hashable | None = None) -> None:
+        """Drop one cached entry, or all entries of an entity type."""
+        with self._lock:
+            if key is not None:
+                self._entries.pop((entity, key), None)
+                return
+            for cached in [k for k in self._entries if k[0] == entity]:
+                del self._entries[cached]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _detach(value: Any) -> Any:
+    # Take a copy of the loaded column values, so that the cached object is
+    # unaffected by anything happening to the instance in the caller's session
+    state = sqlalchemy.inspect(value, raiseerr=False)
+    if state is None:
+        return value
+    snapshot = state.mapper.class_(
+        **{
+            attr.key: getattr(value, attr.key)
+            for attr in state.mapper.column_attrs
+            if attr.key not in state.unloaded
+        }
+    )
+    sqlalchemy.orm.make_transient_to_detached(snapshot)
+    return snapshot
+
+
+def _attach(value: Any, session: sqlalchemy.orm.session.Session) -> Any:
+    if sqlalchemy.inspect(value, raiseerr=False) is None:
+        return value
+    return session.merge(value, load=False)
+
+
+def _cached(
+    cache: EntityCache | None,
+    entity: str,
+    key: Hashable,
+    session: sqlalchemy.orm.session.Session,
+    load: Callable[[], Any],
+) -> Any:
+    if cache is None:
+        return load()
+    return cache.get(entity, key, session, load)
 
 
 def get_data_collection(
@@ -59,6 +188,7 @@ def get_gridinfo_for_dcid(
 def get_blsession_for_dcid(
     dcid: int,
     session: sqlalchemy.orm.session.Session,
+    cache: EntityCache | None = None,
 ) -> models.BLSession | None:
     query = (
         session.query(models.BLSession)
@@ -66,7 +196,26 @@ def get_blsession_for_dcid(
         .join(models.DataCollection)
         .filter(models.DataCollection.dataCollectionId == dcid)
     )
-    return query.first()
+    return _cached(cache, "blsession_for_dcid", dcid, session, query.first)
+
+
+def get_proposal_for_dcid(
+    dcid: int,
+    session: sqlalchemy.orm.session.Session,
+    cache: EntityCache | None = None,
+) -> models.Proposal | None:
+    query = (
+        session.query(models.Proposal)
+        .join(
+            models.BLSession, models.BLSession.proposalId == models.Proposal.proposalId
+        )
+        .join(
+            models.DataCollection,
+            models.DataCollection.SESSIONID == models.BLSession.sessionId,
+        )
+        .filter(models.DataCollection.dataCollectionId == dcid)
+    )
+    return _cached(cache, "proposal_for_dcid", dcid, session, query.first)
 
 
 def get_dcids_for_sample_id(
@@ -135,7 +284,9 @@ def get_crystal_for_dcid(
 
 
 def get_protein_for_dcid(
-    dcid: int, session: sqlalchemy.orm.session.Session
+    dcid: int,
+    session: sqlalchemy.orm.session.Session,
+    cache: EntityCache | None = None,
 ) -> models.Protein | None:
     query = (
         session.query(models.Protein)
@@ -145,7 +296,18 @@ def get_protein_for_dcid(
         .join(models.DataCollection)
         .filter(models.DataCollection.dataCollectionId == dcid)
     )
-    return query.first()
+    return _cached(cache, "protein_for_dcid", dcid, session, query.first)
+
+
+def get_dcg_experiment_type(
+    dcgid: int,
+    session: sqlalchemy.orm.session.Session,
+    cache: EntityCache | None = None,
+) -> str | None:
+    query = session.query(models.DataCollectionGroup.experimentType).filter(
+        models.DataCollectionGroup.dataCollectionGroupId == dcgid
+    )
+    return _cached(cache, "dcg_experiment_type", dcgid, session, query.scalar)
 
 
 def get_visit_team_leader_email(
@@ -204,21 +366,23 @@ def get_priority_processing_for_sample_id(
 def get_detector(
     detector_id: int,
     session: sqlalchemy.orm.session.Session,
+    cache: EntityCache | None = None,
 ) -> models.Detector | None:
     query = session.query(models.Detector).filter(
         models.Detector.detectorId == detector_id
     )
-    return query.first()
+    return _cached(cache, "detector", detector_id, session, query.first)
 
 
 def get_blsample(
     sample_id: int,
     session: sqlalchemy.orm.session.Session,
+    cache: EntityCache | None = None,
 ) -> models.BLSample | None:
     query = session.query(models.BLSample).filter(
         models.BLSample.blSampleId == sample_id
     )
-    return query.first()
+    return _cached(cache, "blsample", sample_id, session, query.first)
 
 
 def get_run_status_for_dcid(
@@ -476,3 +640,92 @@ def insert_xray_centring(
         session.add(db_result)
     session.commit()
     return db_xrc.xrayCentringId
+
+
+def upsert_quality_indicators(
+    quality_indicators: List[dict],
+    session: sqlalchemy.orm.session.Session,
+) -> int:
+    """Insert or update many ImageQualityIndicators rows with a single statement.
+
+    Each row is a dictionary keyed on ImageQualityIndicators column names, and must
+    at least contain dataCollectionId and imageNumber. As with the
+    upsert_quality_indicators stored procedure, existing values are kept where
+    the new value is None.
+    """
+    if not quality_indicators:
+        return 0
+    table = models.ImageQualityIndicators.__table__
+    columns = [
+        c.name
+        for c in table.columns
+        if any(c.name in row for row in quality_indicators)
+    ]
+    stmt = mysql.insert(table).values(
+        [{c: row.get(c) for c in columns} for row in quality_indicators]
+    )
+    stmt = stmt.on_duplicate_key_update(
+        {
+            c: sqlalchemy.func.ifnull(stmt.inserted[c], table.c[c])
+            for c in columns
+            if not table.c[c].primary_key
+        }
+    )
+    session.execute(stmt)
+    session.commit()
+    return len(quality_indicators)
+
+
+def create_processing_job(
+    session: sqlalchemy.orm.session.Session,
+    *,
+    dcid: int,
+    display_name: str,
+    recipe: str,
+    comments: Optional[str] = None,
+    automatic: Optional[bool] = False,
+    parameters: Iterable[tuple[str, Any]] = (),
+    sweeps: Iterable[tuple[int, int, int]] = (),
+) -> int:
+    """Create a ProcessingJob with all of its parameters and image sweeps.
+
+    Parameters are given as (key, value) pairs, and image sweeps as
+    (dataCollectionId, start image, end image) tuples. The parameters and the
+    sweeps are each written with a single batched insert, and everything is
+    committed in one transaction. Returns the new processingJobId.
+    """
+    db_job = models.ProcessingJob(
+        dataCollectionId=dcid,
+        displayName=display_name,
+        comments=comments,
+        recipe=recipe,
+        automatic=automatic,
+    )
+    session.add(db_job)
+    session.flush()
+    jobid = db_job.processingJobId
+    job_parameters = [
+        {
+            "processingJobId": jobid,
+            "parameterKey": key,
+            "parameterValue": value,
+        }
+        for key, value in parameters
+    ]
+    if job_parameters:
+        session.execute(
+            sqlalchemy.insert(models.ProcessingJobParameter), job_parameters
+        )
+    job_sweeps = [
+        {
+            "processingJobId": jobid,
+            "dataCollectionId": sweep_dcid,
+            "startImage": start,
+            "endImage": end,
+        }
+        for sweep_dcid, start, end in sweeps
+    ]
+    if job_sweeps:
+        session.execute(sqlalchemy.insert(models.ProcessingJobImageSweep), job_sweeps)
+    session.commit()
+    return jobid
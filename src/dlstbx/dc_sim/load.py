@@ -0,0 +1,337 @@
+# Generate processing load at detector frame rates
+#
+# This
+# * writes synthetic Eiger-like SWMR collections with swmr/h5maker at a fixed
+#   frame rate, for a number of concurrent collections
+# * sends the start and end messages for each collection
+# * runs the filewatcher, per-image-analysis and X-ray centering services
+#   against an in-process message broker
+# * records the latency of each processing stage
+
+from __future__ import annotations
+
+import contextlib
+import dataclasses
+import logging
+import pathlib
+import threading
+import time
+import uuid
+from typing import Any
+
+import h5py
+import workflows.recipe
+from workflows.services.common_service import CommonService
+
+from dlstbx.services.filewatcher import DLSFileWatcher
+from dlstbx.services.xray_centering import DLSXRayCentering
+from dlstbx.swmr import h5maker
+from dlstbx.util.latency import LatencyRecorder
+from dlstbx.util.memory_transport import (
+    MemoryBroker,
+    MemoryTransport,
+    running_service,
+)
+from dlstbx.util.plugins import LazyPlugins
+
+log = logging.getLogger("dlstbx.dc_sim.load")
+
+PIA_QUEUE = "per_image_analysis"
+XRC_QUEUE = "reduce.xray_centering"
+RESULT_QUEUE = "dc_sim.load.result"
+END_QUEUE = "dc_sim.load.end"
+
+# Names of the recorded latencies
+FILEWATCHER = "filewatcher"
+PER_IMAGE_ANALYSIS = "per-image-analysis"
+XRAY_CENTERING = "xray-centering"
+
+
+@dataclasses.dataclass
+class LoadParameters:
+    "Parameters of a load test"
+
+    # Directory to write the collections to
+    directory: pathlib.Path
+    # Number of collections written at the same time
+    collections: int = 1
+    # Images written per second, for each collection
+    frame_rate: float = 100
+    # Number of images along x and y of each grid scan
+    grid: tuple[int, int] = (20, 10)
+    # Image dimensions
+    shape: tuple[int, int] = (512, 512)
+    compression: str = "gzip"
+    # Seconds to wait for processing to complete after the last image
+    timeout: float = 60
+    # Per-image-analysis implementation, "synthetic" or "dials"
+    pia: str = "synthetic"
+    # Number of service instances processing the per-image-analysis queue
+    pia_instances: int = 1
+
+    @property
+    def image_count(self) -> int:
+        return self.grid[0] * self.grid[1]
+
+
+@dataclasses.dataclass
+class LoadReport:
+    "Outcome of a load test"
+
+    parameters: LoadParameters
+    images_written: int
+    collections_completed: int
+    seconds: float
+    latencies: dict[str, dict[str, float]]
+    messages: dict[str, int]
+
+    def as_dict(self) -> dict[str, Any]:
+        report = dataclasses.asdict(self)
+        report["parameters"]["directory"] = str(self.parameters.directory)
+        return report
+
+
+class SyntheticPerImageAnalysis(CommonService):
+    """
+    A stand-in for the DLS Per-Image-Analysis service for load testing, which
+    reads each image and counts the pixels above a threshold instead of
+    running spot finding. Results are sent in the same format.
+    """
+
+    _service_name = "Synthetic Per-Image-Analysis"
+    _logger_name = "dlstbx.dc_sim.load.pia"
+
+    def initializing(self):
+        self._threshold = int(self._environment.get("threshold", 98))
+        workflows.recipe.wrap_subscribe(
+            self._transport,
+            self._environment.get("queue") or PIA_QUEUE,
+            self.per_image_analysis,
+            acknowledgement=True,
+            log_extender=self.extend_log,
+        )
+
+    def per_image_analysis(self, rw, header, message):
+        with h5py.File(message["hdf5"], "r") as f:
+            image = f["entry/data/data"][message["hdf5-index"]]
+        results = {"n_spots_total": int((image > self._threshold).sum())}
+        # Pass through all file* fields
+        for key in (x for x in message if x.startswith("file")):
+            results[key] = message[key]
+
+        txn = rw.transport.transaction_begin(subscription_id=header["subscription"])
+        rw.transport.ack(header, transaction=txn)
+        rw.set_default_channel("result")
+        rw.send_to("result", results, transaction=txn)
+        rw.transport.transaction_commit(txn)
+
+
+def _block_size(image_count: int, max_block_size: int = 100) -> int:
+    "The largest VDS block size dividing the collection into equal blocks"
+    return max(
+        n
+        for n in range(1, min(image_count, max_block_size) + 1)
+        if image_count % n == 0
+    )
+
+
+def _recipe(parameters: LoadParameters, dcid: int, master_h5: str) -> dict:
+    steps_x, steps_y = parameters.grid
+    return {
+        "1": {
+            "service": "DLS Filewatcher",
+            "queue": "filewatcher",
+            "parameters": {
+                "hdf5": master_h5,
+                "expected-per-image-delay": 1 / parameters.frame_rate,
+                "timeout": parameters.timeout,
+                "log-timeout-as-info": True,
+            },
+            "output": {"every": 2},
+        },
+        "2": {
+            "service": "DLS Per-Image-Analysis",
+            "queue": PIA_QUEUE,
+            "parameters": {},
+            "output": 3,
+        },
+        "3": {
+            "service": "DLS X-Ray Centering",
+            "queue": XRC_QUEUE,
+            "parameters": {
+                "dcid": dcid,
+                "experiment_type": "Mesh",
+                "beamline": "simulated",
+            },
+            "gridinfo": {
+                "steps_x": steps_x,
+                "steps_y": steps_y,
+                "dx_mm": 0.02,
+                "dy_mm": 0.02,
+                "micronsPerPixelX": 1,
+                "micronsPerPixelY": 1,
+                "snapshot_offsetXPixel": 0,
+                "snapshot_offsetYPixel": 0,
+                "snaked": True,
+                "orientation": "horizontal",
+            },
+            "output": {"success": 4},
+        },
+        "4": {
+            "service": "DC load generator",
+            "queue": RESULT_QUEUE,
+            "parameters": {"dcid": dcid},
+        },
+        "start": [(1, [])],
+    }
+
+
+class LoadGenerator:
+    """
+    Write synthetic grid scan collections at a fixed frame rate and measure
+    how long it takes the processing pipeline to catch up.
+
+    Latencies are recorded for
+    * the filewatcher: from an image being written to it being seen,
+    * per-image-analysis: from an image being seen to its result arriving
+      at the X-ray centering queue,
+    * X-ray centering: from the end of a collection to the centering result.
+    """
+
+    def __init__(self, parameters: LoadParameters):
+        self.parameters = parameters
+        self.latencies = LatencyRecorder()
+        self.broker = MemoryBroker()
+        self._lock = threading.Lock()
+        self._written: dict[tuple[str, int], float] = {}
+        self._ended: dict[int, float] = {}
+        self._completed: set[int] = set()
+        self._all_completed = threading.Event()
+        self._images_written = 0
+
+    def _image_written(self, master_h5: str, index: int) -> None:
+        with self._lock:
+            self._written[(master_h5, index)] = time.time()
+            self._images_written += 1
+
+    def _image_seen(self, destination, header, message) -> None:
+        payload = message["payload"]
+        written = self._written.get((payload["hdf5"], payload["hdf5-index"]))
+        if written:
+            self.latencies.record(FILEWATCHER, payload["file-seen-at"] - written)
+
+    def _image_analysed(self, destination, header, message) -> None:
+        self.latencies.record(
+            PER_IMAGE_ANALYSIS, time.time() - message["payload"]["file-seen-at"]
+        )
+
+    def _collection_ended(self, header, message) -> None:
+        self._ended[message["dcid"]] = message["timestamp"]
+
+    def _centering_result(self, rw, header, message) -> None:
+        dcid = rw.recipe_step["parameters"]["dcid"]
+        rw.transport.ack(header)
+        ended = self._ended.get(dcid)
+        if ended:
+            self.latencies.record(XRAY_CENTERING, time.time() - ended)
+        with self._lock:
+            self._completed.add(dcid)
+            if len(self._completed) == self.parameters.collections:
+                self._all_completed.set()
+
+    def _collect(self, transport: MemoryTransport, dcid: int) -> None:
+        "Write one collection, sending start and end messages"
+        parameters = self.parameters
+        prefix = parameters.directory / f"loadtest_{dcid}"
+        master_h5 = f"{prefix}_master.h5"
+        block_size = _block_size(parameters.image_count)
+
+        rw = workflows.recipe.wrapper.RecipeWrapper(
+            recipe=_recipe(parameters, dcid, master_h5),
+            transport=transport,
+            environment={"ID": str(uuid.uuid4())},
+        )
+        rw.start()
+        h5maker.main(
+            prefix,
+            shape=parameters.shape,
+            block_size=block_size,
+            nblocks=parameters.image_count // block_size,
+            shuffle=False,
+            compression=parameters.compression,
+            frame_rate=parameters.frame_rate,
+            on_write=lambda index: self._image_written(master_h5, index),
+        )
+        transport.send(
+            END_QUEUE,
+            {
+                "dcid": dcid,
+                "event": "end",
+                "images": parameters.image_count,
+                "timestamp": time.time(),
+            },
+        )
+
+    def run(self) -> LoadReport:
+        parameters = self.parameters
+        parameters.directory.mkdir(parents=True, exist_ok=True)
+        self.broker.add_listener(PIA_QUEUE, self._image_seen)
+        self.broker.add_listener(XRC_QUEUE, self._image_analysed)
+        if parameters.pia == "synthetic":
+            pia_service = SyntheticPerImageAnalysis
+        else:
+            pia_service = LazyPlugins("workflows.services")["DLSPerImageAnalysis"]
+
+        generator = MemoryTransport(self.broker)
+        generator.connect()
+        generator.subscribe(END_QUEUE, self._collection_ended)
+        workflows.recipe.wrap_subscribe(
+            generator, RESULT_QUEUE, self._centering_result, acknowledgement=True
+        )
+        start = time.perf_counter()
+        try:
+            with contextlib.ExitStack() as stack:
+                stack.enter_context(
+                    running_service(DLSFileWatcher, MemoryTransport(self.broker))
+                )
+                for _ in range(parameters.pia_instances):
+                    stack.enter_context(
+                        running_service(pia_service, MemoryTransport(self.broker))
+                    )
+                stack.enter_context(
+                    running_service(DLSXRayCentering, MemoryTransport(self.broker))
+                )
+
+                writers = [
+                    threading.Thread(
+                        target=self._collect,
+                        args=(generator, dcid),
+                        name=f"collection {dcid}",
+                    )
+                    for dcid in range(1, parameters.collections + 1)
+                ]
+                for writer in writers:
+                    writer.start()
+                for writer in writers:
+                    writer.join()
+                log.info(
+                    f"{self._images_written} images written in "
+                    f"{time.perf_counter() - start:.1f}s, waiting for processing"
+                )
+                if not self._all_completed.wait(parameters.timeout):
+                    log.warning(
+                        f"Processing of {parameters.collections - len(self._completed)} "
+                        f"collections did not complete within {parameters.timeout}s"
+                    )
+        finally:
+            generator.disconnect()
+            self.broker.stop()
+
+        return LoadReport(
+            parameters=parameters,
+            images_written=self._images_written,
+            collections_completed=len(self._completed),
+            seconds=time.perf_counter() - start,
+            latencies=self.latencies.summary(),
+            messages=dict(self.broker.statistics),
+        )
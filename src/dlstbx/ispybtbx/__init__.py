@@ -15,7 +15,6 @@ from typing import Any, Optional, Tuple, TypedDict, Union, cast
 
 import gemmi
 import ispyb.sqlalchemy as isa
-import ispyb.sqlalchemy as models
 import marshmallow.fields
 import sqlalchemy
 import yaml
@@ -24,6 +23,7 @@ from sqlalchemy import select
 from sqlalchemy.orm import aliased, selectinload, sessionmaker
 
 from dlstbx import crud
+from dlstbx.util import database
 from dlstbx.util.pdb import PDBFileOrCode
 
 logger = logging.getLogger("dlstbx.ispybtbx")
@@ -44,7 +44,7 @@ def _get(obj: Any, name: str):
 def Session() -> sqlalchemy.orm.session.Session:
     if (_maker := getattr(Session, "_maker", None)) is None:  # type: ignore
         Session._maker = sessionmaker(  # type: ignore
-            bind=sqlalchemy.create_engine(isa.url(), connect_args={"use_pure": True})
+            bind=database.create_engine(service="ispybtbx")
         )
     return Session._maker()  # type: ignore
 
@@ -81,6 +81,45 @@ class PinInfoDict(TypedDict):
     location: int | None
 
 
+@dataclasses.dataclass
+class DCIDContext:
+    """
+    Database context of a data collection, as needed by ispyb_filter.
+
+    Populated by ispybtbx.get_dcid_context() with a handful of joined queries
+    rather than one round trip per item.
+    """
+
+    dcid: int
+    dc_info: dict
+    dcg_id: int | None = None
+    beamline: str | None = None
+    detector_model: str | None = None
+    gridinfo: dict = dataclasses.field(default_factory=dict)
+    dcg_experiment_type: str | None = None
+    diffraction_plan: dict | None = None
+    protein: dict | None = None
+    space_group: str | None = None
+    unit_cell: bool | Tuple[float, ...] | None = None
+    sample_id: int | None = None
+    sample_name: str | None = None
+    smiles: str | None = None
+    priority_processing: str | None = None
+    pin_info: PinInfoDict | None = None
+    msp_sample_ids: dict[int, int] = dataclasses.field(default_factory=dict)
+    # Selected columns of all data collections in the same group, including
+    # this one, as mappings
+    dcg_collections: list = dataclasses.field(default_factory=list)
+
+    @property
+    def dcg_dcids(self) -> list[int]:
+        return [
+            dc.dataCollectionId
+            for dc in self.dcg_collections
+            if dc.dataCollectionId != self.dcid
+        ]
+
+
 class ispybtbx:
     def __init__(self):
         with Session() as session:
@@ -176,36 +215,60 @@ class ispybtbx:
             return bs.beamLineName
 
     def dc_info_to_detectorclass(
-        self, dc_info, session: sqlalchemy.orm.session.Session
+        self,
+        dc_info,
+        session: sqlalchemy.orm.session.Session,
+        cache: crud.EntityCache | None = None,
     ):
         det_id = dc_info.get("detectorId")
-        if det_id is not None and (det := crud.get_detector(det_id, session)):
-            if det.detectorModel.lower().startswith("eiger"):
+        detector_model = None
+        if det_id is not None and (
+            det := crud.get_detector(det_id, session, cache=cache)
+        ):
+            detector_model = det.detectorModel
+        return self.detector_model_to_class(detector_model, dc_info.get("fileTemplate"))
+
+    @staticmethod
+    def detector_model_to_class(
+        detector_model: str | None, template: str | None
+    ) -> str | None:
+        if detector_model:
+            if detector_model.lower().startswith("eiger"):
                 return "eiger"
-            elif det.detectorModel.lower().startswith("pilatus"):
+            elif detector_model.lower().startswith("pilatus"):
                 return "pilatus"
 
         # Fallback on examining the file extension if nothing recorded in ISPyB
-        template = dc_info.get("fileTemplate")
         if not template:
             return None
         if template.endswith("master.h5"):
             return "eiger"
         elif template.endswith(".cbf"):
             return "pilatus"
+        return None
 
     def dc_info_to_detectorname(
-        self, dc_info, session: sqlalchemy.orm.session.Session
+        self,
+        dc_info,
+        session: sqlalchemy.orm.session.Session,
+        cache: crud.EntityCache | None = None,
     ):
-        ## Get a detector name if it is one of a set of allowed values for fast feedback service.
         det_id = dc_info.get("detectorId")
-        if det_id is not None and (det := crud.get_detector(det_id, session)):
-            if det.detectorModel == "Eiger2 XE 16M":
-                return "Eiger16M"
-            elif det.detectorModel == "Eiger2 X 4M":
-                return "Eiger4M"
-            elif det.detectorModel == "Eiger2 X CdTe 9M":
-                return "Eiger9MCdTe"
+        if det_id is not None and (
+            det := crud.get_detector(det_id, session, cache=cache)
+        ):
+            return self.detector_model_to_name(det.detectorModel)
+        return None
+
+    @staticmethod
+    def detector_model_to_name(detector_model: str | None) -> str | None:
+        ## Get a detector name if it is one of a set of allowed values for fast feedback service.
+        if detector_model == "Eiger2 XE 16M":
+            return "Eiger16M"
+        elif detector_model == "Eiger2 X 4M":
+            return "Eiger4M"
+        elif detector_model == "Eiger2 X CdTe 9M":
+            return "Eiger9MCdTe"
 
         # Not one of the set of detectors allowed for fast feedback service.
         return None
@@ -299,26 +362,40 @@ class ispybtbx:
                 )
         return related_dcids
 
-    def get_sample_dcids(self, sample_id, session: sqlalchemy.orm.session.Session):
+    def get_sample_dcids(
+        self,
+        sample_id,
+        session: sqlalchemy.orm.session.Session,
+        sample_name: str | None = None,
+        cache: crud.EntityCache | None = None,
+    ):
         if not sample_id:
             return None
         dcids = crud.get_dcids_for_sample_id(sample_id, session)
         if dcids:
-            sample = crud.get_blsample(sample_id, session)
+            if sample_name is None and (
+                sample := crud.get_blsample(sample_id, session, cache=cache)
+            ):
+                sample_name = sample.name
             related_dcids = {
                 "dcids": dcids,
                 "sample_id": sample_id,
-                "name": sample.name if sample else None,
+                "name": sample_name,
             }
             logger.debug(
                 f"dcids defined via BLSample for {sample_id=}: {related_dcids}"
             )
             return related_dcids
 
-    def get_sample_smiles(self, sample_id, session: sqlalchemy.orm.session.Session):
+    def get_sample_smiles(
+        self,
+        sample_id,
+        session: sqlalchemy.orm.session.Session,
+        cache: crud.EntityCache | None = None,
+    ):
         if not sample_id:
             return None
-        sample = crud.get_blsample(sample_id, session)
+        sample = crud.get_blsample(sample_id, session, cache=cache)
         if not sample:
             return None
         return sample.SMILES
@@ -339,19 +416,24 @@ class ispybtbx:
         ]
 
     def get_dcg_experiment_type(
-        self, dcgid: int, session: sqlalchemy.orm.session.Session
+        self,
+        dcgid: int,
+        session: sqlalchemy.orm.session.Session,
+        cache: crud.EntityCache | None = None,
     ) -> Optional[str]:
         if not dcgid:
             return None
-        query = session.query(isa.DataCollectionGroup.experimentType).filter(
-            isa.DataCollectionGroup.dataCollectionGroupId == dcgid
-        )
-        return query.one()[0]
+        return crud.get_dcg_experiment_type(dcgid, session, cache=cache)
 
     def get_space_group_and_unit_cell(
         self, dcid: int, session: sqlalchemy.orm.session.Session
     ):
-        c = crud.get_crystal_for_dcid(dcid, session)
+        return self.crystal_to_space_group_and_unit_cell(
+            crud.get_crystal_for_dcid(dcid, session)
+        )
+
+    @staticmethod
+    def crystal_to_space_group_and_unit_cell(c: isa.Crystal | None):
         if not c or not c.spaceGroup:
             return None, None
         proto_cell = (
@@ -813,6 +895,139 @@ class ispybtbx:
     ):
         return crud.get_priority_processing_for_sample_id(sample_id, session)
 
+    def get_dcid_context(
+        self,
+        dcid: int,
+        session: sqlalchemy.orm.session.Session,
+        cache: crud.EntityCache | None = None,
+    ) -> DCIDContext | None:
+        """
+        Load the database context of a data collection in a few round trips.
+
+        Everything that is at most one-to-one with the data collection is
+        fetched in a single outer-joined query. Grid info, the collections in
+        the same group and the samples on a multi-sample pin each take one
+        further query. The detector is looked up separately, through the
+        given cache if any. Returns None if the data collection does not exist.
+        """
+        dcg_sample = aliased(isa.BLSample)
+        dc_sample = aliased(isa.BLSample, name="dc_sample")
+        row = (
+            session.query(
+                isa.DataCollection,
+                isa.DataCollectionGroup.experimentType,
+                isa.BLSession.beamLineName,
+                isa.Crystal,
+                isa.Protein,
+                isa.DiffractionPlan,
+                dc_sample,
+                isa.ProcessingPipeline.name.label("pipeline"),
+            )
+            .outerjoin(
+                isa.DataCollectionGroup,
+                isa.DataCollectionGroup.dataCollectionGroupId
+                == isa.DataCollection.dataCollectionGroupId,
+            )
+            .outerjoin(
+                isa.BLSession,
+                isa.BLSession.sessionId == isa.DataCollectionGroup.sessionId,
+            )
+            .outerjoin(
+                dcg_sample,
+                dcg_sample.blSampleId == isa.DataCollectionGroup.blSampleId,
+            )
+            .outerjoin(isa.Crystal, isa.Crystal.crystalId == dcg_sample.crystalId)
+            .outerjoin(isa.Protein, isa.Protein.proteinId == isa.Crystal.proteinId)
+            .outerjoin(
+                isa.DiffractionPlan,
+                isa.DiffractionPlan.diffractionPlanId == dcg_sample.diffractionPlanId,
+            )
+            .outerjoin(dc_sample, dc_sample.blSampleId == isa.DataCollection.BLSAMPLEID)
+            .outerjoin(
+                isa.Container, isa.Container.containerId == dc_sample.containerId
+            )
+            .outerjoin(
+                isa.ProcessingPipeline,
+                isa.ProcessingPipeline.processingPipelineId
+                == isa.Container.priorityPipelineId,
+            )
+            .filter(isa.DataCollection.dataCollectionId == dcid)
+            .first()
+        )
+        if row is None:
+            return None
+
+        dc = row.DataCollection
+        sample = row.dc_sample
+        detector = (
+            crud.get_detector(dc.detectorId, session, cache=cache)
+            if dc.detectorId is not None
+            else None
+        )
+        space_group, unit_cell = self.crystal_to_space_group_and_unit_cell(row.Crystal)
+        context = DCIDContext(
+            dcid=dcid,
+            dc_info=isa.DataCollection.__marshmallow__().dump(dc),
+            dcg_id=dc.dataCollectionGroupId,
+            beamline=row.beamLineName,
+            detector_model=detector.detectorModel if detector else None,
+            dcg_experiment_type=row.experimentType,
+            diffraction_plan=(
+                isa.DiffractionPlan.__marshmallow__().dump(row.DiffractionPlan)
+                if row.DiffractionPlan
+                else None
+            ),
+            protein=(
+                isa.Protein.__marshmallow__(exclude=("externalId",)).dump(row.Protein)
+                if row.Protein
+                else None
+            ),
+            space_group=space_group,
+            unit_cell=unit_cell,
+            sample_id=dc.BLSAMPLEID,
+            priority_processing=row.pipeline,
+        )
+        if sample is not None:
+            context.sample_name = sample.name
+            context.smiles = sample.SMILES
+            context.pin_info = {
+                "containerId": sample.containerId,
+                "location": sample.location,
+                "subLocation": sample.subLocation,
+                "loopType": sample.loopType,
+            }
+            context.msp_sample_ids = self.get_all_sample_ids_for_multisample_pin(
+                context.pin_info, session
+            )
+
+        # Prefer grid info recorded against the data collection over the
+        # legacy entries recorded against the data collection group
+        gridinfo_match = isa.GridInfo.dataCollectionId == dcid
+        if context.dcg_id:
+            gridinfo_match |= isa.GridInfo.dataCollectionGroupId == context.dcg_id
+        gridinfo = (
+            session.query(isa.GridInfo)
+            .filter(gridinfo_match)
+            .order_by((isa.GridInfo.dataCollectionId == dcid).desc())
+            .first()
+        )
+        if gridinfo:
+            context.gridinfo = isa.GridInfo.__marshmallow__().dump(gridinfo)
+
+        if context.dcg_id:
+            stmt = select(
+                isa.DataCollection.dataCollectionId,
+                isa.DataCollection.startImageNumber,
+                isa.DataCollection.numberOfImages,
+                isa.DataCollection.overlap,
+                isa.DataCollection.axisRange,
+                isa.DataCollection.fileTemplate,
+                isa.DataCollection.imageDirectory,
+            ).where(isa.DataCollection.dataCollectionGroupId == context.dcg_id)
+            context.dcg_collections = list(session.execute(stmt).mappings())
+
+        return context
+
 
 def ready_for_processing(
     message, parameters, session: sqlalchemy.orm.session.Session | None = None
@@ -837,6 +1052,7 @@ def ispyb_filter(
     parameters,
     session: sqlalchemy.orm.session.Session | None = None,
     io_timeout: float = 10,
+    cache: crud.EntityCache | None = None,
 ):
     """Do something to work out what to do with this data..."""
 
@@ -854,38 +1070,33 @@ def ispyb_filter(
     # files exist; if image already set check they exist, ...
 
     dc_id = parameters["ispyb_dcid"]
-    dc_info = i.get_dc_info(dc_id, session)
-    dcg_id: int | None = dc_info.get("dataCollectionGroupId")
-
-    if not dc_info:
+    context = i.get_dcid_context(dc_id, session, cache=cache)
+    if context is None:
         raise ValueError(f"No database entry found for dcid={dc_id}: {dc_id}")
+    dc_info = context.dc_info
+    dcg_id = context.dcg_id
+
     dc_info["uuid"] = parameters.get("guid") or str(uuid.uuid4())
-    parameters["ispyb_beamline"] = i.get_beamline_from_dcid(dc_id, session)
+    parameters["ispyb_beamline"] = context.beamline
 
-    parameters["ispyb_detectorclass"] = i.dc_info_to_detectorclass(dc_info, session)
-    parameters["ispyb_detectorname"] = i.dc_info_to_detectorname(dc_info, session)
-    parameters["ispyb_dc_info"] = dc_info
-    parameters["ispyb_dc_info"]["gridinfo"] = i.get_gridscan_info(
-        dc_info.get("dataCollectionId"), dc_info.get("dataCollectionGroupId"), session
-    )
-    parameters["ispyb_dcg_experiment_type"] = i.get_dcg_experiment_type(
-        dc_info.get("dataCollectionGroupId"), session
+    parameters["ispyb_detectorclass"] = i.detector_model_to_class(
+        context.detector_model, dc_info.get("fileTemplate")
     )
+    parameters["ispyb_detectorname"] = i.detector_model_to_name(context.detector_model)
+    parameters["ispyb_dc_info"] = dc_info
+    parameters["ispyb_dc_info"]["gridinfo"] = context.gridinfo
+    parameters["ispyb_dcg_experiment_type"] = context.dcg_experiment_type
     dc_class = i.classify_dc(dc_info, parameters["ispyb_dcg_experiment_type"])
     parameters["ispyb_dc_class"] = dc_class
-    diff_plan_info = i.get_diffractionplan_from_dcid(dc_id, session)
-    parameters["ispyb_diffraction_plan"] = diff_plan_info
-    protein_info = i.get_protein_from_dcid(dc_id, session)
-    parameters["ispyb_protein_info"] = protein_info
+    parameters["ispyb_diffraction_plan"] = context.diffraction_plan
+    parameters["ispyb_protein_info"] = context.protein
     energy_scan_info = i.get_energy_scan_from_dcid(dc_id, session)
     parameters["ispyb_energy_scan_info"] = energy_scan_info
     start, end = i.dc_info_to_start_end(dc_info)
-    sample_id = parameters["ispyb_dc_info"].get("BLSAMPLEID")
-    parameters["ispyb_smiles"] = i.get_sample_smiles(sample_id, session)
-    priority_processing = crud.get_priority_processing_for_sample_id(sample_id, session)
-    if not priority_processing:
-        priority_processing = "xia2/DIALS"
-    parameters["ispyb_preferred_processing"] = priority_processing
+    parameters["ispyb_smiles"] = context.smiles
+    parameters["ispyb_preferred_processing"] = (
+        context.priority_processing or "xia2/DIALS"
+    )
     parameters["ispyb_image_first"] = start
     parameters["ispyb_image_last"] = end
     parameters["ispyb_image_template"] = dc_info.get("fileTemplate")
@@ -941,7 +1152,7 @@ def ispyb_filter(
     else:
         parameters["ispyb_crystal"] = "DEFAULT"
 
-    space_group, cell = i.get_space_group_and_unit_cell(dc_id, session)
+    space_group, cell = context.space_group, context.unit_cell
     if not any((space_group, cell)) and visit_directory:
         space_group, cell = i.get_space_group_and_unit_cell_from_yaml(
             parameters, io_timeout=io_timeout
@@ -954,19 +1165,18 @@ def ispyb_filter(
         parameters, session, io_timeout=io_timeout
     )
     related_dcids = None
-    if parameters["ispyb_dc_info"].get("BLSAMPLEID"):
+    if context.sample_id:
         # if a sample is linked to the dc, then get dcids on the same sample
-        sample_id = parameters["ispyb_dc_info"].get("BLSAMPLEID")
-        related_dcids = i.get_sample_dcids(sample_id, session)
+        related_dcids = i.get_sample_dcids(
+            context.sample_id, session, sample_name=context.sample_name, cache=cache
+        )
     elif dc_id:
         # else get dcids collected into the same image directory
         related_dcids = i.get_related_dcids_same_directory(dc_id, session)
     if related_dcids:
         parameters["ispyb_related_dcids"].append(related_dcids)
     logger.debug(f"ispyb_related_dcids: {parameters['ispyb_related_dcids']}")
-    parameters["ispyb_dcg_dcids"] = i.get_dcg_dcids(
-        dc_info.get("dataCollectionId"), dc_info.get("dataCollectionGroupId"), session
-    )
+    parameters["ispyb_dcg_dcids"] = context.dcg_dcids
 
     # for the moment we do not want multi-xia2 for /dls/mx i.e. VMXi
     # beware if other projects start using this directory structure will
@@ -974,19 +1184,9 @@ def ispyb_filter(
 
     # Handle related DCID properties via DataCollectionGroup, if there is one
     if dcg_id:
-        stmt = select(
-            models.DataCollection.dataCollectionId,
-            models.DataCollection.startImageNumber,
-            models.DataCollection.numberOfImages,
-            models.DataCollection.overlap,
-            models.DataCollection.axisRange,
-            models.DataCollection.fileTemplate,
-            models.DataCollection.imageDirectory,
-        ).where(models.DataCollection.dataCollectionGroupId == dcg_id)
-
         related_images = []
 
-        for dc in session.execute(stmt).mappings():
+        for dc in context.dcg_collections:
             start, end = i.dc_info_to_start_end(dc)
             parameters["ispyb_related_sweeps"].append((dc.dataCollectionId, start, end))
             parameters["ispyb_related_images"].append(
@@ -1006,13 +1206,8 @@ def ispyb_filter(
         if not parameters.get("ispyb_images"):
             parameters["ispyb_images"] = ",".join(related_images)
 
-    pin_info = i.get_pin_info_from_sample_id(
-        parameters["ispyb_dc_info"].get("BLSAMPLEID"), session
-    )
-    parameters["ispyb_pin_info"] = pin_info or {}
-    parameters["ispyb_msp_sample_ids"] = (
-        i.get_all_sample_ids_for_multisample_pin(pin_info, session) if pin_info else {}
-    )
+    parameters["ispyb_pin_info"] = context.pin_info or {}
+    parameters["ispyb_msp_sample_ids"] = context.msp_sample_ids
 
     if (
         "ispyb_processing_job" in parameters
@@ -4,13 +4,20 @@ import dataclasses
 import enum
 import functools
 import importlib.metadata
+import itertools
 import numbers
-from typing import Any, Callable, List, Optional, Tuple, Union
+from typing import Any, Callable, Iterable, List, Optional, Tuple, Union
 
 import gemmi
 import zocalo.configuration
 
-from dlstbx.mimas.specification import BaseSpecification
+from dlstbx.mimas.specification import (
+    AndSpecification,
+    BaseSpecification,
+    BeamlineSpecification,
+    InvertSpecification,
+    OrSpecification,
+)
 
 MimasDCClass = enum.Enum(
     "MimasDCClass",
@@ -402,11 +409,119 @@ def match_specification(specification: BaseSpecification):
                 return handler(scenario, zc=zc)
             return []
 
+        inner_wrapper.specification = specification  # type: ignore[attr-defined]
         return inner_wrapper
 
     return outer_wrapper
 
 
+@dataclasses.dataclass(frozen=True)
+class _ScenarioKey:
+    beamline: Optional[str]
+    event: MimasEvent
+    dcclass: MimasDCClass
+    detectorclass: Optional[MimasDetectorClass]
+
+
+def _specification_beamlines(specification: BaseSpecification) -> set[str]:
+    if isinstance(specification, BeamlineSpecification):
+        return {specification.beamline, *(specification.beamlines or ())} - {None}
+    if isinstance(specification, (AndSpecification, OrSpecification)):
+        return _specification_beamlines(specification.first) | (
+            _specification_beamlines(specification.second)
+        )
+    if isinstance(specification, InvertSpecification):
+        return _specification_beamlines(specification.subject)
+    return set()
+
+
+class DecisionIndex:
+    """
+    A lookup table from the enumerable properties of a scenario (beamline,
+    event, dcclass and detectorclass) to the handlers that may apply to it.
+
+    The specification of each handler is evaluated ahead of time for every
+    combination of those properties. Beamlines that are not named by any
+    specification are indistinguishable from each other and share one entry.
+    Handlers whose specification also depends on other properties, eg. a
+    VisitSpecification, are listed with the specification still to be checked,
+    and handlers without a specification are always called.
+    """
+
+    def __init__(self, handlers: Iterable[Callable]):
+        self.handlers = list(handlers)
+        self.beamlines = frozenset(
+            itertools.chain.from_iterable(
+                _specification_beamlines(handler.specification)
+                for handler in self.handlers
+                if hasattr(handler, "specification")
+            )
+        )
+        self._table: dict[
+            _ScenarioKey, Tuple[Tuple[Callable, Optional[BaseSpecification]], ...]
+        ] = {
+            key: self._compile(key)
+            for key in itertools.starmap(
+                _ScenarioKey,
+                itertools.product(
+                    (*self.beamlines, None),
+                    MimasEvent,
+                    MimasDCClass,
+                    (*MimasDetectorClass, None),
+                ),
+            )
+        }
+        self._fallback = tuple(
+            (handler, None)
+            if not hasattr(handler, "specification")
+            else (handler.__wrapped__, handler.specification)
+            for handler in self.handlers
+        )
+
+    def _compile(
+        self, key: _ScenarioKey
+    ) -> Tuple[Tuple[Callable, Optional[BaseSpecification]], ...]:
+        entries: List[Tuple[Callable, Optional[BaseSpecification]]] = []
+        for handler in self.handlers:
+            specification = getattr(handler, "specification", None)
+            if specification is None:
+                entries.append((handler, None))
+                continue
+            result = specification.partially_satisfied_by(key)
+            if result is None:
+                entries.append((handler.__wrapped__, specification))
+            elif result:
+                entries.append((handler.__wrapped__, None))
+        return tuple(entries)
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def candidates(
+        self, scenario: MimasScenario
+    ) -> Tuple[Tuple[Callable, Optional[BaseSpecification]], ...]:
+        """
+        Return the handlers that may apply to a scenario, each together with
+        the specification that remains to be checked, if any.
+        """
+        key = _ScenarioKey(
+            beamline=scenario.beamline if scenario.beamline in self.beamlines else None,
+            event=scenario.event,
+            dcclass=scenario.dcclass,
+            detectorclass=scenario.detectorclass,
+        )
+        # Scenarios with unexpected property values are evaluated in full
+        return self._table.get(key, self._fallback)
+
+    def match(self, scenario: MimasScenario) -> List[Callable]:
+        """Return the handlers that apply to a scenario."""
+        return [
+            handler
+            for handler, specification in self.candidates(scenario)
+            if specification is None or specification.is_satisfied_by(scenario)
+        ]
+
+
 @functools.lru_cache
 def _get_handlers() -> dict[str, Callable]:
     return {
@@ -415,10 +530,15 @@ def _get_handlers() -> dict[str, Callable]:
     }
 
 
+@functools.lru_cache
+def get_decision_index() -> DecisionIndex:
+    return DecisionIndex(_get_handlers().values())
+
+
 def handle_scenario(
     scenario: MimasScenario, zc: zocalo.configuration.Configuration
 ) -> List[Invocation]:
     tasks: List[Invocation] = []
-    for handler in _get_handlers().values():
+    for handler in get_decision_index().match(scenario):
         tasks.extend(handler(scenario, zc=zc))
     return tasks
@@ -12,6 +12,13 @@ class BaseSpecification:
     def is_satisfied_by(self, candidate: Any) -> bool:
         raise NotImplementedError()
 
+    def partially_satisfied_by(self, candidate: Any) -> Optional[bool]:
+        """
+        Evaluate the specification using only the enumerable properties of a
+        candidate. Returns None if the result depends on anything else.
+        """
+        return None
+
     def __and__(self, other: BaseSpecification) -> AndSpecification:
         return AndSpecification(self, other)
 
@@ -32,6 +39,15 @@ class AndSpecification(BaseSpecification):
             candidate
         )
 
+    def partially_satisfied_by(self, candidate: Any) -> Optional[bool]:
+        first = self.first.partially_satisfied_by(candidate)
+        if first is False:
+            return False
+        second = self.second.partially_satisfied_by(candidate)
+        if second is False:
+            return False
+        return True if first and second else None
+
 
 @dataclass(frozen=True)
 class OrSpecification(BaseSpecification):
@@ -43,6 +59,15 @@ class OrSpecification(BaseSpecification):
             candidate
         )
 
+    def partially_satisfied_by(self, candidate: Any) -> Optional[bool]:
+        first = self.first.partially_satisfied_by(candidate)
+        if first:
+            return True
+        second = self.second.partially_satisfied_by(candidate)
+        if second:
+            return True
+        return False if first is False and second is False else None
+
 
 @dataclass(frozen=True)
 class InvertSpecification(BaseSpecification):
@@ -51,6 +76,10 @@ class InvertSpecification(BaseSpecification):
     def is_satisfied_by(self, candidate: Any) -> bool:
         return not self.subject.is_satisfied_by(candidate)
 
+    def partially_satisfied_by(self, candidate: Any) -> Optional[bool]:
+        result = self.subject.partially_satisfied_by(candidate)
+        return None if result is None else not result
+
 
 class ScenarioSpecification(BaseSpecification):
     @abstractmethod
@@ -58,8 +87,19 @@ class ScenarioSpecification(BaseSpecification):
         raise NotImplementedError()
 
 
+class EnumerableScenarioSpecification(ScenarioSpecification):
+    """
+    A specification that only depends on the scenario beamline, event, dcclass
+    and detectorclass, and can therefore be evaluated ahead of time for every
+    combination of those.
+    """
+
+    def partially_satisfied_by(self, candidate: Any) -> Optional[bool]:
+        return self.is_satisfied_by(candidate)
+
+
 @dataclass(frozen=True)
-class BeamlineSpecification(ScenarioSpecification):
+class BeamlineSpecification(EnumerableScenarioSpecification):
     beamline: Optional[str] = None
     beamlines: Optional[set[str]] = None
 
@@ -72,7 +112,7 @@ class BeamlineSpecification(ScenarioSpecification):
 
 
 @dataclass(frozen=True)
-class EventSpecification(ScenarioSpecification):
+class EventSpecification(EnumerableScenarioSpecification):
     event: dlstbx.mimas.MimasEvent
 
     def is_satisfied_by(self, candidate: dlstbx.mimas.MimasScenario) -> bool:
@@ -80,7 +120,7 @@ class EventSpecification(ScenarioSpecification):
 
 
 @dataclass(frozen=True)
-class DCClassSpecification(ScenarioSpecification):
+class DCClassSpecification(EnumerableScenarioSpecification):
     dcclass: dlstbx.mimas.MimasDCClass
 
     def is_satisfied_by(self, candidate: dlstbx.mimas.MimasScenario) -> bool:
@@ -88,7 +128,7 @@ class DCClassSpecification(ScenarioSpecification):
 
 
 @dataclass(frozen=True)
-class DetectorClassSpecification(ScenarioSpecification):
+class DetectorClassSpecification(EnumerableScenarioSpecification):
     detectorclass: dlstbx.mimas.MimasDetectorClass
 
     def is_satisfied_by(self, candidate: dlstbx.mimas.MimasScenario) -> bool:
@@ -3,7 +3,6 @@ from __future__ import annotations
 import datetime
 import errno
 import getpass
-import importlib.metadata
 import json
 import logging
 import math
@@ -18,6 +17,8 @@ from workflows.services.common_service import CommonService
 from zocalo.configuration import Configuration
 from zocalo.util import slurm
 
+from dlstbx.util.plugins import LazyPlugins
+
 
 class JobSubmissionParameters(pydantic.BaseModel):
     scheduler: str = "slurm"
@@ -163,12 +164,7 @@ class DLSCluster(CommonService):
         Received messages must be acknowledged."""
         self.log.info("Cluster service starting")
 
-        self.schedulers = {
-            f.name: f.load()
-            for f in importlib.metadata.entry_points(
-                group="zocalo.services.cluster.schedulers"
-            )
-        }
+        self.schedulers = LazyPlugins("zocalo.services.cluster.schedulers")
         self.log.debug(f"Supported schedulers: {', '.join(self.schedulers.keys())}")
         workflows.recipe.wrap_subscribe(
             self._transport,
@@ -2,15 +2,16 @@ from __future__ import annotations
 
 import logging
 import os
+import stat
 import time
 from pathlib import Path
 
-import h5py
 import workflows.recipe
 from workflows.recipe import RecipeWrapper
 from workflows.services.common_service import CommonService
 
-from dlstbx.swmr import h5check
+from dlstbx.swmr.h5cache import swmr_file_cache
+from dlstbx.util.inotify import DirectoryEvents
 
 
 def is_file_selected(file_number, selection, total_files):
@@ -50,23 +51,53 @@ class _StatProfiler:
         try:
             return Path(path).is_file()
         finally:
-            runtime = time.time() - start
+            self._record(path, time.time() - start)
 
-            self._timing_count += 1
-            self._timing_sum += runtime
-            self._timing_max = max(self._timing_max or 0, runtime)
+    def mtime(self, path: str | os.PathLike) -> float | None:
+        """
+        Return the modification time of a single file, or None if the file
+        does not exist, tracking IO time.
+        """
+        start = time.time()
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        else:
+            return st.st_mtime if stat.S_ISREG(st.st_mode) else None
+        finally:
+            self._record(path, time.time() - start)
 
-            if runtime > 5 and self._logger:
-                # Anything higher than 5 seconds should be explicitly logged
-                self._logger.warning(
-                    "Excessive filewatcher stat-time for file: %s",
-                    path,
-                    extra={
-                        "stat-time-max": self.max,
-                        "stat-time-mean": self.mean,
-                        "stat-time": runtime,
-                    },
-                )
+    def listdir(self, directory: str | os.PathLike) -> frozenset[str]:
+        """
+        Return the names of all non-directory entries in a directory, or an
+        empty set if the directory does not exist, tracking IO time.
+        """
+        start = time.time()
+        try:
+            with os.scandir(directory) as it:
+                return frozenset(entry.name for entry in it if not entry.is_dir())
+        except (FileNotFoundError, NotADirectoryError):
+            return frozenset()
+        finally:
+            self._record(directory, time.time() - start)
+
+    def _record(self, path: str | os.PathLike, runtime: float) -> None:
+        self._timing_count += 1
+        self._timing_sum += runtime
+        self._timing_max = max(self._timing_max or 0, runtime)
+
+        if runtime > 5 and self._logger:
+            # Anything higher than 5 seconds should be explicitly logged
+            self._logger.warning(
+                "Excessive filewatcher stat-time for file: %s",
+                path,
+                extra={
+                    "stat-time-max": self.max,
+                    "stat-time-mean": self.mean,
+                    "stat-time": runtime,
+                },
+            )
 
     @property
     def max(self):
@@ -80,6 +111,35 @@ class _StatProfiler:
             return None
 
 
+class _DirectoryListingCache:
+    """
+    Short-lived cache of directory listings, so that existence checks for many
+    files in the same directory only require a single directory read. Listings
+    are shared by all watches in the process, and expire after max_age seconds,
+    which must be shorter than the minimum delay between watch rounds.
+    """
+
+    def __init__(self, max_age: float = 0.5):
+        self.max_age = max_age
+        self._listings: dict[str, tuple[float, frozenset[str]]] = {}
+
+    def is_file(self, path: str | os.PathLike, os_stat_profiler: _StatProfiler) -> bool:
+        directory, filename = os.path.split(os.fspath(path))
+        now = time.monotonic()
+        listing = self._listings.get(directory)
+        if listing is None or now - listing[0] > self.max_age:
+            for d in [
+                d for d, (t, _) in self._listings.items() if now - t > self.max_age
+            ]:
+                del self._listings[d]
+            listing = (now, os_stat_profiler.listdir(directory))
+            self._listings[directory] = listing
+        return filename in listing[1]
+
+
+_directory_listings = _DirectoryListingCache()
+
+
 class DLSFileWatcher(CommonService):
     """
     A service that waits for files to arrive on disk and notifies interested
@@ -92,12 +152,28 @@ class DLSFileWatcher(CommonService):
     # Logger name
     _logger_name = "dlstbx.services.filewatcher"
 
+    # Shared record of files arriving in watched directories, if enabled
+    _directory_events: DirectoryEvents | None = None
+
+    # Minimum delay between watch rounds, if the next expected file is in a
+    # directory watched with inotify, and otherwise
+    _inotify_delay = 0.2
+    _polling_delay = 1
+
     def initializing(self):
         """
         Subscribe to the filewatcher queue. Received messages must be
         acknowledged.
         """
         self.log.info("Filewatcher starting")
+        if self._environment.get("inotify"):
+            try:
+                self._directory_events = DirectoryEvents()
+                self._inotify_delay = float(
+                    self._environment.get("inotify-delay", self._inotify_delay)
+                )
+            except (AttributeError, OSError) as e:
+                self.log.warning(f"inotify not available, polling for files: {e}")
         workflows.recipe.wrap_subscribe(
             self._transport,
             self._environment.get("queue") or "filewatcher",
@@ -118,6 +194,37 @@ class DLSFileWatcher(CommonService):
             self.log.error("Rejecting message with unknown watch target")
             rw.transport.nack(header)
 
+    def _is_file(
+        self, path, os_stat_profiler: _StatProfiler, list_directory: bool = False
+    ) -> bool:
+        """
+        Check existence of a single file. If directory events are enabled and
+        supported for the file location then no filesystem access is needed.
+        Otherwise check against a shared recent listing of the directory if
+        requested, or fall back to checking the file directly.
+        """
+        if self._directory_events is not None:
+            arrived = self._directory_events.has_arrived(path)
+            if arrived is not None:
+                return arrived
+        if list_directory:
+            return _directory_listings.is_file(path, os_stat_profiler)
+        return os_stat_profiler.is_file(path)
+
+    def _minimum_delay(self, path) -> float:
+        """
+        The minimum delay before looking for the next expected file again.
+        Checking a directory watched with inotify does not touch the
+        filesystem, so it can be checked again much sooner than otherwise.
+        Directories on shared filesystems such as GPFS or NFS can not be
+        watched, and are always polled at the default rate.
+        """
+        if self._directory_events is not None and self._directory_events.is_watched(
+            path
+        ):
+            return self._inotify_delay
+        return self._polling_delay
+
     @staticmethod
     def _parse_everys(outputs):
         """
@@ -238,7 +345,7 @@ class DLSFileWatcher(CommonService):
             and files_found < rw.recipe_step["parameters"].get("burst-limit", 100)
             and filelist[status["seen-files"]]
         ):
-            if not os_stat_profiler.is_file(filelist[status["seen-files"]]):
+            if not self._is_file(filelist[status["seen-files"]], os_stat_profiler):
                 break
 
             files_found += 1
@@ -403,10 +510,11 @@ class DLSFileWatcher(CommonService):
                 return
 
             # If no timeouts are triggered, set a minimum waiting time.
+            minimum_delay = self._minimum_delay(filelist[status["seen-files"]])
             if message_delay:
-                message_delay = max(1, message_delay)
+                message_delay = max(minimum_delay, message_delay)
             else:
-                message_delay = 1
+                message_delay = minimum_delay
             self.log.debug(
                 (
                     "No further files in list found after a total time of {time:.1f} seconds\n"
@@ -497,13 +605,17 @@ class DLSFileWatcher(CommonService):
         # Keep a record of os.stat timings
         os_stat_profiler = _StatProfiler(self.log)
 
+        # Check for files against a single directory listing per round
+        # instead of looking for each file individually
+        list_directory = bool(rw.recipe_step["parameters"].get("directory-listing"))
+
         # Look for files
         files_found = 0
         while status["seen-files"] < filecount and files_found < rw.recipe_step[
             "parameters"
         ].get("burst-limit", 100):
             filename = pattern % (pattern_start + status["seen-files"])
-            if not os_stat_profiler.is_file(filename):
+            if not self._is_file(filename, os_stat_profiler, list_directory):
                 break
 
             files_found += 1
@@ -657,10 +769,13 @@ class DLSFileWatcher(CommonService):
                 return
 
             # If no timeouts are triggered, set a minimum waiting time.
+            minimum_delay = self._minimum_delay(
+                pattern % (pattern_start + status["seen-files"])
+            )
             if message_delay:
-                message_delay = max(1, message_delay)
+                message_delay = max(minimum_delay, message_delay)
             else:
-                message_delay = 1
+                message_delay = minimum_delay
             self.log.debug(
                 (
                     "No further files found for {pattern} after a total time of {time:.1f} seconds\n"
@@ -718,13 +833,14 @@ class DLSFileWatcher(CommonService):
 
         hdf5 = rw.recipe_step["parameters"]["hdf5"]
         image_count = None
-        if os_stat_profiler.is_file(hdf5):
-            self.log.debug(f"Opening {hdf5}")
+        master_mtime = os_stat_profiler.mtime(hdf5)
+        if master_mtime is not None:
             try:
-                with h5py.File(hdf5, mode="r", swmr=True) as f:
-                    d = f["/entry/data/data"]
-                    dataset_files, file_map = h5check.get_real_frames(f, d)
-                    image_count = len(file_map)
+                # Decoded VDS layout and data file handles are shared across
+                # rounds, and only re-read if the master file has changed
+                master = swmr_file_cache.get_master(hdf5, master_mtime)
+                dataset_files, file_map = master.dataset_files, master.file_map
+                image_count = master.image_count
             except Exception as e:
                 if not is_known_hdf5_exception(e):
                     self.log.error(f"Error reading {hdf5}", exc_info=True)
@@ -746,79 +862,76 @@ class DLSFileWatcher(CommonService):
         txn = rw.transport.transaction_begin(subscription_id=header["subscription"])
         rw.transport.ack(header, transaction=txn)
 
-        # Cache file handles locally to minimise repeatedly re-opening the same data file(s)
-        file_handles = {}
+        # Written frame masks of the datasets scanned in this round
+        written = {}
 
-        try:
-            # Look for images
-            images_found = 0
-            while (
-                image_count is not None
-                and status["seen-images"] < image_count
-                and images_found < rw.recipe_step["parameters"].get("burst-limit", 100)
-            ):
-                m, frame = file_map[status["seen-images"]]
-                h5_data_file, dsetname = dataset_files[m]
-                if not os_stat_profiler.is_file(h5_data_file):
-                    break
+        # Look for images
+        images_found = 0
+        while (
+            image_count is not None
+            and status["seen-images"] < image_count
+            and images_found < rw.recipe_step["parameters"].get("burst-limit", 100)
+        ):
+            m, frame = file_map[status["seen-images"]]
+            h5_data_file, dsetname = dataset_files[m]
 
-                try:
-                    if h5_data_file not in file_handles:
-                        file_handles[h5_data_file] = h5py.File(
-                            h5_data_file, mode="r", swmr=True
-                        )
-                        self.log.debug(f"Opening file {h5_data_file}")
-                    h5_file = file_handles[h5_data_file]
-                    dataset = h5_file[dsetname]
+            if not swmr_file_cache.is_open(
+                h5_data_file
+            ) and not os_stat_profiler.is_file(h5_data_file):
+                break
+
+            try:
+                h5_file = swmr_file_cache.get_handle(hdf5, h5_data_file)
+                dataset = h5_file[dsetname]
+                if (h5_data_file, dsetname) not in written:
+                    # Scan all chunk records of this dataset once per round
                     dataset.id.refresh()
-                    s = dataset.id.get_chunk_info_by_coord((frame, 0, 0))
-                    if s.size == 0:
-                        break
-                except Exception as e:
-                    if not is_known_hdf5_exception(e):
-                        self.log.error(f"Error reading {h5_data_file}", exc_info=True)
-                        rw.transport.transaction_abort(txn)
-                        rw.transport.nack(header)
-                        return
-                    # For some reason this means that the .nxs file is probably
-                    # still being written to, so quietly log the message and
-                    # break, leading to the message being resubmitted for
-                    # another round of processing
-                    self.log.info(f"Error reading {h5_data_file}", exc_info=True)
+                    written[(h5_data_file, dsetname)] = master.written_frames(
+                        h5_data_file, dataset
+                    )
+                mask = written[(h5_data_file, dsetname)]
+                if frame >= len(mask) or not mask[frame]:
                     break
+            except Exception as e:
+                swmr_file_cache.discard_handle(h5_data_file)
+                if not is_known_hdf5_exception(e):
+                    self.log.error(f"Error reading {h5_data_file}", exc_info=True)
+                    rw.transport.transaction_abort(txn)
+                    rw.transport.nack(header)
+                    return
+                # For some reason this means that the .nxs file is probably
+                # still being written to, so quietly log the message and
+                # break, leading to the message being resubmitted for
+                # another round of processing
+                self.log.info(f"Error reading {h5_data_file}", exc_info=True)
+                break
 
-                images_found += 1
+            images_found += 1
 
-                def notify_function(output):
-                    rw.send_to(
-                        output,
-                        {
-                            "hdf5": hdf5,
-                            "hdf5-index": status["seen-images"],
-                            "file": hdf5,
-                            "file-number": status["seen-images"] + 1,
-                            "file-seen-at": time.time(),
-                            "parameters": {
-                                "scan_range": "{0},{0}".format(
-                                    status["seen-images"] + 1
-                                )
-                            },
+            def notify_function(output):
+                rw.send_to(
+                    output,
+                    {
+                        "hdf5": hdf5,
+                        "hdf5-index": status["seen-images"],
+                        "file": hdf5,
+                        "file-number": status["seen-images"] + 1,
+                        "file-seen-at": time.time(),
+                        "parameters": {
+                            "scan_range": "{0},{0}".format(status["seen-images"] + 1)
                         },
-                        transaction=txn,
-                    )
-
-                self._notify_for_found_file(
-                    status["seen-images"] + 1,
-                    image_count,
-                    selections,
-                    everys,
-                    notify_function,
+                    },
+                    transaction=txn,
                 )
-                status["seen-images"] += 1
-        finally:
-            # Clean up file handles
-            for f in file_handles.values():
-                f.close()
+
+            self._notify_for_found_file(
+                status["seen-images"] + 1,
+                image_count,
+                selections,
+                everys,
+                notify_function,
+            )
+            status["seen-images"] += 1
 
         # Are we done?
         if status["seen-images"] == image_count:
@@ -826,6 +939,9 @@ class DLSFileWatcher(CommonService):
 
             self.log.debug(f"All {image_count} images found for {hdf5}")
 
+            # Release the cached layout and file handles for this collection
+            swmr_file_cache.evict(hdf5)
+
             extra_log = {
                 "delay": time.time() - status["start-time"],
                 "stat-time-max": os_stat_profiler.max,
@@ -908,6 +1024,8 @@ class DLSFileWatcher(CommonService):
                     },
                 )
 
+                swmr_file_cache.evict(hdf5)
+
                 # Notify for timeout
                 rw.send_to(
                     "timeout",
@@ -1,17 +1,18 @@
 from __future__ import annotations
 
 import errno
-import importlib.metadata
 import logging
 import os
 import re
 import time
-from typing import Any, Callable, Dict, NamedTuple, Protocol
+from typing import Any, Callable, Dict, Mapping, NamedTuple, Protocol
 
 import procrunner
 import workflows.recipe
 from workflows.services.common_service import CommonService
 
+from dlstbx.util.plugins import LazyPlugins
+
 logger = logging.getLogger("dlstbx.services.images")
 
 
@@ -50,12 +51,9 @@ class DLSImages(CommonService):
     def initializing(self):
         """Subscribe to a queue. Received messages must be acknowledged."""
         self.log.info("Image service starting")
-        self.image_functions: dict[str, Callable] = {
-            e.name: e.load()
-            for e in importlib.metadata.entry_points(
-                group="zocalo.services.images.plugins"
-            )
-        }
+        self.image_functions: Mapping[str, Callable] = LazyPlugins(
+            "zocalo.services.images.plugins"
+        )
         workflows.recipe.wrap_subscribe(
             self._transport,
             "images",
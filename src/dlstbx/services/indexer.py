@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import functools
 import logging
 from pathlib import Path
 from typing import Optional
@@ -10,7 +11,6 @@ from cctbx import sgtbx, uctbx
 from dials.algorithms.indexing import indexer
 from dials.array_family import flex
 from dials.command_line.index import phil_scope as index_phil_scope
-from dials.util import phil
 from dxtbx.model.experiment_list import (
     Experiment,
     ExperimentList,
@@ -21,6 +21,7 @@ from workflows.services.common_service import CommonService
 
 from dlstbx.services.per_image_analysis import msgpack_mangle_for_receiving
 from dlstbx.util import ChainMapWithReplacement
+from dlstbx.util.phil_cache import PhilParameterCache
 
 UnitCell = tuple[float, float, float, float, float, float]
 
@@ -71,6 +72,12 @@ class IndexingResult(pydantic.BaseModel):
     n_unindexed: pydantic.NonNegativeInt
 
 
+def _customise_index_params(phil_params, max_lattices: int):
+    phil_params.indexing.multiple_lattice_search.max_lattices = max_lattices
+    phil_params.indexing.method = "fft1d"
+    phil_params.refinement.parameterisation.detector.fix = "all"
+
+
 class DLSIndexer(CommonService):
     """A service that analyses individual images."""
 
@@ -81,6 +88,7 @@ class DLSIndexer(CommonService):
 
     def initializing(self):
         logging.getLogger("dials").setLevel(logging.WARNING)
+        self._index_phil_cache = PhilParameterCache(index_phil_scope)
         workflows.recipe.wrap_subscribe(
             self._transport,
             "index",
@@ -147,14 +155,14 @@ class DLSIndexer(CommonService):
                         ]
                     )
 
-                phil_params = index_phil_scope.fetch(source=phil.parse("")).extract()
+                phil_params = self._index_phil_cache.get(
+                    payload.max_lattices,
+                    functools.partial(
+                        _customise_index_params, max_lattices=payload.max_lattices
+                    ),
+                )
                 phil_params.indexing.known_symmetry.space_group = payload.space_group
                 phil_params.indexing.known_symmetry.unit_cell = payload.unit_cell
-                phil_params.indexing.multiple_lattice_search.max_lattices = (
-                    payload.max_lattices
-                )
-                phil_params.indexing.method = "fft1d"
-                phil_params.refinement.parameterisation.detector.fix = "all"
                 idxr = indexer.Indexer.from_parameters(
                     payload.reflections,
                     payload.experiments,
@@ -1,8 +1,12 @@
 from __future__ import annotations
 
+import contextlib
+import dataclasses
+import inspect
 import json
 import os.path
 import pathlib
+import random
 import time
 from datetime import datetime
 from typing import List
@@ -18,13 +22,56 @@ from workflows.services.common_service import CommonService
 import dlstbx.services.ispybsvc_buffer as buffer
 from dlstbx import crud, schemas
 from dlstbx.services.ispybsvc_em import EM_Mixin
-from dlstbx.util import ChainMapWithReplacement
+from dlstbx.util import ChainMapWithReplacement, database
+from dlstbx.util.program_status import PROGRAM_STATUS_TOPIC
+from dlstbx.util.prometheus_metrics import BasePrometheusMetrics, NoMetrics
+
+
+class PrometheusMetrics(BasePrometheusMetrics):
+    def create_metrics(self):
+        database.create_pool_metrics(self)
 
 
 def lookup_command(command, refclass):
     return getattr(refclass, "do_" + command, None)
 
 
+class _MultipartRollback(Exception):
+    """Raised to roll back the steps of a multipart message run in process."""
+
+    def __init__(self, result):
+        super().__init__(result)
+        self.result = result
+
+
+# Mapping of upsert_quality_indicators parameters to ImageQualityIndicators columns
+_QUALITY_INDICATORS_COLUMNS = {
+    "datacollectionid": "dataCollectionId",
+    "programid": "autoProcProgramId",
+    "imagenumber": "imageNumber",
+    "spottotal": "spotTotal",
+    "inrestotal": "inResTotal",
+    "goodbraggcandidates": "goodBraggCandidates",
+    "icerings": "iceRings",
+    "method1res": "method1Res",
+    "method2res": "method2Res",
+    "maxunitcell": "maxUnitCell",
+    "pctsaturationtop50peaks": "pctSaturationTop50Peaks",
+    "inresolutionovrlspots": "inResolutionOvrlSpots",
+    "binpopcutoffmethod2res": "binPopCutOffMethod2Res",
+    "totalintegratedsignal": "totalIntegratedSignal",
+    "dozorscore": "dozor_score",
+    "driftfactor": "driftFactor",
+}
+
+
+@dataclasses.dataclass
+class _BufferedPIARecord:
+    rw: workflows.recipe.RecipeWrapper
+    header: dict
+    params: dict
+
+
 class DimpleResult(pydantic.BaseModel):
     mxmrrun: schemas.MXMRRun
     blobs: List[schemas.Blob]
@@ -48,26 +95,48 @@ class DLSISPyB(EM_Mixin, CommonService):
     # Logger name
     _logger_name = "dlstbx.services.ispyb"
 
+    # Number of PIA records to buffer before writing them to the database at once
+    _pia_buffer_size = 0
+
+    # Run the steps of multipart messages in a single transaction where possible
+    _multipart_in_process = False
+
+    # Announce finished processing programs on PROGRAM_STATUS_TOPIC
+    _broadcast_program_status = False
+
+    # Program status announcements of in-process multipart steps, which are
+    # only sent once the steps have been committed
+    _held_announcements = None
+
+    # Seconds between clean-ups of the buffer table, or 0 to disable them
+    _buffer_eviction_interval = 0.0
+
     def initializing(self):
         """Subscribe the ISPyB connector queue. Received messages must be
         acknowledged. Prepare ISPyB database connection."""
         self.log.info(f"ISPyB connector using ispyb v{ispyb.__version__}")
         self.ispyb = ispyb.open()
-        self._ispyb_sessionmaker = sqlalchemy.orm.sessionmaker(
-            bind=sqlalchemy.create_engine(
-                ispyb.sqlalchemy.url(), connect_args={"use_pure": True}
-            )
+        # Initialise metrics if requested
+        if self._environment.get("metrics"):
+            self._metrics = PrometheusMetrics()
+        else:
+            self._metrics = NoMetrics()
+        self._ispyb_sessionmaker = database.sessionmaker(
+            self._environment, service="ispyb", metrics=self._metrics
         )
-        try:
-            self.log.info("Cleaning up ISPyB buffer table...")
-            with self._ispyb_sessionmaker() as session:
-                buffer.evict(session=session)
-        except Exception as e:
-            self.log.warning(
-                f"Encountered exception {e!r} while cleaning up ISPyB buffer table",
-                exc_info=True,
-            )
+        self._multipart_in_process = bool(
+            int(self._environment.get("multipart-in-process", 0))
+        )
+        if self._multipart_in_process:
+            self.log.info("Running multipart messages in process")
+        self._broadcast_program_status = bool(
+            int(self._environment.get("broadcast-program-status", 0))
+        )
+        if self._broadcast_program_status:
+            self.log.info("Announcing finished programs on %s", PROGRAM_STATUS_TOPIC)
         self.log.info("ISPyB service ready")
+        subscription_options = self._setup_pia_buffer()
+        self._setup_buffer_eviction()
         workflows.recipe.wrap_subscribe(
             self._transport,
             "ispyb_connector",  # will become 'ispyb' in far future
@@ -75,8 +144,66 @@ class DLSISPyB(EM_Mixin, CommonService):
             acknowledgement=True,
             log_extender=self.extend_log,
             allow_non_recipe_messages=True,
+            **subscription_options,
         )
 
+    def _setup_pia_buffer(self) -> dict:
+        """Optionally collect PIA results across messages for up to
+        pia-buffer-size records or pia-buffer-window seconds, and write them to
+        the database with a single statement. Returns any additional options
+        required for the subscription."""
+        self._pia_buffer_size = int(self._environment.get("pia-buffer-size", 0))
+        self._pia_buffer_window = float(self._environment.get("pia-buffer-window", 0.5))
+        self._pia_records: list[_BufferedPIARecord] = []
+        self._pia_buffer_started = 0.0
+        if self._pia_buffer_size > 1:
+            self.log.info(
+                "Buffering up to %d PIA records for %.1f seconds",
+                self._pia_buffer_size,
+                self._pia_buffer_window,
+            )
+            self._register_idle(self._pia_buffer_window, self.on_idle)
+            return {"prefetch_count": self._pia_buffer_size}
+        return {}
+
+    def _setup_buffer_eviction(self):
+        """Clean up the buffer table every buffer-eviction-interval seconds
+        while the service is idle. The first clean-up is spread out over a
+        minute, so that connector instances started together do not all
+        delete the same entries at once."""
+        self._buffer_eviction_interval = float(
+            self._environment.get("buffer-eviction-interval", 3600)
+        )
+        self._buffer_eviction_due = time.time() + random.uniform(0, 60)
+        if self._buffer_eviction_interval and self._pia_buffer_size <= 1:
+            self._register_idle(60, self.on_idle)
+
+    def on_idle(self):
+        if self._pia_buffer_size > 1:
+            self.flush_pia_records()
+        if self._buffer_eviction_interval:
+            self.evict_buffer()
+
+    def evict_buffer(self):
+        """Delete expired buffer table entries, if a clean-up is due. Only a
+        limited number of entries is deleted at a time, so that the service
+        is not held up for long."""
+        if time.time() < self._buffer_eviction_due:
+            return
+        self._buffer_eviction_due = time.time() + self._buffer_eviction_interval
+        try:
+            with self._ispyb_sessionmaker() as session:
+                buffer.evict(session=session)
+        except Exception as e:
+            self.log.warning(
+                f"Encountered exception {e!r} while cleaning up ISPyB buffer table",
+                exc_info=True,
+            )
+
+    def in_shutdown(self):
+        if self._pia_buffer_size > 1:
+            self.flush_pia_records()
+
     def receive_msg(self, rw, header, message):
         """Do something with ISPyB."""
 
@@ -126,7 +253,6 @@ class DLSISPyB(EM_Mixin, CommonService):
             return
 
         self.log.debug("Running ISPyB call %s", command)
-        txn = rw.transport.transaction_begin(subscription_id=header["subscription"])
         rw.set_default_channel("output")
 
         parameter_map = ChainMapWithReplacement(
@@ -160,6 +286,11 @@ class DLSISPyB(EM_Mixin, CommonService):
                     base_value = base_value.replace("$" + key, str(rw.environment[key]))
             return base_value
 
+        if self._pia_buffer_size > 1 and command == "store_per_image_analysis_results":
+            self.buffer_pia_result(rw, header, parameters)
+            return
+
+        txn = rw.transport.transaction_begin(subscription_id=header["subscription"])
         try:
             with self._ispyb_sessionmaker() as session:
                 result = command_function(
@@ -293,6 +424,11 @@ class DLSISPyB(EM_Mixin, CommonService):
             self.log.info(
                 f"Updating program {ppid} with status {message!r}",
             )
+            if self._broadcast_program_status and status in ("success", "failure"):
+                self._announce_program_status(
+                    {"program_id": result, "status": status},
+                    transaction=kwargs.get("transaction"),
+                )
             # result is just ppid
             return {"success": True, "return_value": result}
         except ispyb.ISPyBException as e:
@@ -305,6 +441,17 @@ class DLSISPyB(EM_Mixin, CommonService):
             )
             return False
 
+    def _announce_program_status(self, message, transaction=None):
+        """Broadcast the status of a finished program. While multipart steps
+        run in a single database transaction the announcement is held back
+        until that transaction has been committed."""
+        if self._held_announcements is not None:
+            self._held_announcements.append((message, transaction))
+            return
+        self._transport.broadcast(
+            PROGRAM_STATUS_TOPIC, message, transaction=transaction
+        )
+
     def do_store_dimple_failure(self, parameters, **kwargs):
         params = self.ispyb.mx_processing.get_run_params()
         params["parentid"] = parameters("scaling_id")
@@ -495,18 +642,95 @@ class DLSISPyB(EM_Mixin, CommonService):
         )
         return {"success": True, "return_value": result}
 
-    def do_store_per_image_analysis_results(self, parameters, **kwargs):
+    def buffer_pia_result(self, rw, header, parameters):
+        """Queue a PIA result to be written to the database together with others.
+
+        All buffered records are written in a single statement once there are
+        pia-buffer-size records, or when the oldest record has waited for
+        pia-buffer-window seconds. The messages are then acknowledged together.
+        """
+        params = self._quality_indicators_params(parameters)
+        if not params:
+            rw.transport.nack(header)
+            return
+        if not self._pia_records:
+            self._pia_buffer_started = time.time()
+        self._pia_records.append(_BufferedPIARecord(rw, header, params))
+        if (
+            len(self._pia_records) >= self._pia_buffer_size
+            or time.time() - self._pia_buffer_started >= self._pia_buffer_window
+        ):
+            self.flush_pia_records()
+
+    def flush_pia_records(self):
+        """Write all buffered PIA records to the database in one transaction,
+        then acknowledge all of their messages in one broker transaction."""
+        records, self._pia_records = self._pia_records, []
+        if not records:
+            return
+        rows = [
+            {
+                column: record.params[key]
+                for key, column in _QUALITY_INDICATORS_COLUMNS.items()
+            }
+            for record in records
+        ]
+        try:
+            with self._ispyb_sessionmaker() as session:
+                crud.upsert_quality_indicators(rows, session)
+        except Exception as e:
+            self.log.warning(
+                f"Could not write {len(records)} PIA records to database in bulk "
+                f"({e!r}), writing them individually",
+                exc_info=True,
+            )
+            for record in records:
+                self._store_buffered_pia_record(record)
+            return
+
+        self.log.debug("Wrote %d PIA records to database", len(records))
+        txn = self._transport.transaction_begin(
+            subscription_id=records[0].header["subscription"]
+        )
+        for record in records:
+            record.rw.send({"result": None}, transaction=txn)
+            record.rw.transport.ack(record.header, transaction=txn)
+        self._transport.transaction_commit(txn)
+
+    def _store_buffered_pia_record(self, record: _BufferedPIARecord):
+        try:
+            result = self._retry_mysql_call(
+                self.ispyb.mx_processing.upsert_quality_indicators,
+                list(record.params.values()),
+            )
+        except Exception as e:
+            self.log.error(
+                "Could not write PIA results %s to database: %s",
+                record.params,
+                e,
+                exc_info=True,
+            )
+            record.rw.transport.nack(record.header)
+            return
+        txn = record.rw.transport.transaction_begin(
+            subscription_id=record.header["subscription"]
+        )
+        record.rw.send({"result": result}, transaction=txn)
+        record.rw.transport.ack(record.header, transaction=txn)
+        record.rw.transport.transaction_commit(txn)
+
+    def _quality_indicators_params(self, parameters):
         params = self.ispyb.mx_processing.get_quality_indicators_params()
         params["datacollectionid"] = parameters("dcid")
         if not params["datacollectionid"]:
             self.log.error("DataCollectionID not specified")
-            return False
+            return None
         params["image_number"] = parameters("file-pattern-index") or parameters(
             "file-number"
         )
         if not params["image_number"]:
             self.log.error("Image number not specified")
-            return False
+            return None
 
         params["dozor_score"] = parameters("dozor_score")
         params["spot_total"] = parameters("n_spots_total")
@@ -519,12 +743,18 @@ class DLSISPyB(EM_Mixin, CommonService):
             params["binpopcutoffmethod2res"] = 0
         elif params["dozor_score"] is None:
             self.log.error("Message contains neither dozor score nor spot count")
-            return False
+            return None
 
         params["totalintegratedsignal"] = parameters("total_intensity")
         params["good_bragg_candidates"] = parameters("n_spots_no_ice")
         params["method1_res"] = parameters("estimated_d_min")
         params["method2_res"] = parameters("estimated_d_min")
+        return params
+
+    def do_store_per_image_analysis_results(self, parameters, **kwargs):
+        params = self._quality_indicators_params(parameters)
+        if not params:
+            return False
 
         self.log.debug(
             "Writing PIA record for image %r in DCID %s",
@@ -1096,7 +1326,12 @@ class DLSISPyB(EM_Mixin, CommonService):
           * do_upsert_integration
         Each API call may have a return value that can be stored.
         Multipart_message takes care of chaining and checkpointing to make the
-        overall call near-ACID compliant."""
+        overall call near-ACID compliant.
+
+        If the service is started with multipart-in-process set then
+        consecutive steps that only use stored procedures are run in a single
+        database transaction without going back to the message broker. If any
+        of these steps fails then all of them are rolled back."""
 
         if not rw.environment.get("has_recipe_wrapper", True):
             self.log.error(
@@ -1121,7 +1356,88 @@ class DLSISPyB(EM_Mixin, CommonService):
             self.log.error("Received multipart message containing no commands")
             return False
 
-        current_command = commands[0]
+        # If this step previously checkpointed then override the message passed
+        # to the step.
+        step_message = commands[0]
+        if isinstance(message, dict):
+            step_message = message.get("step_message", step_message)
+
+        completed = 0
+        if self._multipart_in_process and self._runs_in_process(commands[0]):
+            completed, result = self._run_multipart_in_process(
+                rw, message, commands, step, step_message, **kwargs
+            )
+            if not completed:
+                if result is not None:
+                    return result
+                self.log.debug("Falling back to running multipart steps one by one")
+
+        if completed:
+            # Steps have completed, so remove from queue
+            del commands[:completed]
+            step += completed - 1
+        else:
+            current_command = commands[0]
+            result = self._run_multipart_step(
+                rw,
+                message,
+                current_command,
+                step,
+                len(commands),
+                step_message,
+                **kwargs,
+            )
+
+            # If the current step has checkpointed then need to manage this
+            if result and result.get("checkpoint"):
+                self.log.debug(
+                    "Checkpointing for sub-command %s",
+                    current_command.get("ispyb_command"),
+                )
+
+                if isinstance(message, dict):
+                    checkpoint_dictionary = message
+                else:
+                    checkpoint_dictionary = {}
+                checkpoint_dictionary["checkpoint"] = step - 1
+                checkpoint_dictionary["ispyb_command_list"] = commands
+                checkpoint_dictionary["step_message"] = result.get("return_value")
+                return {
+                    "checkpoint": True,
+                    "return_value": checkpoint_dictionary,
+                    "delay": result.get("delay"),
+                }
+
+            # If the step did not succeed then propagate failure
+            if not result or not result.get("success"):
+                self.log.debug("Multipart command failed")
+                return result
+
+            # Step has completed, so remove from queue
+            commands.pop(0)
+
+        # If the multipart command is finished then propagate success
+        if not commands:
+            self.log.debug("and done.")
+            return result
+
+        # If there are more steps then checkpoint the current state
+        # and put it back on the queue (with no delay)
+        self.log.debug("Checkpointing remaining %d steps", len(commands))
+        if isinstance(message, dict):
+            checkpoint_dictionary = message
+        else:
+            checkpoint_dictionary = {}
+        checkpoint_dictionary["checkpoint"] = step
+        checkpoint_dictionary["ispyb_command_list"] = commands
+        if "step_message" in checkpoint_dictionary:
+            del checkpoint_dictionary["step_message"]
+        return {"checkpoint": True, "return_value": checkpoint_dictionary}
+
+    def _run_multipart_step(
+        self, rw, message, current_command, step, n_commands, step_message, **kwargs
+    ):
+        """Run a single step of a multipart message and store its result."""
         command = current_command.get("ispyb_command")
         if not command:
             self.log.error(
@@ -1136,8 +1452,8 @@ class DLSISPyB(EM_Mixin, CommonService):
             "Processing step %d of multipart message (%s) with %d further steps",
             step,
             command,
-            len(commands) - 1,
-            extra={"ispyb-message-parts": len(commands)} if step == 1 else {},
+            n_commands - 1,
+            extra={"ispyb-message-parts": n_commands} if step == 1 else {},
         )
 
         # Create a parameter lookup function specific to this step of the
@@ -1175,12 +1491,6 @@ class DLSISPyB(EM_Mixin, CommonService):
 
         kwargs["parameters"] = step_parameters
 
-        # If this step previously checkpointed then override the message passed
-        # to the step.
-        step_message = current_command
-        if isinstance(message, dict):
-            step_message = message.get("step_message", step_message)
-
         # Run the multipart step
         result = command_function(rw=rw, message=step_message, **kwargs)
 
@@ -1193,49 +1503,86 @@ class DLSISPyB(EM_Mixin, CommonService):
                 result["return_value"],
                 store_result,
             )
+        return result
 
-        # If the current step has checkpointed then need to manage this
-        if result and result.get("checkpoint"):
-            self.log.debug("Checkpointing for sub-command %s", command)
-
-            if isinstance(message, dict):
-                checkpoint_dictionary = message
-            else:
-                checkpoint_dictionary = {}
-            checkpoint_dictionary["checkpoint"] = step - 1
-            checkpoint_dictionary["ispyb_command_list"] = commands
-            checkpoint_dictionary["step_message"] = result.get("return_value")
-            return {
-                "checkpoint": True,
-                "return_value": checkpoint_dictionary,
-                "delay": result.get("delay"),
-            }
-
-        # If the step did not succeed then propagate failure
-        if not result or not result.get("success"):
-            self.log.debug("Multipart command failed")
-            return result
-
-        # Step has completed, so remove from queue
-        commands.pop(0)
-
-        # If the multipart command is finished then propagate success
-        if not commands:
-            self.log.debug("and done.")
-            return result
+    def _runs_in_process(self, current_command) -> bool:
+        """Whether a multipart step can be run as part of a transaction on the
+        stored procedure connection. Commands that write through an SQLAlchemy
+        session use a different database connection, and so can not see rows
+        written earlier in the same transaction."""
+        command = current_command.get("ispyb_command")
+        if not command or command in ("buffer", "multipart_message"):
+            return False
+        command_function = lookup_command(command, self)
+        return bool(command_function) and (
+            "session" not in inspect.signature(command_function).parameters
+        )
 
-        # If there are more steps then checkpoint the current state
-        # and put it back on the queue (with no delay)
-        self.log.debug("Checkpointing remaining %d steps", len(commands))
-        if isinstance(message, dict):
-            checkpoint_dictionary = message
-        else:
-            checkpoint_dictionary = {}
-        checkpoint_dictionary["checkpoint"] = step
-        checkpoint_dictionary["ispyb_command_list"] = commands
-        if "step_message" in checkpoint_dictionary:
-            del checkpoint_dictionary["step_message"]
-        return {"checkpoint": True, "return_value": checkpoint_dictionary}
+    @contextlib.contextmanager
+    def _stored_procedure_transaction(self):
+        """Suspend autocommit on the stored procedure connection, so that all
+        calls made within the block are committed or rolled back together."""
+        connection = self.ispyb.conn
+        connection.autocommit = False
+        try:
+            yield
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        finally:
+            connection.autocommit = True
+
+    def _run_multipart_in_process(
+        self, rw, message, commands, step, step_message, **kwargs
+    ):
+        """Run consecutive steps of a multipart message in a single database
+        transaction, resolving stored results in memory.
+
+        Returns the number of completed steps together with the result of the
+        last one. If a step fails then all steps are rolled back and (0, result)
+        is returned. If a step wants to checkpoint, eg. to wait for a buffered
+        value, then all steps are rolled back and (0, None) is returned, so that
+        the message can be processed one step at a time instead. Finished
+        programs are only announced once all steps have been committed."""
+        original_environment = dict(rw.environment)
+        completed = 0
+        result = None
+        self._held_announcements = []
+        try:
+            with self._stored_procedure_transaction():
+                for current_command in commands:
+                    if not self._runs_in_process(current_command):
+                        break
+                    result = self._run_multipart_step(
+                        rw,
+                        message,
+                        current_command,
+                        step + completed,
+                        len(commands) - completed,
+                        step_message if completed == 0 else current_command,
+                        **kwargs,
+                    )
+                    if not result or not result.get("success"):
+                        raise _MultipartRollback(result)
+                    completed += 1
+        except _MultipartRollback as e:
+            # Results stored by rolled back steps are no longer valid
+            rw.environment.clear()
+            rw.environment.update(original_environment)
+            if e.result and e.result.get("checkpoint"):
+                return 0, None
+            self.log.debug(
+                "Multipart command failed, rolled back %d steps", completed + 1
+            )
+            return 0, e.result
+        finally:
+            # Announcements of rolled back steps are discarded
+            announcements, self._held_announcements = self._held_announcements, None
+        for announcement, transaction in announcements:
+            self._announce_program_status(announcement, transaction=transaction)
+        self.log.debug("Ran %d multipart steps in a single transaction", completed)
+        return completed, result
 
     def _retry_mysql_call(self, function, *args, **kwargs):
         tries = 0
@@ -1333,24 +1680,24 @@ class DLSISPyB(EM_Mixin, CommonService):
             if not program_id:
                 self.log.error("Invalid buffer call: program_id is undefined")
                 return False
-            for entry in list(message["buffer_lookup"]):
-                buffer_result = buffer.load(
-                    session=session,
-                    program=program_id,
-                    uuid=message["buffer_lookup"][entry],
-                )
-                if buffer_result.success:
+            references = buffer.load_many(
+                session=session,
+                program=program_id,
+                uuids=message["buffer_lookup"].values(),
+            )
+            for entry, uuid in list(message["buffer_lookup"].items()):
+                if uuid in references:
                     # resolve value and continue
-                    message["buffer_command"][entry] = buffer_result.value
+                    message["buffer_command"][entry] = references[uuid]
                     del message["buffer_lookup"][entry]
                     self.log.debug(
-                        f"Successfully resolved buffer reference {entry!r} to {buffer_result.value!r}"
+                        f"Successfully resolved buffer reference {entry!r} to {references[uuid]!r}"
                     )
-                    continue
 
+            if message["buffer_lookup"]:
                 if message["buffer_expiry_time"] < time.time():
                     self.log.warning(
-                        f"Buffer call could not be resolved: entry {entry} not found for program {program_id}"
+                        f"Buffer call could not be resolved: entries {list(message['buffer_lookup'])} not found for program {program_id}"
                     )
                     return False
 
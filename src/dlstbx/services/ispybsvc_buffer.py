@@ -1,20 +1,46 @@
 from __future__ import annotations
 
+import collections
+import datetime
 import logging
-from typing import NamedTuple, Optional
+from typing import Iterable, NamedTuple, Optional
 
 import ispyb.sqlalchemy
 import sqlalchemy
 
 logger = logging.getLogger("dlstbx.services.ispybsvc_buffer")
 
+# Per-process cache of recently loaded buffer references, keyed on
+# (AutoProcProgramID, UUID). Entries are dropped when the reference is stored
+# again by this process, or evicted from the database.
+_cache: collections.OrderedDict[tuple[int, int], int] = collections.OrderedDict()
+cache_size = 10000
+
 
 class BufferResult(NamedTuple):
     success: bool
     value: Optional[int]
 
 
-def evict(*, session):
+def _remember(program: int, uuid: int, reference: int) -> None:
+    _cache[(program, uuid)] = reference
+    _cache.move_to_end((program, uuid))
+    while len(_cache) > cache_size:
+        _cache.popitem(last=False)
+
+
+def clear_cache() -> None:
+    _cache.clear()
+
+
+def evict(
+    *,
+    session,
+    end_time_days: int = 30,
+    record_time_days: int = 60,
+    batch_size: int = 1000,
+    max_batches: Optional[int] = 10,
+) -> int:
     """Throw away buffered information after a certain time.
 
     This needs to be run periodically to ensure the buffer tables don't
@@ -23,18 +49,51 @@ def evict(*, session):
     to a single AutoProcProgram run it should be a safe bet that the buffer
     information is only of limited use after that program has completed. We
     give 30 days to deal with transient database and service problems and any
-    messages stuck in the DLQ.
-    """
-
-    # Not quite clear yet how we should do this. SQLAlchemy vs stored procedure.
-    # Suggested SQL something along the lines of
+    messages stuck in the DLQ, or 60 days for programs that never finished.
 
-    # DELETE zb
-    # FROM zc_ZocaloBuffer zb
-    # JOIN AutoProcProgram app
-    # WHERE app.autoProcProgramId = zb.AutoProcProgramId
-    # AND (DATE(app.processingEndTime) < DATE_SUB(CURDATE(), INTERVAL 30 DAY)
-    #      OR DATE(app.recordTimeStamp) < DATE_SUB(CURDATE(), INTERVAL 60 DAY))
+    Entries are deleted for up to batch_size programs at a time, committing
+    after each batch so that locks on the buffer table are held only briefly.
+    At most max_batches batches are deleted per call, if given, so any
+    further entries are left for the next call. Returns the number of
+    deleted entries.
+    """
+    now = datetime.datetime.now()
+    buffer_table = ispyb.sqlalchemy.ZcZocaloBuffer
+    app = ispyb.sqlalchemy.AutoProcProgram
+    expired = (
+        session.query(buffer_table.AutoProcProgramID)
+        .join(app, app.autoProcProgramId == buffer_table.AutoProcProgramID)
+        .filter(
+            (app.processingEndTime < now - datetime.timedelta(days=end_time_days))
+            | (app.recordTimeStamp < now - datetime.timedelta(days=record_time_days))
+        )
+        .distinct()
+        .limit(batch_size)
+    )
+    deleted = 0
+    evicted_programs = set()
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        batches += 1
+        programs = [row.AutoProcProgramID for row in expired.all()]
+        if not programs:
+            break
+        deleted += (
+            session.query(buffer_table)
+            .filter(buffer_table.AutoProcProgramID.in_(programs))
+            .delete(synchronize_session=False)
+        )
+        session.commit()
+        evicted_programs.update(programs)
+        if len(programs) < batch_size:
+            break
+
+    for key in [k for k in _cache if k[0] in evicted_programs]:
+        del _cache[key]
+    logger.info(
+        f"Evicted {deleted} buffer entries for {len(evicted_programs)} programs"
+    )
+    return deleted
 
 
 def load(*, session, program: int, uuid: int) -> BufferResult:
@@ -43,6 +102,12 @@ def load(*, session, program: int, uuid: int) -> BufferResult:
     Given an AutoProcProgramID and a client-defined unique reference (uuid)
     retrieve a reference value from the database if possible.
     """
+    program, uuid = int(program), int(uuid)
+    if (program, uuid) in _cache:
+        _cache.move_to_end((program, uuid))
+        reference = _cache[(program, uuid)]
+        logger.info(f"buffer lookup for {program}.{uuid} succeeded (={reference})")
+        return BufferResult(success=True, value=reference)
     query = (
         session.query(ispyb.sqlalchemy.ZcZocaloBuffer)
         .filter(ispyb.sqlalchemy.ZcZocaloBuffer.AutoProcProgramID == program)
@@ -53,12 +118,52 @@ def load(*, session, program: int, uuid: int) -> BufferResult:
         logger.info(
             f"buffer lookup for {program}.{uuid} succeeded (={result.Reference})"
         )
+        _remember(program, uuid, result.Reference)
         return BufferResult(success=True, value=result.Reference)
     except sqlalchemy.exc.NoResultFound:
         logger.info(f"buffer lookup for {program}.{uuid} failed")
         return BufferResult(success=False, value=None)
 
 
+def load_many(*, session, program: int, uuids: Iterable[int]) -> dict[int, int]:
+    """Load several entries from the zc_ZocaloBuffer table at once.
+
+    Returns a dictionary mapping each uuid that could be resolved to its
+    reference value, keyed by the uuids as they were passed in. Entries that
+    are not cached are read in a single query.
+    """
+    program = int(program)
+    requested = collections.defaultdict(set)
+    for uuid in uuids:
+        requested[int(uuid)].add(uuid)
+    found = {}
+    missing = set()
+    for uuid in requested:
+        if (program, uuid) in _cache:
+            _cache.move_to_end((program, uuid))
+            found[uuid] = _cache[(program, uuid)]
+        else:
+            missing.add(uuid)
+    if missing:
+        query = session.query(
+            ispyb.sqlalchemy.ZcZocaloBuffer.UUID,
+            ispyb.sqlalchemy.ZcZocaloBuffer.Reference,
+        ).filter(
+            ispyb.sqlalchemy.ZcZocaloBuffer.AutoProcProgramID == program,
+            ispyb.sqlalchemy.ZcZocaloBuffer.UUID.in_(missing),
+        )
+        for row in query.all():
+            found[row.UUID] = row.Reference
+            _remember(program, row.UUID, row.Reference)
+    for uuid, reference in found.items():
+        logger.info(f"buffer lookup for {program}.{uuid} succeeded (={reference})")
+    for uuid in missing - found.keys():
+        logger.info(f"buffer lookup for {program}.{uuid} failed")
+    return {
+        key: reference for uuid, reference in found.items() for key in requested[uuid]
+    }
+
+
 def store(*, session, program: int, uuid: int, reference: int):
     """Write an entry into the zc_ZocaloBuffer table.
 
@@ -68,7 +173,11 @@ def store(*, session, program: int, uuid: int, reference: int):
     key value (reference). All uuids are relative to an AutoProcProgramID
     and will be stored for a limited time based on the underlying
     AutoProcProgram record.
+
+    An existing entry is overwritten, so the reference is not cached here
+    but read from the database again by the next load().
     """
+    program, uuid = int(program), int(uuid)
     entry = ispyb.sqlalchemy.ZcZocaloBuffer(
         AutoProcProgramID=program,
         UUID=uuid,
@@ -77,3 +186,4 @@ def store(*, session, program: int, uuid: int, reference: int):
     session.merge(entry)
     logger.info(f"buffering value {reference} for {program}.{uuid}")
     session.commit()
+    _cache.pop((program, uuid), None)
@@ -1,10 +1,11 @@
 from __future__ import annotations
 
 import ispyb
-import sqlalchemy
 import workflows.recipe
 
-from dlstbx.services.ispybsvc import DLSISPyB
+from dlstbx.services.ispybsvc import DLSISPyB, PrometheusMetrics
+from dlstbx.util import database
+from dlstbx.util.prometheus_metrics import NoMetrics
 
 
 class DLSISPyBPIA(DLSISPyB):
@@ -27,12 +28,16 @@ class DLSISPyBPIA(DLSISPyB):
         """
         self.log.info("ISPyB PIA inserter using ispyb v%s", ispyb.__version__)
         self.ispyb = ispyb.open()
-        self._ispyb_sessionmaker = sqlalchemy.orm.sessionmaker(
-            bind=sqlalchemy.create_engine(
-                ispyb.sqlalchemy.url(), connect_args={"use_pure": True}
-            )
+        # Initialise metrics if requested
+        if self._environment.get("metrics"):
+            self._metrics = PrometheusMetrics()
+        else:
+            self._metrics = NoMetrics()
+        self._ispyb_sessionmaker = database.sessionmaker(
+            self._environment, service="ispyb_pia", metrics=self._metrics
         )
         self.log.debug("ISPyB PIA inserter starting")
+        subscription_options = self._setup_pia_buffer()
         workflows.recipe.wrap_subscribe(
             self._transport,
             "ispyb_pia",
@@ -40,4 +45,5 @@ class DLSISPyBPIA(DLSISPyB):
             acknowledgement=True,
             log_extender=self.extend_log,
             allow_non_recipe_messages=True,
+            **subscription_options,
         )
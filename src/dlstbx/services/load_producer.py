@@ -4,9 +4,26 @@ import time
 
 from workflows.services.common_service import CommonService
 
+from dlstbx.util.message_benchmark import end_of_run, new_run_id, stamp
+
 
 class LoadProducer(CommonService):
-    """A service creating messages as quickly as possible."""
+    """
+    A service creating messages as quickly as possible, or at a fixed rate.
+
+    Messages are stamped with a run ID, a sequence number and their send
+    time, so that the LoadReceiver service can measure latency, loss and
+    reordering. A final message marks the end of a run.
+
+    Service environment options:
+      destination: Queue to send messages to (default: transient.destination)
+      message-size: Payload size in bytes (default: 1024)
+      count: Number of messages to send, or 0 to send messages indefinitely
+      rate: Messages to send per second, or 0 to send as quickly as possible
+      transaction-size: Number of messages to send in each transaction, or 0
+                        to send messages outside of transactions
+      run: Run ID to stamp messages with (default: a random ID)
+    """
 
     # Human readable service name
     _service_name = "Load Producer"
@@ -16,21 +33,53 @@ class LoadProducer(CommonService):
 
     def initializing(self):
         """Generate messages."""
+        destination = self._environment.get("destination") or "transient.destination"
+        size = int(self._environment.get("message-size") or 1024)
+        count = int(self._environment.get("count") or 0)
+        rate = float(self._environment.get("rate") or 0)
+        transaction_size = int(self._environment.get("transaction-size") or 0)
+        self.run = self._environment.get("run") or new_run_id()
+        content = "X" * size
+
+        self.sent = 0
         counter = 0
         interval = time.time() + 5
-        content = "X" * 1024
-        while True:
+        start = time.perf_counter()
+        txn = None
+        while not count or self.sent < count:
+            if rate:
+                delay = start + self.sent / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            if transaction_size and not txn:
+                txn = self._transport.transaction_begin()
+            message = stamp(self.run, self.sent, content)
+            if txn:
+                self._transport.send(destination, message, transaction=txn)
+            else:
+                self._transport.send(destination, message)
+            self.sent += 1
             counter += 1
-            self._transport.send(
-                "transient.destination",
-                #     self._transport.send("destination",
-                content,
-            )
+            if txn and self.sent % transaction_size == 0:
+                self._transport.transaction_commit(txn)
+                txn = None
             if interval < time.time():
                 self.log.info(
-                    "Produced %5d 1K messages in 5 seconds = %7.1f/s",
+                    "Produced %5d %dB messages in 5 seconds = %7.1f/s",
                     counter,
+                    size,
                     counter / 5,
                 )
                 counter = 0
                 interval = time.time() + 5
+        if txn:
+            self._transport.transaction_commit(txn)
+        self.seconds = time.perf_counter() - start
+        self._transport.send(destination, end_of_run(self.run, self.sent))
+        self.log.info(
+            "Produced %d %dB messages in %.2f seconds = %.1f/s",
+            self.sent,
+            size,
+            self.seconds,
+            self.sent / self.seconds if self.seconds else 0,
+        )
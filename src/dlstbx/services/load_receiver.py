@@ -1,12 +1,30 @@
 from __future__ import annotations
 
+import json
 import time
 
 from workflows.services.common_service import CommonService
 
+from dlstbx.util.message_benchmark import MODES, MessageStatistics
+
 
 class LoadReceiver(CommonService):
-    """service consuming messages as fast as possible."""
+    """
+    A service consuming messages as fast as possible.
+
+    For messages stamped by the LoadProducer service the latency, loss,
+    reordering and throughput of each run are reported once the end of the
+    run has been received.
+
+    Service environment options:
+      destination: Queue to consume messages from
+                   (default: destination and transient.destination)
+      mode: 'none' to consume messages without acknowledgement, 'ack' to
+            acknowledge each message, or 'transaction' to acknowledge each
+            message in a transaction (default: none)
+      prefetch-count: Maximum number of unacknowledged messages
+      report: File to append a JSON report of each completed run to
+    """
 
     # Human readable service name
     _service_name = "Load receiver"
@@ -18,12 +36,46 @@ class LoadReceiver(CommonService):
         """Subscribe to channels."""
         self.interval = time.time() + 5
         self.count = 0
-        self._transport.subscribe("destination", self.consume_message)
-        self._transport.subscribe("transient.destination", self.consume_message)
+        self.runs: dict[str, MessageStatistics] = {}
+        self.reports: dict[str, dict] = {}
+        self._mode = self._environment.get("mode") or "none"
+        if self._mode not in MODES:
+            self.log.error(f"Unknown mode {self._mode!r}, expected one of {MODES}")
+            self._request_termination()
+            return
+        subscription = {}
+        if self._mode != "none":
+            subscription["acknowledgement"] = True
+        if self._environment.get("prefetch-count"):
+            subscription["prefetch_count"] = int(self._environment["prefetch-count"])
+        if self._environment.get("destination"):
+            destinations = [self._environment["destination"]]
+        else:
+            destinations = ["destination", "transient.destination"]
+        for destination in destinations:
+            self._transport.subscribe(destination, self.consume_message, **subscription)
         self._register_idle(1, self.print_stats)
 
     def consume_message(self, header, message):
         """Consume a message"""
+        received_at = time.time()
+        if self._mode == "ack":
+            self._transport.ack(header)
+        elif self._mode == "transaction":
+            txn = self._transport.transaction_begin(
+                subscription_id=header["subscription"]
+            )
+            self._transport.ack(header, transaction=txn)
+            self._transport.transaction_commit(txn)
+
+        if isinstance(message, dict) and "run" in message:
+            run = message["run"]
+            if run not in self.runs:
+                self.runs[run] = MessageStatistics(run)
+            self.runs[run].record(message, received_at)
+            if self.runs[run].complete and run not in self.reports:
+                self.report(self.runs[run])
+
         if self.interval < time.time():
             self.log.info(
                 "Received %5d messages in 5 seconds = %7.1f/s",
@@ -35,6 +87,33 @@ class LoadReceiver(CommonService):
         else:
             self.count = self.count + 1
 
+    def report(self, statistics: MessageStatistics):
+        """Report the outcome of a completed run"""
+        report = {
+            "run": statistics.run,
+            "mode": self._mode,
+            "prefetch_count": int(self._environment.get("prefetch-count") or 0),
+            **statistics.summary(),
+        }
+        self.reports[statistics.run] = report
+        latency = report["latency"]
+        self.log.info(
+            "Run %s: received %d messages at %.1f/s, %d lost, %d reordered, "
+            "latency p50 %.1fms, p95 %.1fms, p99 %.1fms",
+            statistics.run,
+            report["received"],
+            report["messages_per_second"] or 0,
+            report["lost"],
+            report["reordered"],
+            latency.get("p50", 0) * 1000,
+            latency.get("p95", 0) * 1000,
+            latency.get("p99", 0) * 1000,
+            extra={"benchmark": report},
+        )
+        if self._environment.get("report"):
+            with open(self._environment["report"], "a") as fh:
+                fh.write(json.dumps(report) + "\n")
+
     def print_stats(self):
         """Continue to print statistics when idle"""
         if self.interval < time.time():
@@ -40,6 +40,12 @@ class DLSMimas(CommonService):
             "s3echo": {"total": 0.0, "last_cluster_update": time.time()},
         }
 
+        # Compile the handler specifications before the first scenario arrives
+        index = mimas.get_decision_index()
+        self.log.debug(
+            f"Compiled {len(index.handlers)} mimas handlers into {len(index)} decision table entries"
+        )
+
         workflows.recipe.wrap_subscribe(
             self._transport,
             "mimas",
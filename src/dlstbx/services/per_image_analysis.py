@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import dataclasses
 import io
 import logging
 import pathlib
@@ -17,8 +18,11 @@ from workflows.services.common_service import CommonService
 import dlstbx.util.sanity
 from dlstbx.util import ChainMapWithReplacement
 from dlstbx.util.per_image_analysis import (
+    ExperimentListCache,
     PerImageAnalysisParameters,
     do_per_image_analysis,
+    do_per_image_analysis_batch,
+    find_spots_phil_cache,
 )
 
 
@@ -27,6 +31,21 @@ class PerImageAnalysisPayload(pydantic.BaseModel):
     parameters: Optional[PerImageAnalysisParameters] = None
 
 
+@dataclasses.dataclass
+class _BatchedMessage:
+    rw: workflows.recipe.RecipeWrapper
+    header: dict
+    message: dict
+    payload: PerImageAnalysisPayload
+    image_number: int
+
+
+@dataclasses.dataclass
+class _Batch:
+    started: float = dataclasses.field(default_factory=time.time)
+    messages: list[_BatchedMessage] = dataclasses.field(default_factory=list)
+
+
 def msgpack_mangle_for_sending(message):
     return msgpack.packb(message, default=msgpack_serializer)
 
@@ -85,6 +104,40 @@ class DLSPerImageAnalysis(CommonService):
             return
         self.log.info("Node self-check passed")
 
+        # Keep recently imported experiments so that further images of the
+        # same collection can be analysed without re-reading the master file
+        self._experiments_cache = ExperimentListCache(
+            maxsize=int(self._environment.get("experiments-cache-size", 8))
+        )
+        self._cache_statistics_interval = float(
+            self._environment.get("cache-statistics-interval", 300)
+        )
+        self._cache_statistics_reported = time.time()
+
+        # Optionally gather up to batch-size single image messages for the same
+        # file, for up to batch-window seconds, and analyse them together
+        self._batch_size = int(self._environment.get("batch-size", 1))
+        self._batch_window = float(self._environment.get("batch-window", 0.5))
+        self._batch_nproc = int(self._environment.get("batch-nproc", 1))
+        self._batches: dict[tuple, _Batch] = {}
+
+        if self._batch_size > 1:
+            self.log.info(
+                "Analysing up to %d images per batch with %d processes",
+                self._batch_size,
+                self._batch_nproc,
+            )
+            self._register_idle(self._batch_window, self.process_batches)
+            workflows.recipe.wrap_subscribe(
+                self._transport,
+                self._environment.get("queue") or "per_image_analysis",
+                self.batch_per_image_analysis,
+                acknowledgement=True,
+                log_extender=self.extend_log,
+                prefetch_count=self._batch_size,
+            )
+            return
+
         # The main per_image_analysis queue.
         # For every received message a single frame will be analysed.
         workflows.recipe.wrap_subscribe(
@@ -95,6 +148,163 @@ class DLSPerImageAnalysis(CommonService):
             log_extender=self.extend_log,
         )
 
+    def _report_cache_statistics(self):
+        """Log the cache statistics every cache-statistics-interval seconds."""
+        now = time.time()
+        if now - self._cache_statistics_reported < self._cache_statistics_interval:
+            return
+        self._cache_statistics_reported = now
+        self.log.info(
+            "Experiment list cache: %d hits, %d misses",
+            self._experiments_cache.hits,
+            self._experiments_cache.misses,
+            extra={
+                "experiments-cache-hits": self._experiments_cache.hits,
+                "experiments-cache-misses": self._experiments_cache.misses,
+            },
+        )
+        self.log.info(
+            "PHIL parameter cache: %d hits, %d misses, %.2f seconds saved",
+            find_spots_phil_cache.hits,
+            find_spots_phil_cache.misses,
+            find_spots_phil_cache.time_saved,
+            extra={
+                "phil-cache-hits": find_spots_phil_cache.hits,
+                "phil-cache-misses": find_spots_phil_cache.misses,
+                "phil-cache-time-saved": find_spots_phil_cache.time_saved,
+            },
+        )
+
+    @staticmethod
+    def _parse_payload(
+        rw: workflows.recipe.RecipeWrapper, message: dict
+    ) -> PerImageAnalysisPayload:
+        parameters = ChainMapWithReplacement(
+            message.get("parameters", {}) if isinstance(message, dict) else {},
+            rw.recipe_step.get("parameters", {}),
+            substitutions=rw.environment,
+        )
+        return PerImageAnalysisPayload(**(message | {"parameters": parameters}))
+
+    def batch_per_image_analysis(
+        self,
+        rw: workflows.recipe.RecipeWrapper,
+        header: dict,
+        message: dict,
+    ):
+        """Queue a message for batched PIA.
+
+        Messages for single images of HDF5/NeXus files that do not request
+        reflections output are grouped by file and parameters. A group is
+        analysed once it reaches batch-size messages, or when the oldest
+        message in it has waited for batch-window seconds. All other messages
+        are analysed immediately.
+        """
+        payload = self._parse_payload(rw, message)
+        params = payload.parameters
+        output = rw.recipe_step.get("output", {})
+        if (
+            payload.file.suffix not in {".h5", ".nxs"}
+            or not params
+            or not params.scan_range
+            or params.scan_range[0] != params.scan_range[1]
+            or (isinstance(output, dict) and output.get("reflections"))
+        ):
+            self.per_image_analysis(rw, header, message)
+        else:
+            key = (payload.file, params.model_dump_json(exclude={"scan_range"}))
+            batch = self._batches.setdefault(key, _Batch())
+            batch.messages.append(
+                _BatchedMessage(rw, header, message, payload, params.scan_range[0])
+            )
+            if len(batch.messages) >= self._batch_size:
+                self._process_batch(key)
+
+        # Do not hold on to messages for longer than the batch window
+        expired = time.time() - self._batch_window
+        for key in [k for k, b in self._batches.items() if b.started < expired]:
+            self._process_batch(key)
+
+    def process_batches(self):
+        """Analyse all waiting batches, regardless of size."""
+        for key in list(self._batches):
+            self._process_batch(key)
+
+    def _process_batch(self, key):
+        batch = self._batches.pop(key)
+        messages = sorted(batch.messages, key=lambda m: m.image_number)
+
+        # Split the batch into runs of consecutive images
+        runs = [[messages[0]]]
+        for m in messages[1:]:
+            if m.image_number == runs[-1][-1].image_number:
+                # Duplicate of an image already in this run
+                runs.append([m])
+            elif m.image_number == runs[-1][-1].image_number + 1:
+                runs[-1].append(m)
+            else:
+                runs.append([m])
+
+        for run in runs:
+            if len(run) == 1:
+                self.per_image_analysis(run[0].rw, run[0].header, run[0].message)
+                continue
+            self._analyse_run(run)
+
+    def _analyse_run(self, run: list[_BatchedMessage]):
+        filename = run[0].payload.file
+        params = run[0].payload.parameters.model_copy(
+            update={"scan_range": (run[0].image_number, run[-1].image_number)}
+        )
+        start = time.time()
+        try:
+            pia_results = do_per_image_analysis_batch(
+                filename,
+                params,
+                experiments_cache=self._experiments_cache,
+                nproc=self._batch_nproc,
+            )
+        except Exception as e:
+            self.log.warning(
+                "Batched PIA on %s images %d-%d failed with %r, analysing individually",
+                filename,
+                run[0].image_number,
+                run[-1].image_number,
+                e,
+                exc_info=True,
+            )
+            for m in run:
+                self.per_image_analysis(m.rw, m.header, m.message)
+            return
+        runtime = time.time() - start
+
+        # Acknowledge all messages and send all results in a single transaction
+        txn = run[0].rw.transport.transaction_begin(
+            subscription_id=run[0].header["subscription"]
+        )
+        for m in run:
+            results = pia_results[m.image_number].model_dump()
+            # Pass through all file* fields
+            for key in (x for x in m.message if x.startswith("file")):
+                results[key] = m.message[key]
+            m.rw.transport.ack(m.header, transaction=txn)
+            m.rw.set_default_channel("result")
+            m.rw.send_to("result", results, transaction=txn)
+        run[0].rw.transport.transaction_commit(txn)
+        self.log.info(
+            "PIA completed on %s images %d-%d with parameters %s in %.2f seconds",
+            filename,
+            run[0].image_number,
+            run[-1].image_number,
+            params,
+            runtime,
+            extra={
+                "pia-time": runtime / len(run),
+                "pia-batch-size": len(run),
+            },
+        )
+        self._report_cache_statistics()
+
     # @pydantic.validate_call(config=dict(arbitrary_types_allowed=True))
     def per_image_analysis(
         self,
@@ -138,12 +348,7 @@ class DLSPerImageAnalysis(CommonService):
           "total_intensity": ... }
         """
 
-        parameters = ChainMapWithReplacement(
-            message.get("parameters", {}) if isinstance(message, dict) else {},
-            rw.recipe_step.get("parameters", {}),
-            substitutions=rw.environment,
-        )
-        payload = PerImageAnalysisPayload(**(message | {"parameters": parameters}))
+        payload = self._parse_payload(rw, message)
         self.log.info("Starting PIA on %s", payload.file)
         params = payload.parameters or PerImageAnalysisParameters()
 
@@ -151,7 +356,7 @@ class DLSPerImageAnalysis(CommonService):
         start = time.time()
         try:
             expts, reflections, pia_results = do_per_image_analysis(
-                payload.file, params
+                payload.file, params, experiments_cache=self._experiments_cache
             )
         except Exception as e:
             # if isinstance(e, RuntimeError) and str(e).startswith(
@@ -227,3 +432,4 @@ class DLSPerImageAnalysis(CommonService):
                 "pia-time": runtime,
             },
         )
+        self._report_cache_statistics()
@@ -5,10 +5,8 @@ import math
 import os
 import time
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
-import matplotlib
-import matplotlib.pyplot as plt
 import numpy as np
 import pydantic
 import workflows.recipe
@@ -16,7 +14,18 @@ from workflows.services.common_service import CommonService
 
 from dlstbx.util import ChainMapWithReplacement
 
-matplotlib.use("Agg")
+if TYPE_CHECKING:
+    import matplotlib.pyplot as plt
+
+
+def _pyplot():
+    # matplotlib is slow to import, so defer it until the first plot is made
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    return plt
 
 
 class Status(pydantic.BaseModel):
@@ -179,6 +188,7 @@ class SSXPlotter(CommonService):
             result.file_number: result.n_spots_total for result in pia_results
         }
 
+        plt = _pyplot()
         fig, ax = plt.subplots()
 
         plot_pia(n_spots_total, spot_count_cutoff=payload.spot_count_cutoff, ax=ax)
@@ -209,6 +219,7 @@ class SSXPlotter(CommonService):
             f"Found {n_indexed_lattices} indexed lattices in {payload.results_file}"
         )
 
+        plt = _pyplot()
         fig, axes = plt.subplots(nrows=3, ncols=3, layout="constrained")
         for i, (x, y) in enumerate([("a", "b"), ("b", "c"), ("c", "a")]):
             axes[0, i].set_xlabel(x + " (Å)")
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import dataclasses
 import os
 import pathlib
 import re
@@ -8,7 +9,6 @@ from time import time
 from typing import Any, Dict, List, Literal, Mapping, Optional
 
 import gemmi
-import ispyb
 import prometheus_client
 import pydantic
 import sqlalchemy.engine
@@ -33,11 +33,12 @@ from sqlalchemy.orm import Load, contains_eager, joinedload
 from workflows.recipe.wrapper import RecipeWrapper
 from workflows.services.common_service import CommonService
 
-import dlstbx.ispybtbx
+from dlstbx import crud
 from dlstbx.crud import get_protein_for_dcid
-from dlstbx.util import INDUSTRIAL_CODES, ChainMapWithReplacement
+from dlstbx.util import INDUSTRIAL_CODES, ChainMapWithReplacement, database
 from dlstbx.util.metal_id_helpers import dcids_from_related_dcids
 from dlstbx.util.pdb import PDBFileOrCode, trim_pdb_bfactors
+from dlstbx.util.program_status import PROGRAM_STATUS_TOPIC
 from dlstbx.util.prometheus_metrics import BasePrometheusMetrics, NoMetrics
 
 
@@ -48,6 +49,28 @@ class PrometheusMetrics(BasePrometheusMetrics):
             documentation="The total number of jobs triggered by the Zocalo trigger service",
             labelnames=["target"],
         )
+        database.create_pool_metrics(self)
+        self.zocalo_ispyb_cache_requests_total = prometheus_client.Counter(
+            name="zocalo_ispyb_cache_requests_total",
+            documentation="The total number of ISPyB entity cache lookups",
+            labelnames=["entity", "result"],
+        )
+
+
+@dataclasses.dataclass
+class _WaitingCheckpoint:
+    payload: dict
+    delay: float
+    program_ids: set[int]
+
+
+@dataclasses.dataclass
+class _HeldMessage:
+    rw: RecipeWrapper
+    header: dict
+    checkpoints: list[_WaitingCheckpoint]
+    return_value: Any
+    deadline: float
 
 
 class DimpleParameters(pydantic.BaseModel):
@@ -76,6 +99,18 @@ class RelatedDCIDs(pydantic.BaseModel):
     sample_group_id: Optional[int] = pydantic.Field(gt=0, default=None)
 
 
+class RelatedCandidate(pydantic.BaseModel):
+    """A successful processing result for a related data collection"""
+
+    dcid: int
+    appid: int
+    wavelength: Optional[float] = None
+    start_image: Optional[int] = None
+    number_of_images: Optional[int] = None
+    spacegroup: Optional[str] = None
+    files: List[str] = []
+
+
 class MetalIdParameters(pydantic.BaseModel):
     dcid: int = pydantic.Field(gt=0)
     dcg_dcids: list[int]
@@ -305,28 +340,137 @@ class DLSTrigger(CommonService):
 
     def initializing(self):
         """Subscribe to the trigger queue. Received messages must be acknowledged."""
-        self._ispyb_sessionmaker = sqlalchemy.orm.sessionmaker(
-            bind=sqlalchemy.create_engine(
-                ispyb.sqlalchemy.url(), connect_args={"use_pure": True}
-            )
+        # Initialise metrics if requested
+        if self._environment.get("metrics"):
+            self._metrics = PrometheusMetrics()
+        else:
+            self._metrics = NoMetrics()
+        self._ispyb_sessionmaker = database.sessionmaker(
+            self._environment, service="trigger", metrics=self._metrics
         )
+        subscription_options = self._setup_held_messages()
         workflows.recipe.wrap_subscribe(
             self._transport,
             "trigger",
             self.trigger,
             acknowledgement=True,
             log_extender=self.extend_log,
+            **subscription_options,
         )
-        self.ispyb = ispyb.open()
 
-        # Initialise metrics if requested
-        if self._environment.get("metrics"):
-            self._metrics = PrometheusMetrics()
+        # Proposals, sessions, proteins, samples and detectors looked up by the
+        # trigger targets rarely change, so they are cached between messages.
+        # Data collection rows are not cached, as they are updated while a
+        # collection is running
+        self._entity_cache = crud.EntityCache(
+            maxsize=int(self._environment.get("entity-cache-size", 4096)),
+            ttl=float(self._environment.get("entity-cache-ttl", 600)),
+            metrics=self._metrics,
+        )
+
+    def _setup_held_messages(self) -> dict:
+        """Optionally hold up to held-messages messages that are waiting for
+        related processing programs to finish, instead of checkpointing them
+        with a delay straight away. A held message is checkpointed as soon as
+        the ISPyB connector announces that one of the programs it is waiting for
+        has finished, or once its backoff delay has passed. The connector must
+        be run with the broadcast-program-status option for this. Messages are only
+        held for backoff delays of up to max-hold-time seconds. Returns any
+        additional options required for the subscription."""
+        self._max_held_messages = int(self._environment.get("held-messages", 0))
+        self._max_hold_time = float(self._environment.get("max-hold-time", 600))
+        self._held_messages: list[_HeldMessage] = []
+        self._waiting_checkpoints: list[_WaitingCheckpoint] = []
+        if self._max_held_messages > 0:
+            self.log.info(
+                "Holding up to %d messages waiting on processing programs",
+                self._max_held_messages,
+            )
+            self._transport.subscribe_broadcast(
+                PROGRAM_STATUS_TOPIC, self.receive_program_status
+            )
+            self._register_idle(5, self.release_expired_messages)
+            return {"prefetch_count": self._max_held_messages + 1}
+        return {}
+
+    def in_shutdown(self):
+        # Checkpoint held messages with whatever remains of their backoff delay
+        for held in list(self._held_messages):
+            self._release_held_message(held, delay=max(0, int(held.deadline - time())))
+
+    def receive_program_status(self, header, message):
+        """Release all held messages waiting on a program that has finished."""
+        self.release_expired_messages()
+        if not isinstance(message, dict) or not message.get("program_id"):
+            return
+        program_id = message["program_id"]
+        for held in list(self._held_messages):
+            if any(program_id in cp.program_ids for cp in held.checkpoints):
+                self.log.debug(f"Program {program_id} finished, releasing held message")
+                self._release_held_message(held, woken=True)
+
+    def release_expired_messages(self):
+        """Release all held messages whose backoff delay has passed."""
+        now = time()
+        for held in list(self._held_messages):
+            if held.deadline <= now:
+                self._release_held_message(held)
+
+    def _checkpoint_waiting(
+        self,
+        rw: RecipeWrapper,
+        payload: dict,
+        *,
+        delay: float,
+        transaction: int,
+        program_ids: list[int],
+    ):
+        """Checkpoint a message that is waiting for the given processing
+        programs to finish. If messages can be held then the checkpoint is
+        deferred until the trigger target has returned (see trigger())."""
+        if self._max_held_messages > 0:
+            self._waiting_checkpoints.append(
+                _WaitingCheckpoint(payload, delay, set(program_ids))
+            )
         else:
-            self._metrics = NoMetrics()
+            rw.checkpoint(payload, delay=delay, transaction=transaction)
+
+    def _hold_message(self, rw, header, checkpoints, return_value) -> bool:
+        delay = min(cp.delay for cp in checkpoints)
+        if (
+            len(self._held_messages) >= self._max_held_messages
+            or delay > self._max_hold_time
+        ):
+            return False
+        self._held_messages.append(
+            _HeldMessage(rw, header, checkpoints, return_value, time() + delay)
+        )
+        return True
+
+    def _release_held_message(
+        self, held: _HeldMessage, *, delay: float = 0, woken: bool = False
+    ):
+        self._held_messages.remove(held)
+        txn = held.rw.transport.transaction_begin(
+            subscription_id=held.header["subscription"]
+        )
+        for checkpoint in held.checkpoints:
+            payload = checkpoint.payload
+            if woken and "trigger-status" in payload:
+                # Being woken up early does not count as one of the attempts
+                status = dict(payload["trigger-status"])
+                status["ntry"] -= 1
+                payload = {**payload, "trigger-status": status}
+            held.rw.checkpoint(payload, delay=delay, transaction=txn)
+        held.rw.send({"result": held.return_value}, transaction=txn)
+        held.rw.transport.ack(held.header, transaction=txn)
+        held.rw.transport.transaction_commit(txn)
 
     def trigger(self, rw, header, message):
         """Forward the trigger message to a specific trigger function."""
+        # The idle callback only runs when no messages arrive for a while, so
+        # also release expired held messages whenever a message comes in
+        self.release_expired_messages()
         # Extract trigger target from the recipe
         params = rw.recipe_step.get("parameters", {})
         target = params.get("target")
@@ -365,8 +509,22 @@ class DLSTrigger(CommonService):
                     f"{target.capitalize()} trigger called with invalid parameters: {e}"
                 )
                 result = None
+        waiting, self._waiting_checkpoints = self._waiting_checkpoints, []
 
         if result and result.get("success"):
+            if (
+                waiting
+                and not result.get("return_value")
+                and self._hold_message(rw, header, waiting, result.get("return_value"))
+            ):
+                # Nothing has been sent yet, so the message can be held without
+                # acknowledging it until it is released
+                rw.transport.transaction_abort(txn)
+                return
+            for checkpoint in waiting:
+                rw.checkpoint(
+                    checkpoint.payload, delay=checkpoint.delay, transaction=txn
+                )
             rw.send({"result": result.get("return_value")}, transaction=txn)
             rw.transport.ack(header, transaction=txn)
             if retval := result.get("return_value"):
@@ -455,11 +613,12 @@ class DLSTrigger(CommonService):
         pdb_files = [str(p) for p in pdb_files_or_codes]
         self.log.info("PDB files: %s", ", ".join(pdb_files))
 
-        dc = (
-            session.query(DataCollection)
-            .filter(DataCollection.dataCollectionId == dcid)
-            .one()
-        )
+        dc = crud.get_data_collection(dcid, session)
+        if not dc:
+            self.log.error(
+                f"Dimple trigger failed: no data collection with dcid={dcid}"
+            )
+            return False
         if isinstance(parameters.mtz, dict):
             query = (
                 session.query(
@@ -517,36 +676,24 @@ class DLSTrigger(CommonService):
             "create_symlink": [parameters.symlink],
         }
 
-        jisp = self.ispyb.mx_processing.get_job_image_sweep_params()
-        jisp["datacollectionid"] = dcid
-        jisp["start_image"] = dc.startImageNumber
-        jisp["end_image"] = dc.startImageNumber + dc.numberOfImages - 1
-
         self.log.debug("Dimple trigger: Starting")
 
-        jp = self.ispyb.mx_processing.get_job_params()
-        jp["automatic"] = parameters.automatic
-        jp["comments"] = parameters.comment
-        jp["datacollectionid"] = dcid
-        jp["display_name"] = "DIMPLE"
-        jp["recipe"] = "postprocessing-dimple"
-        jobid = self.ispyb.mx_processing.upsert_job(list(jp.values()))
-        self.log.debug(f"Dimple trigger: generated JobID {jobid}")
-
-        for key, values in dimple_parameters.items():
-            for value in values:
-                jpp = self.ispyb.mx_processing.get_job_parameter_params()
-                jpp["job_id"] = jobid
-                jpp["parameter_key"] = key
-                jpp["parameter_value"] = value
-                jppid = self.ispyb.mx_processing.upsert_job_parameter(
-                    list(jpp.values())
-                )
-                self.log.debug(f"Dimple trigger: generated JobParameterID {jppid}")
-
-        jisp["job_id"] = jobid
-        jispid = self.ispyb.mx_processing.upsert_job_image_sweep(list(jisp.values()))
-        self.log.debug(f"Dimple trigger: generated JobImageSweepID {jispid}")
+        jobid = crud.create_processing_job(
+            session,
+            dcid=dcid,
+            display_name="DIMPLE",
+            recipe="postprocessing-dimple",
+            comments=parameters.comment,
+            automatic=parameters.automatic,
+            parameters=[
+                (key, value)
+                for key, values in dimple_parameters.items()
+                for value in values
+            ],
+            sweeps=[
+                (dcid, dc.startImageNumber, dc.startImageNumber + dc.numberOfImages - 1)
+            ],
+        )
 
         self.log.debug(f"Dimple trigger: Processing job {jobid} created")
 
@@ -886,38 +1033,27 @@ class DLSTrigger(CommonService):
 
         self.log.debug("Metal_id trigger: Starting")
 
-        jp = self.ispyb.mx_processing.get_job_params()
-        jp["automatic"] = parameters.automatic
-        jp["comments"] = parameters.comment
-        jp["datacollectionid"] = parameters.dcid
-        jp["display_name"] = "metal_id"
-        jp["recipe"] = "postprocessing-metal-id"
-        self.log.info(jp)
-        jobid = self.ispyb.mx_processing.upsert_job(list(jp.values()))
-        self.log.debug(f"metal_id trigger: generated JobID {jobid}")
-
-        jisp = self.ispyb.mx_processing.get_job_image_sweep_params()
-        jisp["datacollectionid"] = parameters.dcid
-        jisp["start_image"] = parameters.dc_info.startImageNumber
-        jisp["end_image"] = (
-            parameters.dc_info.startImageNumber + parameters.dc_info.numberOfImages - 1
-        )
-        for key, values in metal_id_parameters.items():
-            for value in values:
-                jpp = self.ispyb.mx_processing.get_job_parameter_params()
-                jpp["job_id"] = jobid
-                jpp["parameter_key"] = key
-                jpp["parameter_value"] = value
-                jppid = self.ispyb.mx_processing.upsert_job_parameter(
-                    list(jpp.values())
-                )
-                self.log.debug(
-                    f"Metal_id trigger: generated JobParameterID {jppid} with {key}={value}"
+        dc_info = parameters.dc_info
+        jobid = crud.create_processing_job(
+            session,
+            dcid=parameters.dcid,
+            display_name="metal_id",
+            recipe="postprocessing-metal-id",
+            comments=parameters.comment,
+            automatic=parameters.automatic,
+            parameters=[
+                (key, value)
+                for key, values in metal_id_parameters.items()
+                for value in values
+            ],
+            sweeps=[
+                (
+                    parameters.dcid,
+                    dc_info.startImageNumber,
+                    dc_info.startImageNumber + dc_info.numberOfImages - 1,
                 )
-
-        jisp["job_id"] = jobid
-        jispid = self.ispyb.mx_processing.upsert_job_image_sweep(list(jisp.values()))
-        self.log.debug(f"Metal_id trigger: generated JobImageSweepID {jispid}")
+            ],
+        )
 
         self.log.debug(f"Metal_id trigger: Processing job {jobid} created")
 
@@ -967,20 +1103,6 @@ class DLSTrigger(CommonService):
             )
             return {"success": True}
 
-        jisp = self.ispyb.mx_processing.get_job_image_sweep_params()
-        jisp["datacollectionid"] = dcid
-        jisp["start_image"] = dc.startImageNumber
-        jisp["end_image"] = dc.startImageNumber + dc.numberOfImages - 1
-
-        jp = self.ispyb.mx_processing.get_job_params()
-        jp["automatic"] = parameters.automatic
-        jp["comments"] = parameters.comment
-        jp["datacollectionid"] = dcid
-        jp["display_name"] = "ep_predict"
-        jp["recipe"] = "postprocessing-ep-predict"
-        jobid = self.ispyb.mx_processing.upsert_job(list(jp.values()))
-        self.log.debug(f"ep_predict trigger: generated JobID {jobid}")
-
         ep_parameters = {
             "program": parameters.program,
             "program_id": parameters.program_id,
@@ -988,17 +1110,18 @@ class DLSTrigger(CommonService):
             "threshold": parameters.threshold,
         }
 
-        for key, value in ep_parameters.items():
-            jpp = self.ispyb.mx_processing.get_job_parameter_params()
-            jpp["job_id"] = jobid
-            jpp["parameter_key"] = key
-            jpp["parameter_value"] = value
-            jppid = self.ispyb.mx_processing.upsert_job_parameter(list(jpp.values()))
-            self.log.debug(f"ep_predict trigger: generated JobParameterID {jppid}")
-
-        jisp["job_id"] = jobid
-        jispid = self.ispyb.mx_processing.upsert_job_image_sweep(list(jisp.values()))
-        self.log.debug(f"ep_predict trigger: generated JobImageSweepID {jispid}")
+        jobid = crud.create_processing_job(
+            session,
+            dcid=dcid,
+            display_name="ep_predict",
+            recipe="postprocessing-ep-predict",
+            comments=parameters.comment,
+            automatic=parameters.automatic,
+            parameters=ep_parameters.items(),
+            sweeps=[
+                (dcid, dc.startImageNumber, dc.startImageNumber + dc.numberOfImages - 1)
+            ],
+        )
 
         self.log.debug(f"ep_predict trigger: Processing job {jobid} created")
 
@@ -1028,13 +1151,7 @@ class DLSTrigger(CommonService):
     ):
         dcid = parameters.dcid
 
-        query = (
-            session.query(Proposal)
-            .join(BLSession, BLSession.proposalId == Proposal.proposalId)
-            .join(DataCollection, DataCollection.SESSIONID == BLSession.sessionId)
-            .filter(DataCollection.dataCollectionId == dcid)
-        )
-        proposal = query.first()
+        proposal = crud.get_proposal_for_dcid(dcid, session, cache=self._entity_cache)
         if not proposal:
             self.log.error(
                 f"mr_predict trigger failed: no proposal associated with dcid={dcid}"
@@ -1052,15 +1169,6 @@ class DLSTrigger(CommonService):
             )
             return {"success": True}
 
-        jp = self.ispyb.mx_processing.get_job_params()
-        jp["automatic"] = parameters.automatic
-        jp["comments"] = parameters.comment
-        jp["datacollectionid"] = dcid
-        jp["display_name"] = "mr_predict"
-        jp["recipe"] = "postprocessing-mr-predict"
-        jobid = self.ispyb.mx_processing.upsert_job(list(jp.values()))
-        self.log.debug(f"mr_predict trigger: generated JobID {jobid}")
-
         mr_parameters = {
             "program_id": parameters.program_id,
             "program": parameters.program_id,
@@ -1068,13 +1176,15 @@ class DLSTrigger(CommonService):
             "threshold": parameters.threshold,
         }
 
-        for key, value in mr_parameters.items():
-            jpp = self.ispyb.mx_processing.get_job_parameter_params()
-            jpp["job_id"] = jobid
-            jpp["parameter_key"] = key
-            jpp["parameter_value"] = value
-            jppid = self.ispyb.mx_processing.upsert_job_parameter(list(jpp.values()))
-            self.log.debug(f"mr_predict trigger: generated JobParameterID {jppid}")
+        jobid = crud.create_processing_job(
+            session,
+            dcid=dcid,
+            display_name="mr_predict",
+            recipe="postprocessing-mr-predict",
+            comments=parameters.comment,
+            automatic=parameters.automatic,
+            parameters=mr_parameters.items(),
+        )
 
         self.log.debug(f"mr_predict trigger: Processing job {jobid} created")
 
@@ -1114,27 +1224,20 @@ class DLSTrigger(CommonService):
             )
             return {"success": True}
 
-        jp = self.ispyb.mx_processing.get_job_params()
-        jp["automatic"] = parameters.automatic
-        jp["comments"] = parameters.comment
-        jp["datacollectionid"] = dcid
-        jp["display_name"] = "screen19_mx"
-        jp["recipe"] = "postprocessing-screen19-mx"
-        jobid = self.ispyb.mx_processing.upsert_job(list(jp.values()))
-        self.log.debug(f"screen19_mx trigger: generated JobID {jobid}")
-
         screen19_parameters = {
             "program_id": parameters.program_id,
             "data": os.fspath(parameters.data),
         }
 
-        for key, value in screen19_parameters.items():
-            jpp = self.ispyb.mx_processing.get_job_parameter_params()
-            jpp["job_id"] = jobid
-            jpp["parameter_key"] = key
-            jpp["parameter_value"] = value
-            jppid = self.ispyb.mx_processing.upsert_job_parameter(list(jpp.values()))
-            self.log.debug(f"screen19_mx trigger: generated JobParameterID {jppid}")
+        jobid = crud.create_processing_job(
+            session,
+            dcid=dcid,
+            display_name="screen19_mx",
+            recipe="postprocessing-screen19-mx",
+            comments=parameters.comment,
+            automatic=parameters.automatic,
+            parameters=screen19_parameters.items(),
+        )
 
         self.log.debug(f"screen19_mx trigger: Processing job {jobid} created")
 
@@ -1157,30 +1260,24 @@ class DLSTrigger(CommonService):
         rw: workflows.recipe.RecipeWrapper,
         *,
         parameters: BestParameters,
+        session: sqlalchemy.orm.session.Session,
         **kwargs,
     ):
         dcid = parameters.dcid
-        jp = self.ispyb.mx_processing.get_job_params()
-        jp["automatic"] = parameters.automatic
-        jp["comments"] = parameters.comment
-        jp["datacollectionid"] = dcid
-        jp["display_name"] = "best"
-        jp["recipe"] = "postprocessing-best"
-        jobid = self.ispyb.mx_processing.upsert_job(list(jp.values()))
-        self.log.debug(f"best trigger: generated JobID {jobid}")
-
         best_parameters = {
             "program_id": parameters.program_id,
             "data": os.fspath(parameters.data),
         }
 
-        for key, value in best_parameters.items():
-            jpp = self.ispyb.mx_processing.get_job_parameter_params()
-            jpp["job_id"] = jobid
-            jpp["parameter_key"] = key
-            jpp["parameter_value"] = value
-            jppid = self.ispyb.mx_processing.upsert_job_parameter(list(jpp.values()))
-            self.log.debug(f"best trigger: generated JobParameterID {jppid}")
+        jobid = crud.create_processing_job(
+            session,
+            dcid=dcid,
+            display_name="best",
+            recipe="postprocessing-best",
+            comments=parameters.comment,
+            automatic=parameters.automatic,
+            parameters=best_parameters.items(),
+        )
 
         self.log.debug(f"best trigger: Processing job {jobid} created")
 
@@ -1276,40 +1373,29 @@ class DLSTrigger(CommonService):
             return {"success": True}
 
         dcid = parameters.dcid
-        query = session.query(DataCollection).filter(
-            DataCollection.dataCollectionId == dcid
-        )
-        dc = query.one()
-        jisp = self.ispyb.mx_processing.get_job_image_sweep_params()
-        jisp["datacollectionid"] = dcid
-        jisp["start_image"] = dc.startImageNumber
-        jisp["end_image"] = dc.startImageNumber + dc.numberOfImages - 1
-
-        jp = self.ispyb.mx_processing.get_job_params()
-        jp["automatic"] = parameters.automatic
-        jp["comments"] = parameters.comment
-        jp["datacollectionid"] = dcid
-        jp["display_name"] = "fast_ep"
-        jp["recipe"] = parameters.recipe or "postprocessing-fast-ep"
-        jobid = self.ispyb.mx_processing.upsert_job(list(jp.values()))
-        self.log.debug(f"fast_ep trigger: generated JobID {jobid}")
-
+        dc = crud.get_data_collection(dcid, session)
+        if not dc:
+            self.log.error(
+                f"fast_ep trigger failed: no data collection with dcid={dcid}"
+            )
+            return False
         fast_ep_parameters = {
             "data": os.fspath(mtzin),
             "scaling_id": parameters.scaling_id,
         }
 
-        for key, value in fast_ep_parameters.items():
-            jpp = self.ispyb.mx_processing.get_job_parameter_params()
-            jpp["job_id"] = jobid
-            jpp["parameter_key"] = key
-            jpp["parameter_value"] = value
-            jppid = self.ispyb.mx_processing.upsert_job_parameter(list(jpp.values()))
-            self.log.debug(f"fast_ep trigger: generated JobParameterID {jppid}")
-
-        jisp["job_id"] = jobid
-        jispid = self.ispyb.mx_processing.upsert_job_image_sweep(list(jisp.values()))
-        self.log.debug(f"fast_ep trigger: generated JobImageSweepID {jispid}")
+        jobid = crud.create_processing_job(
+            session,
+            dcid=dcid,
+            display_name="fast_ep",
+            recipe=parameters.recipe or "postprocessing-fast-ep",
+            comments=parameters.comment,
+            automatic=parameters.automatic,
+            parameters=fast_ep_parameters.items(),
+            sweeps=[
+                (dcid, dc.startImageNumber, dc.startImageNumber + dc.numberOfImages - 1)
+            ],
+        )
 
         self.log.debug(f"fast_ep trigger: Processing job {jobid} created")
 
@@ -1400,16 +1486,6 @@ class DLSTrigger(CommonService):
             if (fp := pdb_param.filepath) is not None and pathlib.Path(fp).is_file():
                 all_pdb_files.add(pdb_param)
         for pdb_files in {(), tuple(all_pdb_files)}:
-            jp = self.ispyb.mx_processing.get_job_params()
-            jp["automatic"] = parameters.automatic
-            jp["comments"] = parameters.comment
-            jp["datacollectionid"] = dcid
-            jp["display_name"] = "MrBUMP"
-            jp["recipe"] = parameters.recipe or "postprocessing-mrbump"
-            jobid = self.ispyb.mx_processing.upsert_job(list(jp.values()))
-            jobids.append(jobid)
-            self.log.debug(f"mrbump trigger: generated JobID {jobid}")
-
             mrbump_parameters = {
                 "hklin": os.fspath(hklin),
                 "scaling_id": parameters.scaling_id,
@@ -1417,16 +1493,7 @@ class DLSTrigger(CommonService):
             if pdb_files:
                 mrbump_parameters["dophmmer"] = "False"
                 mrbump_parameters["mdlunmod"] = "True"
-
-            for key, value in mrbump_parameters.items():
-                jpp = self.ispyb.mx_processing.get_job_parameter_params()
-                jpp["job_id"] = jobid
-                jpp["parameter_key"] = key
-                jpp["parameter_value"] = value
-                jppid = self.ispyb.mx_processing.upsert_job_parameter(
-                    list(jpp.values())
-                )
-                self.log.debug(f"mrbump trigger: generated JobParameterID {jppid}")
+            job_parameters = list(mrbump_parameters.items())
 
             for pdb_file in pdb_files:
                 if not pdb_file.filepath:
@@ -1444,16 +1511,18 @@ class DLSTrigger(CommonService):
                         set_b_iso=20,
                     )
                     filepath = trimmed
+                job_parameters.append(("localfile", os.fspath(filepath)))
 
-                jpp = self.ispyb.mx_processing.get_job_parameter_params()
-                jpp["job_id"] = jobid
-                jpp["parameter_key"] = "localfile"
-                jpp["parameter_value"] = os.fspath(filepath)
-                jppid = self.ispyb.mx_processing.upsert_job_parameter(
-                    list(jpp.values())
-                )
-                self.log.debug(f"mrbump trigger: generated JobParameterID {jppid}")
-
+            jobid = crud.create_processing_job(
+                session,
+                dcid=dcid,
+                display_name="MrBUMP",
+                recipe=parameters.recipe or "postprocessing-mrbump",
+                comments=parameters.comment,
+                automatic=parameters.automatic,
+                parameters=job_parameters,
+            )
+            jobids.append(jobid)
             self.log.debug(f"mrbump trigger: Processing job {jobid} created")
 
             message = {"recipes": [], "parameters": {"ispyb_process": jobid}}
@@ -1472,26 +1541,13 @@ class DLSTrigger(CommonService):
         session,
         **kwargs,
     ):
-        query = (
-            session.query(Proposal)
-            .join(BLSession, BLSession.proposalId == Proposal.proposalId)
-            .join(DataCollection, DataCollection.SESSIONID == BLSession.sessionId)
-            .filter(DataCollection.dataCollectionId == parameters.dcid)
+        proposal = crud.get_proposal_for_dcid(
+            parameters.dcid, session, cache=self._entity_cache
         )
-        proposal = query.first()
         if proposal.proposalCode in INDUSTRIAL_CODES:
             self.log.info(f"Skipping big_ep trigger for {proposal.proposalCode} visit")
             return {"success": True}
 
-        jp = self.ispyb.mx_processing.get_job_params()
-        jp["automatic"] = parameters.automatic
-        jp["comments"] = parameters.comment
-        jp["datacollectionid"] = parameters.dcid
-        jp["display_name"] = parameters.pipeline
-        jp["recipe"] = parameters.recipe or "postprocessing-big-ep-launcher"
-        jobid = self.ispyb.mx_processing.upsert_job(list(jp.values()))
-        self.log.debug(f"big_ep_launcher trigger: generated JobID {jobid}")
-
         try:
             program_id = parameters.program_id
         except (TypeError, ValueError):
@@ -1517,13 +1573,15 @@ class DLSTrigger(CommonService):
             "upstream_source": parameters.upstream_source,
         }
 
-        for key, value in big_ep_parameters.items():
-            jpp = self.ispyb.mx_processing.get_job_parameter_params()
-            jpp["job_id"] = jobid
-            jpp["parameter_key"] = key
-            jpp["parameter_value"] = value
-            jppid = self.ispyb.mx_processing.upsert_job_parameter(list(jpp.values()))
-            self.log.debug(f"big_ep_launcher trigger: generated JobParameterID {jppid}")
+        jobid = crud.create_processing_job(
+            session,
+            dcid=parameters.dcid,
+            display_name=parameters.pipeline,
+            recipe=parameters.recipe or "postprocessing-big-ep-launcher",
+            comments=parameters.comment,
+            automatic=parameters.automatic,
+            parameters=big_ep_parameters.items(),
+        )
 
         self.log.debug(f"big_ep_launcher trigger: Processing job {jobid} created")
 
@@ -1576,13 +1634,8 @@ class DLSTrigger(CommonService):
             return {"success": True}
 
         dcid = parameters.dcid
-        query = (
-            session.query(Proposal, BLSession)
-            .join(BLSession, BLSession.proposalId == Proposal.proposalId)
-            .join(DataCollection, DataCollection.SESSIONID == BLSession.sessionId)
-            .filter(DataCollection.dataCollectionId == dcid)
-        )
-        proposal, blsession = query.first()
+        proposal = crud.get_proposal_for_dcid(dcid, session, cache=self._entity_cache)
+        blsession = crud.get_blsession_for_dcid(dcid, session, cache=self._entity_cache)
         if proposal.proposalCode in INDUSTRIAL_CODES:
             self.log.info(f"Skipping big_ep trigger for {proposal.proposalCode} visit")
             return {"success": True}
@@ -1667,15 +1720,6 @@ class DLSTrigger(CommonService):
         if parameters.spacegroup:
             big_ep_params.path_ext += "-" + parameters.spacegroup
 
-        jp = self.ispyb.mx_processing.get_job_params()
-        jp["automatic"] = parameters.automatic
-        jp["comments"] = parameters.comment
-        jp["datacollectionid"] = dcid
-        jp["display_name"] = "big_ep"
-        jp["recipe"] = parameters.recipe or "postprocessing-big-ep"
-        jobid = self.ispyb.mx_processing.upsert_job(list(jp.values()))
-        self.log.debug(f"big_ep trigger: generated JobID {jobid}")
-
         pattern_scaled_unmerged = str(
             getattr(parameters, "scaled_unmerged_mtz")
             or processing_params.get("scaled_unmerged_mtz")
@@ -1691,13 +1735,15 @@ class DLSTrigger(CommonService):
             "upstream_source": parameters.upstream_source,
         }
 
-        for key, value in big_ep_parameters.items():
-            jpp = self.ispyb.mx_processing.get_job_parameter_params()
-            jpp["job_id"] = jobid
-            jpp["parameter_key"] = key
-            jpp["parameter_value"] = value
-            jppid = self.ispyb.mx_processing.upsert_job_parameter(list(jpp.values()))
-            self.log.debug(f"big_ep trigger: generated JobParameterID {jppid}")
+        jobid = crud.create_processing_job(
+            session,
+            dcid=dcid,
+            display_name="big_ep",
+            recipe=parameters.recipe or "postprocessing-big-ep",
+            comments=parameters.comment,
+            automatic=parameters.automatic,
+            parameters=big_ep_parameters.items(),
+        )
 
         self.log.debug(f"big_ep trigger: Processing job {jobid} created")
 
@@ -1718,6 +1764,151 @@ class DLSTrigger(CommonService):
 
         return {"success": True, "return_value": None}
 
+    def _discover_related_candidates(
+        self,
+        session: sqlalchemy.orm.session.Session,
+        dcids: set[int],
+        *,
+        program: str,
+        attachment_filter,
+        message: Any,
+        min_start_time: Optional[datetime] = None,
+    ) -> tuple[dict[int, list[int]], dict[int, list[RelatedCandidate]]]:
+        """Find the processing results for all groups of related dcids at once.
+
+        Rather than querying each group of related data collections in turn, one
+        query is made for the processing programs that are yet to finish, and one
+        for the successful results with their attachments, across all given
+        dcids. Callers then split the results by group.
+
+        The results for data collections with finished but no waiting programs
+        are memoised in the "trigger-candidates" field of a checkpointed message (see
+        _memoise_candidates), so that on later attempts only the dcids that were
+        still pending are queried again.
+
+        Returns a tuple (waiting, candidates), where waiting maps dcids to the
+        autoProcProgramIds that are still running or yet to start, and candidates
+        maps dcids to their successful processing results.
+        """
+        candidates: dict[int, list[RelatedCandidate]] = {}
+        if isinstance(message, dict):
+            for key, memoised in message.get("trigger-candidates", {}).items():
+                candidates[int(key)] = [RelatedCandidate(**c) for c in memoised]
+        pending = sorted(set(dcids) - set(candidates))
+        waiting: dict[int, list[int]] = {}
+        if not pending:
+            return waiting, candidates
+        self.log.debug(
+            f"Looking up {program} results for dcids {pending} ({len(candidates)} memoised)"
+        )
+
+        query = (
+            (
+                session.query(
+                    AutoProcProgram.autoProcProgramId, ProcessingJob.dataCollectionId
+                ).join(
+                    ProcessingJob,
+                    ProcessingJob.processingJobId == AutoProcProgram.processingJobId,
+                )
+            )
+            .filter(ProcessingJob.dataCollectionId.in_(pending))
+            .filter(ProcessingJob.automatic == True)  # noqa E712
+            .filter(AutoProcProgram.processingPrograms == program)
+            .filter(
+                or_(
+                    AutoProcProgram.processingStatus == None,  # noqa E711
+                    AutoProcProgram.processingStartTime == None,  # noqa E711
+                )
+            )
+        )
+        if min_start_time:
+            query = query.filter(ProcessingJob.recordTimestamp > min_start_time)
+        for appid, waiting_dcid in query.all():
+            waiting.setdefault(waiting_dcid, []).append(appid)
+
+        query = (
+            (
+                session.query(
+                    DataCollection,
+                    AutoProcProgram,
+                    ProcessingJob,
+                )
+                .join(
+                    AutoProcIntegration,
+                    AutoProcIntegration.dataCollectionId
+                    == DataCollection.dataCollectionId,
+                )
+                .join(
+                    AutoProcProgram,
+                    AutoProcProgram.autoProcProgramId
+                    == AutoProcIntegration.autoProcProgramId,
+                )
+                .join(
+                    ProcessingJob,
+                    ProcessingJob.processingJobId == AutoProcProgram.processingJobId,
+                )
+                .join(AutoProcProgram.AutoProcProgramAttachments)
+            )
+            .filter(DataCollection.dataCollectionId.in_(pending))
+            .filter(ProcessingJob.automatic == True)  # noqa E712
+            .filter(AutoProcProgram.processingPrograms == program)
+            .filter(AutoProcProgram.processingStatus == 1)
+            .filter(attachment_filter)
+            .options(
+                contains_eager(AutoProcProgram.AutoProcProgramAttachments),
+                joinedload(ProcessingJob.ProcessingJobParameters),
+                Load(DataCollection).load_only(
+                    DataCollection.dataCollectionId,
+                    DataCollection.wavelength,
+                    DataCollection.startImageNumber,
+                    DataCollection.numberOfImages,
+                    raiseload=True,
+                ),
+            )
+            .populate_existing()
+        )
+        candidates.update({d: [] for d in pending})
+        for dc, app, pj in query.all():
+            spacegroup = next(
+                (
+                    param.parameterValue
+                    for param in pj.ProcessingJobParameters
+                    if param.parameterKey == "spacegroup"
+                ),
+                None,
+            )
+            candidates[dc.dataCollectionId].append(
+                RelatedCandidate(
+                    dcid=dc.dataCollectionId,
+                    appid=app.autoProcProgramId,
+                    wavelength=dc.wavelength,
+                    start_image=dc.startImageNumber,
+                    number_of_images=dc.numberOfImages,
+                    spacegroup=spacegroup,
+                    files=[
+                        str(pathlib.Path(att.filePath) / att.fileName)
+                        for att in app.AutoProcProgramAttachments
+                    ],
+                )
+            )
+        return waiting, candidates
+
+    @staticmethod
+    def _memoise_candidates(
+        waiting: dict[int, list[int]],
+        candidates: dict[int, list[RelatedCandidate]],
+    ) -> dict[str, list[dict]]:
+        """
+        Serialise the results that need not be looked up again on a retry.
+        Data collections without any results are looked up again, as their
+        processing programs may not have been registered yet.
+        """
+        return {
+            str(d): [c.model_dump() for c in results]
+            for d, results in candidates.items()
+            if d not in waiting and results
+        }
+
     @pydantic.validate_call(config={"arbitrary_types_allowed": True})
     def trigger_multiplex(
         self,
@@ -1752,6 +1943,11 @@ class DLSTrigger(CommonService):
         Multiple groups of `related_dcids` may be provided, in which case a separate
         xia2.multiplex job will be triggered for each group of related dcids.
 
+        The processing results for all groups are looked up together. Results for
+        data collections that are not waiting on any processing are stored in the
+        checkpointed message, so that only the still pending dcids are looked up
+        again on the next attempt.
+
         New ProcessingJob, ProcessingJobImageSweep and ProcessingJobParameter entries
         will be created, and the resulting list of processingJobIds will be sent to
         the `processing_recipe` queue.
@@ -1850,8 +2046,10 @@ class DLSTrigger(CommonService):
             self.log.info("Checking for subsequent dcids that are still processing.")
 
             # Get currnent list of data collections for all samples in the sample groups
+            import dlstbx.ispybtbx
+
             _, ispyb_info = dlstbx.ispybtbx.ispyb_filter(
-                {}, {"ispyb_dcid": dcid}, session
+                {}, {"ispyb_dcid": dcid}, session, cache=self._entity_cache
             )
             ispyb_related_dcids = ispyb_info.get("ispyb_related_dcids", [])
             # If we have a sample group that doesn't have any new data collections,
@@ -1916,8 +2114,8 @@ class DLSTrigger(CommonService):
         multiplex_job_dcids: list[set[int]] = []
         jobids = []
 
+        groups: list[tuple[RelatedDCIDs, list[int]]] = []
         for group in related_dcids:
-            self.log.debug(f"group: {group}")
             # Select only those dcids that were collected before the triggering dcid
             dcids = [d for d in group.dcids if d < dcid]
 
@@ -1930,42 +2128,32 @@ class DLSTrigger(CommonService):
                 )
                 continue
             self.log.info(f"xia2.multiplex trigger: found dcids: {dcids}")
+            groups.append((group, dcids))
+
+        # Check for any processing jobs that are yet to finish (or fail) and
+        # find the successful results for all groups at once
+        waiting, candidates = self._discover_related_candidates(
+            session,
+            {d for _, dcids in groups for d in dcids},
+            program="xia2 dials",
+            attachment_filter=(
+                AutoProcProgramAttachment.fileName.endswith(".expt")
+                | AutoProcProgramAttachment.fileName.endswith(".refl")
+            )
+            & ~AutoProcProgramAttachment.fileName.contains("_scaled."),
+            message=message,
+            min_start_time=datetime.now() - timedelta(hours=24),
+        )
 
-            # Check for any processing jobs that are yet to finish (or fail)
-            min_start_time = datetime.now() - timedelta(hours=24)
-            query = (
-                (
-                    session.query(AutoProcProgram, ProcessingJob.dataCollectionId).join(
-                        ProcessingJob,
-                        ProcessingJob.processingJobId
-                        == AutoProcProgram.processingJobId,
-                    )
-                )
-                .filter(ProcessingJob.dataCollectionId.in_(dcids))
-                .filter(ProcessingJob.automatic == True)  # noqa E712
-                .filter(AutoProcProgram.processingPrograms == "xia2 dials")
-                .filter(ProcessingJob.recordTimestamp > min_start_time)  # noqa E711
-                .filter(
-                    or_(
-                        AutoProcProgram.processingStatus == None,  # noqa E711
-                        AutoProcProgram.processingStartTime == None,  # noqa E711
-                    )
-                )
-            )
+        for group, dcids in groups:
+            self.log.debug(f"group: {group}")
 
             # If there are any running (or yet to start) jobs, then checkpoint with delay
-            waiting_processing_jobs = query.all()
-            if n_waiting_processing_jobs := len(waiting_processing_jobs):
+            if waiting_dcids := [d for d in dcids if d in waiting]:
+                waiting_appids = [a for d in waiting_dcids for a in waiting[d]]
                 self.log.info(
-                    f"Waiting on {n_waiting_processing_jobs} processing jobs for {dcid=}"
+                    f"Waiting on {len(waiting_appids)} processing jobs for {dcid=}"
                 )
-                waiting_dcids = [
-                    row.dataCollectionId for row in waiting_processing_jobs
-                ]
-                waiting_appids = [
-                    row.AutoProcProgram.autoProcProgramId
-                    for row in waiting_processing_jobs
-                ]
                 if status["ntry"] > backoff_max_try:
                     # Give up waiting for this program to finish and trigger
                     # multiplex with remaining related results are available
@@ -1977,82 +2165,40 @@ class DLSTrigger(CommonService):
                     self.log.debug(
                         f"Waiting for dcids={waiting_dcids}\nappids={waiting_appids}"
                     )
-                    rw.checkpoint(
+                    self._checkpoint_waiting(
+                        rw,
                         {
                             "trigger-status": status,
+                            "trigger-candidates": self._memoise_candidates(
+                                waiting, candidates
+                            ),
                             "related_dcid_group": [
                                 group.model_dump(),
                             ],
                         },
                         delay=message_delay,
                         transaction=transaction,
+                        program_ids=waiting_appids,
                     )
                     continue
 
-            query = (
-                (
-                    session.query(
-                        DataCollection,
-                        AutoProcProgram,
-                        ProcessingJob,
-                    )
-                    .join(
-                        AutoProcIntegration,
-                        AutoProcIntegration.dataCollectionId
-                        == DataCollection.dataCollectionId,
-                    )
-                    .join(
-                        AutoProcProgram,
-                        AutoProcProgram.autoProcProgramId
-                        == AutoProcIntegration.autoProcProgramId,
-                    )
-                    .join(
-                        ProcessingJob,
-                        ProcessingJob.processingJobId
-                        == AutoProcProgram.processingJobId,
-                    )
-                    .join(AutoProcProgram.AutoProcProgramAttachments)
-                )
-                .filter(DataCollection.dataCollectionId.in_(dcids))
-                .filter(ProcessingJob.automatic == True)  # noqa E712
-                .filter(AutoProcProgram.processingPrograms == "xia2 dials")
-                .filter(AutoProcProgram.processingStatus == 1)
-                .filter(
-                    (
-                        AutoProcProgramAttachment.fileName.endswith(".expt")
-                        | AutoProcProgramAttachment.fileName.endswith(".refl")
-                    )
-                    & ~AutoProcProgramAttachment.fileName.contains("_scaled.")
-                )
-                .options(
-                    contains_eager(AutoProcProgram.AutoProcProgramAttachments),
-                    joinedload(ProcessingJob.ProcessingJobParameters),
-                    Load(DataCollection).load_only(
-                        DataCollection.dataCollectionId,
-                        DataCollection.wavelength,
-                        raiseload=True,
-                    ),
-                )
-                .populate_existing()
-            )
-
-            dcids = []
-            data_files = []
-            for dc, app, pj in query.all():
+            selected: list[RelatedCandidate] = []
+            for candidate in (c for d in dcids for c in candidates.get(d, [])):
+                appid = candidate.appid
                 # Select only those dcids at the same wavelength as the triggering dcid
-                if not dc.wavelength:
+                if not candidate.wavelength:
                     self.log.debug(
-                        f"Discarding appid {app.autoProcProgramId} (no wavelength information)"
+                        f"Discarding appid {appid} (no wavelength information)"
                     )
                     continue
                 if (
                     parameters.wavelength
-                    and abs(dc.wavelength - parameters.wavelength)
+                    and abs(candidate.wavelength - parameters.wavelength)
                     > parameters.wavelength_tolerance
                 ):
                     self.log.debug(
-                        f"Discarding appid {app.autoProcProgramId} (wavelength does not match input):\n"
-                        f"    {dc.wavelength} != {parameters.wavelength} (tolerance={parameters.wavelength_tolerance}"
+                        f"Discarding appid {appid} (wavelength does not match input):\n"
+                        f"    {candidate.wavelength} != {parameters.wavelength} (tolerance={parameters.wavelength_tolerance}"
                     )
                     continue
 
@@ -2060,41 +2206,36 @@ class DLSTrigger(CommonService):
                 # then only use xia2-dials autoprocessing results that were
                 # themselves run with a spacegroup parameter. Else only use those
                 # results that weren't run with a space group parameter
-                job_spacegroup_param = None
-                for param in pj.ProcessingJobParameters:
-                    self.log.debug(f"{param.parameterKey}: {param.parameterValue}")
-                    if param.parameterKey == "spacegroup":
-                        job_spacegroup_param = param.parameterValue
-                        break
                 if parameters.spacegroup and (
-                    not job_spacegroup_param
-                    or job_spacegroup_param != parameters.spacegroup
+                    not candidate.spacegroup
+                    or candidate.spacegroup != parameters.spacegroup
                 ):
-                    self.log.debug(f"Discarding appid {app.autoProcProgramId}")
+                    self.log.debug(f"Discarding appid {appid}")
                     continue
-                elif job_spacegroup_param and not parameters.spacegroup:
-                    self.log.debug(f"Discarding appid {app.autoProcProgramId}")
+                elif candidate.spacegroup and not parameters.spacegroup:
+                    self.log.debug(f"Discarding appid {appid}")
                     continue
 
-                self.log.debug(f"Using appid {app.autoProcProgramId}")
-                attachments = [
-                    str(pathlib.Path(att.filePath) / att.fileName)
-                    for att in app.AutoProcProgramAttachments
-                ]
+                self.log.debug(f"Using appid {appid}")
+                attachments = candidate.files
                 self.log.debug(
-                    f"Found the following files for appid {app.autoProcProgramId}:\n{', '.join(attachments)}"
+                    f"Found the following files for appid {appid}:\n{', '.join(attachments)}"
                 )
                 if len(attachments) % 2:
                     self.log.warning(
-                        f"Expected to find an even number of data files for appid {app.autoProcProgramId} (found {len(attachments)})"
+                        f"Expected to find an even number of data files for appid {appid} (found {len(attachments)})"
                     )
                     continue
                 if len(attachments) != 2:
-                    f"Skipping xia2.multiplex trigger: Found {len(attachments)} attachments, expected only two for dcid={dcid} group={group}"
+                    self.log.debug(
+                        f"Skipping appid {appid}: Found {len(attachments)} attachments, expected only two for dcid={dcid} group={group}"
+                    )
                     continue
 
-                dcids.append(dc.dataCollectionId)
-                data_files.append(attachments)
+                selected.append(candidate)
+
+            dcids = [c.dcid for c in selected]
+            data_files = [c.files for c in selected]
 
             if not any(data_files):
                 self.log.info(
@@ -2127,44 +2268,6 @@ class DLSTrigger(CommonService):
                 continue
             multiplex_job_dcids.append(set_dcids)
 
-            jp = self.ispyb.mx_processing.get_job_params()
-            jp["automatic"] = parameters.automatic
-            jp["comments"] = parameters.comment
-            jp["datacollectionid"] = dcid
-            jp["display_name"] = "xia2.multiplex"
-            jp["recipe"] = parameters.recipe
-            self.log.info(jp)
-            jobid = self.ispyb.mx_processing.upsert_job(list(jp.values()))
-            jobids.append(jobid)
-            self.log.debug(f"xia2.multiplex trigger: generated JobID {jobid}")
-
-            query = (
-                session.query(DataCollection)
-                .filter(DataCollection.dataCollectionId.in_(dcids))
-                .options(
-                    Load(DataCollection).load_only(
-                        DataCollection.dataCollectionId,
-                        DataCollection.wavelength,
-                        DataCollection.startImageNumber,
-                        DataCollection.numberOfImages,
-                        raiseload=True,
-                    )
-                )
-            )
-            for dc in query.all():
-                jisp = self.ispyb.mx_processing.get_job_image_sweep_params()
-                jisp["datacollectionid"] = dc.dataCollectionId
-                jisp["start_image"] = dc.startImageNumber
-                jisp["end_image"] = dc.startImageNumber + dc.numberOfImages - 1
-
-                jisp["job_id"] = jobid
-                jispid = self.ispyb.mx_processing.upsert_job_image_sweep(
-                    list(jisp.values())
-                )
-                self.log.debug(
-                    f"xia2.multiplex trigger: generated JobImageSweepID {jispid}"
-                )
-
             job_parameters: list[tuple[str, str]] = [
                 ("data", ";".join(files)) for files in data_files
             ]
@@ -2210,24 +2313,29 @@ class DLSTrigger(CommonService):
                         ("deltacchalf.group_size", str(group_size)),
                     ]
                 )
-            for k, v in job_parameters:
-                jpp = self.ispyb.mx_processing.get_job_parameter_params()
-                jpp["job_id"] = jobid
-                jpp["parameter_key"] = k
-                jpp["parameter_value"] = v
-                jppid = self.ispyb.mx_processing.upsert_job_parameter(
-                    list(jpp.values())
-                )
-                self.log.debug(
-                    f"xia2.multiplex trigger generated JobParameterID {jppid} with {k}={v}",
-                )
+
+            jobid = crud.create_processing_job(
+                session,
+                dcid=dcid,
+                display_name="xia2.multiplex",
+                recipe=parameters.recipe,
+                comments=parameters.comment,
+                automatic=parameters.automatic,
+                parameters=job_parameters,
+                sweeps=[
+                    (c.dcid, c.start_image, c.start_image + c.number_of_images - 1)
+                    for c in {c.dcid: c for c in selected}.values()
+                ],
+            )
+            jobids.append(jobid)
+            self.log.debug(
+                f"xia2.multiplex trigger: generated JobID {jobid} with parameters {job_parameters}"
+            )
 
             message = {"recipes": [], "parameters": {"ispyb_process": jobid}}
             rw.transport.send("processing_recipe", message)
 
-            self.log.info(
-                f"xia2.multiplex trigger: Processing job {jobid} triggered"
-            )
+            self.log.info(f"xia2.multiplex trigger: Processing job {jobid} triggered")
 
         return {"success": True, "return_value": jobids}
 
@@ -2255,7 +2363,8 @@ class DLSTrigger(CommonService):
 
         If any xia2.ssx jobs are still running after backoff-max-try iterations,
         then a multiplex will be triggered with whatever remaining related results
-        are available.
+        are available. As for multiplex, results that are no longer pending are
+        stored in the checkpointed message and not looked up again.
 
         New ProcessingJob, ProcessingJobImageSweep and ProcessingJobParameter entries
         will be created, and the resulting list of processingJobIds will be sent to
@@ -2290,8 +2399,8 @@ class DLSTrigger(CommonService):
         ssx_reduce_job_dcids: list[set[int]] = []
         jobids = []
 
+        groups: list[tuple[RelatedDCIDs, list[int]]] = []
         for group in related_dcids:
-            self.log.debug(f"group: {group}")
             # Select only those dcids that were collected before the triggering dcid
             dcids = [d for d in group.dcids if d < dcid]
 
@@ -2304,117 +2413,68 @@ class DLSTrigger(CommonService):
                 )
                 continue
             self.log.info(f"xia2.ssx_reduce trigger: found dcids: {dcids}")
+            groups.append((group, dcids))
+
+        # Check for any processing jobs that are yet to finish (or fail) and
+        # find the successful results for all groups at once
+        waiting, candidates = self._discover_related_candidates(
+            session,
+            {d for _, dcids in groups for d in dcids},
+            program="xia2.ssx",
+            attachment_filter=(
+                AutoProcProgramAttachment.fileName.endswith(".expt")
+                | AutoProcProgramAttachment.fileName.endswith(".refl")
+            )
+            & AutoProcProgramAttachment.fileName.startswith("integrated"),
+            message=message,
+        )
 
-            # Check for any processing jobs that are yet to finish (or fail)
-            query = (
-                (
-                    session.query(AutoProcProgram, ProcessingJob.dataCollectionId).join(
-                        ProcessingJob,
-                        ProcessingJob.processingJobId
-                        == AutoProcProgram.processingJobId,
-                    )
-                )
-                .filter(ProcessingJob.dataCollectionId.in_(dcids))
-                .filter(ProcessingJob.automatic == True)  # noqa E712
-                .filter(AutoProcProgram.processingPrograms == "xia2.ssx")
-                .filter(
-                    or_(
-                        AutoProcProgram.processingStatus == None,  # noqa E711
-                        AutoProcProgram.processingStartTime == None,  # noqa E711
-                    )
-                )
+        # If there are any running (or yet to start) jobs, then checkpoint with delay
+        if waiting_dcids := [d for _, dcids in groups for d in dcids if d in waiting]:
+            waiting_appids = [a for d in set(waiting_dcids) for a in waiting[d]]
+            self.log.info(
+                f"Waiting on {len(waiting_appids)} processing jobs for {dcid=}"
             )
-
-            # If there are any running (or yet to start) jobs, then checkpoint with delay
-            waiting_processing_jobs = query.all()
-            if n_waiting_processing_jobs := len(waiting_processing_jobs):
+            if status["ntry"] >= parameters.backoff_max_try:
+                # Give up waiting for this program to finish and trigger
+                # multiplex with remaining related results are available
                 self.log.info(
-                    f"Waiting on {n_waiting_processing_jobs} processing jobs for {dcid=}"
+                    f"max-try exceeded, giving up waiting for related processings for dcids {waiting_dcids}\n"
                 )
-                waiting_dcids = [
-                    row.dataCollectionId for row in waiting_processing_jobs
-                ]
-                waiting_appids = [
-                    row.AutoProcProgram.autoProcProgramId
-                    for row in waiting_processing_jobs
-                ]
-                if status["ntry"] >= parameters.backoff_max_try:
-                    # Give up waiting for this program to finish and trigger
-                    # multiplex with remaining related results are available
-                    self.log.info(
-                        f"max-try exceeded, giving up waiting for related processings for dcids {waiting_dcids}\n"
-                    )
-                else:
-                    # Send results to myself for next round of processing
-                    self.log.debug(
-                        f"Waiting for dcids={waiting_dcids}\nappids={waiting_appids}"
-                    )
-                    rw.checkpoint(
-                        {"trigger-status": status},
-                        delay=message_delay,
-                        transaction=transaction,
-                    )
-                    return {"success": True}
-
-            query = (
-                (
-                    session.query(
-                        DataCollection,
-                        AutoProcProgram,
-                        ProcessingJob,
-                    )
-                    .join(
-                        AutoProcIntegration,
-                        AutoProcIntegration.dataCollectionId
-                        == DataCollection.dataCollectionId,
-                    )
-                    .join(
-                        AutoProcProgram,
-                        AutoProcProgram.autoProcProgramId
-                        == AutoProcIntegration.autoProcProgramId,
-                    )
-                    .join(
-                        ProcessingJob,
-                        ProcessingJob.processingJobId
-                        == AutoProcProgram.processingJobId,
-                    )
-                    .join(AutoProcProgram.AutoProcProgramAttachments)
-                )
-                .filter(DataCollection.dataCollectionId.in_(dcids))
-                .filter(ProcessingJob.automatic == True)  # noqa E712
-                .filter(AutoProcProgram.processingPrograms == "xia2.ssx")
-                .filter(AutoProcProgram.processingStatus == 1)
-                .filter(
-                    (
-                        AutoProcProgramAttachment.fileName.endswith(".expt")
-                        | AutoProcProgramAttachment.fileName.endswith(".refl")
-                    )
-                    & AutoProcProgramAttachment.fileName.startswith("integrated")
-                )
-                .options(
-                    contains_eager(AutoProcProgram.AutoProcProgramAttachments),
-                    joinedload(ProcessingJob.ProcessingJobParameters),
-                    Load(DataCollection).load_only(
-                        DataCollection.dataCollectionId,
-                        DataCollection.wavelength,
-                        raiseload=True,
-                    ),
+            else:
+                # Send results to myself for next round of processing
+                self.log.debug(
+                    f"Waiting for dcids={waiting_dcids}\nappids={waiting_appids}"
+                )
+                self._checkpoint_waiting(
+                    rw,
+                    {
+                        "trigger-status": status,
+                        "trigger-candidates": self._memoise_candidates(
+                            waiting, candidates
+                        ),
+                    },
+                    delay=message_delay,
+                    transaction=transaction,
+                    program_ids=waiting_appids,
                 )
-                .populate_existing()
-            )
+                return {"success": True}
+
+        for group, dcids in groups:
+            self.log.debug(f"group: {group}")
 
-            dcids = []
-            data_files = []
-            for dc, app, pj in query.all():
+            selected: list[RelatedCandidate] = []
+            for candidate in (c for d in dcids for c in candidates.get(d, [])):
+                appid = candidate.appid
                 # Select only those dcids at the same wavelength as the triggering dcid
                 if (
                     parameters.wavelength
-                    and abs(dc.wavelength - parameters.wavelength)
+                    and abs(candidate.wavelength - parameters.wavelength)
                     > parameters.wavelength_tolerance
                 ):
                     self.log.debug(
-                        f"Discarding appid {app.autoProcProgramId} (wavelength does not match input):\n"
-                        f"    {dc.wavelength} != {parameters.wavelength} (tolerance={parameters.wavelength_tolerance}"
+                        f"Discarding appid {appid} (wavelength does not match input):\n"
+                        f"    {candidate.wavelength} != {parameters.wavelength} (tolerance={parameters.wavelength_tolerance}"
                     )
                     continue
 
@@ -2422,38 +2482,31 @@ class DLSTrigger(CommonService):
                 # then only use xia2-dials autoprocessing results that were
                 # themselves run with a spacegroup parameter. Else only use those
                 # results that weren't run with a space group parameter
-                job_spacegroup_param = None
-                for param in pj.ProcessingJobParameters:
-                    self.log.debug(f"{param.parameterKey}: {param.parameterValue}")
-                    if param.parameterKey == "spacegroup":
-                        job_spacegroup_param = param.parameterValue
-                        break
                 if parameters.spacegroup and (
-                    not job_spacegroup_param
-                    or job_spacegroup_param != parameters.spacegroup
+                    not candidate.spacegroup
+                    or candidate.spacegroup != parameters.spacegroup
                 ):
-                    self.log.debug(f"Discarding appid {app.autoProcProgramId}")
+                    self.log.debug(f"Discarding appid {appid}")
                     continue
-                elif job_spacegroup_param and not parameters.spacegroup:
-                    self.log.debug(f"Discarding appid {app.autoProcProgramId}")
+                elif candidate.spacegroup and not parameters.spacegroup:
+                    self.log.debug(f"Discarding appid {appid}")
                     continue
 
-                self.log.debug(f"Using appid {app.autoProcProgramId}")
-                attachments = [
-                    str(pathlib.Path(att.filePath) / att.fileName)
-                    for att in app.AutoProcProgramAttachments
-                ]
+                self.log.debug(f"Using appid {appid}")
+                attachments = candidate.files
                 self.log.debug(
-                    f"Found the following files for appid {app.autoProcProgramId}:\n{', '.join(attachments)}"
+                    f"Found the following files for appid {appid}:\n{', '.join(attachments)}"
                 )
                 if len(attachments) % 2:
                     self.log.warning(
-                        f"Expected to find an even number of data files for appid {app.autoProcProgramId} (found {len(attachments)})"
+                        f"Expected to find an even number of data files for appid {appid} (found {len(attachments)})"
                     )
                     continue
                 if len(attachments) >= 2:
-                    dcids.append(dc.dataCollectionId)
-                    data_files.extend(attachments)
+                    selected.append(candidate)
+
+            dcids = [c.dcid for c in selected]
+            data_files = [f for c in selected for f in c.files]
 
             if not any(data_files):
                 self.log.info(
@@ -2474,44 +2527,6 @@ class DLSTrigger(CommonService):
                 continue
             ssx_reduce_job_dcids.append(set(dcids))
 
-            jp = self.ispyb.mx_processing.get_job_params()
-            jp["automatic"] = parameters.automatic
-            jp["comments"] = parameters.comment
-            jp["datacollectionid"] = dcid
-            jp["display_name"] = "xia2.ssx_reduce"
-            jp["recipe"] = "postprocessing-xia2-ssx-reduce"
-            self.log.info(jp)
-            jobid = self.ispyb.mx_processing.upsert_job(list(jp.values()))
-            jobids.append(jobid)
-            self.log.debug(f"xia2.ssx_reduce trigger: generated JobID {jobid}")
-
-            query = (
-                session.query(DataCollection)
-                .filter(DataCollection.dataCollectionId.in_(dcids))
-                .options(
-                    Load(DataCollection).load_only(
-                        DataCollection.dataCollectionId,
-                        DataCollection.wavelength,
-                        DataCollection.startImageNumber,
-                        DataCollection.numberOfImages,
-                        raiseload=True,
-                    )
-                )
-            )
-            for dc in query.all():
-                jisp = self.ispyb.mx_processing.get_job_image_sweep_params()
-                jisp["datacollectionid"] = dc.dataCollectionId
-                jisp["start_image"] = dc.startImageNumber
-                jisp["end_image"] = dc.startImageNumber + dc.numberOfImages - 1
-
-                jisp["job_id"] = jobid
-                jispid = self.ispyb.mx_processing.upsert_job_image_sweep(
-                    list(jisp.values())
-                )
-                self.log.debug(
-                    f"xia2.ssx_reduce trigger: generated JobImageSweepID {jispid}"
-                )
-
             data_files = sorted(data_files)
             # group into pairs
             data_file_pairs = [
@@ -2536,17 +2551,24 @@ class DLSTrigger(CommonService):
             #             ("absorption_level", "high"),
             #         ]
             #     )
-            for k, v in job_parameters:
-                jpp = self.ispyb.mx_processing.get_job_parameter_params()
-                jpp["job_id"] = jobid
-                jpp["parameter_key"] = k
-                jpp["parameter_value"] = v
-                jppid = self.ispyb.mx_processing.upsert_job_parameter(
-                    list(jpp.values())
-                )
-                self.log.debug(
-                    f"xia2.ssx_reduce trigger generated JobParameterID {jppid} with {k}={v}",
-                )
+
+            jobid = crud.create_processing_job(
+                session,
+                dcid=dcid,
+                display_name="xia2.ssx_reduce",
+                recipe="postprocessing-xia2-ssx-reduce",
+                comments=parameters.comment,
+                automatic=parameters.automatic,
+                parameters=job_parameters,
+                sweeps=[
+                    (c.dcid, c.start_image, c.start_image + c.number_of_images - 1)
+                    for c in {c.dcid: c for c in selected}.values()
+                ],
+            )
+            jobids.append(jobid)
+            self.log.debug(
+                f"xia2.ssx_reduce trigger: generated JobID {jobid} with parameters {job_parameters}"
+            )
 
             message = {"recipes": [], "parameters": {"ispyb_process": jobid}}
             rw.transport.send("processing_recipe", message)
@@ -2662,25 +2684,19 @@ class DLSTrigger(CommonService):
 
         self.log.debug("Shelxt trigger: Starting")
 
-        jp = self.ispyb.mx_processing.get_job_params()
-        jp["datacollectionid"] = dcid
-        jp["display_name"] = "shelxt"
-        jp["recipe"] = "postprocessing-shelxt"
-        jp["automatic"] = parameters.automatic
-        jp["comments"] = parameters.comment
-        jobid = self.ispyb.mx_processing.upsert_job(list(jp.values()))
-        self.log.debug(f"Shelxt trigger: generated JobID {jobid}")
-
-        for key, values in shelx_parameters.items():
-            for value in values:
-                jpp = self.ispyb.mx_processing.get_job_parameter_params()
-                jpp["job_id"] = jobid
-                jpp["parameter_key"] = key
-                jpp["parameter_value"] = value
-                jppid = self.ispyb.mx_processing.upsert_job_parameter(
-                    list(jpp.values())
-                )
-                self.log.debug(f"Shelxt trigger: generated JobParameterID {jppid}")
+        jobid = crud.create_processing_job(
+            session,
+            dcid=dcid,
+            display_name="shelxt",
+            recipe="postprocessing-shelxt",
+            comments=parameters.comment,
+            automatic=parameters.automatic,
+            parameters=[
+                (key, value)
+                for key, values in shelx_parameters.items()
+                for value in values
+            ],
+        )
 
         self.log.debug(f"Shelxt trigger: Processing job {jobid} created")
 
@@ -2744,7 +2760,9 @@ class DLSTrigger(CommonService):
             )
             return {"success": True}
 
-        protein_info = get_protein_for_dcid(parameters.dcid, session)
+        protein_info = get_protein_for_dcid(
+            parameters.dcid, session, cache=self._entity_cache
+        )
 
         proposal_id = getattr(protein_info, "proposalId", None)
         acronym = getattr(protein_info, "acronym", "Protein")
@@ -2811,25 +2829,15 @@ class DLSTrigger(CommonService):
             "scaling_id": scaling_id,
         }
 
-        jp = self.ispyb.mx_processing.get_job_params()
-        jp["automatic"] = parameters.automatic
-        jp["comments"] = parameters.comment
-        jp["datacollectionid"] = parameters.dcid
-        jp["display_name"] = "ligandfit"
-        jp["recipe"] = "postprocessing-ligandfit"
-        self.log.info(jp)
-        jobid = self.ispyb.mx_processing.upsert_job(list(jp.values()))
-        self.log.debug(f"ligandfit trigger: generated JobID {jobid}")
-
-        for key, value in ligand_fit_parameters.items():
-            jpp = self.ispyb.mx_processing.get_job_parameter_params()
-            jpp["job_id"] = jobid
-            jpp["parameter_key"] = key
-            jpp["parameter_value"] = value
-            jppid = self.ispyb.mx_processing.upsert_job_parameter(list(jpp.values()))
-            self.log.debug(
-                f"Ligand_fit trigger: generated JobParameterID {jppid} with {key}={value}"
-            )
+        jobid = crud.create_processing_job(
+            session,
+            dcid=parameters.dcid,
+            display_name="ligandfit",
+            recipe="postprocessing-ligandfit",
+            comments=parameters.comment,
+            automatic=parameters.automatic,
+            parameters=ligand_fit_parameters.items(),
+        )
 
         self.log.debug(f"Ligand_fit_id trigger: Processing job {jobid} created")
 
@@ -2857,31 +2865,21 @@ class DLSTrigger(CommonService):
 
         downstream_pipeline = {"fast_dp": "xoalign", "xia2-dials": "align-crystal"}
 
-        jp = self.ispyb.mx_processing.get_job_params()
-        jp["comments"] = parameters.comment
-        jp["datacollectionid"] = parameters.dcid
-        jp["display_name"] = downstream_pipeline[parameters.upstream_pipeline]
-        jp["recipe"] = (
-            f"postprocessing-{downstream_pipeline[parameters.upstream_pipeline]}"
-        )
-        self.log.info(jp)
-        jobid = self.ispyb.mx_processing.upsert_job(list(jp.values()))
-        self.log.debug(f"align_crystal trigger: generated JobID {jobid}")
-
         align_crystal_parameters = {
             "experiment_file": parameters.experiment_file.as_posix(),
             "symlink": parameters.symlink,
         }
 
-        for key, value in align_crystal_parameters.items():
-            jpp = self.ispyb.mx_processing.get_job_parameter_params()
-            jpp["job_id"] = jobid
-            jpp["parameter_key"] = key
-            jpp["parameter_value"] = value
-            jppid = self.ispyb.mx_processing.upsert_job_parameter(list(jpp.values()))
-            self.log.debug(
-                f"Align_crystal trigger: generated JobParameterID {jppid} with {key}={value}"
-            )
+        jobid = crud.create_processing_job(
+            session,
+            dcid=parameters.dcid,
+            display_name=downstream_pipeline[parameters.upstream_pipeline],
+            recipe=f"postprocessing-{downstream_pipeline[parameters.upstream_pipeline]}",
+            comments=parameters.comment,
+            automatic=None,
+            parameters=align_crystal_parameters.items(),
+        )
+        self.log.debug(f"align_crystal trigger: generated JobID {jobid}")
 
         message = {"recipes": [], "parameters": {"ispyb_process": jobid}}
         rw.transport.send("processing_recipe", message)
@@ -2952,30 +2950,22 @@ class DLSTrigger(CommonService):
             )
             return {"success": True}
 
-        jp = self.ispyb.mx_processing.get_job_params()
-        jp["comments"] = parameters.comment
-        jp["datacollectionid"] = parameters.dcid
-        jp["display_name"] = "udc-strategy"
-        jp["recipe"] = "postprocessing-udc-strategy"
-        self.log.info(jp)
-        jobid = self.ispyb.mx_processing.upsert_job(list(jp.values()))
-        self.log.debug(f"Strategy trigger: generated JobID {jobid}")
-
         strategy_parameters = {
             "beamline": parameters.beamline,
             "resolution": resolution,
             "wavelength": parameters.wavelength,
         }
 
-        for key, value in strategy_parameters.items():
-            jpp = self.ispyb.mx_processing.get_job_parameter_params()
-            jpp["job_id"] = jobid
-            jpp["parameter_key"] = key
-            jpp["parameter_value"] = value
-            jppid = self.ispyb.mx_processing.upsert_job_parameter(list(jpp.values()))
-            self.log.debug(
-                f"Strategy trigger: generated JobParameterID {jppid} with {key}={value}"
-            )
+        jobid = crud.create_processing_job(
+            session,
+            dcid=parameters.dcid,
+            display_name="udc-strategy",
+            recipe="postprocessing-udc-strategy",
+            comments=parameters.comment,
+            automatic=None,
+            parameters=strategy_parameters.items(),
+        )
+        self.log.debug(f"Strategy trigger: generated JobID {jobid}")
 
         message = {"recipes": [], "parameters": {"ispyb_process": jobid}}
         rw.transport.send("processing_recipe", message)
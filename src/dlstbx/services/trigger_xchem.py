@@ -10,7 +10,6 @@ from datetime import datetime, timedelta
 from typing import Dict, Optional
 
 import gemmi
-import ispyb
 import pandas as pd
 import prometheus_client
 import pydantic
@@ -37,11 +36,12 @@ from workflows.services.common_service import CommonService
 
 import dlstbx.ispybtbx
 from dlstbx.crud import (
+    create_processing_job,
     get_latest_dcid_for_dtag,
     get_protein_for_dcid,
     get_visit_team_leader_email,
 )
-from dlstbx.util import ChainMapWithReplacement
+from dlstbx.util import ChainMapWithReplacement, database
 from dlstbx.util.prometheus_metrics import BasePrometheusMetrics, NoMetrics
 from dlstbx.util.soakdb import find_xchem_visit_dir
 from dlstbx.util.stage_reprocess import stage_existing_modeldir
@@ -54,6 +54,7 @@ class PrometheusMetrics(BasePrometheusMetrics):
             documentation="The total number of jobs triggered by the Zocalo trigger service",
             labelnames=["target"],
         )
+        database.create_pool_metrics(self)
 
 
 class ModelBuildingParameters(pydantic.BaseModel):
@@ -112,10 +113,13 @@ class DLSTriggerXChem(CommonService):
 
     def initializing(self):
         """Subscribe to the trigger_xchem queue. Received messages must be acknowledged."""
-        self._ispyb_sessionmaker = sqlalchemy.orm.sessionmaker(
-            bind=sqlalchemy.create_engine(
-                ispyb.sqlalchemy.url(), connect_args={"use_pure": True}
-            )
+        # Initialise metrics if requested
+        if self._environment.get("metrics"):
+            self._metrics = PrometheusMetrics()
+        else:
+            self._metrics = NoMetrics()
+        self._ispyb_sessionmaker = database.sessionmaker(
+            self._environment, service="trigger_xchem", metrics=self._metrics
         )
         workflows.recipe.wrap_subscribe(
             self._transport,
@@ -124,13 +128,6 @@ class DLSTriggerXChem(CommonService):
             acknowledgement=True,
             log_extender=self.extend_log,
         )
-        self.ispyb = ispyb.open()
-
-        # Initialise metrics if requested
-        if self._environment.get("metrics"):
-            self._metrics = PrometheusMetrics()
-        else:
-            self._metrics = NoMetrics()
 
     def trigger(self, rw, header, message):
         """Forward the trigger message to a specific trigger function."""
@@ -190,27 +187,17 @@ class DLSTriggerXChem(CommonService):
             return
         rw.transport.transaction_commit(txn)
 
-    def upsert_proc(self, rw, dcid, procname, recipe_parameters):
-        jp = self.ispyb.mx_processing.get_job_params()
-        jp["automatic"] = True
-        # jp["comments"] = parameters.comment
-        jp["datacollectionid"] = dcid
-        jp["display_name"] = procname
-        jp["recipe"] = f"postprocessing-{procname.lower()}"
-        self.log.info(jp)
-        jobid = self.ispyb.mx_processing.upsert_job(list(jp.values()))
+    def upsert_proc(self, rw, session, dcid, procname, recipe_parameters):
+        jobid = create_processing_job(
+            session,
+            dcid=dcid,
+            display_name=procname,
+            recipe=f"postprocessing-{procname.lower()}",
+            automatic=True,
+            parameters=recipe_parameters.items(),
+        )
         self.log.debug(f"{procname} trigger: generated JobID {jobid}")
 
-        for key, value in recipe_parameters.items():
-            jpp = self.ispyb.mx_processing.get_job_parameter_params()
-            jpp["job_id"] = jobid
-            jpp["parameter_key"] = key
-            jpp["parameter_value"] = value
-            jppid = self.ispyb.mx_processing.upsert_job_parameter(list(jpp.values()))
-            self.log.debug(
-                f"{procname} trigger: generated JobParameterID {jppid} with {key}={value}"
-            )
-
         self.log.debug(f"{procname}_id trigger: Processing job {jobid} created")
 
         message = {"recipes": [], "parameters": {"ispyb_process": jobid}}
@@ -700,7 +687,7 @@ class DLSTriggerXChem(CommonService):
         }
 
         self.log.info(f"Launching ligand-restraints for dtag {dtag} (dcid {dcid})")
-        self.upsert_proc(rw, dcid, "Grade2", recipe_parameters)
+        self.upsert_proc(rw, session, dcid, "Grade2", recipe_parameters)
         return {"success": True}
 
     @pydantic.validate_call(config={"arbitrary_types_allowed": True})
@@ -803,17 +790,19 @@ class DLSTriggerXChem(CommonService):
                 self.log.info(
                     f"bulk_array=True, launching PanDDA2 array job over {dataset_count} datasets"
                 )
-                self.upsert_proc(rw, dcid, "PanDDA2-array", recipe_parameters)
+                self.upsert_proc(rw, session, dcid, "PanDDA2-array", recipe_parameters)
             if pipedream:
                 self.log.info(
                     f"bulk_array=True, launching Pipedream array job over {dataset_count} datasets"
                 )
-                self.upsert_proc(rw, dcid, "Pipedream-array", recipe_parameters)
+                self.upsert_proc(
+                    rw, session, dcid, "Pipedream-array", recipe_parameters
+                )
             return {"success": True}
 
         if pipedream:
             self.log.info(f"Launching Pipedream for dtag {dtag}")
-            self.upsert_proc(rw, dcid, "Pipedream", recipe_parameters)
+            self.upsert_proc(rw, session, dcid, "Pipedream", recipe_parameters)
 
         if not pandda:
             self.log.info(f"pandda=False, skipping PanDDA2 for dtag {dtag}")
@@ -853,12 +842,12 @@ class DLSTriggerXChem(CommonService):
                     "dtag": batch_dtag,
                     "n_datasets": 1,
                 }
-                self.upsert_proc(rw, batch_dcid, "PanDDA2", batch_params)
+                self.upsert_proc(rw, session, batch_dcid, "PanDDA2", batch_params)
             return {"success": True}
 
         # dataset_count > comparator_threshold
         self.log.info(f"Launching single PanDDA2 job for dtag {dtag}")
-        self.upsert_proc(rw, dcid, "PanDDA2", recipe_parameters)
+        self.upsert_proc(rw, session, dcid, "PanDDA2", recipe_parameters)
         return {"success": True}
 
     @pydantic.validate_call(config={"arbitrary_types_allowed": True})
@@ -1073,6 +1062,6 @@ class DLSTriggerXChem(CommonService):
             "team_leader_email": team_leader_email,
         }
         # Upsert on max dcid
-        self.upsert_proc(rw, max(dcids), "XChem-Collate", recipe_parameters)
+        self.upsert_proc(rw, session, max(dcids), "XChem-Collate", recipe_parameters)
 
         return {"success": True}
@@ -37,6 +37,17 @@ class GridInfo(pydantic.BaseModel):
     def image_count(self) -> int:
         return self.steps_x * self.steps_y
 
+    @property
+    def row_length(self) -> int:
+        "The number of consecutive images collected along each line of the grid"
+        if self.orientation == dlstbx.util.xray_centering.Orientation.VERTICAL:
+            return self.steps_y
+        return self.steps_x
+
+    @property
+    def row_count(self) -> int:
+        return -(-self.image_count // self.row_length)
+
 
 class Parameters(pydantic.BaseModel):
     "Recipe parameters used by the X-ray centering service"
@@ -57,6 +68,7 @@ class Parameters(pydantic.BaseModel):
     threshold_absolute: pydantic.NonNegativeFloat = 0
     threshold_msp: pydantic.NonNegativeFloat = 0.25
     threshold_absolute_msp: pydantic.NonNegativeFloat = 3
+    provisional_rows: pydantic.PositiveInt = 3
 
 
 class RecipeStep(pydantic.BaseModel):
@@ -64,6 +76,15 @@ class RecipeStep(pydantic.BaseModel):
     gridinfo: GridInfo
 
 
+class HandoverState(pydantic.BaseModel):
+    "In-flight centering state passed on by a shard that is shutting down"
+
+    images_seen: pydantic.NonNegativeInt
+    data: List[int]
+    row_counts: List[int]
+    last_image_seen_at: pydantic.PositiveFloat
+
+
 class Message(pydantic.BaseModel):
     file_number: pydantic.PositiveInt = pydantic.Field(alias="file-number")
     n_spots_total: pydantic.NonNegativeInt
@@ -74,17 +95,50 @@ class CenteringData(pydantic.BaseModel):
     gridinfo: GridInfo
     recipewrapper: workflows.recipe.wrapper.RecipeWrapper
     headers: list = pydantic.Field(default_factory=list)
+    images_seen: int = 0
     last_activity: float = pydantic.Field(default_factory=time.time)
     last_image_seen_at: pydantic.PositiveFloat
     data: np.ndarray = None
+    # Number of images recorded in each line of the grid
+    row_counts: np.ndarray = None
+    # Number of leading lines of the grid for which all images were recorded
+    rows_complete: int = 0
+    # Maximum spot count over all complete lines
+    running_max: int = 0
+    # Whether complete lines arrived since the last provisional analysis
+    # that may change its outcome
+    provisional_stale: bool = False
+    provisional_result: Optional[dlstbx.util.xray_centering.GridScan2DResult] = None
 
     def __init__(self, **data):
         super().__init__(**data)
-        self.data = np.empty(self.gridinfo.image_count, dtype=int)
-
-    @property
-    def images_seen(self):
-        return len(self.headers)
+        self.data = np.zeros(self.gridinfo.image_count, dtype=int)
+        self.row_counts = np.zeros(self.gridinfo.row_count, dtype=int)
+
+    def record(self, index: int, n_spots: int) -> None:
+        self.data[index] = n_spots
+        self.row_counts[index // self.gridinfo.row_length] += 1
+
+    def complete_rows(self) -> int:
+        """Advance past all leading lines of the grid that are now complete,
+        keeping track of the maximum spot count seen within them. Returns the
+        number of newly completed lines."""
+        row_length = self.gridinfo.row_length
+        start = self.rows_complete
+        while (
+            self.rows_complete < self.gridinfo.row_count
+            and self.row_counts[self.rows_complete] >= row_length
+        ):
+            self.rows_complete += 1
+        if self.rows_complete > start:
+            new_rows = self.data[start * row_length : self.rows_complete * row_length]
+            self.running_max = max(self.running_max, int(new_rows.max()))
+            # The 2D analysis only considers images with at least half the
+            # maximum spot count, so lines without any of those can not move
+            # the centre
+            if self.running_max and (new_rows >= 0.5 * self.running_max).any():
+                self.provisional_stale = True
+        return self.rows_complete - start
 
     model_config = ConfigDict(arbitrary_types_allowed=True)
 
@@ -96,6 +150,11 @@ class PrometheusMetrics(BasePrometheusMetrics):
             documentation="Counts total number of completed x-ray centerings",
             labelnames=["beamline"],
         )
+        self.provisional_centering = prometheus_client.Counter(
+            name="provisional_centerings",
+            documentation="Counts provisional x-ray centering results sent before the end of a grid scan",
+            labelnames=["beamline"],
+        )
         self.analysis_latency = prometheus_client.Histogram(
             name="analysis_latency",
             documentation="The time passed (s) from end of data collection to end of x-ray centering",
@@ -105,6 +164,31 @@ class PrometheusMetrics(BasePrometheusMetrics):
         )
 
 
+def shard_for_dcids(dcids: List[int], shards: int) -> int:
+    """Map a data collection, or group of data collections, onto one of a number
+    of shards using jump consistent hashing (Lamping & Veach, 2014), so that only
+    a fraction of collections move to a different shard when shards are added.
+    Grouped data collections are keyed on the lowest DCID in the group so that
+    they all end up on the same shard."""
+    key = min(dcids, default=0) & 0xFFFFFFFFFFFFFFFF
+    bucket, j = -1, 0
+    while j < shards:
+        bucket = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def _routing_dcids(recipe_step: dict) -> List[int]:
+    parameters = recipe_step.get("parameters") or {}
+    try:
+        return [int(parameters["dcid"])] + [
+            int(dcid) for dcid in parameters.get("dcg_dcids") or []
+        ]
+    except (KeyError, TypeError, ValueError):
+        return []
+
+
 class DLSXRayCentering(CommonService):
     """A service to aggregate per-image-analysis results and identify an X-ray
     centering solution for a data collection."""
@@ -112,27 +196,70 @@ class DLSXRayCentering(CommonService):
     _service_name = "DLS X-Ray Centering"
     _logger_name = "dlstbx.services.xray-centering"
 
+    # Number of shards and the shard handled by this instance in sharded mode
+    _shards = 0
+    _shard: Optional[int] = None
+
     def initializing(self):
         """Try to exclusively subscribe to the x-ray centering queue. Received messages must be acknowledged.
         Exclusive subscription enables a single process to do the 'reduce' step, aggregating many messages
         that belong together.
+
+        In incremental mode messages are acknowledged as they arrive rather than
+        being held until the scan is complete, and provisional 2D results are
+        sent to the 'provisional' output as complete lines of the grid come in.
+        Partial scan results are then lost if the service is restarted.
+
+        In sharded mode ('shards' set in the service environment) every instance
+        forwards messages from the x-ray centering queue to one of the queues
+        <queue>.shard.<n>, based on the DCID. An instance with 'shard' set to n
+        then exclusively subscribes to the queue for that shard, so that several
+        grid scans can be reduced in parallel. On shutdown a shard hands over its
+        in-flight sessions to the next instance consuming the same shard queue.
         """
         self.log.info("X-Ray centering service starting up")
+        self._incremental = bool(self._environment.get("incremental"))
+        if self._incremental:
+            self.log.info("Running in incremental mode")
 
         self._centering_data = {}
         self._centering_lock = threading.Lock()
 
         self._next_garbage_collection = time.time() + 60
         self._register_idle(60, self.garbage_collect)
-        workflows.recipe.wrap_subscribe(
-            self._transport,
-            self._environment.get("queue") or "reduce.xray_centering",
-            self.add_pia_result,
-            acknowledgement=True,
-            exclusive=True,
-            log_extender=self.extend_log,
-            prefetch_count=65535,
-        )
+        self._queue = self._environment.get("queue") or "reduce.xray_centering"
+        self._shards = int(self._environment.get("shards") or 0)
+        if self._shards:
+            if self._environment.get("shard") is not None:
+                self._shard = int(self._environment["shard"])
+                if not 0 <= self._shard < self._shards:
+                    self.log.error(
+                        f"Invalid shard {self._shard} for {self._shards} shards"
+                    )
+                    self._request_termination()
+                    return
+            workflows.recipe.wrap_subscribe(
+                self._transport,
+                self._queue,
+                self.route_pia_result,
+                acknowledgement=True,
+                log_extender=self.extend_log,
+                prefetch_count=100,
+            )
+        if not self._shards or self._shard is not None:
+            if self._shard is not None:
+                self.log.info(f"Reducing shard {self._shard} of {self._shards}")
+            workflows.recipe.wrap_subscribe(
+                self._transport,
+                self._shard_queue(self._shard)
+                if self._shard is not None
+                else self._queue,
+                self.add_pia_result,
+                acknowledgement=True,
+                exclusive=True,
+                log_extender=self.extend_log,
+                prefetch_count=65535,
+            )
 
         # Initialise metrics if requested
         if self._environment.get("metrics"):
@@ -140,6 +267,112 @@ class DLSXRayCentering(CommonService):
         else:
             self._prom_metrics = NoMetrics()
 
+    def in_shutdown(self):
+        """Hand over the state of all in-flight sessions to the next instance of
+        this shard, acknowledging the held messages in the same transaction."""
+        if self._shard is None:
+            return
+        with self._centering_lock:
+            for dcid, cd in self._centering_data.items():
+                rw = cd.recipewrapper
+                subscription_id = cd.headers[0]["subscription"] if cd.headers else None
+                txn = rw.transport.transaction_begin(subscription_id=subscription_id)
+                for header in cd.headers:
+                    rw.transport.ack(header, transaction=txn)
+                state = HandoverState(
+                    images_seen=cd.images_seen,
+                    data=cd.data.tolist(),
+                    row_counts=cd.row_counts.tolist(),
+                    last_image_seen_at=cd.last_image_seen_at,
+                )
+                self._send_to_shard(
+                    rw,
+                    self._shard,
+                    {"xray-centering-handover": state.model_dump()},
+                    transaction=txn,
+                )
+                rw.transport.transaction_commit(txn)
+                self.log.info(
+                    f"Handed over X-ray centering session for DCID {dcid} "
+                    f"with {cd.images_seen} of {cd.gridinfo.image_count} images"
+                )
+            self._centering_data.clear()
+
+    def _shard_queue(self, shard: int) -> str:
+        return f"{self._queue}.shard.{shard}"
+
+    def _send_to_shard(
+        self, rw: workflows.recipe.wrapper.RecipeWrapper, shard: int, payload, **kwargs
+    ):
+        rw.transport.send(
+            self._shard_queue(shard),
+            {
+                "recipe": rw.recipe.recipe,
+                "recipe-pointer": rw.recipe_pointer,
+                "recipe-path": rw.recipe_path,
+                "environment": rw.environment,
+                "payload": payload,
+            },
+            headers={"workflows-recipe": True},
+            **kwargs,
+        )
+
+    def route_pia_result(self, rw, header, message):
+        """Forward an incoming message to the shard reducing its data collection."""
+        shard = shard_for_dcids(_routing_dcids(rw.recipe_step), self._shards)
+        txn = rw.transport.transaction_begin(subscription_id=header["subscription"])
+        rw.transport.ack(header, transaction=txn)
+        self._send_to_shard(rw, shard, message, transaction=txn)
+        rw.transport.transaction_commit(txn)
+
+    def restore_handover(
+        self,
+        rw: workflows.recipe.wrapper.RecipeWrapper,
+        header: dict,
+        parameters: Parameters,
+        gridinfo: GridInfo,
+        state: dict,
+    ):
+        """Resume a session handed over by a previous instance of this shard,
+        merging it with any results that have arrived since."""
+        try:
+            state = HandoverState(**state)
+            if (
+                len(state.data) != gridinfo.image_count
+                or len(state.row_counts) != gridinfo.row_count
+            ):
+                raise ValueError("Handover state inconsistent with grid size")
+        except (pydantic.ValidationError, ValueError) as e:
+            self.log.error(f"Discarding invalid X-ray centering handover: {e}")
+            rw.transport.ack(header)
+            return
+
+        dcid = parameters.dcid
+        with self._centering_lock:
+            cd = self._centering_data.get(dcid)
+            if cd is None:
+                cd = CenteringData(
+                    gridinfo=gridinfo,
+                    recipewrapper=rw,
+                    last_image_seen_at=state.last_image_seen_at,
+                )
+                self._centering_data[dcid] = cd
+            self.log.info(
+                f"Resuming X-ray centering on DCID {dcid} with {state.images_seen} "
+                f"of {gridinfo.image_count} images handed over"
+            )
+            cd.last_activity = time.time()
+            cd.images_seen += state.images_seen
+            # Images that have not been seen yet are recorded as 0 spots
+            cd.data = np.maximum(cd.data, state.data)
+            cd.row_counts += state.row_counts
+            cd.last_image_seen_at = max(cd.last_image_seen_at, state.last_image_seen_at)
+            if self._incremental and cd.images_seen < gridinfo.image_count:
+                rw.transport.ack(header)
+            else:
+                cd.headers.append(header)
+            self.reduce_if_complete(rw, header, cd, parameters)
+
     def garbage_collect(self):
         """Throw away partial scan results after a while."""
         self._next_garbage_collection = time.time() + 60
@@ -152,9 +385,9 @@ class DLSXRayCentering(CommonService):
                         self.log.warning(
                             f"Expiring X-Ray Centering session for DCID {dcid}"
                         )
-                    subscription_id = self._centering_data[dcid].headers[0][
-                        "subscription"
-                    ]
+                    headers = self._centering_data[dcid].headers
+                    # In incremental mode messages may already have been acknowledged
+                    subscription_id = headers[0]["subscription"] if headers else None
                     txn = rw.transport.transaction_begin(
                         subscription_id=subscription_id
                     )
@@ -208,6 +441,20 @@ class DLSXRayCentering(CommonService):
             return
         dcid = parameters.dcid
         dcg_dcids = parameters.dcg_dcids
+        if (
+            self._shard is not None
+            and shard_for_dcids(_routing_dcids(rw.recipe_step), self._shards)
+            != self._shard
+        ):
+            # Message was routed with a different shard map, eg. before the
+            # number of shards changed
+            self.route_pia_result(rw, header, message)
+            return
+        if isinstance(message, dict) and "xray-centering-handover" in message:
+            self.restore_handover(
+                rw, header, parameters, gridinfo, message["xray-centering-handover"]
+            )
+            return
         try:
             message = Message(**message)
         except pydantic.ValidationError as e:
@@ -231,7 +478,14 @@ class DLSXRayCentering(CommonService):
                 )
 
             cd.last_activity = time.time()
-            cd.headers.append(header)
+            cd.images_seen += 1
+            # Unless this message completes the scan, acknowledge it straight
+            # away in incremental mode instead of holding it until the end
+            acknowledged = self._incremental and cd.images_seen < gridinfo.image_count
+            if acknowledged:
+                rw.transport.ack(header)
+            else:
+                cd.headers.append(header)
             self.log.debug(
                 "Received PIA result for DCID %d image %d, %d of %d expected results",
                 dcid,
@@ -240,188 +494,270 @@ class DLSXRayCentering(CommonService):
                 gridinfo.image_count,
             )
             try:
-                cd.data[message.file_number - 1] = message.n_spots_total
+                cd.record(message.file_number - 1, message.n_spots_total)
             except IndexError:
                 # Cannot analyse images with an inconsistent metadata
                 self.log.exception(
                     f"Image index {message.file_number} inconsistent with data size {cd.data.shape}"
                 )
-                rw.transport.ack(header)
+                if not acknowledged:
+                    rw.transport.ack(header)
                 return
             cd.last_image_seen_at = max(cd.last_image_seen_at, message.file_seen_at)
 
-            if cd.images_seen == gridinfo.image_count:
-                well_limits = dlstbx.util.xray_centering.get_well_limits_from_loop_type(
-                    parameters.loop_type, gridinfo.dx_mm * 1000
-                )
-                if dcg_dcids:
-                    dcids = [dcid] + dcg_dcids
-                    try:
-                        all_images_seen = all(
-                            self._centering_data[_dcid].images_seen
-                            == self._centering_data[_dcid].gridinfo.image_count
-                            for _dcid in dcids
-                        )
-                    # Catch if centering data doesn't exist yet for a dcid.
-                    except KeyError:
-                        all_images_seen = False
-                    if all_images_seen:
-                        self.log.info(
-                            f"All records arrived for X-ray centering on DCIDs {sorted(dcids)}"
-                        )
-                        data = []
-                        for _dcid in dcids:
-                            _cd = self._centering_data.get(_dcid)
-                            data.append(
-                                dlstbx.util.xray_centering.reshape_grid(
-                                    _cd.data,
-                                    (_cd.gridinfo.steps_x, _cd.gridinfo.steps_y),
-                                    _cd.gridinfo.snaked,
-                                    _cd.gridinfo.orientation,
-                                )
-                            )
-                        # Sort the data by dcid
-                        perm = np.argsort(dcids)
-                        self.log.debug(f"{perm=}")
-                        data = [data[p] for p in perm]
-
-                        if parameters.msp_sample_ids:
-                            self.log.debug(
-                                f"Applying multi-sample pin thresholds for sample IDs {parameters.msp_sample_ids}"
-                            )
-                            threshold = parameters.threshold_msp
-                            threshold_absolute = parameters.threshold_absolute_msp
-                        else:
-                            threshold = parameters.threshold
-                            threshold_absolute = parameters.threshold_absolute
-
-                        result = dlstbx.util.xray_centering_3d.gridscan3d(
-                            data=tuple(data),
-                            sample_id=parameters.sample_id,
-                            threshold=threshold,
-                            threshold_absolute=threshold_absolute,
-                            plot=False,
-                            multipin_sample_ids=parameters.msp_sample_ids,
-                            well_limits=well_limits,
-                        )
-                        self.log.info(f"3D X-ray centering result: {result}")
+            if (
+                self._incremental
+                and cd.images_seen < gridinfo.image_count
+                and not dcg_dcids
+                and parameters.experiment_type != "Mesh3D"
+            ):
+                self.send_provisional_result(rw, cd, parameters)
 
-                        # Acknowledge all messages
-                        txn = rw.transport.transaction_begin(
-                            subscription_id=header["subscription"]
-                        )
-                        for _dcid in dcids:
-                            cd = self._centering_data[_dcid]
-                            for h in cd.headers:
-                                rw.transport.ack(h, transaction=txn)
-
-                        # Send results onwards
-                        rw.set_default_channel("success")
-                        rw.send_to(
-                            "success",
-                            {
-                                "results": [r.model_dump() for r in result],
-                                "status": "success",
-                                "type": "3d",
-                            },
-                            transaction=txn,
-                        )
-                        rw.transport.transaction_commit(txn)
+            self.reduce_if_complete(rw, header, cd, parameters)
 
-                        for _dcid in dcids:
-                            del self._centering_data[_dcid]
+        if self._next_garbage_collection < time.time():
+            self.garbage_collect()
 
-                elif parameters.experiment_type != "Mesh3D":
-                    self.log.info(
-                        "All records arrived for X-ray centering on DCID %d", dcid
+    def reduce_if_complete(
+        self,
+        rw: workflows.recipe.wrapper.RecipeWrapper,
+        header: dict,
+        cd: CenteringData,
+        parameters: Parameters,
+    ):
+        """Run the X-ray centering analysis once all images of a data collection,
+        or of all data collections in a group, have been seen."""
+        dcid = parameters.dcid
+        dcg_dcids = parameters.dcg_dcids
+        gridinfo = cd.gridinfo
+        if cd.images_seen == gridinfo.image_count:
+            well_limits = dlstbx.util.xray_centering.get_well_limits_from_loop_type(
+                parameters.loop_type, gridinfo.dx_mm * 1000
+            )
+            if dcg_dcids:
+                dcids = [dcid] + dcg_dcids
+                try:
+                    all_images_seen = all(
+                        self._centering_data[_dcid].images_seen
+                        == self._centering_data[_dcid].gridinfo.image_count
+                        for _dcid in dcids
                     )
-                    result, output = dlstbx.util.xray_centering.gridscan2d(
-                        cd.data,
-                        sample_id=parameters.sample_id,
-                        steps=(gridinfo.steps_x, gridinfo.steps_y),
-                        box_size_px=(
-                            1000 * gridinfo.dx_mm / gridinfo.micronsPerPixelX,
-                            1000 * gridinfo.dy_mm / gridinfo.micronsPerPixelY,
-                        ),
-                        snapshot_offset=(
-                            gridinfo.snapshot_offsetXPixel,
-                            gridinfo.snapshot_offsetYPixel,
-                        ),
-                        snaked=gridinfo.snaked,
-                        orientation=gridinfo.orientation,
-                        multipin_sample_ids=parameters.msp_sample_ids,
-                        well_limits=well_limits,
+                # Catch if centering data doesn't exist yet for a dcid.
+                except KeyError:
+                    all_images_seen = False
+                if all_images_seen:
+                    self.log.info(
+                        f"All records arrived for X-ray centering on DCIDs {sorted(dcids)}"
                     )
-                    self.log.debug(output)
-
-                    # Write result file
-                    if parameters.output:
-                        self.log.info(
-                            "Writing X-Ray centering results for DCID %d to %s",
-                            dcid,
-                            parameters.output,
-                        )
-                        parameters.output.parent.mkdir(parents=True, exist_ok=True)
-                        parameters.output.write_text(result.model_dump_json())
-                        if parameters.results_symlink:
-                            # Create symbolic link above working directory
-                            dlstbx.util.symlink.create_parent_symlink(
-                                str(parameters.output.parent),
-                                parameters.results_symlink,
+                    data = []
+                    for _dcid in dcids:
+                        _cd = self._centering_data.get(_dcid)
+                        data.append(
+                            dlstbx.util.xray_centering.reshape_grid(
+                                _cd.data,
+                                (_cd.gridinfo.steps_x, _cd.gridinfo.steps_y),
+                                _cd.gridinfo.snaked,
+                                _cd.gridinfo.orientation,
                             )
-
-                    # Write human-readable result file
-                    if parameters.log:
-                        parameters.log.parent.mkdir(parents=True, exist_ok=True)
-                        parameters.log.write_text(output)
-
-                    # Write latency log message
-                    latency = time.time() - cd.last_image_seen_at
-                    if latency >= parameters.latency_log_error:
-                        message_level = logging.ERROR
-                    elif (
-                        parameters.latency_log_warning
-                        <= latency
-                        < parameters.latency_log_error
-                    ):
-                        message_level = logging.WARNING
+                        )
+                    # Sort the data by dcid
+                    perm = np.argsort(dcids)
+                    self.log.debug(f"{perm=}")
+                    data = [data[p] for p in perm]
+
+                    if parameters.msp_sample_ids:
+                        self.log.debug(
+                            f"Applying multi-sample pin thresholds for sample IDs {parameters.msp_sample_ids}"
+                        )
+                        threshold = parameters.threshold_msp
+                        threshold_absolute = parameters.threshold_absolute_msp
                     else:
-                        message_level = logging.INFO
-                    self.log.log(
-                        message_level,
-                        f"X-ray centering completed for DCID {parameters.dcid} with latency of {latency:.2f} seconds",
-                        extra={"xray-centering-latency": latency},
-                    )
+                        threshold = parameters.threshold
+                        threshold_absolute = parameters.threshold_absolute
 
-                    # Set prometheus metrics
-                    self._prom_metrics.record_metric(
-                        "complete_centering", [f"{parameters.beamline}"]
-                    )
-                    self._prom_metrics.record_metric(
-                        "analysis_latency", [f"{parameters.beamline}"], latency
+                    result = dlstbx.util.xray_centering_3d.gridscan3d(
+                        data=tuple(data),
+                        sample_id=parameters.sample_id,
+                        threshold=threshold,
+                        threshold_absolute=threshold_absolute,
+                        plot=False,
+                        multipin_sample_ids=parameters.msp_sample_ids,
+                        well_limits=well_limits,
                     )
+                    self.log.info(f"3D X-ray centering result: {result}")
 
                     # Acknowledge all messages
                     txn = rw.transport.transaction_begin(
                         subscription_id=header["subscription"]
                     )
-                    for h in cd.headers:
-                        rw.transport.ack(h, transaction=txn)
+                    for _dcid in dcids:
+                        cd = self._centering_data[_dcid]
+                        for h in cd.headers:
+                            rw.transport.ack(h, transaction=txn)
 
                     # Send results onwards
                     rw.set_default_channel("success")
                     rw.send_to(
                         "success",
                         {
-                            "results": [result.model_dump()],
+                            "results": [r.model_dump() for r in result],
                             "status": "success",
-                            "type": "2d",
+                            "type": "3d",
                         },
                         transaction=txn,
                     )
                     rw.transport.transaction_commit(txn)
 
-                    del self._centering_data[dcid]
+                    for _dcid in dcids:
+                        del self._centering_data[_dcid]
 
-        if self._next_garbage_collection < time.time():
-            self.garbage_collect()
+            elif parameters.experiment_type != "Mesh3D":
+                self.log.info(
+                    "All records arrived for X-ray centering on DCID %d", dcid
+                )
+                result, output = dlstbx.util.xray_centering.gridscan2d(
+                    cd.data,
+                    sample_id=parameters.sample_id,
+                    steps=(gridinfo.steps_x, gridinfo.steps_y),
+                    box_size_px=(
+                        1000 * gridinfo.dx_mm / gridinfo.micronsPerPixelX,
+                        1000 * gridinfo.dy_mm / gridinfo.micronsPerPixelY,
+                    ),
+                    snapshot_offset=(
+                        gridinfo.snapshot_offsetXPixel,
+                        gridinfo.snapshot_offsetYPixel,
+                    ),
+                    snaked=gridinfo.snaked,
+                    orientation=gridinfo.orientation,
+                    multipin_sample_ids=parameters.msp_sample_ids,
+                    well_limits=well_limits,
+                )
+                self.log.debug(output)
+
+                # Write result file
+                if parameters.output:
+                    self.log.info(
+                        "Writing X-Ray centering results for DCID %d to %s",
+                        dcid,
+                        parameters.output,
+                    )
+                    parameters.output.parent.mkdir(parents=True, exist_ok=True)
+                    parameters.output.write_text(result.model_dump_json())
+                    if parameters.results_symlink:
+                        # Create symbolic link above working directory
+                        dlstbx.util.symlink.create_parent_symlink(
+                            str(parameters.output.parent),
+                            parameters.results_symlink,
+                        )
+
+                # Write human-readable result file
+                if parameters.log:
+                    parameters.log.parent.mkdir(parents=True, exist_ok=True)
+                    parameters.log.write_text(output)
+
+                # Write latency log message
+                latency = time.time() - cd.last_image_seen_at
+                if latency >= parameters.latency_log_error:
+                    message_level = logging.ERROR
+                elif (
+                    parameters.latency_log_warning
+                    <= latency
+                    < parameters.latency_log_error
+                ):
+                    message_level = logging.WARNING
+                else:
+                    message_level = logging.INFO
+                self.log.log(
+                    message_level,
+                    f"X-ray centering completed for DCID {parameters.dcid} with latency of {latency:.2f} seconds",
+                    extra={"xray-centering-latency": latency},
+                )
+
+                # Set prometheus metrics
+                self._prom_metrics.record_metric(
+                    "complete_centering", [f"{parameters.beamline}"]
+                )
+                self._prom_metrics.record_metric(
+                    "analysis_latency", [f"{parameters.beamline}"], latency
+                )
+
+                # Acknowledge all messages
+                txn = rw.transport.transaction_begin(
+                    subscription_id=header["subscription"]
+                )
+                for h in cd.headers:
+                    rw.transport.ack(h, transaction=txn)
+
+                # Send results onwards
+                rw.set_default_channel("success")
+                rw.send_to(
+                    "success",
+                    {
+                        "results": [result.model_dump()],
+                        "status": "success",
+                        "type": "2d",
+                    },
+                    transaction=txn,
+                )
+                rw.transport.transaction_commit(txn)
+
+                del self._centering_data[dcid]
+
+    def send_provisional_result(
+        self,
+        rw: workflows.recipe.wrapper.RecipeWrapper,
+        cd: CenteringData,
+        parameters: Parameters,
+    ):
+        """Analyse the complete lines of a partial 2D grid scan, and send the
+        result onwards if the centre has moved since the last one was sent."""
+        cd.complete_rows()
+        if not cd.provisional_stale or cd.rows_complete < parameters.provisional_rows:
+            return
+        cd.provisional_stale = False
+
+        gridinfo = cd.gridinfo
+        data = cd.data.copy()
+        data[cd.rows_complete * gridinfo.row_length :] = 0
+        result, _ = dlstbx.util.xray_centering.gridscan2d(
+            data,
+            sample_id=parameters.sample_id,
+            steps=(gridinfo.steps_x, gridinfo.steps_y),
+            box_size_px=(
+                1000 * gridinfo.dx_mm / gridinfo.micronsPerPixelX,
+                1000 * gridinfo.dy_mm / gridinfo.micronsPerPixelY,
+            ),
+            snapshot_offset=(
+                gridinfo.snapshot_offsetXPixel,
+                gridinfo.snapshot_offsetYPixel,
+            ),
+            snaked=gridinfo.snaked,
+            orientation=gridinfo.orientation,
+            multipin_sample_ids=parameters.msp_sample_ids,
+            well_limits=dlstbx.util.xray_centering.get_well_limits_from_loop_type(
+                parameters.loop_type, gridinfo.dx_mm * 1000
+            ),
+        )
+        if result.status != "ok" or (
+            cd.provisional_result
+            and cd.provisional_result.centre_of_mass == result.centre_of_mass
+        ):
+            return
+        cd.provisional_result = result
+        self.log.info(
+            f"Provisional X-ray centering result for DCID {parameters.dcid} "
+            f"after {cd.rows_complete} of {cd.gridinfo.row_count} lines: "
+            f"centre_x,centre_y={result.centre_x},{result.centre_y}"
+        )
+        self._prom_metrics.record_metric(
+            "provisional_centering", [f"{parameters.beamline}"]
+        )
+        rw.send_to(
+            "provisional",
+            {
+                "results": [result.model_dump()],
+                "status": "provisional",
+                "type": "2d",
+                "rows_complete": cd.rows_complete,
+            },
+        )
@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import collections
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+
+import h5py
+import numpy
+
+from dlstbx.swmr import h5check
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class MasterFileEntry:
+    """Decoded VDS layout of a master file plus per-dataset watch progress."""
+
+    master: str
+    mtime: float
+    dataset_files: list
+    file_map: dict
+    last_used: float = field(default_factory=time.monotonic)
+    # Number of chunks seen at the last scan and the offset of the last of
+    # them, per (data file, dataset)
+    chunk_index: dict = field(default_factory=dict)
+    # Boolean masks of frames known to be written, per (data file, dataset)
+    written: dict = field(default_factory=dict)
+
+    @property
+    def image_count(self) -> int:
+        return len(self.file_map)
+
+    def written_frames(self, h5_data_file: str, dataset: h5py.Dataset) -> numpy.ndarray:
+        """
+        Return a boolean mask of the written frames of a data file dataset.
+        Only the chunk records that have appeared since the previous call are
+        read and added to the mask.
+
+        Chunk records are indexed in the order of their position in the
+        dataset, so while frames are appended the previously seen records keep
+        their indices. If a chunk was written ahead of the last seen one, the
+        indices shift and all chunk records are read again.
+        """
+        key = (h5_data_file, dataset.name)
+        dsid = dataset.id
+        num_chunks = dsid.get_num_chunks()
+        seen, last_offset = self.chunk_index.get(key, (0, None))
+        mask = self.written.get(key)
+        if mask is not None and num_chunks == seen and len(mask) == dataset.shape[0]:
+            return mask
+
+        if (
+            mask is None
+            or num_chunks < seen
+            or len(mask) > dataset.shape[0]
+            or (seen and dsid.get_chunk_info(seen - 1).chunk_offset[0] != last_offset)
+        ):
+            mask = numpy.zeros(dataset.shape[0], dtype=bool)
+            start = 0
+        else:
+            if len(mask) < dataset.shape[0]:
+                mask = numpy.concatenate(
+                    (mask, numpy.zeros(dataset.shape[0] - len(mask), dtype=bool))
+                )
+            # The last seen chunk is read again, as it may hold further frames
+            # if it lay across the previous end of the dataset
+            start = max(seen - 1, 0)
+        mask[h5check.get_chunk_sizes(dataset, start=start)[0]] = True
+
+        if num_chunks:
+            last_offset = dsid.get_chunk_info(num_chunks - 1).chunk_offset[0]
+        self.written[key] = mask
+        self.chunk_index[key] = (num_chunks, last_offset)
+        return mask
+
+
+class SWMRFileCache:
+    """
+    Process-wide cache of SWMR master file layouts and open data file handles.
+
+    Entries are keyed on the master file path and its modification time, so a
+    rewritten master file is decoded afresh. Master entries are evicted after
+    being idle for max_idle seconds, and data file handles are closed in least
+    recently used order once more than max_handles are open.
+    """
+
+    def __init__(self, max_idle: float = 600, max_handles: int = 256):
+        self.max_idle = max_idle
+        self.max_handles = max_handles
+        self._masters: dict[str, MasterFileEntry] = {}
+        self._handles: collections.OrderedDict[str, h5py.File] = (
+            collections.OrderedDict()
+        )
+        self._handle_owner: dict[str, str] = {}
+        self._lock = threading.RLock()
+
+    def get_master(self, master: str, mtime: float) -> MasterFileEntry:
+        """
+        Return the decoded VDS layout of a master file, reading the file only
+        if it is not cached or has changed since it was last read.
+        """
+        with self._lock:
+            self.expire()
+            entry = self._masters.get(master)
+            if entry is not None and entry.mtime == mtime:
+                entry.last_used = time.monotonic()
+                return entry
+            if entry is not None:
+                logger.debug(f"Master file {master} changed, discarding cache entry")
+                self.evict(master)
+            with h5py.File(master, mode="r", swmr=True) as f:
+                d = f["/entry/data/data"]
+                dataset_files, file_map = h5check.get_real_frames(f, d)
+            entry = MasterFileEntry(
+                master=master,
+                mtime=mtime,
+                dataset_files=dataset_files,
+                file_map=file_map,
+            )
+            self._masters[master] = entry
+            return entry
+
+    def get_handle(self, master: str, h5_data_file: str) -> h5py.File:
+        """Return an open SWMR handle for a data file belonging to a master file."""
+        with self._lock:
+            if h5_data_file in self._handles:
+                self._handles.move_to_end(h5_data_file)
+                return self._handles[h5_data_file]
+            logger.debug(f"Opening file {h5_data_file}")
+            handle = h5py.File(h5_data_file, mode="r", swmr=True)
+            self._handles[h5_data_file] = handle
+            self._handle_owner[h5_data_file] = master
+            while len(self._handles) > self.max_handles:
+                self._close_handle(next(iter(self._handles)))
+            return handle
+
+    def is_open(self, h5_data_file: str) -> bool:
+        return h5_data_file in self._handles
+
+    def discard_handle(self, h5_data_file: str) -> None:
+        """Close a data file handle, eg. after an error reading from it."""
+        with self._lock:
+            self._close_handle(h5_data_file)
+
+    def evict(self, master: str) -> None:
+        """Drop a master file entry and close all of its data file handles."""
+        with self._lock:
+            self._masters.pop(master, None)
+            for h5_data_file in [
+                h for h, owner in self._handle_owner.items() if owner == master
+            ]:
+                self._close_handle(h5_data_file)
+
+    def expire(self) -> None:
+        """Evict all master file entries that have not been used recently."""
+        with self._lock:
+            cutoff = time.monotonic() - self.max_idle
+            for master in [
+                m for m, entry in self._masters.items() if entry.last_used < cutoff
+            ]:
+                logger.debug(f"Evicting idle cache entry for {master}")
+                self.evict(master)
+
+    def clear(self) -> None:
+        with self._lock:
+            for master in list(self._masters):
+                self.evict(master)
+            for h5_data_file in list(self._handles):
+                self._close_handle(h5_data_file)
+
+    def _close_handle(self, h5_data_file: str) -> None:
+        handle = self._handles.pop(h5_data_file, None)
+        self._handle_owner.pop(h5_data_file, None)
+        if handle is not None:
+            try:
+                handle.close()
+            except Exception:
+                logger.debug(f"Error closing {h5_data_file}", exc_info=True)
+
+    @property
+    def open_handles(self) -> int:
+        return len(self._handles)
+
+    def __contains__(self, master: str) -> bool:
+        return master in self._masters
+
+
+swmr_file_cache = SWMRFileCache()
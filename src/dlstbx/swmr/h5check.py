@@ -6,6 +6,7 @@ import sys
 import time
 
 import h5py
+import numpy
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +24,56 @@ def wait_for_frame(h5_data_file, dsetname, frame):
     return size
 
 
+def get_chunk_sizes(dataset, start=0):
+    """
+    Read all chunk records of a chunked dataset in a single pass.
+
+    Returns a tuple of numpy arrays (frames, sizes), with the sorted indices
+    of all frames that have been written, and the stored size in bytes of the
+    chunk holding each of those frames. If start is given, only the chunk
+    records from that index onwards are read.
+    """
+    dsid = dataset.id
+    offsets = []
+    sizes = []
+    if hasattr(dsid, "chunk_iter") and not start:
+        # Requires HDF5 1.12.3/1.14 or later: visit all chunks with a single call
+        def visit(info):
+            offsets.append(info.chunk_offset[0])
+            sizes.append(info.size)
+
+        dsid.chunk_iter(visit)
+    else:
+        for j in range(start, dsid.get_num_chunks()):
+            info = dsid.get_chunk_info(j)
+            offsets.append(info.chunk_offset[0])
+            sizes.append(info.size)
+
+    offsets = numpy.array(offsets, dtype=numpy.int64)
+    sizes = numpy.array(sizes, dtype=numpy.int64)
+    written = sizes > 0
+    offsets, sizes = offsets[written], sizes[written]
+
+    frames_per_chunk = dataset.chunks[0]
+    if frames_per_chunk > 1:
+        # Each chunk contains several frames, so expand to the individual frames
+        offsets = (offsets[:, numpy.newaxis] + numpy.arange(frames_per_chunk)).ravel()
+        sizes = numpy.repeat(sizes, frames_per_chunk)
+        in_range = offsets < dataset.shape[0]
+        offsets, sizes = offsets[in_range], sizes[in_range]
+
+    order = numpy.argsort(offsets, kind="stable")
+    return offsets[order], sizes[order]
+
+
+def get_written_frames(dataset):
+    """
+    Return a sorted numpy array of the indices of all frames of a chunked
+    dataset that have been written, reading all chunk records in one pass.
+    """
+    return get_chunk_sizes(dataset)[0]
+
+
 def get_real_frames(master, dataset):
     root = os.path.split(master.filename)[0]
     logger.debug(f"{root}, {master.filename}")
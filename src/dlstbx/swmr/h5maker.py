@@ -21,6 +21,9 @@ def main(
     delay=None,
     per_image_delay=None,
     shuffle=True,
+    compression="gzip",
+    frame_rate=None,
+    on_write=None,
 ):
     def image():
         return (numpy.random.rand(*shape) * 100).astype(numpy.int16)
@@ -38,10 +41,20 @@ def main(
 
     with h5py.File(f"{prefix}_master.h5", "w", libver="latest") as f:
         f.create_virtual_dataset("/entry/data/data", vds, fillvalue=-1)
+        f["entry"].attrs["NX_class"] = numpy.bytes_("NXentry")
+        f["entry/data"].attrs["NX_class"] = numpy.bytes_("NXdata")
+        f["entry/data"].attrs["signal"] = numpy.bytes_("data")
 
     if delay:
         time.sleep(delay)
 
+    if compression == "bitshuffle":
+        import hdf5plugin
+
+        compression_options = dict(hdf5plugin.Bitshuffle())
+    else:
+        compression_options = {"compression": compression}
+
     # now open nblocks h5 files in SWMR mode
     data_files = []
 
@@ -52,8 +65,8 @@ def main(
             "data",
             shape=(block_size,) + shape,
             chunks=(1,) + shape,
-            compression="gzip",
             dtype="i4",
+            **compression_options,
         )
         data_file.swmr_mode = True
         data_files.append(data_file)
@@ -63,13 +76,23 @@ def main(
     if shuffle:
         random.shuffle(to_do)
 
+    # optionally keep to a fixed frame rate, irrespective of the write time
+    next_frame = time.perf_counter()
     for b, f in to_do:
         if per_image_delay:
             time.sleep(per_image_delay)
+        if frame_rate:
+            next_frame += 1 / frame_rate
+            time.sleep(max(0, next_frame - time.perf_counter()))
         data_files[b]["data"][f] = image()
         data_files[b].flush()
+        if on_write:
+            on_write(b * block_size + f)
         logger.info(f"data_{b:06d}.h5 {f} {b * block_size + f} {time.time()}")
 
+    for data_file in data_files:
+        data_file.close()
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate a fake HDF5 SWMR file.")
@@ -105,12 +128,23 @@ if __name__ == "__main__":
         type=float,
         help="time delay (in seconds) between writing each image",
     )
+    parser.add_argument(
+        "--frame_rate",
+        type=float,
+        help="number of images to write per second",
+    )
     parser.add_argument(
         "--shuffle",
         dest="shuffle",
         action="store_true",
         help="shuffle output order of images",
     )
+    parser.add_argument(
+        "--compression",
+        choices=("gzip", "lzf", "bitshuffle"),
+        default="gzip",
+        help="compression of the image data (default: %(default)s)",
+    )
     args = parser.parse_args()
     logging.basicConfig(level=logging.INFO, format="%(message)s")
     main(
@@ -120,5 +154,7 @@ if __name__ == "__main__":
         nblocks=args.nblocks,
         delay=args.delay,
         per_image_delay=args.per_image_delay,
+        frame_rate=args.frame_rate,
         shuffle=args.shuffle,
+        compression=args.compression,
     )
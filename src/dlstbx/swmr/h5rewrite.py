@@ -1,7 +1,13 @@
 from __future__ import annotations
 
+import bisect
+import concurrent.futures
+import contextlib
+import itertools
 import logging
 import math
+import multiprocessing
+import os
 import pathlib
 import time
 from typing import Optional, Tuple, Union
@@ -97,12 +103,186 @@ class Visitor:
                         group[child.name] = h5py.SoftLink(ref_name)
 
 
+def _filter_pipeline(dataset: h5py.Dataset) -> tuple:
+    """Describe the filters applied to the chunks of a dataset.
+
+    Two datasets with the same pipeline can exchange compressed chunks without
+    decoding them. The bitshuffle filter stores the HDF5 library and element
+    size in its first options, and the block size in the chunk header, so only
+    the compression type is compared for it.
+    """
+    plist = dataset.id.get_create_plist()
+    pipeline = []
+    for i in range(plist.get_nfilters()):
+        code, _, values, _ = plist.get_filter(i)
+        if code == hdf5plugin.BSHUF_ID:
+            values = values[4:]
+        elif code == h5py.h5z.FILTER_DEFLATE:
+            # Compression level does not affect decompression
+            values = ()
+        pipeline.append((code, tuple(values)))
+    return tuple(pipeline)
+
+
+class FrameReader:
+    """Read frames from the signal dataset of a NeXus file.
+
+    Frames can be read as arrays, or as the raw compressed chunks if they are
+    stored one frame per chunk in a dataset, or in a virtual source of a
+    virtual dataset, that uses the requested filter pipeline.
+    """
+
+    def __init__(self, data: h5py.Dataset):
+        self.data = data
+        self.frame_shape = data.shape[1:]
+        self._files: dict[str, h5py.File] = {}
+        self._pipelines: dict[str, tuple] = {}
+        # (first frame, last frame, source dataset, first frame in source)
+        self._sources: list[tuple[int, int, h5py.Dataset, int]] = []
+        if data.is_virtual:
+            for source in data.virtual_sources():
+                self._add_virtual_source(source)
+            self._sources.sort(key=lambda source: source[0])
+        else:
+            self._sources.append((0, data.shape[0] - 1, data, 0))
+        self._first_frames = [source[0] for source in self._sources]
+
+    def _add_virtual_source(self, source) -> None:
+        v_lo, v_hi = source.vspace.get_select_bounds()
+        s_lo, s_hi = source.src_space.get_select_bounds()
+        n_frames = v_hi[0] - v_lo[0] + 1
+        frame_pixels = int(np.prod(self.frame_shape))
+        if (
+            s_hi[0] - s_lo[0] + 1 != n_frames
+            or source.src_space.get_select_npoints() != n_frames * frame_pixels
+            or source.vspace.get_select_npoints() != n_frames * frame_pixels
+        ):
+            # Not a contiguous block of whole frames
+            return
+        if source.file_name == ".":
+            filename = self.data.file.filename
+        else:
+            filename = os.path.join(
+                os.path.dirname(self.data.file.filename), source.file_name
+            )
+        try:
+            if filename not in self._files:
+                self._files[filename] = h5py.File(filename, "r", swmr=True)
+            dataset = self._files[filename][source.dset_name]
+        except (OSError, KeyError):
+            logger.debug(f"Unable to open virtual source {filename}:{source.dset_name}")
+            return
+        self._sources.append((v_lo[0], v_hi[0], dataset, s_lo[0]))
+
+    def close(self) -> None:
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+        self._sources.clear()
+        self._first_frames.clear()
+
+    def __enter__(self) -> FrameReader:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        return self.data[i]
+
+    def chunk(self, i: int, pipeline: tuple) -> Optional[Tuple[int, bytes]]:
+        """Return the filter mask and compressed chunk for frame i, if it is
+        stored with the given filter pipeline, or None otherwise."""
+        k = bisect.bisect_right(self._first_frames, i) - 1
+        if k < 0 or i > self._sources[k][1]:
+            return None
+        first, _, dataset, offset = self._sources[k]
+        if (
+            dataset.chunks != (1,) + self.frame_shape
+            or dataset.dtype != self.data.dtype
+        ):
+            return None
+        if dataset.name not in self._pipelines:
+            self._pipelines[dataset.name] = _filter_pipeline(dataset)
+        if self._pipelines[dataset.name] != pipeline:
+            return None
+        try:
+            return dataset.id.read_direct_chunk(
+                (i - first + offset,) + (0,) * len(self.frame_shape)
+            )
+        except RuntimeError:
+            # Frame has not been written
+            return None
+
+
+def _create_block_file(
+    filename: pathlib.Path, n_images: int, data: h5py.Dataset
+) -> h5py.File:
+    assert not filename.exists(), f"Refusing to overwrite existing file {filename}"
+    data_file = h5py.File(filename, "w", libver="latest")
+    data_file.create_dataset(
+        "data",
+        shape=(n_images,) + data.shape[1:],
+        chunks=(1,) + data.shape[1:],
+        dtype=data.dtype,
+        **hdf5plugin.Bitshuffle(),
+    )
+    return data_file
+
+
+def _copy_frame(
+    frames: FrameReader,
+    dest: h5py.Dataset,
+    pipeline: Optional[tuple],
+    i: int,
+    j: int,
+    zeros: bool,
+) -> bool:
+    """Copy frame i of the source to frame j of dest. Returns True if the
+    compressed chunk could be copied directly."""
+    if zeros:
+        dest[j] = np.zeros(dest.shape[1:], dtype=dest.dtype)
+        return False
+    if pipeline is not None and (chunk := frames.chunk(i, pipeline)):
+        filter_mask, raw = chunk
+        dest.id.write_direct_chunk((j,) + (0,) * (dest.ndim - 1), raw, filter_mask)
+        return True
+    dest[j] = frames[i]
+    return False
+
+
+def _write_block(
+    master_h5: pathlib.Path,
+    filename: pathlib.Path,
+    start: int,
+    n_images: int,
+    block_size: int,
+    zeros: bool,
+    direct_chunks: bool,
+) -> int:
+    """Write one VDS block file in a worker process. Returns the number of
+    frames that were copied as compressed chunks."""
+    with h5py.File(master_h5, "r") as fs:
+        entry_data = fs["entry/data"]
+        data = entry_data[entry_data.attrs.get("signal", "data")]
+        with FrameReader(data) as frames:
+            with _create_block_file(filename, block_size, data) as data_file:
+                dest = data_file["data"]
+                pipeline = _filter_pipeline(dest) if direct_chunks else None
+                return sum(
+                    _copy_frame(frames, dest, pipeline, start + j, j, zeros)
+                    for j in range(n_images)
+                )
+
+
 def rewrite(
     master_h5: pathlib.Path,
     out_h5: pathlib.Path,
     zeros: bool = False,
     image_range: Optional[Tuple[int, int]] = None,
     delay: Optional[float] = None,
+    direct_chunks: bool = True,
+    processes: int = 1,
 ) -> None:
     """Re-write an HDF5 file as a VDS/SWMR file.
 
@@ -112,6 +292,11 @@ def rewrite(
         zeros (bool): Output zeros in place of the original data (default=False)
         image_range (tuple): Zero-indexed image range selection
         delay (float): Time delay (in seconds) between writing each image
+        direct_chunks (bool): Copy frames that are already bitshuffle/LZ4
+            compressed without decompressing them (default=True)
+        processes (int): Number of worker processes writing VDS block files
+            in parallel. Ignored if a delay is set, as images are then written
+            in sequence (default=1)
     """
 
     if image_range:
@@ -120,8 +305,6 @@ def rewrite(
         assert start < end
 
     with h5py.File(master_h5, "r") as fs:
-        data_files = []
-
         entry_data = fs["entry/data"]
         data = entry_data[entry_data.attrs.get("signal", "data")]
         axes = entry_data.attrs.get("axes")
@@ -174,32 +357,59 @@ def rewrite(
                         axes, data=entry_data[axes][start:end]
                     )
 
-        for i in range(vds_nblocks):
-            filename = dest_path.parent.joinpath(f"{dest_path.stem}_{i:06d}.h5")
-            assert not filename.exists(), (
-                f"Refusing to overwrite existing file {filename}"
-            )
-            data_file = h5py.File(filename, "w", libver="latest")
-            data_file.create_dataset(
-                "data",
-                shape=(vds_block_size,) + data.shape[1:],
-                chunks=(1,) + data.shape[1:],
-                dtype=data.dtype,
-                **bitshuffle_compression,
+        blocks = [
+            (
+                dest_path.parent.joinpath(f"{dest_path.stem}_{i:06d}.h5"),
+                start + i * vds_block_size,
+                min(n_images - (i * vds_block_size), vds_block_size),
             )
-            data_file.swmr_mode = True
-            data_files.append(data_file)
-        for i in range(start, end):
-            if delay:
-                time.sleep(delay)
-            i_block, j = divmod(i - start, vds_block_size)
-            if zeros:
-                data_files[i_block]["data"][j] = np.zeros(
-                    data.shape[1:], dtype=data.dtype
+            for i in range(vds_nblocks)
+        ]
+        copy_start = time.perf_counter()
+        if processes > 1 and not delay:
+            # Spawn rather than fork workers, as HDF5 handles are open in this process
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=processes, mp_context=multiprocessing.get_context("spawn")
+            ) as pool:
+                direct = sum(
+                    pool.map(
+                        _write_block,
+                        itertools.repeat(master_h5),
+                        *zip(*blocks),
+                        itertools.repeat(vds_block_size),
+                        itertools.repeat(zeros),
+                        itertools.repeat(direct_chunks),
+                    )
                 )
-            else:
-                data_files[i_block]["data"][j] = data[i]
-            data_files[i_block].flush()
-            logger.debug(f"{data_files[i_block].filename} {j} {i}")
-
+        else:
+            direct = 0
+            with contextlib.ExitStack() as stack:
+                frames = stack.enter_context(FrameReader(data))
+                data_files = []
+                for filename, _, _ in blocks:
+                    data_file = stack.enter_context(
+                        _create_block_file(filename, vds_block_size, data)
+                    )
+                    data_file.swmr_mode = True
+                    data_files.append(data_file)
+                pipeline = (
+                    _filter_pipeline(data_files[0]["data"])
+                    if direct_chunks and data_files
+                    else None
+                )
+                for i in range(start, end):
+                    i_block, j = divmod(i - start, vds_block_size)
+                    if delay:
+                        time.sleep(delay)
+                    direct += _copy_frame(
+                        frames, data_files[i_block]["data"], pipeline, i, j, zeros
+                    )
+                    if delay:
+                        # Make each image visible to SWMR readers as it arrives
+                        data_files[i_block].flush()
+                    logger.debug(f"{data_files[i_block].filename} {j} {i}")
+        logger.info(
+            f"Wrote {n_images} images in {time.perf_counter() - copy_start:.1f}s, "
+            f"{direct} copied as compressed chunks"
+        )
         return
@@ -8,6 +8,8 @@ from dataclasses import dataclass, field
 
 import h5py
 
+from dlstbx.swmr import h5check
+
 
 @dataclass
 class h5_data_file:
@@ -52,17 +54,15 @@ def watcher(h5_data_files):
             else:
                 h5.dset.id.refresh()
 
-            h5.finished = True
-
-            for j in range(h5.frames):
-                if h5.chunk_sizes[j]:
+            # Read all chunk records in one pass and report the new ones
+            frames, sizes = h5check.get_chunk_sizes(h5.dset)
+            for j, size in zip(frames.tolist(), sizes.tolist()):
+                if j >= h5.frames or h5.chunk_sizes[j]:
                     continue
-                s = h5.dset.id.get_chunk_info_by_coord((j, 0, 0))
-                if s.size == 0:
-                    h5.finished = False
-                else:
-                    h5.chunk_sizes[j] = s.size
-                    print(h5.filename, j, h5.offset + j, s.size, time.time())
+                h5.chunk_sizes[j] = size
+                print(h5.filename, j, h5.offset + j, size, time.time())
+
+            h5.finished = all(h5.chunk_sizes)
 
             if h5.finished:
                 h5.dset = None
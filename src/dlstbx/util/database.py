@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import logging
+import time
+from typing import Any, Mapping, Optional
+
+import ispyb.sqlalchemy
+import prometheus_client
+import sqlalchemy
+import sqlalchemy.orm
+import sqlalchemy.pool
+
+from dlstbx.util.prometheus_metrics import BasePrometheusMetrics, NoMetrics
+
+logger = logging.getLogger(__name__)
+
+POOL_CHECKOUT_METRIC = "zocalo_ispyb_pool_checkout_seconds"
+POOL_OVERFLOW_METRIC = "zocalo_ispyb_pool_overflow"
+
+
+def _as_bool(value: Any) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() not in {"", "0", "false", "no", "off"}
+    return bool(value)
+
+
+# Service environment options understood by engine_options_from_environment()
+_ENVIRONMENT_OPTIONS = {
+    "db-pool-size": ("pool_size", int),
+    "db-max-overflow": ("max_overflow", int),
+    "db-pool-timeout": ("pool_timeout", float),
+    "db-pool-recycle": ("pool_recycle", int),
+    "db-pool-pre-ping": ("pool_pre_ping", _as_bool),
+    "db-c-extension": ("c_extension", _as_bool),
+}
+
+
+def create_pool_metrics(metrics: BasePrometheusMetrics) -> None:
+    """
+    Add the connection pool metrics to a service metrics object. Call this
+    from the create_metrics() method of the service's PrometheusMetrics class.
+    """
+    setattr(
+        metrics,
+        POOL_CHECKOUT_METRIC,
+        prometheus_client.Histogram(
+            name=POOL_CHECKOUT_METRIC,
+            documentation="Time taken to check out an ISPyB database connection from the pool",
+            labelnames=["service"],
+            buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+        ),
+    )
+    setattr(
+        metrics,
+        POOL_OVERFLOW_METRIC,
+        prometheus_client.Gauge(
+            name=POOL_OVERFLOW_METRIC,
+            documentation="Number of ISPyB database connections open beyond the pool size",
+            labelnames=["service"],
+        ),
+    )
+
+
+class InstrumentedQueuePool(sqlalchemy.pool.QueuePool):
+    """A QueuePool that records checkout latency and overflow use."""
+
+    metrics: BasePrometheusMetrics = NoMetrics()
+    service: str = ""
+
+    def connect(self):
+        start = time.perf_counter()
+        connection = super().connect()
+        self.metrics.record_metric(
+            POOL_CHECKOUT_METRIC, [self.service], time.perf_counter() - start
+        )
+        self.metrics.record_metric(
+            POOL_OVERFLOW_METRIC, [self.service], max(self.overflow(), 0)
+        )
+        return connection
+
+    def recreate(self) -> InstrumentedQueuePool:
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        pool.service = self.service
+        return pool
+
+
+def create_engine(
+    url: Optional[str] = None,
+    *,
+    service: str = "",
+    metrics: Optional[BasePrometheusMetrics] = None,
+    pool_size: int = 5,
+    max_overflow: int = 10,
+    pool_timeout: float = 30,
+    pool_recycle: int = 3600,
+    pool_pre_ping: bool = True,
+    c_extension: bool = False,
+) -> sqlalchemy.engine.Engine:
+    """
+    Create a SQLAlchemy engine for the ISPyB database.
+
+    Connections are recycled after pool_recycle seconds so that they are not
+    dropped by the server while sitting idle in the pool, and are checked
+    before use if pool_pre_ping is set. By default the pure Python MySQL
+    driver is used. Setting c_extension selects the MySQL Connector C
+    extension instead, which decodes rows considerably faster, if it is
+    available. Checkout latency and overflow use are recorded with the given
+    metrics object, labelled with the service name.
+    """
+    use_pure = True
+    if c_extension:
+        try:
+            import mysql.connector
+
+            use_pure = not mysql.connector.HAVE_CEXT
+        except ImportError:
+            pass
+        if use_pure:
+            logger.warning(
+                "MySQL Connector C extension not available, using pure Python driver"
+            )
+    engine = sqlalchemy.create_engine(
+        url or ispyb.sqlalchemy.url(),
+        poolclass=InstrumentedQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=pool_timeout,
+        pool_recycle=pool_recycle,
+        pool_pre_ping=pool_pre_ping,
+        connect_args={"use_pure": use_pure},
+    )
+    engine.pool.metrics = metrics or NoMetrics()
+    engine.pool.service = service
+    return engine
+
+
+def engine_options_from_environment(environment: Mapping) -> dict[str, Any]:
+    """
+    Translate db-* service environment options into create_engine() keyword
+    arguments, eg. db-pool-size, db-max-overflow, db-pool-timeout,
+    db-pool-recycle, db-pool-pre-ping and db-c-extension.
+    """
+    return {
+        argument: convert(environment[option])
+        for option, (argument, convert) in _ENVIRONMENT_OPTIONS.items()
+        if environment.get(option) is not None
+    }
+
+
+def sessionmaker(
+    environment: Optional[Mapping] = None, **kwargs
+) -> sqlalchemy.orm.sessionmaker:
+    """
+    Return a sessionmaker bound to a new ISPyB engine. Engine options are read
+    from the service environment, and can be overridden with keyword arguments.
+    """
+    options = engine_options_from_environment(environment or {})
+    options.update(kwargs)
+    return sqlalchemy.orm.sessionmaker(bind=create_engine(**options))
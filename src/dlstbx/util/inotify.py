@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+# Event masks and flags from <sys/inotify.h>
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+# Filesystems on which inotify reports all changes, not just those made by
+# processes on the local host. On anything else (NFS, GPFS, Lustre, ...) we
+# cannot rely on events and must fall back to polling.
+LOCAL_FILESYSTEMS = frozenset(
+    {"btrfs", "ext2", "ext3", "ext4", "overlay", "tmpfs", "xfs", "zfs"}
+)
+
+
+def filesystem_type(path: str | os.PathLike) -> str | None:
+    """Return the filesystem type of the mount a path resides on, if known."""
+    path = os.path.realpath(path)
+    best_mount, best_type = "", None
+    try:
+        with open("/proc/self/mounts") as fh:
+            for line in fh:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                # Mount points escape whitespace as octal sequences
+                mount = fields[1].encode().decode("unicode_escape")
+                contains_path = path == mount or path.startswith(
+                    mount.rstrip("/") + "/"
+                )
+                if contains_path and len(mount) >= len(best_mount):
+                    best_mount, best_type = mount, fields[2]
+    except OSError:
+        return None
+    return best_type
+
+
+class DirectoryEvents:
+    """
+    Keep track of the files present in a set of watched directories using
+    inotify, so that the existence of a file can be checked without touching
+    the filesystem.
+
+    A single instance is meant to be shared by all active watches in a process.
+    Pending events are consumed whenever a lookup is made, so no background
+    thread is required. Directories that have not been looked at for max_idle
+    seconds stop being watched.
+    """
+
+    def __init__(self, max_idle: float = 3600, max_watches: int = 1000):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._inotify_add_watch = libc.inotify_add_watch
+        self._inotify_add_watch.argtypes = [
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        ]
+        self._inotify_rm_watch = libc.inotify_rm_watch
+        self._inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1 failed: {os.strerror(err)}")
+        self.max_idle = max_idle
+        self.max_watches = max_watches
+        self._directories: dict[str, int] = {}
+        self._wd_to_directory: dict[int, str] = {}
+        self._arrived: dict[str, set[str]] = {}
+        self._last_used: dict[str, float] = {}
+        self._unsupported: set[str] = set()
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+        self._directories.clear()
+        self._wd_to_directory.clear()
+        self._arrived.clear()
+        self._last_used.clear()
+
+    def has_arrived(self, path: str | os.PathLike) -> bool | None:
+        """
+        Check whether a file is present in a watched directory.
+
+        Returns None if the directory can not be watched, in which case the
+        caller should fall back to checking the filesystem directly.
+        """
+        directory, filename = os.path.split(os.path.abspath(path))
+        if directory not in self._directories and not self._watch(directory):
+            return None
+        self._last_used[directory] = time.monotonic()
+        self.process_events()
+        arrived = self._arrived.get(directory)
+        if arrived is None:
+            # Watch was dropped while processing events
+            return None
+        return filename in arrived
+
+    def is_watched(self, path: str | os.PathLike) -> bool:
+        """Whether changes to the directory containing a file are being watched."""
+        return os.path.dirname(os.path.abspath(path)) in self._directories
+
+    def process_events(self) -> None:
+        """Consume all pending events without blocking."""
+        while True:
+            try:
+                buffer = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
+            if not buffer:
+                break
+            self._parse(buffer)
+        self._expire()
+
+    def _parse(self, buffer: bytes) -> None:
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(buffer, offset)
+            offset += _EVENT_HEADER.size
+            name = buffer[offset : offset + length].rstrip(b"\0")
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                logger.warning("inotify event queue overflowed, rescanning")
+                for directory in list(self._directories):
+                    self._rescan(directory)
+                continue
+
+            directory = self._wd_to_directory.get(wd)
+            if directory is None:
+                continue
+            if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                self._unwatch(directory)
+                continue
+            if mask & IN_ISDIR or not name:
+                continue
+            filename = os.fsdecode(name)
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self._arrived[directory].add(filename)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self._arrived[directory].discard(filename)
+
+    def _watch(self, directory: str) -> bool:
+        if directory in self._unsupported:
+            return False
+        if filesystem_type(directory) not in LOCAL_FILESYSTEMS:
+            logger.debug(f"Not using inotify for {directory}: unsupported filesystem")
+            self._unsupported.add(directory)
+            return False
+        if len(self._directories) >= self.max_watches:
+            return False
+        wd = self._inotify_add_watch(
+            self._fd,
+            os.fsencode(directory),
+            IN_CREATE
+            | IN_MOVED_TO
+            | IN_DELETE
+            | IN_MOVED_FROM
+            | IN_DELETE_SELF
+            | IN_MOVE_SELF
+            | IN_ONLYDIR,
+        )
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err not in (errno.ENOENT, errno.ENOTDIR):
+                # Directories that do not exist yet may be watched later, but
+                # any other failure (eg. permissions) is not transient
+                logger.debug(f"Could not watch {directory}: {os.strerror(err)}")
+                self._unsupported.add(directory)
+            return False
+        self._directories[directory] = wd
+        self._wd_to_directory[wd] = directory
+        self._last_used[directory] = time.monotonic()
+        # Files that arrived before the watch was set up produce no events
+        self._rescan(directory)
+        return True
+
+    def _rescan(self, directory: str) -> None:
+        try:
+            with os.scandir(directory) as it:
+                self._arrived[directory] = {
+                    entry.name for entry in it if not entry.is_dir()
+                }
+        except OSError:
+            self._unwatch(directory)
+
+    def _unwatch(self, directory: str) -> None:
+        wd = self._directories.pop(directory, None)
+        if wd is not None:
+            self._wd_to_directory.pop(wd, None)
+            self._inotify_rm_watch(self._fd, wd)
+        self._arrived.pop(directory, None)
+        self._last_used.pop(directory, None)
+
+    def _expire(self) -> None:
+        cutoff = time.monotonic() - self.max_idle
+        for directory, last_used in list(self._last_used.items()):
+            if last_used < cutoff:
+                self._unwatch(directory)
+
+    @property
+    def watched_directories(self) -> int:
+        return len(self._directories)
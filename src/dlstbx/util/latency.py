@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import collections
+import threading
+from typing import Iterable
+
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+
+
+def summarise(samples: Iterable[float], percentiles=PERCENTILES) -> dict[str, float]:
+    """
+    Summarise a series of latencies (in seconds) with their count, mean,
+    maximum and the given percentiles, eg. {"count": 3, "mean": 0.2,
+    "p50": 0.2, ..., "max": 0.3}.
+    """
+    values = np.fromiter(samples, dtype=float)
+    if not values.size:
+        return {"count": 0}
+    summary = {"count": int(values.size), "mean": float(values.mean())}
+    for percentile, value in zip(percentiles, np.percentile(values, percentiles)):
+        summary[f"p{percentile}"] = float(value)
+    summary["max"] = float(values.max())
+    return summary
+
+
+class LatencyRecorder:
+    """
+    Collect latency samples for a number of named stages, eg. of a
+    processing pipeline, from any thread.
+    """
+
+    def __init__(self, percentiles=PERCENTILES):
+        self.percentiles = tuple(percentiles)
+        self._samples: dict[str, list[float]] = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._samples[stage].append(seconds)
+
+    def samples(self, stage: str) -> list[float]:
+        with self._lock:
+            return list(self._samples.get(stage, ()))
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """Summarise the latencies recorded for each stage."""
+        with self._lock:
+            return {
+                stage: summarise(samples, self.percentiles)
+                for stage, samples in self._samples.items()
+            }
+
+    def format(self) -> str:
+        """Tabulate the latency summaries, in milliseconds."""
+        return format_table(self.summary())
+
+
+def format_table(summaries: dict[str, dict[str, float]]) -> str:
+    """Tabulate latency summaries of a number of stages, in milliseconds."""
+    columns: list[str] = []
+    for summary in summaries.values():
+        columns.extend(c for c in summary if c != "count" and c not in columns)
+    lines = [f"{'stage':24s} {'count':>7s} " + " ".join(f"{c:>9s}" for c in columns)]
+    for stage, summary in summaries.items():
+        lines.append(
+            f"{stage:24s} {summary['count']:7d} "
+            + " ".join(
+                f"{summary[c] * 1000:7.1f}ms" if c in summary else f"{'-':>9s}"
+                for c in columns
+            )
+        )
+    return "\n".join(lines)
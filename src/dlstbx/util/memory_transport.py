@@ -0,0 +1,512 @@
+from __future__ import annotations
+
+import collections
+import contextlib
+import dataclasses
+import heapq
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+import uuid
+from typing import Any, Callable, Optional
+
+import workflows.util
+from workflows.services.common_service import Commands, CommonService
+from workflows.transport.common_transport import CommonTransport, json_serializer
+
+logger = logging.getLogger(__name__)
+
+# A listener is called with the destination, header and decoded message
+Listener = Callable[[str, dict, Any], None]
+
+
+@dataclasses.dataclass(eq=False)
+class _Subscription:
+    transport: MemoryTransport
+    sub_id: int
+    channel: str
+    callback: Callable
+    acknowledgement: bool = False
+    # Maximum number of unacknowledged messages, or 0 for no limit
+    prefetch_count: int = 0
+    unacked: int = 0
+
+    @property
+    def available(self) -> bool:
+        return not self.prefetch_count or self.unacked < self.prefetch_count
+
+
+class MemoryBroker:
+    """
+    A message broker living in the current process.
+
+    Messages sent to a queue are delivered to one subscriber of the queue in
+    turn, and messages sent to a topic to all of its subscribers. Delayed
+    messages are held back until they are due. A subscription with
+    acknowledgement receives at most prefetch_count unacknowledged messages at
+    a time, and rejected messages are delivered again. Messages wait on their
+    queue until a subscriber is available.
+
+    Several MemoryTransport objects connect to the same broker, typically one
+    per service, so that services can be run against each other without an
+    external message broker. Listeners see every message delivered to a
+    destination, eg. to measure latencies.
+
+    Example usage:
+
+    broker = MemoryBroker()
+    transport = MemoryTransport(broker)
+    transport.connect()
+    transport.subscribe("queue", callback)
+    transport.send("queue", {"message": "content"})
+    broker.wait_until_idle(timeout=10)
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        # Heap of (due time, sequence number, destination, broadcast, headers, message)
+        self._scheduled: list[tuple] = []
+        self._sequence = itertools.count(1)
+        self._queues: dict[str, list[_Subscription]] = collections.defaultdict(list)
+        self._topics: dict[str, list[_Subscription]] = collections.defaultdict(list)
+        self._waiting: dict[str, collections.deque] = collections.defaultdict(
+            collections.deque
+        )
+        self._unacked: dict[str, tuple[_Subscription, str, dict, Any]] = {}
+        self._listeners: dict[str, list[Listener]] = collections.defaultdict(list)
+        # Number of messages handed to transports but not yet processed
+        self._in_progress = 0
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        self.statistics: collections.Counter[str] = collections.Counter()
+
+    def start(self) -> None:
+        """Start delivering messages in a background thread."""
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(
+                target=self._run, name="MemoryBroker", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop delivering messages."""
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        with self._condition:
+            while self._running:
+                now = time.time()
+                while self._scheduled and self._scheduled[0][0] <= now:
+                    _, _, destination, broadcast, headers, message = heapq.heappop(
+                        self._scheduled
+                    )
+                    if broadcast:
+                        self._broadcast(destination, headers, message)
+                    else:
+                        self._waiting[destination].append((headers, message))
+                        self._dispatch(destination)
+                self._condition.notify_all()
+                self._condition.wait(
+                    self._scheduled[0][0] - now if self._scheduled else None
+                )
+
+    def publish(
+        self,
+        destination: str,
+        message: Any,
+        headers: Optional[dict] = None,
+        delay: Optional[float] = None,
+        broadcast: bool = False,
+    ) -> None:
+        """Send a message to a queue, or to a topic if broadcast is set."""
+        with self._condition:
+            heapq.heappush(
+                self._scheduled,
+                (
+                    time.time() + (delay or 0),
+                    next(self._sequence),
+                    destination,
+                    broadcast,
+                    dict(headers or {}),
+                    message,
+                ),
+            )
+            self.statistics["sent"] += 1
+            self._condition.notify_all()
+
+    def _broadcast(self, destination: str, headers: dict, message: Any) -> None:
+        subscriptions = self._topics.get(destination)
+        if not subscriptions:
+            self.statistics["dropped"] += 1
+        for subscription in subscriptions or ():
+            self._deliver(subscription, destination, headers, message)
+
+    def _dispatch(self, destination: str) -> None:
+        """Deliver waiting messages on a queue to available subscribers."""
+        waiting = self._waiting[destination]
+        subscriptions = self._queues.get(destination)
+        while waiting and subscriptions:
+            for subscription in subscriptions:
+                if subscription.available:
+                    break
+            else:
+                return
+            # Round robin between subscribers
+            subscriptions.remove(subscription)
+            subscriptions.append(subscription)
+            headers, message = waiting.popleft()
+            self._deliver(subscription, destination, headers, message)
+
+    def _deliver(
+        self, subscription: _Subscription, destination: str, headers: dict, message
+    ) -> None:
+        message_id = f"memory-{next(self._sequence)}"
+        header = {
+            **headers,
+            "message-id": message_id,
+            "subscription": subscription.sub_id,
+            "destination": destination,
+        }
+        if subscription.acknowledgement:
+            subscription.unacked += 1
+            self._unacked[message_id] = (subscription, destination, headers, message)
+        self._in_progress += 1
+        self.statistics["delivered"] += 1
+        subscription.transport._inbox.put((subscription, header, message))
+
+    def _processed(self) -> None:
+        with self._condition:
+            self._in_progress -= 1
+            self._condition.notify_all()
+
+    def acknowledge(self, message_id: str, requeue: bool = False) -> None:
+        """Acknowledge a message, or reject it to have it delivered again."""
+        with self._condition:
+            record = self._unacked.pop(message_id, None)
+            if not record:
+                logger.warning(f"Unknown message {message_id} acknowledged")
+                return
+            subscription, destination, headers, message = record
+            subscription.unacked -= 1
+            if requeue:
+                self.statistics["redelivered"] += 1
+                self._waiting[destination].appendleft((headers, message))
+            self._dispatch(destination)
+
+    def subscribe(self, subscription: _Subscription, broadcast: bool = False) -> None:
+        with self._condition:
+            if broadcast:
+                self._topics[subscription.channel].append(subscription)
+            else:
+                self._queues[subscription.channel].append(subscription)
+                self._dispatch(subscription.channel)
+
+    def unsubscribe(self, subscription: _Subscription) -> None:
+        """Remove a subscription, returning its unacknowledged messages to the
+        queue."""
+        with self._condition:
+            for subscriptions in (
+                self._queues.get(subscription.channel, []),
+                self._topics.get(subscription.channel, []),
+            ):
+                if subscription in subscriptions:
+                    subscriptions.remove(subscription)
+            for message_id, record in list(self._unacked.items()):
+                if record[0] is subscription:
+                    self._unacked.pop(message_id)
+                    self._waiting[record[1]].appendleft(record[2:])
+            self._dispatch(subscription.channel)
+
+    def add_listener(self, destination: str, listener: Listener) -> None:
+        """Call listener(destination, header, message) for every message
+        delivered to a queue or topic, before it is processed."""
+        with self._condition:
+            self._listeners[destination].append(listener)
+
+    def _notify_listeners(self, destination: str, header: dict, message) -> None:
+        listeners = self._listeners.get(destination)
+        if listeners:
+            decoded = MemoryTransport._mangle_for_receiving(message)
+            for listener in listeners:
+                listener(destination, header, decoded)
+
+    def wait_until_idle(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until there are no scheduled messages and no messages being
+        processed. Messages waiting on queues without an available subscriber
+        are ignored, and messages passed on to the main loop of a service
+        count as processed. Returns False if the timeout expired first.
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._scheduled and not self._in_progress, timeout
+            )
+
+
+class MemoryTransport(CommonTransport):
+    """
+    A workflows transport connected to a MemoryBroker.
+
+    Received messages are processed in order in a worker thread of the
+    transport, or are passed on to the main loop of the service using the
+    transport if it intercepts transport callbacks. Messages are serialised
+    to JSON, like they are by the message broker transports.
+    """
+
+    # Add for compatibility
+    defaults: dict[Any, Any] = {}
+    # Effective configuration
+    config: dict[Any, Any] = {}
+
+    def __init__(self, broker: MemoryBroker, middleware=None):
+        super().__init__(middleware=middleware)
+        # CommonTransport keeps its records of subscriptions and transactions
+        # in class attributes, which would otherwise be shared by all
+        # transports in this process
+        self._CommonTransport__subscriptions = {}
+        self._CommonTransport__transactions = set()
+        self.broker = broker
+        self._connected = False
+        self._inbox: queue.Queue = queue.Queue()
+        self._subscriptions: dict[int, _Subscription] = {}
+        self._transactions: dict[int, list[Callable[[], None]]] = {}
+        self._worker: Optional[threading.Thread] = None
+        self._interceptor: Optional[Callable] = None
+
+    def subscription_callback_set_intercept(self, interceptor):
+        super().subscription_callback_set_intercept(interceptor)
+        self._interceptor = interceptor
+
+    def connect(self) -> bool:
+        if not self._connected:
+            self._connected = True
+            self.broker.start()
+            self._worker = threading.Thread(
+                target=self._process_messages, name="MemoryTransport", daemon=True
+            )
+            self._worker.start()
+        return True
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+    def disconnect(self) -> None:
+        if not self._connected:
+            return
+        self._connected = False
+        for subscription in self._subscriptions.values():
+            self.broker.unsubscribe(subscription)
+        self._subscriptions.clear()
+        self._inbox.put(None)
+        if self._worker is not threading.current_thread():
+            self._worker.join()
+
+    def _process_messages(self) -> None:
+        while True:
+            item = self._inbox.get()
+            if item is None:
+                break
+            subscription, header, message = item
+            try:
+                if subscription.sub_id in self._subscriptions:
+                    self.broker._notify_listeners(
+                        header["destination"], header, message
+                    )
+                    if self._interceptor:
+                        self._interceptor(subscription.callback)(header, message)
+                    else:
+                        subscription.callback(header, message)
+            except Exception:
+                logger.exception(
+                    f"Error processing message {header['message-id']} "
+                    f"from {header['destination']}"
+                )
+            finally:
+                self.broker._processed()
+        # Return any messages that were not processed before disconnecting
+        while not self._inbox.empty():
+            if self._inbox.get() is not None:
+                self.broker._processed()
+
+    def broadcast_status(self, status):
+        pass
+
+    def _subscribe(self, sub_id, channel, callback, **kwargs):
+        subscription = _Subscription(
+            transport=self,
+            sub_id=sub_id,
+            channel=channel,
+            callback=callback,
+            acknowledgement=bool(kwargs.get("acknowledgement")),
+            prefetch_count=int(kwargs.get("prefetch_count") or 0),
+        )
+        self._subscriptions[sub_id] = subscription
+        self.broker.subscribe(subscription, broadcast=kwargs.get("broadcast", False))
+
+    def _subscribe_temporary(self, sub_id, channel_hint, callback, **kwargs):
+        channel = channel_hint or workflows.util.generate_unique_host_id()
+        channel = channel + "." + str(uuid.uuid4())
+        if not channel.startswith("transient."):
+            channel = "transient." + channel
+        self._subscribe(sub_id, channel, callback, **kwargs)
+        return channel
+
+    def _subscribe_broadcast(self, sub_id, channel, callback, **kwargs):
+        self._subscribe(sub_id, channel, callback, broadcast=True, **kwargs)
+
+    def _unsubscribe(self, subscription, **kwargs):
+        if subscription in self._subscriptions:
+            self.broker.unsubscribe(self._subscriptions.pop(subscription))
+
+    def _in_transaction(self, transaction, operation: Callable[[], None]) -> None:
+        if transaction:
+            self._transactions[transaction].append(operation)
+        else:
+            operation()
+
+    def _send(
+        self,
+        destination,
+        message,
+        headers=None,
+        delay=None,
+        expiration=None,
+        transaction=None,
+        **kwargs,
+    ):
+        self._in_transaction(
+            transaction,
+            lambda: self.broker.publish(destination, message, headers, delay),
+        )
+
+    def _broadcast(
+        self,
+        destination,
+        message,
+        headers=None,
+        delay=None,
+        expiration=None,
+        transaction=None,
+        **kwargs,
+    ):
+        self._in_transaction(
+            transaction,
+            lambda: self.broker.publish(
+                destination, message, headers, delay, broadcast=True
+            ),
+        )
+
+    def _transaction_begin(self, transaction_id, **kwargs):
+        self._transactions[transaction_id] = []
+
+    def _transaction_abort(self, transaction_id, **kwargs):
+        del self._transactions[transaction_id]
+
+    def _transaction_commit(self, transaction_id, **kwargs):
+        for operation in self._transactions.pop(transaction_id):
+            operation()
+
+    def _ack(self, message_id, subscription_id, transaction=None, **kwargs):
+        self._in_transaction(transaction, lambda: self.broker.acknowledge(message_id))
+
+    def _nack(self, message_id, subscription_id, transaction=None, **kwargs):
+        self._in_transaction(
+            transaction, lambda: self.broker.acknowledge(message_id, requeue=True)
+        )
+
+    @staticmethod
+    def _mangle_for_sending(message):
+        return json.dumps(message, default=json_serializer)
+
+    @staticmethod
+    def _mangle_for_receiving(message):
+        if isinstance(message, (str, bytes)):
+            try:
+                return json.loads(message)
+            except ValueError:
+                pass
+        return message
+
+
+class _ServiceControl:
+    """
+    Stands in for the pipes connecting a service to its frontend, to send
+    commands to a service running in a thread and follow its status.
+    """
+
+    def __init__(self):
+        self.status: Optional[int] = None
+        self.ready = threading.Event()
+        self._commands: queue.Queue = queue.Queue()
+        self._next_command = None
+
+    def send(self, message: dict) -> None:
+        "Receive a message from the service"
+        if message.get("band") == "status_update":
+            self.status = message["statuscode"]
+            if self.status in (
+                CommonService.SERVICE_STATUS_IDLE,
+                CommonService.SERVICE_STATUS_END,
+                CommonService.SERVICE_STATUS_ERROR,
+            ):
+                self.ready.set()
+
+    def command(self, payload: str) -> None:
+        "Send a command to the service"
+        self._commands.put({"band": "command", "payload": payload})
+
+    def poll(self, timeout: Optional[float] = None) -> bool:
+        if self._next_command is None:
+            try:
+                self._next_command = self._commands.get(timeout=timeout)
+            except queue.Empty:
+                return False
+        return True
+
+    def recv(self) -> dict:
+        self.poll()
+        command, self._next_command = self._next_command, None
+        return command
+
+
+@contextlib.contextmanager
+def running_service(
+    service_class: type[CommonService],
+    transport: CommonTransport,
+    environment: Optional[dict] = None,
+):
+    """
+    Run a service in a thread of this process, using the given transport,
+    eg. a MemoryTransport. Messages are processed by the main loop of the
+    service, as they would be in a service process. The service is ready
+    once it has been initialised, and is shut down on leaving the context.
+    """
+    service = service_class(environment=environment or {})
+    service.transport = transport
+    # Keep the logging configuration of this process
+    service.initialize_logging = lambda: None
+    control = _ServiceControl()
+    service.connect(frontend=control, commands=control)
+    thread = threading.Thread(
+        target=service.start, name=service.get_name(), daemon=True
+    )
+    thread.start()
+    control.ready.wait()
+    try:
+        if control.status == CommonService.SERVICE_STATUS_ERROR:
+            raise RuntimeError(f"{service.get_name()} failed to start")
+        yield service
+    finally:
+        control.command(Commands.SHUTDOWN)
+        thread.join()
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import time
+import uuid
+from typing import Any, Optional
+
+from dlstbx.util.latency import PERCENTILES, summarise
+
+# Receiver acknowledgement and producer transaction modes
+MODES = ("none", "ack", "transaction")
+
+
+def stamp(run: str, sequence: int, payload: str) -> dict[str, Any]:
+    "Wrap a benchmark payload with its run ID, sequence number and send time"
+    return {"run": run, "sequence": sequence, "sent": time.time(), "payload": payload}
+
+
+def end_of_run(run: str, count: int) -> dict[str, Any]:
+    "The message sent after the last message of a run"
+    return {"run": run, "end": True, "count": count, "sent": time.time()}
+
+
+def new_run_id() -> str:
+    return uuid.uuid4().hex
+
+
+class MessageStatistics:
+    """
+    Track the messages of one benchmark run as they are received, to
+    calculate their latency, throughput, loss and reordering.
+    """
+
+    def __init__(self, run: str):
+        self.run = run
+        self.received = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.bytes = 0
+        self.expected: Optional[int] = None
+        self.first_sent: Optional[float] = None
+        self.last_received: Optional[float] = None
+        self._latencies: list[float] = []
+        self._sequences: set[int] = set()
+        self._highest = -1
+
+    def record(self, message: dict, received_at: Optional[float] = None) -> None:
+        received_at = received_at or time.time()
+        if message.get("end"):
+            self.expected = message["count"]
+            return
+        sequence = message["sequence"]
+        if sequence in self._sequences:
+            self.duplicates += 1
+            return
+        self._sequences.add(sequence)
+        if sequence < self._highest:
+            self.reordered += 1
+        self._highest = max(self._highest, sequence)
+        self.received += 1
+        self.bytes += len(message["payload"])
+        self._latencies.append(received_at - message["sent"])
+        if self.first_sent is None or message["sent"] < self.first_sent:
+            self.first_sent = message["sent"]
+        self.last_received = received_at
+
+    @property
+    def complete(self) -> bool:
+        "Whether the end of the run has been seen"
+        return self.expected is not None
+
+    @property
+    def lost(self) -> int:
+        expected = self.expected if self.complete else self._highest + 1
+        return expected - self.received
+
+    def summary(self, percentiles=PERCENTILES) -> dict[str, Any]:
+        seconds = (
+            self.last_received - self.first_sent
+            if self.received and self.last_received > self.first_sent
+            else 0
+        )
+        return {
+            "received": self.received,
+            "lost": self.lost,
+            "duplicates": self.duplicates,
+            "reordered": self.reordered,
+            "seconds": seconds,
+            "messages_per_second": self.received / seconds if seconds else None,
+            "megabytes_per_second": self.bytes / seconds / 1e6 if seconds else None,
+            "latency": summarise(self._latencies, percentiles),
+        }
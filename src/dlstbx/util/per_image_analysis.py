@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import collections
 import copy
 import enum
 import logging
@@ -12,9 +13,10 @@ from cctbx import uctbx
 from dials.algorithms.spot_finding import per_image_analysis
 from dials.array_family import flex
 from dials.command_line.find_spots import phil_scope as find_spots_phil_scope
-from dials.util import phil
 from dxtbx.model.experiment_list import ExperimentList, ExperimentListFactory
 
+from dlstbx.util.phil_cache import PhilParameterCache
+
 logger = logging.getLogger(__name__)
 
 
@@ -51,29 +53,76 @@ class PerImageAnalysisResults(pydantic.BaseModel):
     noisiness_method_2: Optional[float] = None
 
 
+class ExperimentListCache:
+    """
+    A least-recently-used cache of experiment lists imported from multi-image
+    files, so that analysing further images from the same file does not
+    require reading the file metadata and constructing the models again.
+
+    Entries are keyed on the file path. The layout of a master file does not
+    change once it has been written, so a file is only imported again if the
+    master file itself has changed, or if an image is requested beyond the
+    number of images known from the previous import.
+    """
+
+    def __init__(self, maxsize: int = 8):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache: collections.OrderedDict[
+            pathlib.Path, tuple[tuple[int, int], int, ExperimentList]
+        ] = collections.OrderedDict()
+
+    def get(
+        self, filename: pathlib.Path, image_number: Optional[int] = None
+    ) -> ExperimentList:
+        stat = filename.stat()
+        state = (stat.st_mtime_ns, stat.st_size)
+        if filename in self._cache:
+            cached_state, image_count, experiments = self._cache[filename]
+            if cached_state == state and (
+                image_number is None or image_number <= image_count
+            ):
+                self.hits += 1
+                self._cache.move_to_end(filename)
+                return experiments
+
+        self.misses += 1
+        experiments = ExperimentListFactory.from_filenames(
+            [filename], load_models=False
+        )
+        if self.maxsize > 0:
+            self._cache[filename] = (state, len(experiments[0].imageset), experiments)
+            self._cache.move_to_end(filename)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return experiments
+
+
 def do_per_image_analysis(
-    filename: pathlib.Path, params: PerImageAnalysisParameters
+    filename: pathlib.Path,
+    params: PerImageAnalysisParameters,
+    experiments_cache: Optional[ExperimentListCache] = None,
 ) -> tuple[ExperimentList, flex.reflection_table, PerImageAnalysisResults]:
     if filename.suffix in {".h5", ".nxs"} and params.scan_range:
-        experiments = ExperimentListFactory.from_filenames(
-            [filename], load_models=False
+        if experiments_cache is not None:
+            imported = experiments_cache.get(filename, params.scan_range[1])
+        else:
+            imported = ExperimentListFactory.from_filenames(
+                [filename], load_models=False
+            )
+        start, end = params.scan_range
+        # Only the models of the requested images are loaded, into copies so
+        # that a cached experiment list is never modified itself
+        experiments = ExperimentList(
+            [copy.deepcopy(imported[0]) for _ in range(end - start + 1)]
         )
-        if params.scan_range:
-            start, end = params.scan_range
-        if end > start:
-            for _ in range(end - start):
-                experiments.append(copy.deepcopy(experiments[0]))
         for i, expt in enumerate(experiments):
             expt.load_models(index=start - 1 + i)
     else:
         experiments = ExperimentListFactory.from_filenames([filename])
 
-    phil_params = find_spots_phil_scope.fetch(source=phil.parse("")).extract()
-    phil_params.spotfinder.scan_range = (params.scan_range,)
-    phil_params.spotfinder.threshold.algorithm = params.threshold_algorithm.value
-    phil_params.spotfinder.filter.disable_parallax_correction = (
-        params.disable_parallax_correction
-    )
+    phil_params = _find_spots_phil_params(params)
 
     t0 = time.perf_counter()
     reflections = flex.reflection_table.from_observations(experiments, phil_params)
@@ -99,6 +148,79 @@ def do_per_image_analysis(
     return experiments, reflections, PerImageAnalysisResults(**stats)
 
 
+def do_per_image_analysis_batch(
+    filename: pathlib.Path,
+    params: PerImageAnalysisParameters,
+    experiments_cache: Optional[ExperimentListCache] = None,
+    nproc: int = 1,
+) -> dict[int, PerImageAnalysisResults]:
+    """
+    Analyse a contiguous range of images of a multi-image file with a single
+    spot finding call over params.scan_range, and return the individual
+    results for each image, keyed by image number. The results are the same
+    as those of do_per_image_analysis() on each image.
+    """
+    start, end = params.scan_range
+    if experiments_cache is not None:
+        imported = experiments_cache.get(filename, end)
+    else:
+        imported = ExperimentListFactory.from_filenames([filename], load_models=False)
+    experiments = ExperimentList([copy.deepcopy(imported[0])])
+    experiments[0].load_models(index=start - 1)
+
+    phil_params = _find_spots_phil_params(params)
+    phil_params.spotfinder.mp.nproc = nproc
+    # Spots on consecutive images would otherwise be joined into 3D spots, and
+    # counted only once, whereas each image is analysed on its own otherwise
+    phil_params.spotfinder.force_2d = True
+
+    t0 = time.perf_counter()
+    reflections = flex.reflection_table.from_observations(experiments, phil_params)
+
+    if params.d_min or params.d_max:
+        reflections = _filter_by_resolution(
+            experiments, reflections, d_min=params.d_min, d_max=params.d_max
+        )
+
+    t1 = time.perf_counter()
+    logger.info("Spotfinding on %d images took %.2f seconds", end - start + 1, t1 - t0)
+
+    reflections.centroid_px_to_mm(experiments)
+    reflections.map_centroids_to_reciprocal_space(experiments)
+
+    # Split the reflections by the (1-based) number of the image they are on
+    _, _, z = reflections["xyzobs.px.value"].parts()
+    image_numbers = flex.floor(z).iround() + 1
+    results = {}
+    for image_number in range(start, end + 1):
+        stats = per_image_analysis.stats_for_reflection_table(
+            reflections.select(image_numbers == image_number),
+            filter_ice=params.filter_ice,
+            ice_rings_width=params.ice_rings_width,
+        )._asdict()
+        results[image_number] = PerImageAnalysisResults(**stats)
+    t2 = time.perf_counter()
+    logger.info("Resolution analysis took %.2f seconds", t2 - t1)
+    return results
+
+
+find_spots_phil_cache = PhilParameterCache(find_spots_phil_scope)
+
+
+def _find_spots_phil_params(params: PerImageAnalysisParameters):
+    def customise(phil_params):
+        phil_params.spotfinder.threshold.algorithm = params.threshold_algorithm.value
+        phil_params.spotfinder.filter.disable_parallax_correction = (
+            params.disable_parallax_correction
+        )
+
+    phil_params = find_spots_phil_cache.get(
+        (params.threshold_algorithm, params.disable_parallax_correction), customise
+    )
+    phil_params.spotfinder.scan_range = (params.scan_range,)
+    return phil_params
+
+
 def _filter_by_resolution(experiments, reflections, d_min=None, d_max=None):
     reflections.centroid_px_to_mm(experiments)
     reflections.map_centroids_to_reciprocal_space(experiments)
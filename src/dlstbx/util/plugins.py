@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import functools
+import importlib.metadata
+from collections.abc import Iterator, Mapping
+from typing import Any
+
+
+@functools.lru_cache
+def entry_points(group: str) -> tuple[importlib.metadata.EntryPoint, ...]:
+    """
+    Return the entry points registered for a group. Scanning the installed
+    distributions is slow, so the result is cached for the lifetime of the
+    process.
+    """
+    return tuple(importlib.metadata.entry_points(group=group))
+
+
+class LazyPlugins(Mapping):
+    """
+    A read-only mapping of entry point names to the objects they refer to.
+
+    Entry points are only loaded when first looked up, so that a process does
+    not pay for importing plugins that it never uses. Loaded objects are kept
+    for subsequent lookups.
+
+    Example usage:
+
+    schedulers = LazyPlugins("zocalo.services.cluster.schedulers")
+    if "slurm" in schedulers:
+        schedulers["slurm"](...)
+    """
+
+    def __init__(self, group: str):
+        self.group = group
+        self._entry_points = {e.name: e for e in entry_points(group)}
+        self._loaded: dict[str, Any] = {}
+
+    def __getitem__(self, name: str) -> Any:
+        if name not in self._loaded:
+            self._loaded[name] = self._entry_points[name].load()
+        return self._loaded[name]
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._entry_points
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._entry_points)
+
+    def __len__(self) -> int:
+        return len(self._entry_points)
+
+    def __repr__(self) -> str:
+        return f"<LazyPlugins {self.group}: {', '.join(self._entry_points)}>"
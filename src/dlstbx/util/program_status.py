@@ -0,0 +1,7 @@
+from __future__ import annotations
+
+# Topic on which the ISPyB connector announces the completion of processing
+# programs, so that trigger messages waiting on those programs can be woken up.
+# The topic exchange must have been declared on the broker, and is only used
+# by connectors started with the broadcast-program-status option.
+PROGRAM_STATUS_TOPIC = "transient.program_status"
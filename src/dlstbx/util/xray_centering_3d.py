@@ -124,54 +124,66 @@ def gridscan3d(
         labels = np.ones_like(reconstructed_3d, dtype=int)
         n_regions = 1
 
-    results: list[GridScan3DResult] = []
-    # Loop over each continuous region, apply a relative threshold then find sub-regions
-    for label in range(1, n_regions + 1):
-        labelled_data = (labels == label) * reconstructed_3d
-        # Apply relative threshold to filter out edge effects and to separate out multiple centres in a single region.
-        thresholded = (labelled_data >= threshold * labelled_data.max()) * labelled_data
-        sub_labels, n_sub_regions = scipy.ndimage.label(
-            thresholded, structure=structure
+    # Apply a relative threshold to each region in a single pass over the grid,
+    # to filter out edge effects and to separate out multiple centres in a
+    # single region.
+    region_max = np.zeros(n_regions + 1, dtype=reconstructed_3d.dtype)
+    np.maximum.at(region_max, labels.ravel(), reconstructed_3d.ravel())
+    region_max[0] = 0
+    thresholded = np.where(
+        (labels > 0) & (reconstructed_3d >= threshold * region_max[labels]),
+        reconstructed_3d,
+        0,
+    )
+
+    # Sub-regions can never span multiple regions, as the regions themselves are
+    # not connected, so find all sub-regions at once
+    sub_labels, n_sub_regions = scipy.ndimage.label(thresholded, structure=structure)
+    object_slices = scipy.ndimage.find_objects(sub_labels)
+
+    # Compute the statistics of each sub-region within its bounding box only,
+    # so the cost does not grow with the number of crystals on the pin
+    sub_regions = []
+    for sub_label, (x, y, z) in enumerate(object_slices, start=1):
+        offset = np.array((x.start, y.start, z.start))
+        mask = sub_labels[x, y, z] == sub_label
+        counts = np.where(mask, thresholded[x, y, z], 0)
+        com = tuple(
+            float(c) + 0.5 for c in scipy.ndimage.center_of_mass(counts) + offset
         )
-        logger.debug(f"For label {label}, {n_sub_regions} sub regions found")
-        object_slices = scipy.ndimage.find_objects(sub_labels)
-
-        for sub_label in range(1, n_sub_regions + 1):
-            com = tuple(
-                c + 0.5
-                for c in scipy.ndimage.center_of_mass(
-                    thresholded, labels=sub_labels, index=sub_label
-                )
-            )
-            max_voxel = tuple(
-                int(i)
-                for i in scipy.ndimage.maximum_position(
-                    thresholded, labels=sub_labels, index=sub_label
-                )
-            )
-            max_count = int(thresholded[max_voxel])
-            n_voxels = np.count_nonzero(sub_labels == sub_label)
-            total_count = int(
-                scipy.ndimage.sum_labels(
-                    thresholded, labels=sub_labels, index=sub_label
-                )
-            )
-            x, y, z = object_slices[sub_label - 1]
-            bounding_box = ((x.start, y.start, z.start), (x.stop, y.stop, z.stop))
-            tagged_sample_id = tag_sample_id(
-                sample_id, multipin_sample_ids, well_limits, com[0]
+        # Take the first voxel in C order in case of ties
+        max_voxel = tuple(
+            int(i)
+            for i in np.unravel_index(np.argmax(np.where(mask, counts, -1)), mask.shape)
+            + offset
+        )
+        sub_regions.append(
+            (
+                # Region that the sub-region lies within
+                int(labels[max_voxel]),
+                sub_label,
+                GridScan3DResult(
+                    centre_of_mass=com,
+                    max_voxel=max_voxel,
+                    max_count=int(thresholded[max_voxel]),
+                    n_voxels=int(np.count_nonzero(mask)),
+                    total_count=int(counts.sum()),
+                    bounding_box=(
+                        (x.start, y.start, z.start),
+                        (x.stop, y.stop, z.stop),
+                    ),
+                    sample_id=tag_sample_id(
+                        sample_id, multipin_sample_ids, well_limits, com[0]
+                    ),
+                ),
             )
+        )
+    for label in range(1, n_regions + 1):
+        n_sub_regions = sum(1 for region, *_ in sub_regions if region == label)
+        logger.debug(f"For label {label}, {n_sub_regions} sub regions found")
 
-            result = GridScan3DResult(
-                centre_of_mass=com,
-                max_voxel=max_voxel,
-                max_count=max_count,
-                n_voxels=n_voxels,
-                total_count=total_count,
-                bounding_box=bounding_box,
-                sample_id=tagged_sample_id,
-            )
-            results.append(result)
+    # Order results by region, and then by sub-region within each region
+    results = [result for *_, result in sorted(sub_regions, key=lambda r: r[:2])]
 
     if plot:
         plot_gridscan3d_results(data, reconstructed_3d, results)
@@ -1,10 +1,15 @@
 from __future__ import annotations
 
+import concurrent.futures
+import dataclasses
 import os
 import shutil
 import subprocess
+import tempfile
+import time
 from copy import deepcopy
 from pathlib import Path
+from typing import Callable, Iterable
 
 import py
 
@@ -33,23 +38,219 @@ def run_dials_estimate_resolution(
     return resolution_limits
 
 
+# Number of threads used to copy files in parallel. Most of the time is spent
+# waiting for the (network) filesystem, so this can exceed the number of cores.
+COPY_THREADS = 8
+
+# Maximum number of paths passed to a single setfacl call
+SETFACL_BATCH_SIZE = 500
+
+# Amount of data inspected to tell whether a file is a text file
+_TEXT_PROBE_SIZE = 8192
+
+
+@dataclasses.dataclass
+class CopyStatistics:
+    files: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+    @property
+    def files_per_second(self) -> float:
+        return self.files / self.seconds if self.seconds else 0.0
+
+    def __add__(self, other: CopyStatistics) -> CopyStatistics:
+        return CopyStatistics(
+            files=self.files + other.files,
+            bytes=self.bytes + other.bytes,
+            seconds=self.seconds + other.seconds,
+        )
+
+    def __str__(self) -> str:
+        return (
+            f"{self.files} files ({self.bytes / 1e6:.1f} MB) in {self.seconds:.1f}s, "
+            f"{self.files_per_second:.1f} files/s, "
+            f"{self.bytes_per_second / 1e6:.1f} MB/s"
+        )
+
+
+def _is_text(header: bytes) -> bool:
+    # Same heuristic as grep -I: empty files and files with NUL bytes are skipped
+    return bool(header) and b"\0" not in header
+
+
+def _rewrite_lines(fsrc, fdst, replacements: dict[bytes, bytes]) -> bool:
+    """Copy lines from fsrc to fdst with replacements applied.
+    Returns whether any line was changed."""
+    changed = False
+    for line in fsrc:
+        original = line
+        for old, new in replacements.items():
+            line = line.replace(old, new)
+        changed = changed or line != original
+        fdst.write(line)
+    return changed
+
+
+def _copy_file(
+    src: str,
+    dst: str,
+    replacements: dict[bytes, bytes] | None,
+    copy_function: Callable,
+) -> int:
+    """Copy a single file, replacing paths in text files on the way through.
+    Returns the number of bytes read."""
+    if replacements:
+        with open(src, "rb") as fsrc:
+            header = fsrc.read(_TEXT_PROBE_SIZE)
+            if _is_text(header):
+                fsrc.seek(0)
+                with open(dst, "wb") as fdst:
+                    _rewrite_lines(fsrc, fdst, replacements)
+                shutil.copystat(src, dst)
+                return os.path.getsize(src)
+    copy_function(src, dst)
+    return os.path.getsize(src)
+
+
+def copy_files(
+    files: Iterable[tuple[str | os.PathLike, str | os.PathLike]],
+    *,
+    replacements: dict[bytes, bytes] | None = None,
+    copy_function: Callable = shutil.copy2,
+    max_workers: int = COPY_THREADS,
+) -> CopyStatistics:
+    """
+    Copy a list of (source, destination) file pairs using a thread pool.
+
+    If replacements are given then these are applied to the contents of any
+    text files while they are copied. Errors are collected and raised together
+    as a shutil.Error once all other files have been copied.
+    """
+    start = time.perf_counter()
+    statistics = CopyStatistics()
+    errors = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(
+                _copy_file,
+                os.fspath(src),
+                os.fspath(dst),
+                replacements,
+                copy_function,
+            ): (src, dst)
+            for src, dst in files
+        }
+        for future in concurrent.futures.as_completed(futures):
+            src, dst = futures[future]
+            try:
+                statistics.bytes += future.result()
+                statistics.files += 1
+            except OSError as e:
+                errors.append((os.fspath(src), os.fspath(dst), str(e)))
+    statistics.seconds = time.perf_counter() - start
+    if errors:
+        raise shutil.Error(errors)
+    return statistics
+
+
+def copy_tree(
+    src: str | os.PathLike,
+    dst: str | os.PathLike,
+    *,
+    symlinks: bool = True,
+    ignore: Callable[[str, list[str]], Iterable[str]] | None = None,
+    replacements: dict[bytes, bytes] | None = None,
+    max_workers: int = COPY_THREADS,
+) -> CopyStatistics:
+    """
+    A parallel replacement for shutil.copytree(src, dst, symlinks=symlinks).
+
+    The directory structure is created first, then all files are copied with
+    copy_files(). If symlinks is true then symbolic links are recreated in the
+    destination, otherwise the files and directories they point to are copied
+    in their place. dst must not exist yet.
+    """
+    files = []
+    directories = []
+    for directory, dirnames, filenames in os.walk(src, followlinks=not symlinks):
+        target = os.path.join(dst, os.path.relpath(directory, src))
+        names = dirnames + filenames
+        ignored = set(ignore(directory, names)) if ignore else set()
+        os.makedirs(target, exist_ok=directory != os.fspath(src))
+        directories.append((directory, target))
+        for name in names:
+            if name in ignored:
+                continue
+            source = os.path.join(directory, name)
+            if symlinks and os.path.islink(source):
+                os.symlink(os.readlink(source), os.path.join(target, name))
+            elif name in filenames:
+                files.append((source, os.path.join(target, name)))
+        # Do not descend into ignored directories, or recreated symbolic links
+        dirnames[:] = [
+            d
+            for d in dirnames
+            if d not in ignored
+            and not (symlinks and os.path.islink(os.path.join(directory, d)))
+        ]
+    statistics = copy_files(files, replacements=replacements, max_workers=max_workers)
+    for directory, target in directories:
+        shutil.copystat(directory, target)
+    return statistics
+
+
+def _tmp_path_replacements(
+    working_directory, results_directory, uuid=None
+) -> dict[bytes, bytes]:
+    source_paths = [os.path.dirname(os.fspath(working_directory))]
+    if uuid:
+        source_paths.append(f"/tmp/{uuid}")
+    destination = os.fsencode(os.path.dirname(os.fspath(results_directory)))
+    return {os.fsencode(path): destination for path in source_paths}
+
+
+def _rewrite_file(path: str, replacements: dict[bytes, bytes]) -> bool:
+    with open(path, "rb") as fsrc:
+        if not _is_text(fsrc.read(_TEXT_PROBE_SIZE)):
+            return False
+        fsrc.seek(0)
+        with tempfile.TemporaryFile() as tmp:
+            if not _rewrite_lines(fsrc, tmp, replacements):
+                return False
+            # Write in place rather than replacing the file to retain ownership
+            # and ACLs
+            tmp.seek(0)
+            with open(path, "r+b") as fdst:
+                shutil.copyfileobj(tmp, fdst)
+                fdst.truncate()
+    return True
+
+
 def fix_tmp_paths_in_logs(working_directory, results_directory, logger, uuid=None):
-    src_paths_esc = [
-        r"\/".join(os.path.dirname(working_directory).split(os.sep)),
+    replacements = _tmp_path_replacements(working_directory, results_directory, uuid)
+    logger.info(
+        f"Replacing {', '.join(map(os.fsdecode, replacements))} in {results_directory}"
+    )
+    paths = [
+        os.path.join(directory, filename)
+        for directory, _, filenames in os.walk(results_directory)
+        for filename in filenames
+        if not os.path.islink(os.path.join(directory, filename))
     ]
-    if uuid:
-        src_paths_esc.append(rf"\/tmp\/{uuid}")
-    dest_pth_esc = r"\/".join(os.path.dirname(results_directory).split(os.sep))
-    for pth in src_paths_esc:
-        sed_command = (
-            r"find %s -type f -exec grep -Iq . {} \; -and -exec sed -ci 's/%s/%s/g' {} +"
-            % (results_directory, pth, dest_pth_esc)
-        )
-        logger.info(f"Running sed command: {sed_command}")
-        try:
-            subprocess.call([sed_command], shell=True)
-        except Exception:
-            logger.warning("Failed to run sed command to update paths", exc_info=True)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=COPY_THREADS) as pool:
+        futures = {pool.submit(_rewrite_file, p, replacements): p for p in paths}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except OSError:
+                logger.warning(
+                    f"Failed to update paths in {futures[future]}", exc_info=True
+                )
 
 
 def copy_results(working_directory, results_directory, skip_copy, uuid, logger):
@@ -67,35 +268,46 @@ def copy_results(working_directory, results_directory, skip_copy, uuid, logger):
                     ignore_list.append(f)
         return ignore_list
 
-    shutil.copytree(
+    statistics = copy_tree(
         working_directory,
         results_directory,
-        symlinks=True,
-        ignore_dangling_symlinks=False,
         ignore=ignore_func,
+        replacements=_tmp_path_replacements(working_directory, results_directory, uuid),
     )
-    fix_tmp_paths_in_logs(working_directory, results_directory, logger, uuid)
+    logger.info(f"Copied {working_directory} to {results_directory}: {statistics}")
+
+
+def _setfacl(mask: str, paths: list[str], cwd) -> bool:
+    """Apply the mask to all paths, even if it fails for some of them.
+    Returns whether it was applied to all paths successfully."""
+    success = True
+    for i in range(0, len(paths), SETFACL_BATCH_SIZE):
+        result = subprocess.run(
+            ["setfacl", "-m", mask, "--", *paths[i : i + SETFACL_BATCH_SIZE]],
+            cwd=cwd,
+        )
+        if result.returncode:
+            success = False
+    return success
 
 
 def fix_acl_mask(subprocess_directory, results_directory, logger):
     # Fix ACL mask for files extracted from .tar archive
     # Using m:rwX resets mask for files as well, unclear why.
-    # Hence, running find to apply mask to files and directories separately
-    for ft, msk in (("d", "m:rwx"), ("f", "m:rw")):
-        setfacl_command = r"find %s -type %s -exec setfacl -m %s '{}' ';'" % (
-            results_directory,
-            ft,
-            msk,
-        )
-        logger.info(f"Running command to fix ACLs: {setfacl_command}")
-        result = subprocess.run(
-            [
-                setfacl_command,
-            ],
-            cwd=subprocess_directory,
-            shell=True,
+    # Hence, apply the mask to files and directories separately
+    root = os.path.join(subprocess_directory, results_directory)
+    directories: list[str] = []
+    files: list[str] = [root] if os.path.isfile(root) else []
+    for directory, _, filenames in os.walk(root):
+        directories.append(directory)
+        files.extend(
+            path
+            for path in (os.path.join(directory, f) for f in filenames)
+            if not os.path.islink(path)
         )
-        if not result.returncode:
+    for paths, msk in ((directories, "m:rwx"), (files, "m:rw")):
+        logger.info(f"Setting ACL mask {msk} on {len(paths)} paths in {root}")
+        if _setfacl(msk, paths, subprocess_directory):
             logger.info(f"Resetting ALC mask to {msk} in {results_directory}")
         else:
             logger.error(f"Failed to reset ALC mask to {msk} in {results_directory}")
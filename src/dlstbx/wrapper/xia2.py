@@ -15,7 +15,12 @@ import dateutil.parser
 import dlstbx.util.symlink
 from dlstbx.util import iris
 from dlstbx.wrapper import Wrapper
-from dlstbx.wrapper.helpers import run_dials_estimate_resolution
+from dlstbx.wrapper.helpers import (
+    CopyStatistics,
+    copy_files,
+    copy_tree,
+    run_dials_estimate_resolution,
+)
 
 
 class Xia2Wrapper(Wrapper):
@@ -297,12 +302,13 @@ class Xia2Wrapper(Wrapper):
                     for patt in pipeine_final_params["patterns"]
                 )
 
+        copy_statistics = CopyStatistics()
         for subdir in ("DataFiles", "LogFiles"):
             src = working_directory / subdir
             dst = results_directory / subdir
             if src.exists():
                 self.log.debug(f"Recursively copying {src} to {dst}")
-                shutil.copytree(src, dst)
+                copy_statistics += copy_tree(src, dst, symlinks=False)
             elif not success:
                 self.log.info(
                     f"Expected output directory does not exist (non-zero exitcode): {src}"
@@ -311,16 +317,19 @@ class Xia2Wrapper(Wrapper):
                 self.log.warning(f"Expected output directory does not exist: {src}")
 
         allfiles = []
+        files_to_copy = []
         for f in working_directory.iterdir():
             if f.is_file() and not f.name.startswith(".") and f.suffix != ".sif":
                 self.log.debug(f"Copying {f} to results directory")
-                shutil.copy(f, results_directory)
+                files_to_copy.append((f, results_directory / f.name))
                 if pipeine_final_params and is_final_result(f):
                     assert final_directory
-                    shutil.copy(f, final_directory)
+                    files_to_copy.append((f, final_directory / f.name))
                     allfiles.append(str(final_directory / f.name))
                 else:
                     allfiles.append(str(results_directory / f.name))
+        copy_statistics += copy_files(files_to_copy, copy_function=shutil.copy)
+        self.log.info(f"Copied xia2 results to {results_directory}: {copy_statistics}")
 
         success = (
             success
@@ -0,0 +1,10 @@
+from __future__ import annotations
+
+from dlstbx.cli.import_profile import profile_service
+
+
+def test_profile_service():
+    profile = profile_service("DLSImages")
+    assert profile.error is None
+    assert profile.seconds > 0
+    assert "workflows" in profile.packages
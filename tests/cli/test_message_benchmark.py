@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from dlstbx.cli import message_benchmark
+
+
+@pytest.mark.parametrize("mode", ["none", "ack", "transaction"])
+def test_memory_benchmark(mode):
+    result = message_benchmark.benchmark(
+        message_size=100, count=200, prefetch_count=10, mode=mode, timeout=10
+    )
+    assert result["received"] == 200
+    assert result["lost"] == 0
+    assert result["duplicates"] == 0
+    assert result["sent_per_second"] > 0
+    assert result["latency"]["count"] == 200
+    assert result["latency"]["p50"] <= result["latency"]["p99"]
+
+
+def test_offline_benchmark():
+    result = message_benchmark.benchmark(transport="offline", count=100)
+    assert result["sent_per_second"] > 0
+    assert "received" not in result
+
+
+def test_compare_with_baseline(tmp_path, capsys):
+    baseline = tmp_path / "baseline.json"
+    message_benchmark.run(["--count", "100", "--size", "10", "--json", str(baseline)])
+    results = json.loads(baseline.read_text())["results"]
+    assert len(results) == 1
+    assert results[0]["message_size"] == 10
+
+    message_benchmark.run(
+        ["--count", "100", "--size", "10", "20", "--compare", str(baseline)]
+    )
+    output = capsys.readouterr().out
+    assert "10B, prefetch 0, none: throughput" in output
+    assert "20B" not in output.split("Change against")[1]
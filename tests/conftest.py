@@ -15,6 +15,30 @@ from dlstbx import mimas
 from dlstbx.mimas.specification import BeamlineSpecification, DCClassSpecification
 
 
+def pytest_addoption(parser):
+    parser.addoption(
+        "--benchmark",
+        action="store_true",
+        default=False,
+        help="run benchmark tests, which print timings and take longer",
+    )
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "benchmark: benchmark test, only run with the --benchmark option"
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--benchmark"):
+        return
+    skip_benchmark = pytest.mark.skip(reason="needs --benchmark option to run")
+    for item in items:
+        if item.get_closest_marker("benchmark"):
+            item.add_marker(skip_benchmark)
+
+
 @pytest.fixture(scope="session")
 def testconfig():
     """Return the path to a configuration file pointing to a test database."""
@@ -104,5 +128,7 @@ def with_dummy_plugins():
         return_value=combined,
     ):
         mimas._get_handlers.cache_clear()
+        mimas.get_decision_index.cache_clear()
         yield
     mimas._get_handlers.cache_clear()
+    mimas.get_decision_index.cache_clear()
@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import h5py
+
+from dlstbx.dc_sim.load import (
+    FILEWATCHER,
+    PER_IMAGE_ANALYSIS,
+    XRAY_CENTERING,
+    LoadGenerator,
+    LoadParameters,
+    _block_size,
+)
+
+
+def test_block_size():
+    assert _block_size(200) == 100
+    assert _block_size(12) == 12
+    assert _block_size(150) == 75
+    assert _block_size(101) == 1
+
+
+def test_load_generator(tmp_path):
+    parameters = LoadParameters(
+        directory=tmp_path,
+        collections=2,
+        frame_rate=100,
+        grid=(4, 3),
+        shape=(32, 32),
+        timeout=30,
+    )
+    report = LoadGenerator(parameters).run()
+    assert report.images_written == 24
+    assert report.collections_completed == 2
+    assert report.latencies[FILEWATCHER]["count"] == 24
+    assert report.latencies[PER_IMAGE_ANALYSIS]["count"] == 24
+    assert report.latencies[XRAY_CENTERING]["count"] == 2
+    for summary in report.latencies.values():
+        assert 0 <= summary["p50"] <= summary["p95"] <= summary["p99"]
+    assert report.as_dict()["parameters"]["directory"] == str(tmp_path)
+
+    for dcid in (1, 2):
+        with h5py.File(tmp_path / f"loadtest_{dcid}_master.h5") as f:
+            assert f["entry/data/data"].shape == (12, 32, 32)
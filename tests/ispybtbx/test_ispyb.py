@@ -677,6 +677,44 @@ def test_get_dcg_dcids(db_session):
     assert param["ispyb_dcg_dcids"] == [6222221, 6222245]
 
 
+@pytest.mark.parametrize("dcid", [*ds.values(), 6077465, 6222263])
+def test_get_dcid_context_matches_individual_lookups(dcid, db_session):
+    i = ispybtbx()
+    context = i.get_dcid_context(dcid, db_session)
+    dc_info = i.get_dc_info(dcid, db_session)
+    dcg_id = dc_info["dataCollectionGroupId"]
+    assert context.dc_info == dc_info
+    assert context.dcg_id == dcg_id
+    assert context.beamline == i.get_beamline_from_dcid(dcid, db_session)
+    assert i.detector_model_to_class(
+        context.detector_model, dc_info["fileTemplate"]
+    ) == i.dc_info_to_detectorclass(dc_info, db_session)
+    assert i.detector_model_to_name(
+        context.detector_model
+    ) == i.dc_info_to_detectorname(dc_info, db_session)
+    assert context.gridinfo == i.get_gridscan_info(dcid, dcg_id, db_session)
+    assert context.dcg_experiment_type == i.get_dcg_experiment_type(dcg_id, db_session)
+    assert context.diffraction_plan == i.get_diffractionplan_from_dcid(dcid, db_session)
+    assert context.protein == i.get_protein_from_dcid(dcid, db_session)
+    assert (context.space_group, context.unit_cell) == (
+        i.get_space_group_and_unit_cell(dcid, db_session)
+    )
+    assert context.smiles == i.get_sample_smiles(context.sample_id, db_session)
+    assert context.priority_processing == crud.get_priority_processing_for_sample_id(
+        context.sample_id, db_session
+    )
+    assert context.pin_info == i.get_pin_info_from_sample_id(
+        context.sample_id, db_session
+    )
+    assert sorted(context.dcg_dcids) == sorted(
+        i.get_dcg_dcids(dcid, dcg_id, db_session)
+    )
+
+
+def test_get_dcid_context_for_missing_dcid(db_session):
+    assert ispybtbx().get_dcid_context(borken_dcid, db_session) is None
+
+
 def test_dcg_experiment_type(db_session):
     _, params = ispyb_filter({}, {"ispyb_dcid": 13465224}, db_session)
     assert params["ispyb_dcg_experiment_type"] == "Mesh3D"
@@ -684,6 +722,21 @@ def test_dcg_experiment_type(db_session):
     assert params["ispyb_dcg_experiment_type"] == "SAD"
 
 
+def test_ispyb_filter_caches_entities(db_session):
+    cache = crud.EntityCache()
+    _, uncached = ispyb_filter({}, {"ispyb_dcid": ds["gphl_C2"]}, db_session)
+    _, first = ispyb_filter({}, {"ispyb_dcid": ds["gphl_C2"]}, db_session, cache=cache)
+    # The second lookup of each entity is served from the cache
+    assert not cache.hits
+    misses = cache.misses
+    _, second = ispyb_filter({}, {"ispyb_dcid": ds["gphl_C2"]}, db_session, cache=cache)
+    assert (cache.hits, cache.misses) == (misses, misses)
+    for params in (first, second):
+        assert params["ispyb_detectorclass"] == uncached["ispyb_detectorclass"]
+        assert params["ispyb_detectorname"] == uncached["ispyb_detectorname"]
+        assert params["ispyb_related_dcids"] == uncached["ispyb_related_dcids"]
+
+
 def test_get_linked_pdb_files_for_dcid(db_session, tmp_path):
     user_pdb_dir = tmp_path / "user_pdb"
     user_pdb_dir.mkdir()
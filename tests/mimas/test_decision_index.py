@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import itertools
+import time
+
+import pytest
+
+from dlstbx import mimas
+from dlstbx.mimas import (
+    DecisionIndex,
+    MimasDCClass,
+    MimasDetectorClass,
+    MimasEvent,
+    MimasScenario,
+)
+from dlstbx.mimas.specification import (
+    BeamlineSpecification,
+    DCClassSpecification,
+    VisitSpecification,
+)
+
+
+@mimas.match_specification(
+    BeamlineSpecification("i99") & ~VisitSpecification({"cm"})
+    | DCClassSpecification(MimasDCClass.GRIDSCAN)
+)
+def handle_i99_user_visits(scenario, **kwargs):
+    return []
+
+
+def handle_everything(scenario, **kwargs):
+    return []
+
+
+def all_scenarios(beamlines):
+    for beamline, event, dcclass, detectorclass, visit in itertools.product(
+        beamlines,
+        MimasEvent,
+        MimasDCClass,
+        (*MimasDetectorClass, None),
+        ("cm12345-6", "mx12345-6", None),
+    ):
+        yield MimasScenario(
+            DCID=1,
+            dcclass=dcclass,
+            event=event,
+            beamline=beamline,
+            visit=visit,
+            runstatus="DataCollection Successful",
+            detectorclass=detectorclass,
+        )
+
+
+def tree_evaluation(handlers, scenario):
+    return [
+        getattr(handler, "__wrapped__", handler)
+        for handler in handlers
+        if not hasattr(handler, "specification")
+        or handler.specification.is_satisfied_by(scenario)
+    ]
+
+
+@pytest.fixture
+def handlers():
+    return [
+        *mimas._get_handlers().values(),
+        handle_i99_user_visits,
+        handle_everything,
+    ]
+
+
+def test_decision_index_matches_tree_evaluation(handlers):
+    index = DecisionIndex(handlers)
+    assert {"i03", "i19-1", "i24", "i99"} <= index.beamlines
+    for scenario in all_scenarios((*index.beamlines, "i11-1", None)):
+        assert index.match(scenario) == tree_evaluation(handlers, scenario), scenario
+
+
+def test_decision_index_defers_non_enumerable_specifications():
+    index = DecisionIndex([handle_i99_user_visits, handle_everything])
+    scenario = MimasScenario(
+        DCID=1,
+        dcclass=MimasDCClass.ROTATION,
+        event=MimasEvent.END,
+        beamline="i99",
+        visit="cm12345-6",
+        runstatus="DataCollection Successful",
+    )
+    candidates = index.candidates(scenario)
+    assert candidates == (
+        (handle_i99_user_visits.__wrapped__, handle_i99_user_visits.specification),
+        (handle_everything, None),
+    )
+    assert index.match(scenario) == [handle_everything]
+
+    gridscan = MimasScenario(
+        DCID=1,
+        dcclass=MimasDCClass.GRIDSCAN,
+        event=MimasEvent.END,
+        beamline="i03",
+        visit="cm12345-6",
+        runstatus="DataCollection Successful",
+    )
+    assert index.candidates(gridscan) == (
+        (handle_i99_user_visits.__wrapped__, None),
+        (handle_everything, None),
+    )
+
+
+def test_decision_index_falls_back_for_unexpected_values(handlers):
+    index = DecisionIndex(handlers)
+    scenario = MimasScenario(
+        DCID=1,
+        dcclass=MimasDCClass.ROTATION,
+        event=MimasEvent.END,
+        beamline="i03",
+        visit="cm12345-6",
+        runstatus="DataCollection Successful",
+        detectorclass="MYTHEN",
+    )
+    assert index.match(scenario) == tree_evaluation(handlers, scenario)
+
+
+@pytest.mark.benchmark
+def test_benchmark_decision_index(handlers, capsys):
+    index = DecisionIndex(handlers)
+    scenarios = list(all_scenarios((*index.beamlines, "i11-1")))
+
+    start = time.perf_counter()
+    for scenario in scenarios:
+        tree_evaluation(handlers, scenario)
+    tree_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for scenario in scenarios:
+        index.match(scenario)
+    index_time = time.perf_counter() - start
+
+    with capsys.disabled():
+        print(
+            f"\n{len(scenarios)} scenarios, {len(handlers)} handlers: "
+            f"tree evaluation {tree_time:.3f}s, decision index {index_time:.3f}s"
+        )
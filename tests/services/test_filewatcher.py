@@ -13,8 +13,9 @@ import workflows.transport.common_transport
 from workflows.recipe.wrapper import RecipeWrapper
 
 import dlstbx.services.filewatcher
+import dlstbx.util.inotify
 from dlstbx.services.filewatcher import DLSFileWatcher
-from dlstbx.swmr import h5maker
+from dlstbx.swmr import h5cache, h5maker
 
 
 def generate_recipe_message(parameters, output):
@@ -43,9 +44,10 @@ def generate_recipe_message(parameters, output):
     return message
 
 
-def test_filewatcher_watch_pattern(mocker, tmp_path):
+@pytest.mark.parametrize("environment", [{}, {"inotify": True}])
+def test_filewatcher_watch_pattern(environment, mocker, tmp_path):
     mock_transport = mock.Mock()
-    filewatcher = DLSFileWatcher()
+    filewatcher = DLSFileWatcher(environment=environment)
     setattr(filewatcher, "_transport", mock_transport)
     filewatcher.initializing()
     t = mock.create_autospec(workflows.transport.common_transport.CommonTransport)
@@ -157,9 +159,42 @@ def test_filewatcher_watch_pattern(mocker, tmp_path):
     )
 
 
-def test_filewatcher_watch_list(mocker, tmp_path):
+@pytest.mark.parametrize(
+    "environment, delay",
+    [({}, 1), ({"inotify": True}, 0.2), ({"inotify": True, "inotify-delay": 0.5}, 0.5)],
+)
+def test_filewatcher_polls_watched_directories_sooner(
+    environment, delay, mocker, tmp_path
+):
+    filewatcher = DLSFileWatcher(environment=environment)
+    setattr(filewatcher, "_transport", mock.Mock())
+    filewatcher.initializing()
+    if environment and filewatcher._directory_events is None:
+        pytest.skip("inotify not available")
+    if environment and dlstbx.util.inotify.filesystem_type(tmp_path) not in (
+        dlstbx.util.inotify.LOCAL_FILESYSTEMS
+    ):
+        pytest.skip("inotify not supported on the test filesystem")
+    t = mock.create_autospec(workflows.transport.common_transport.CommonTransport)
+    m = generate_recipe_message(
+        parameters={
+            "pattern": os.fspath(tmp_path / "image%06d"),
+            "pattern-start": "1",
+            "pattern-end": "2",
+        },
+        output={"any": 1},
+    )
+    header = {"message-id": mock.sentinel, "subscription": mock.sentinel}
+    rw = RecipeWrapper(message=m, transport=t)
+    checkpoint = mocker.spy(rw, "checkpoint")
+    filewatcher.watch_files(rw, header, mock.sentinel.message)
+    assert checkpoint.call_args.kwargs["delay"] == delay
+
+
+@pytest.mark.parametrize("environment", [{}, {"inotify": True}])
+def test_filewatcher_watch_list(environment, mocker, tmp_path):
     mock_transport = mock.Mock()
-    filewatcher = DLSFileWatcher()
+    filewatcher = DLSFileWatcher(environment=environment)
     setattr(filewatcher, "_transport", mock_transport)
     filewatcher.initializing()
     t = mock.create_autospec(workflows.transport.common_transport.CommonTransport)
@@ -884,3 +919,140 @@ def test_filewatcher_bad_pattern(mocker):
     rw.recipe_step["parameters"]["pattern-start"] = None
     filewatcher.watch_files(rw, header, mock.sentinel.message)
     t.nack.assert_called_once_with(header)
+
+
+def test_swmr_file_cache_reuses_master_and_handles(mocker, tmp_path):
+    h5_prefix = tmp_path / "foo"
+    master_h5 = os.fspath(h5_prefix) + "_master.h5"
+    h5maker.main(h5_prefix, shape=(4, 4), block_size=2, nblocks=3)
+
+    cache = h5cache.SWMRFileCache(max_handles=2)
+    get_real_frames = mocker.spy(h5cache.h5check, "get_real_frames")
+    mtime = os.stat(master_h5).st_mtime
+    master = cache.get_master(master_h5, mtime)
+    assert master.image_count == 6
+    assert cache.get_master(master_h5, mtime) is master
+    assert get_real_frames.call_count == 1
+
+    # Handles are kept open, up to the configured maximum
+    handles = [cache.get_handle(master_h5, f) for f, _ in master.dataset_files]
+    assert cache.open_handles == 2
+    assert not cache.is_open(master.dataset_files[0][0])
+    assert cache.get_handle(master_h5, master.dataset_files[2][0]) is handles[2]
+
+    # A changed master file is decoded again, closing the old handles
+    master = cache.get_master(master_h5, mtime + 1)
+    assert get_real_frames.call_count == 2
+    assert cache.open_handles == 0
+
+    # Idle entries are evicted
+    cache.get_handle(master_h5, master.dataset_files[0][0])
+    cache.max_idle = 0
+    cache.expire()
+    assert master_h5 not in cache
+    assert cache.open_handles == 0
+
+
+@pytest.mark.parametrize("frames_per_chunk", [1, 3])
+def test_master_file_entry_reads_only_new_chunks(frames_per_chunk, mocker, tmp_path):
+    master = h5cache.MasterFileEntry(
+        master="master.h5", mtime=0, dataset_files=[], file_map={}
+    )
+    get_chunk_sizes = mocker.spy(h5cache.h5check, "get_chunk_sizes")
+    with h5py.File(tmp_path / "data.h5", "w", libver="latest") as f:
+        dset = f.create_dataset(
+            "data",
+            shape=(0, 4, 4),
+            maxshape=(None, 4, 4),
+            chunks=(frames_per_chunk, 4, 4),
+            dtype="i4",
+        )
+
+        def append(n):
+            start = dset.shape[0]
+            dset.resize(start + n, axis=0)
+            dset[start:] = 1
+
+        assert not master.written_frames("data.h5", dset).any()
+        append(4)
+        assert master.written_frames("data.h5", dset).all()
+        assert get_chunk_sizes.call_args.kwargs["start"] == 0
+
+        # Only chunk records from the previously last one onwards are read
+        append(5)
+        mask = master.written_frames("data.h5", dset)
+        assert len(mask) == 9 and mask.all()
+        seen = -(-4 // frames_per_chunk)
+        assert get_chunk_sizes.call_args.kwargs["start"] == seen - 1
+
+        # Nothing is read if no new chunks have been written
+        assert master.written_frames("data.h5", dset) is mask
+        assert get_chunk_sizes.call_count == 3
+
+        # A chunk written before the last seen one causes a full rescan
+        dset.resize(15, axis=0)
+        dset[14] = 1
+        master.written_frames("data.h5", dset)
+        assert get_chunk_sizes.call_args.kwargs["start"] > 0
+        dset[10] = 1
+        mask = master.written_frames("data.h5", dset)
+        assert get_chunk_sizes.call_args.kwargs["start"] == 0
+        assert mask.nonzero()[0].tolist() == (
+            h5cache.h5check.get_written_frames(dset).tolist()
+        )
+
+
+def test_filewatcher_watch_pattern_directory_listing(mocker, tmp_path):
+    listings = dlstbx.services.filewatcher._directory_listings
+    filewatcher = DLSFileWatcher()
+    setattr(filewatcher, "_transport", mock.Mock())
+    filewatcher.initializing()
+    t = mock.create_autospec(workflows.transport.common_transport.CommonTransport)
+    pattern = "image%06d"
+    for i in range(1, 6):
+        (tmp_path / (pattern % i)).write_text("content")
+    m = generate_recipe_message(
+        parameters={
+            "pattern": os.fspath(tmp_path / pattern),
+            "pattern-start": "1",
+            "pattern-end": "10",
+            "directory-listing": True,
+        },
+        output={"any": 1},
+    )
+    header = {
+        "message-id": mock.sentinel,
+        "subscription": mock.sentinel,
+    }
+    rw = RecipeWrapper(message=m, transport=t)
+    checkpoint = mocker.spy(rw, "checkpoint")
+    scandir = mocker.spy(dlstbx.services.filewatcher.os, "scandir")
+    is_file = mocker.spy(dlstbx.services.filewatcher.Path, "is_file")
+    filewatcher.watch_files(rw, header, mock.sentinel.message)
+    checkpoint.assert_called_once_with(
+        {
+            "filewatcher-status": {
+                "seen-files": 5,
+                "start-time": mock.ANY,
+                "last-seen": mock.ANY,
+            }
+        },
+        delay=mock.ANY,
+        transaction=mock.ANY,
+    )
+    assert scandir.call_count == 1
+    is_file.assert_not_called()
+
+    for i in range(6, 11):
+        (tmp_path / (pattern % i)).write_text("content")
+    # Let the shared directory listing expire before the next round
+    listings._listings.clear()
+    send_to = mocker.spy(rw, "send_to")
+    filewatcher.watch_files(rw, header, t.send.mock_calls[-1].args[1]["payload"])
+    send_to.assert_any_call(
+        "finally",
+        {"files-expected": 10, "files-seen": 10, "success": True},
+        transaction=mock.ANY,
+    )
+    assert scandir.call_count == 2
+    is_file.assert_not_called()
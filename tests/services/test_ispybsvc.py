@@ -0,0 +1,302 @@
+from __future__ import annotations
+
+from unittest import mock
+
+import pytest
+from ispyb.sp.mxprocessing import MXProcessing
+from workflows.recipe.wrapper import RecipeWrapper
+from workflows.transport.offline_transport import OfflineTransport
+
+import dlstbx.services.ispybsvc
+import dlstbx.services.ispybsvc_pia
+from dlstbx.util.program_status import PROGRAM_STATUS_TOPIC
+
+
+def generate_recipe_message(parameters):
+    return {
+        "recipe": {
+            "1": {
+                "service": "DLS ISPyB connector",
+                "queue": "ispyb_pia",
+                "parameters": parameters,
+            },
+            "start": [(1, [])],
+        },
+        "recipe-pointer": 1,
+        "recipe-path": [],
+        "environment": {"ID": mock.sentinel.GUID},
+        "payload": mock.sentinel.payload,
+    }
+
+
+@pytest.fixture
+def buffered_ispyb(mocker):
+    t = OfflineTransport()
+    svc = dlstbx.services.ispybsvc.DLSISPyB(
+        environment={"pia-buffer-size": 3, "pia-buffer-window": 60}
+    )
+    svc.transport = t
+    svc.ispyb = mock.Mock()
+    svc.ispyb.mx_processing.get_quality_indicators_params = (
+        MXProcessing.get_quality_indicators_params
+    )
+    svc._ispyb_sessionmaker = mock.MagicMock()
+    assert svc._setup_pia_buffer() == {"prefetch_count": 3}
+    return svc
+
+
+def _send_pia_results(svc, n_images):
+    rw = RecipeWrapper(
+        message=generate_recipe_message(
+            {"ispyb_command": "store_per_image_analysis_results", "dcid": 1234}
+        ),
+        transport=svc._transport,
+    )
+    for i in range(n_images):
+        header = {"message-id": i + 1, "subscription": mock.sentinel.subscription}
+        message = {"file-number": i + 1, "n_spots_total": 10 * i, "dozor_score": None}
+        svc.receive_msg(rw, header, message)
+
+
+def test_buffered_pia_results_are_written_together(buffered_ispyb, mocker):
+    upsert = mocker.patch("dlstbx.crud.upsert_quality_indicators")
+    ack = mocker.spy(buffered_ispyb._transport, "ack")
+    commit = mocker.spy(buffered_ispyb._transport, "transaction_commit")
+
+    _send_pia_results(buffered_ispyb, 2)
+    upsert.assert_not_called()
+    ack.assert_not_called()
+
+    _send_pia_results(buffered_ispyb, 1)
+    upsert.assert_called_once()
+    rows = upsert.call_args.args[0]
+    assert [(r["dataCollectionId"], r["imageNumber"]) for r in rows] == [
+        (1234, 1),
+        (1234, 2),
+        (1234, 1),
+    ]
+    assert rows[1]["spotTotal"] == 10
+    assert ack.call_count == 3
+    # All messages are acknowledged in a single broker transaction
+    assert commit.call_count == 1
+    buffered_ispyb.ispyb.mx_processing.upsert_quality_indicators.assert_not_called()
+
+    # Records are also written when the buffer window is reached
+    _send_pia_results(buffered_ispyb, 1)
+    buffered_ispyb.flush_pia_records()
+    assert upsert.call_count == 2
+    assert ack.call_count == 4
+
+
+def test_buffered_pia_results_fall_back_to_single_writes(buffered_ispyb, mocker):
+    mocker.patch(
+        "dlstbx.crud.upsert_quality_indicators", side_effect=RuntimeError("oops")
+    )
+    upsert = buffered_ispyb.ispyb.mx_processing.upsert_quality_indicators
+    upsert.side_effect = [1, RuntimeError("bad record"), 3]
+    ack = mocker.spy(buffered_ispyb._transport, "ack")
+    nack = mocker.spy(buffered_ispyb._transport, "nack")
+
+    _send_pia_results(buffered_ispyb, 3)
+    assert upsert.call_count == 3
+    assert [c.args[0]["message-id"] for c in ack.call_args_list] == [1, 3]
+    assert [c.args[0]["message-id"] for c in nack.call_args_list] == [2]
+
+
+@pytest.mark.parametrize("enabled", [True, False])
+@pytest.mark.parametrize("status", ["success", "failure", None])
+def test_update_processing_status_announces_finished_programs(status, enabled, mocker):
+    t = OfflineTransport()
+    svc = dlstbx.services.ispybsvc.DLSISPyB()
+    svc.transport = t
+    svc.ispyb = mock.Mock()
+    svc.ispyb.mx_processing.upsert_program_ex.return_value = 1234
+    svc._broadcast_program_status = enabled
+    broadcast = mocker.spy(t, "broadcast")
+    parameters = {"program_id": 1234, "status": status, "message": "done"}
+
+    result = svc.do_update_processing_status(parameters.get)
+    assert result == {"success": True, "return_value": 1234}
+    if status and enabled:
+        broadcast.assert_called_once_with(
+            PROGRAM_STATUS_TOPIC,
+            {"program_id": 1234, "status": status},
+            transaction=None,
+        )
+    else:
+        broadcast.assert_not_called()
+
+
+@pytest.fixture
+def in_process_ispyb():
+    t = OfflineTransport()
+    svc = dlstbx.services.ispybsvc.DLSISPyB()
+    svc.transport = t
+    svc.ispyb = mock.Mock()
+    svc.ispyb.mx_processing.upsert_program_ex.return_value = 1234
+    svc._ispyb_sessionmaker = mock.MagicMock()
+    svc._multipart_in_process = True
+    return svc
+
+
+def _send_multipart_message(svc, commands):
+    message = generate_recipe_message(
+        {"ispyb_command": "multipart_message", "ispyb_command_list": commands}
+    )
+    message["environment"] = {"ID": "a2e7a2b8-2ab3-4a0f-a1a1-6d3d0f5e2c44"}
+    rw = RecipeWrapper(message=message, transport=svc._transport)
+    header = {"message-id": 1, "subscription": mock.sentinel.subscription}
+    svc.receive_msg(rw, header, {})
+    return rw
+
+
+def test_multipart_steps_run_in_a_single_transaction(in_process_ispyb, mocker):
+    checkpoint = mocker.spy(RecipeWrapper, "checkpoint")
+    ack = mocker.spy(in_process_ispyb._transport, "ack")
+    commands = [
+        {
+            "ispyb_command": "update_processing_status",
+            "program_id": 1234,
+            "status": "running",
+            "store_result": "ispyb_program_id",
+        },
+        {
+            "ispyb_command": "add_program_message",
+            "program_id": "$ispyb_program_id",
+            "message": "first",
+        },
+        {
+            "ispyb_command": "add_program_message",
+            "program_id": "$ispyb_program_id",
+            "message": "second",
+        },
+        {"ispyb_command": "insert_pdb_files", "pdb_files": []},
+    ]
+    rw = _send_multipart_message(in_process_ispyb, commands)
+
+    connection = in_process_ispyb.ispyb.conn
+    connection.commit.assert_called_once()
+    connection.rollback.assert_not_called()
+    assert connection.autocommit is True
+    upsert_message = in_process_ispyb.ispyb.mx_processing.upsert_program_message
+    assert [c.kwargs["program_id"] for c in upsert_message.call_args_list] == [
+        "1234",
+        "1234",
+    ]
+    assert rw.environment["ispyb_program_id"] == 1234
+
+    # Steps that use an SQLAlchemy session are left for the next delivery
+    checkpoint.assert_called_once()
+    payload = checkpoint.call_args.args[1]
+    assert payload["checkpoint"] == 3
+    assert payload["ispyb_command_list"] == [
+        {"ispyb_command": "insert_pdb_files", "pdb_files": []}
+    ]
+    ack.assert_called_once()
+
+
+def test_failed_multipart_steps_are_rolled_back(in_process_ispyb, mocker):
+    nack = mocker.spy(in_process_ispyb._transport, "nack")
+    in_process_ispyb.ispyb.mx_processing.upsert_program_ex.side_effect = (
+        dlstbx.services.ispybsvc.ispyb.ISPyBException()
+    )
+    commands = [
+        {
+            "ispyb_command": "add_program_message",
+            "program_id": 1234,
+            "message": "first",
+            "store_result": "ispyb_message_id",
+        },
+        {"ispyb_command": "update_processing_status", "program_id": 1234},
+    ]
+    rw = _send_multipart_message(in_process_ispyb, commands)
+
+    connection = in_process_ispyb.ispyb.conn
+    connection.rollback.assert_called_once()
+    connection.commit.assert_not_called()
+    assert "ispyb_message_id" not in rw.environment
+    nack.assert_called_once()
+
+
+@pytest.mark.parametrize(
+    "module, service_class, service",
+    [
+        (dlstbx.services.ispybsvc, "DLSISPyB", "ispyb"),
+        (dlstbx.services.ispybsvc_pia, "DLSISPyBPIA", "ispyb_pia"),
+    ],
+)
+def test_pool_metrics_are_recorded(module, service_class, service, mocker):
+    mocker.patch("ispyb.open")
+    mocker.patch.object(dlstbx.services.ispybsvc.buffer, "evict")
+    mocker.patch("workflows.recipe.wrap_subscribe")
+    metrics = mocker.patch.object(module, "PrometheusMetrics")
+    sessionmaker = mocker.patch.object(module.database, "sessionmaker")
+    svc = getattr(module, service_class)(environment={"metrics": True})
+    svc.transport = OfflineTransport()
+    svc.initializing()
+    sessionmaker.assert_called_once_with(
+        {"metrics": True}, service=service, metrics=metrics.return_value
+    )
+
+
+def test_buffer_table_is_cleaned_up_when_idle(mocker):
+    evict = mocker.patch.object(dlstbx.services.ispybsvc.buffer, "evict")
+    svc = dlstbx.services.ispybsvc.DLSISPyB(
+        environment={"buffer-eviction-interval": 3600}
+    )
+    svc._ispyb_sessionmaker = mock.MagicMock()
+    svc._setup_pia_buffer()
+    svc._setup_buffer_eviction()
+    time = mocker.patch.object(dlstbx.services.ispybsvc.time, "time")
+
+    time.return_value = svc._buffer_eviction_due - 1
+    svc.on_idle()
+    evict.assert_not_called()
+    time.return_value += 2
+    svc.on_idle()
+    evict.assert_called_once()
+    svc.on_idle()
+    evict.assert_called_once()
+    time.return_value += 3600
+    svc.on_idle()
+    assert evict.call_count == 2
+
+
+@pytest.mark.parametrize("fail", [False, True])
+def test_in_process_steps_announce_programs_after_commit(
+    fail, in_process_ispyb, mocker
+):
+    in_process_ispyb._broadcast_program_status = True
+    connection = in_process_ispyb.ispyb.conn
+
+    def broadcast(*args, **kwargs):
+        # Finished programs are only announced once the steps are committed
+        connection.commit.assert_called_once()
+
+    broadcast = mocker.patch.object(
+        in_process_ispyb._transport, "broadcast", side_effect=broadcast
+    )
+    if fail:
+        in_process_ispyb.ispyb.mx_processing.upsert_program_message.side_effect = (
+            dlstbx.services.ispybsvc.ispyb.ISPyBException()
+        )
+    commands = [
+        {
+            "ispyb_command": "update_processing_status",
+            "program_id": 1234,
+            "status": "success",
+        },
+        {"ispyb_command": "add_program_message", "program_id": 1234, "message": "x"},
+    ]
+    _send_multipart_message(in_process_ispyb, commands)
+
+    if fail:
+        connection.rollback.assert_called_once()
+        broadcast.assert_not_called()
+    else:
+        broadcast.assert_called_once_with(
+            PROGRAM_STATUS_TOPIC,
+            {"program_id": 1234, "status": "success"},
+            transaction=mock.ANY,
+        )
+    assert in_process_ispyb._held_announcements is None
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import datetime
+
+import ispyb.sqlalchemy as models
+import pytest
+import sqlalchemy
+import sqlalchemy.orm
+
+import dlstbx.services.ispybsvc_buffer as buffer
+
+
+@pytest.fixture
+def buffer_session():
+    # Minimal stand-ins for the buffer and program tables, as the ISPyB column
+    # types can not be created in SQLite
+    engine = sqlalchemy.create_engine("sqlite://", poolclass=sqlalchemy.pool.StaticPool)
+    with engine.begin() as connection:
+        for model in (models.AutoProcProgram, models.ZcZocaloBuffer):
+            table = model.__table__
+            primary_key = ", ".join(f'"{c.name}"' for c in table.primary_key)
+            columns = ", ".join(f'"{c.name}"' for c in table.c)
+            connection.exec_driver_sql(
+                f'CREATE TABLE "{table.name}" ({columns}, PRIMARY KEY ({primary_key}))'
+            )
+    statements = []
+    sqlalchemy.event.listen(
+        engine,
+        "before_cursor_execute",
+        lambda conn, cursor, statement, *args: statements.append(statement),
+    )
+    buffer.clear_cache()
+    with sqlalchemy.orm.Session(bind=engine) as session:
+        session.statements = statements
+        yield session
+    buffer.clear_cache()
+    engine.dispose()
+
+
+def test_load_many_and_cache(buffer_session):
+    for uuid in (1, 2):
+        buffer.store(
+            session=buffer_session, program=10, uuid=uuid, reference=100 + uuid
+        )
+    buffer.clear_cache()
+
+    buffer_session.statements.clear()
+    assert buffer.load_many(session=buffer_session, program=10, uuids=[1, 2, 3]) == {
+        1: 101,
+        2: 102,
+    }
+    assert len(buffer_session.statements) == 1
+
+    # Resolved references are now served from the cache
+    assert buffer.load(session=buffer_session, program=10, uuid=2).value == 102
+    assert buffer.load_many(session=buffer_session, program=10, uuids=[1, 2]) == {
+        1: 101,
+        2: 102,
+    }
+    assert len(buffer_session.statements) == 1
+
+    # Storing a reference again replaces the cached value
+    buffer.store(session=buffer_session, program=10, uuid=2, reference=112)
+    assert buffer.load(session=buffer_session, program=10, uuid=2).value == 112
+
+    assert buffer.load(session=buffer_session, program=11, uuid=1) == (False, None)
+
+
+def test_string_uuids(buffer_session):
+    # Program IDs and UUIDs may arrive as strings, eg. after parameter
+    # substitution, and must still resolve
+    buffer.store(session=buffer_session, program="10", uuid="1", reference=101)
+    buffer.store(session=buffer_session, program=10, uuid=2, reference=102)
+    assert buffer.load(session=buffer_session, program="10", uuid=1).value == 101
+    assert buffer.load_many(
+        session=buffer_session, program="10", uuids=["1", 2, "3"]
+    ) == {"1": 101, 2: 102}
+
+    buffer.clear_cache()
+    assert buffer.load(session=buffer_session, program=10, uuid="2").value == 102
+    assert buffer.load_many(session=buffer_session, program=10, uuids=["1", "2"]) == {
+        "1": 101,
+        "2": 102,
+    }
+
+
+def test_evict(buffer_session):
+    now = datetime.datetime.now()
+    programs = {
+        1: {"processingEndTime": now - datetime.timedelta(days=31)},
+        2: {"processingEndTime": now - datetime.timedelta(days=5)},
+        3: {"recordTimeStamp": now - datetime.timedelta(days=61)},
+        4: {"recordTimeStamp": now - datetime.timedelta(days=40)},
+    }
+    for program, times in programs.items():
+        buffer_session.add(models.AutoProcProgram(autoProcProgramId=program, **times))
+        for uuid in range(3):
+            buffer_session.add(
+                models.ZcZocaloBuffer(
+                    AutoProcProgramID=program, UUID=uuid, Reference=uuid
+                )
+            )
+    buffer_session.commit()
+    assert buffer.load(session=buffer_session, program=1, uuid=0).success
+
+    # Only a limited number of batches is deleted per call
+    assert buffer.evict(session=buffer_session, batch_size=1, max_batches=1) == 3
+    assert buffer.evict(session=buffer_session, batch_size=1) == 3
+    remaining = buffer_session.query(models.ZcZocaloBuffer.AutoProcProgramID).distinct()
+    assert sorted(row.AutoProcProgramID for row in remaining) == [2, 4]
+    assert not buffer.load(session=buffer_session, program=1, uuid=0).success
@@ -1,10 +1,14 @@
 from __future__ import annotations
 
+import logging
 from unittest import mock
 
 import workflows.transport.common_transport
 from workflows.recipe.wrapper import RecipeWrapper
 
+import dlstbx.services.per_image_analysis
+import dlstbx.util.per_image_analysis
+import dlstbx.util.sanity
 from dlstbx.services.per_image_analysis import DLSPerImageAnalysis
 
 
@@ -123,3 +127,161 @@ def test_per_image_analysis_h5(dials_data, mocker):
         },
         transaction=mock.ANY,
     )
+
+
+def test_per_image_analysis_h5_reuses_experiments(dials_data, mocker):
+    image = dials_data("vmxi_thaumatin") / "image_15799_master.h5"
+    pia = DLSPerImageAnalysis()
+    setattr(pia, "_transport", mock.Mock())
+    pia.initializing()
+    from_filenames = mocker.spy(
+        dlstbx.util.per_image_analysis.ExperimentListFactory, "from_filenames"
+    )
+    t = mock.create_autospec(workflows.transport.common_transport.CommonTransport)
+    for image_number in (1, 2, 3):
+        m = generate_recipe_message(
+            parameters={
+                "d_min": 4,
+                "scan_range": f"{image_number},{image_number}",
+            },
+        )
+        rw = RecipeWrapper(message=m, transport=t)
+        send_to = mocker.spy(rw, "send_to")
+        pia.per_image_analysis(
+            rw,
+            {"subscription": mock.sentinel},
+            {"file": image.strpath, "file-number": image_number},
+        )
+        send_to.assert_called_with(
+            "result",
+            mock.ANY,
+            transaction=mock.ANY,
+        )
+        assert send_to.call_args.args[1]["file-number"] == image_number
+    from_filenames.assert_called_once()
+    assert pia._experiments_cache.hits == 2
+    # Models are loaded into copies of the cached experiments
+    (cached,) = pia._experiments_cache._cache.values()
+    assert cached[0].beam is None
+
+
+def test_experiments_cache_follows_master_file(tmp_path, mocker):
+    def from_filenames(*args, **kwargs):
+        expt = mock.Mock()
+        expt.imageset.__len__ = mock.Mock(return_value=image_count)
+        return [expt]
+
+    image_count = 10
+    from_filenames = mocker.patch.object(
+        dlstbx.util.per_image_analysis.ExperimentListFactory,
+        "from_filenames",
+        side_effect=from_filenames,
+    )
+    master = tmp_path / "image_1_master.h5"
+    master.write_bytes(b"master")
+    data_file = tmp_path / "image_1_data_000001.h5"
+    data_file.write_bytes(b"1")
+    cache = dlstbx.util.per_image_analysis.ExperimentListCache()
+
+    first = cache.get(master, 1)
+    assert cache.get(master, 10) is first
+    assert from_filenames.call_count == 1
+
+    # Images written to the data files do not invalidate the cache
+    data_file.write_bytes(b"12")
+    (tmp_path / "image_1_data_000002.h5").write_bytes(b"1")
+    assert cache.get(master, 5) is first
+
+    # Images beyond those known from the previous import cause a re-import
+    image_count = 20
+    second = cache.get(master, 11)
+    assert second is not first
+    assert cache.get(master, 20) is second
+
+    # As does a changed master file
+    master.write_bytes(b"new master")
+    assert cache.get(master) is not second
+    assert from_filenames.call_count == 3
+    assert (cache.hits, cache.misses) == (3, 3)
+
+
+def test_cache_statistics_are_reported_periodically(mocker, caplog):
+    pia = DLSPerImageAnalysis(environment={"cache-statistics-interval": 60})
+    setattr(pia, "_transport", mock.Mock())
+    mocker.patch.object(dlstbx.util.sanity, "get_missing_file_systems", return_value=[])
+    mocker.patch("workflows.recipe.wrap_subscribe")
+    pia.initializing()
+    pia._experiments_cache.hits = 5
+    pia._experiments_cache.misses = 1
+    mocker.patch.object(
+        dlstbx.services.per_image_analysis,
+        "find_spots_phil_cache",
+        hits=7,
+        misses=2,
+        time_saved=1.5,
+    )
+    time = mocker.patch.object(dlstbx.services.per_image_analysis.time, "time")
+    caplog.set_level(logging.INFO)
+
+    time.return_value = pia._cache_statistics_reported + 30
+    pia._report_cache_statistics()
+    assert "Experiment list cache" not in caplog.text
+    time.return_value = pia._cache_statistics_reported + 60
+    pia._report_cache_statistics()
+    assert "Experiment list cache: 5 hits, 1 misses" in caplog.text
+    assert "PHIL parameter cache: 7 hits, 2 misses, 1.50 seconds saved" in caplog.text
+
+
+def test_per_image_analysis_h5_batched(dials_data, mocker):
+    image = dials_data("vmxi_thaumatin") / "image_15799_master.h5"
+    pia = DLSPerImageAnalysis(environment={"batch-size": 3, "batch-window": 60})
+    setattr(pia, "_transport", mock.Mock())
+    pia.initializing()
+    do_batch = mocker.spy(
+        dlstbx.services.per_image_analysis, "do_per_image_analysis_batch"
+    )
+    t = mock.create_autospec(workflows.transport.common_transport.CommonTransport)
+    send_to = {}
+    for image_number in (2, 1, 3):
+        m = generate_recipe_message(
+            parameters={"d_min": 4, "scan_range": f"{image_number},{image_number}"},
+        )
+        rw = RecipeWrapper(message=m, transport=t)
+        send_to[image_number] = mocker.spy(rw, "send_to")
+        pia.batch_per_image_analysis(
+            rw,
+            {"subscription": mock.sentinel, "message-id": image_number},
+            {"file": image.strpath, "file-number": image_number},
+        )
+        if image_number != 3:
+            # Nothing happens until the batch is complete
+            send_to[image_number].assert_not_called()
+            t.ack.assert_not_called()
+
+    do_batch.assert_called_once()
+    assert do_batch.call_args.args[1].scan_range == (1, 3)
+    t.transaction_begin.assert_called_once()
+    assert t.ack.call_count == 3
+    for image_number, spy in send_to.items():
+        spy.assert_called_once_with(
+            "result",
+            {
+                **dict.fromkeys(
+                    (
+                        "d_min_distl_method_1",
+                        "d_min_distl_method_2",
+                        "estimated_d_min",
+                        "n_spots_4A",
+                        "n_spots_no_ice",
+                        "n_spots_total",
+                        "noisiness_method_1",
+                        "noisiness_method_2",
+                        "total_intensity",
+                    ),
+                    mock.ANY,
+                ),
+                "file": image.strpath,
+                "file-number": image_number,
+            },
+            transaction=mock.ANY,
+        )
@@ -18,7 +18,7 @@ from ispyb.sqlalchemy import (
 from workflows.recipe.wrapper import RecipeWrapper
 from workflows.transport.offline_transport import OfflineTransport
 
-from dlstbx.services.trigger import DLSTrigger
+from dlstbx.services.trigger import DLSTrigger, RelatedCandidate
 
 
 @pytest.fixture
@@ -165,6 +165,81 @@ def test_multiplex(
         } | ({("spacegroup", spacegroup)} if spacegroup else set())
 
 
+def test_multiplex_checkpoint_memoises_candidates(
+    insert_multiplex_input,
+    db_session,
+    testconfig,
+    mocker,
+    monkeypatch,
+):
+    monkeypatch.setenv("ISPYB_CREDENTIALS", testconfig)
+    dcids = insert_multiplex_input
+    # A xia2-dials job that is yet to start for the first data collection
+    pj = ProcessingJob(dataCollectionId=dcids[0], automatic=True)
+    app = AutoProcProgram(ProcessingJob=pj, processingPrograms="xia2 dials")
+    db_session.add_all([pj, app])
+    db_session.commit()
+    message = {
+        "recipe": {
+            "1": {
+                "parameters": {
+                    "target": "multiplex",
+                    "dcid": dcids[-1],
+                    "wavelength": "1.03936",
+                    "automatic": True,
+                    "beamline": "i99",
+                    "trigger_every_collection": True,
+                    "related_dcids": [
+                        {"dcids": dcids[:-1], "sample_group_id": 123},
+                    ],
+                },
+            },
+        },
+        "recipe-pointer": 1,
+    }
+    header = {
+        "message-id": mock.sentinel,
+        "subscription": mock.sentinel,
+    }
+
+    t = OfflineTransport()
+    rw = RecipeWrapper(message=message, transport=t)
+    trigger = DLSTrigger()
+    trigger.transport = t
+    trigger.start()
+    checkpoint = mocker.spy(rw, "checkpoint")
+    trigger.trigger(rw, header, message)
+    checkpoint.assert_called_once()
+    checkpointed = checkpoint.mock_calls[0].args[0]
+    assert checkpointed["trigger-status"] == {"ntry": 1}
+    candidates = checkpointed["trigger-candidates"]
+    assert set(candidates) == {str(dcids[1]), str(dcids[2])}
+    assert {c["spacegroup"] for c in candidates[str(dcids[1])]} == {None, "P422"}
+    assert all(len(c["files"]) == 2 for c in candidates[str(dcids[2])])
+
+    # On the next attempt only the pending data collection is looked up again
+    discover = mocker.spy(trigger, "_discover_related_candidates")
+    trigger.trigger(rw, header, checkpointed)
+    assert discover.spy_return[1].keys() == {dcids[0], dcids[1], dcids[2]}
+    assert discover.spy_return[0].keys() == {dcids[0]}
+
+
+def test_memoise_candidates_skips_dcids_without_results():
+    candidate = RelatedCandidate(
+        dcid=1,
+        appid=10,
+        wavelength=1.0,
+        start_image=1,
+        number_of_images=100,
+        spacegroup=None,
+        files=["/path/to/integrated.expt", "/path/to/integrated.refl"],
+    )
+    memoised = DLSTrigger._memoise_candidates(
+        waiting={2: [20]}, candidates={1: [candidate], 2: [], 3: []}
+    )
+    assert memoised == {"1": [candidate.model_dump()]}
+
+
 @pytest.fixture
 def insert_dimple_input(db_session):
     dcg = DataCollectionGroup(sessionId=55167)
@@ -370,6 +445,42 @@ def test_fast_ep(db_session_factory, testconfig, mocker, monkeypatch):
         }
 
 
+def test_fast_ep_unknown_dcid(db_session_factory, testconfig, mocker, monkeypatch):
+    monkeypatch.setenv("ISPYB_CREDENTIALS", testconfig)
+    message = {
+        "recipe": {
+            "1": {
+                "service": "DLS Trigger",
+                "queue": "trigger",
+                "parameters": {
+                    "target": "fast_ep",
+                    "dcid": 999999999,
+                    "scaling_id": "123456",
+                    "mtz": "/path/to/fast_dp/fast_dp.mtz",
+                },
+            }
+        },
+        "recipe-pointer": 1,
+    }
+    header = {
+        "message-id": mock.sentinel,
+        "subscription": mock.sentinel,
+    }
+
+    t = OfflineTransport()
+    rw = RecipeWrapper(message=message, transport=t)
+    trigger = DLSTrigger()
+    trigger.transport = t
+    trigger.start()
+    send = mocker.spy(rw, "send")
+    nack = mocker.spy(t, "nack")
+    spy_log_error = mocker.spy(trigger.log, "error")
+    trigger.trigger(rw, header, message)
+    send.assert_not_called()
+    nack.assert_called_once()
+    assert "no data collection with dcid=999999999" in spy_log_error.call_args.args[0]
+
+
 def test_big_ep(db_session_factory, testconfig, mocker, monkeypatch, tmp_path):
     monkeypatch.setenv("ISPYB_CREDENTIALS", testconfig)
     dcid = 1002287
@@ -854,3 +965,121 @@ def test_invalid_params(mocker):
         in spy_log_error.call_args.args[0]
     )
     tnack.assert_called_once()
+
+
+def test_waiting_message_is_held_until_program_finishes(mocker):
+    message = {
+        "recipe": {
+            "1": {
+                "service": "DLS Trigger",
+                "queue": "trigger",
+                "parameters": {
+                    "target": "multiplex",
+                },
+            },
+        },
+        "recipe-pointer": 1,
+    }
+    header = {
+        "message-id": mock.sentinel,
+        "subscription": mock.sentinel,
+    }
+
+    t = OfflineTransport()
+    rw = RecipeWrapper(message=message, transport=t)
+    trigger = DLSTrigger(environment={"held-messages": 2})
+    trigger.transport = t
+    trigger.start()
+
+    def trigger_multiplex(rw, transaction, **kwargs):
+        trigger._checkpoint_waiting(
+            rw,
+            {"trigger-status": {"ntry": 1}},
+            delay=8,
+            transaction=transaction,
+            program_ids=[42],
+        )
+        return {"success": True}
+
+    mocker.patch.object(trigger, "trigger_multiplex", side_effect=trigger_multiplex)
+    checkpoint = mocker.spy(rw, "checkpoint")
+    ack = mocker.spy(t, "ack")
+
+    trigger.trigger(rw, header, message)
+    checkpoint.assert_not_called()
+    ack.assert_not_called()
+
+    # Messages are released as soon as a program they wait for has finished,
+    # without this counting as one of the attempts
+    trigger.receive_program_status({}, {"program_id": 41, "status": "success"})
+    checkpoint.assert_not_called()
+    trigger.receive_program_status({}, {"program_id": 42, "status": "failure"})
+    checkpoint.assert_called_once_with(
+        {"trigger-status": {"ntry": 0}}, delay=0, transaction=mocker.ANY
+    )
+    ack.assert_called_once()
+
+    # Otherwise they are released once the backoff delay has passed
+    trigger.trigger(rw, header, message)
+    trigger.release_expired_messages()
+    assert checkpoint.call_count == 1
+    trigger._held_messages[0].deadline = 0
+    trigger.release_expired_messages()
+    checkpoint.assert_called_with(
+        {"trigger-status": {"ntry": 1}}, delay=0, transaction=mocker.ANY
+    )
+    assert ack.call_count == 2
+
+
+def test_expired_messages_are_released_while_messages_keep_arriving(mocker):
+    message = {
+        "recipe": {
+            "1": {
+                "service": "DLS Trigger",
+                "queue": "trigger",
+                "parameters": {
+                    "target": "multiplex",
+                },
+            },
+        },
+        "recipe-pointer": 1,
+    }
+    header = {
+        "message-id": mock.sentinel,
+        "subscription": mock.sentinel,
+    }
+
+    t = OfflineTransport()
+    rw = RecipeWrapper(message=message, transport=t)
+    trigger = DLSTrigger(environment={"held-messages": 2})
+    trigger.transport = t
+    trigger.start()
+
+    def trigger_multiplex(rw, transaction, **kwargs):
+        trigger._checkpoint_waiting(
+            rw,
+            {"trigger-status": {"ntry": 1}},
+            delay=8,
+            transaction=transaction,
+            program_ids=[42],
+        )
+        return {"success": True}
+
+    mocker.patch.object(trigger, "trigger_multiplex", side_effect=trigger_multiplex)
+    checkpoint = mocker.spy(rw, "checkpoint")
+
+    # The service is never idle, so expired messages must be released when
+    # other trigger messages arrive
+    trigger.trigger(rw, header, message)
+    trigger._held_messages[0].deadline = 0
+    trigger.trigger(rw, header, message)
+    checkpoint.assert_called_once_with(
+        {"trigger-status": {"ntry": 1}}, delay=0, transaction=mocker.ANY
+    )
+    assert len(trigger._held_messages) == 1
+
+    # ... or when the status of an unrelated program is broadcast
+    trigger._held_messages[0].deadline = 0
+    trigger.receive_program_status({}, {"program_id": 41, "status": "success"})
+    assert checkpoint.call_count == 2
+    assert not trigger._held_messages
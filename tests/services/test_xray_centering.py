@@ -115,6 +115,75 @@ def test_xray_centering(mocker, tmp_path):
     )
 
 
+def test_xray_centering_incremental(mocker, tmp_path):
+    parameters = {
+        "dcid": "6153461",
+        "experiment_type": "SAD",
+        "output": tmp_path / "Dials5AResults.json",
+        "beamline": "i03",
+        "sample_id": 3351191,
+        "provisional_rows": 2,
+    }
+    gridinfo = {
+        "orientation": "horizontal",
+        "snapshot_offsetYPixel": 57.0822,
+        "gridInfoId": 1337162,
+        "dx_mm": 0.04,
+        "steps_y": 5.0,
+        "micronsPerPixelX": 0.438,
+        "steps_x": 7.0,
+        "micronsPerPixelY": 0.438,
+        "snaked": 1,
+        "snapshot_offsetXPixel": 79.9863,
+        "dy_mm": 0.04,
+    }
+    m = generate_recipe_message(parameters, gridinfo)
+    header = {
+        "message-id": mock.sentinel,
+        "subscription": mock.sentinel,
+    }
+    t = OfflineTransport()
+    xc = dlstbx.services.xray_centering.DLSXRayCentering(
+        environment={"incremental": True}
+    )
+    xc.transport = t
+    xc.start()
+    rw = RecipeWrapper(message=m, transport=t)
+    send_to = mocker.spy(rw, "send_to")
+    ack = mocker.spy(t, "ack")
+    # fmt: off
+    spot_counts = [1, 0, 0, 0, 0, 1, 0, 239, 29, 3, 4, 0, 1, 0, 5, 0, 190, 249, 230, 206, 190, 202, 190, 184, 208, 107, 1, 0, 0, 0, 0, 236, 183, 193, 230]
+    # fmt: on
+    for i, n_spots in enumerate(spot_counts):
+        message = {
+            "n_spots_total": n_spots,
+            "file-number": i + 1,
+            "file-seen-at": time.time(),
+        }
+        xc.add_pia_result(rw, header, message)
+        if i < len(spot_counts) - 1:
+            # Messages are acknowledged as they arrive
+            assert ack.call_count == i + 1
+
+    provisional = [
+        c.args[1] for c in send_to.call_args_list if c.args[0] == "provisional"
+    ]
+    # Provisional results are sent once two lines of the grid are complete,
+    # and then only when the centre moves
+    assert [p["rows_complete"] for p in provisional] == [2, 3, 4]
+    assert all(p["status"] == "provisional" for p in provisional)
+    assert provisional[0]["results"][0]["best_image"] == 8
+    assert provisional[-1]["results"][0]["best_image"] == 18
+
+    assert send_to.call_args.args[0] == "success"
+    success = send_to.call_args.args[1]
+    assert success["status"] == "success"
+    assert success["results"][0]["centre_x_box"] == 4.928571428571429
+    assert success["results"][0]["centre_y_box"] == 3.2857142857142856
+    assert ack.call_count == len(spot_counts)
+    assert not xc._centering_data
+
+
 def test_xray_centering_invalid_parameters(mocker, tmp_path):
     # https://ispyb.diamond.ac.uk/dc/visit/cm28170-2/id/6153461
     parameters = {
@@ -337,3 +406,106 @@ def test_xray_centering_3d_multisample_pin(mocker):
         },
         transaction=mock.ANY,
     )
+
+
+def test_shard_for_dcids():
+    dcids = range(6000000, 6002000)
+    shards = [dlstbx.services.xray_centering.shard_for_dcids([d], 4) for d in dcids]
+    assert set(shards) == {0, 1, 2, 3}
+    # Grouped data collections end up on the same shard
+    assert dlstbx.services.xray_centering.shard_for_dcids(
+        [6000010, 6000005], 4
+    ) == dlstbx.services.xray_centering.shard_for_dcids([6000005], 4)
+    # Adding a shard only moves data collections onto the new shard
+    for dcid, shard in zip(dcids, shards):
+        new_shard = dlstbx.services.xray_centering.shard_for_dcids([dcid], 5)
+        assert new_shard in (shard, 4)
+
+
+def test_xray_centering_sharded_handover(mocker, tmp_path):
+    parameters = {
+        "dcid": "6153461",
+        "experiment_type": "SAD",
+        "output": str(tmp_path / "Dials5AResults.json"),
+        "beamline": "i03",
+        "sample_id": 3351191,
+    }
+    gridinfo = {
+        "orientation": "horizontal",
+        "snapshot_offsetYPixel": 57.0822,
+        "gridInfoId": 1337162,
+        "dx_mm": 0.04,
+        "steps_y": 5.0,
+        "micronsPerPixelX": 0.438,
+        "steps_x": 7.0,
+        "micronsPerPixelY": 0.438,
+        "snaked": 1,
+        "snapshot_offsetXPixel": 79.9863,
+        "dy_mm": 0.04,
+    }
+    shard = dlstbx.services.xray_centering.shard_for_dcids([6153461], 2)
+    environment = {"shards": 2, "shard": shard}
+    header = {
+        "message-id": mock.sentinel,
+        "subscription": mock.sentinel,
+    }
+    # fmt: off
+    spot_counts = [1, 0, 0, 0, 0, 1, 0, 239, 29, 3, 4, 0, 1, 0, 5, 0, 190, 249, 230, 206, 190, 202, 190, 184, 208, 107, 1, 0, 0, 0, 0, 236, 183, 193, 230]
+    # fmt: on
+    messages = [
+        {"n_spots_total": n_spots, "file-number": i + 1, "file-seen-at": time.time()}
+        for i, n_spots in enumerate(spot_counts)
+    ]
+    t = OfflineTransport()
+    send = mocker.spy(t, "send")
+    ack = mocker.spy(t, "ack")
+
+    # Messages on the main queue are forwarded to the shard for the DCID
+    xc = dlstbx.services.xray_centering.DLSXRayCentering(
+        environment={"shards": 2, "shard": 1 - shard}
+    )
+    xc.transport = t
+    xc.start()
+    m = generate_recipe_message(parameters, gridinfo)
+    # Forwarded messages must be serializable
+    m["environment"] = {"ID": "f5ec4e0c-1d5f-4e47-8a5b-6fd8a4d0a0a5"}
+    rw = RecipeWrapper(message=m, transport=t)
+    xc.route_pia_result(rw, header, messages[0])
+    assert send.call_args.args[0] == f"reduce.xray_centering.shard.{shard}"
+    assert send.call_args.args[1]["payload"] == messages[0]
+    # and forwarded again if they end up on the wrong shard
+    send.reset_mock()
+    xc.add_pia_result(rw, header, messages[0])
+    assert send.call_args.args[0] == f"reduce.xray_centering.shard.{shard}"
+    assert not xc._centering_data
+
+    # The shard hands over the session when shutting down
+    xc = dlstbx.services.xray_centering.DLSXRayCentering(environment=environment)
+    xc.transport = t
+    xc.start()
+    ack.reset_mock()
+    send.reset_mock()
+    for message in messages[:20]:
+        xc.add_pia_result(rw, header, message)
+    assert ack.call_count == 0
+    xc.in_shutdown()
+    assert ack.call_count == 20
+    assert send.call_args.args[0] == f"reduce.xray_centering.shard.{shard}"
+    handover = send.call_args.args[1]
+    assert handover["payload"]["xray-centering-handover"]["images_seen"] == 20
+
+    # and the next instance of the shard resumes it
+    xc = dlstbx.services.xray_centering.DLSXRayCentering(environment=environment)
+    xc.transport = t
+    xc.start()
+    rw = RecipeWrapper(message=handover, transport=t)
+    send_to = mocker.spy(rw, "send_to")
+    xc.add_pia_result(rw, header, rw.payload)
+    for message in messages[20:]:
+        xc.add_pia_result(rw, header, message)
+    assert send_to.call_args.args[0] == "success"
+    result = send_to.call_args.args[1]["results"][0]
+    assert result["centre_x_box"] == 4.928571428571429
+    assert result["centre_y_box"] == 3.2857142857142856
+    assert result["total_count"] == 2930.0
+    assert not xc._centering_data
@@ -0,0 +1,32 @@
+from __future__ import annotations
+
+import h5py
+import numpy as np
+import pytest
+
+from dlstbx.swmr import h5check
+
+
+@pytest.mark.parametrize("frames_per_chunk", [1, 3])
+def test_get_chunk_sizes(frames_per_chunk, tmp_path):
+    with h5py.File(tmp_path / "data.h5", "w", libver="latest") as f:
+        dset = f.create_dataset(
+            "data",
+            shape=(10, 4, 4),
+            chunks=(frames_per_chunk, 4, 4),
+            compression="gzip",
+            dtype="i4",
+        )
+        assert h5check.get_written_frames(dset).size == 0
+
+        for frame in (0, 1, 7, 9):
+            dset[frame] = np.ones((4, 4))
+        frames, sizes = h5check.get_chunk_sizes(dset)
+
+    if frames_per_chunk == 1:
+        assert frames.tolist() == [0, 1, 7, 9]
+    else:
+        # Any frame sharing a chunk with a written frame counts as written
+        assert frames.tolist() == [0, 1, 2, 6, 7, 8, 9]
+    assert (sizes > 0).all()
+    assert len(sizes) == len(frames)
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import time
+
+import h5py
+import numpy as np
+import pytest
+
+hdf5plugin = pytest.importorskip("hdf5plugin")
+
+from dlstbx.swmr import h5maker, h5rewrite  # noqa: E402
+
+
+@pytest.fixture
+def bitshuffle_master(tmp_path):
+    prefix = tmp_path / "source" / "image"
+    prefix.parent.mkdir()
+    h5maker.main(
+        prefix, shape=(64, 64), block_size=10, nblocks=3, compression="bitshuffle"
+    )
+    return prefix.parent / "image_master.h5"
+
+
+def read_images(master_h5):
+    with h5py.File(master_h5, "r") as f:
+        return f["entry/data/data"][()]
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+@pytest.mark.parametrize("direct_chunks", [True, False])
+def test_rewrite(bitshuffle_master, tmp_path, direct_chunks, processes, caplog):
+    out_h5 = tmp_path / "rewritten_master.h5"
+    with caplog.at_level("INFO", logger="dlstbx.h5rewrite"):
+        h5rewrite.rewrite(
+            bitshuffle_master,
+            out_h5,
+            direct_chunks=direct_chunks,
+            processes=processes,
+        )
+    np.testing.assert_array_equal(read_images(out_h5), read_images(bitshuffle_master))
+    n_direct = 30 if direct_chunks else 0
+    assert "Wrote 30 images in" in caplog.text
+    assert f"{n_direct} copied as compressed chunks" in caplog.text
+
+
+def test_rewrite_image_range(bitshuffle_master, tmp_path):
+    out_h5 = tmp_path / "rewritten_master.h5"
+    h5rewrite.rewrite(bitshuffle_master, out_h5, image_range=(5, 25))
+    np.testing.assert_array_equal(
+        read_images(out_h5), read_images(bitshuffle_master)[5:25]
+    )
+
+
+def test_frame_reader_falls_back_for_other_compression(tmp_path):
+    prefix = tmp_path / "image"
+    h5maker.main(prefix, shape=(16, 16), block_size=5, nblocks=2, compression="gzip")
+    with h5py.File(tmp_path / "image_master.h5", "r") as f:
+        with h5rewrite.FrameReader(f["entry/data/data"]) as frames:
+            pipeline = ((hdf5plugin.BSHUF_ID, (2,)),)
+            assert frames.chunk(3, pipeline) is None
+            np.testing.assert_array_equal(frames[3], f["entry/data/data"][3])
+
+
+@pytest.mark.benchmark
+def test_benchmark_rewrite(tmp_path, capsys):
+    prefix = tmp_path / "source" / "image"
+    prefix.parent.mkdir()
+    h5maker.main(
+        prefix, shape=(512, 512), block_size=100, nblocks=4, compression="bitshuffle"
+    )
+    master_h5 = prefix.parent / "image_master.h5"
+
+    timings = {}
+    for name, kwargs in (
+        ("decode/encode", {"direct_chunks": False}),
+        ("direct chunks", {"direct_chunks": True}),
+        ("direct chunks, 4 processes", {"direct_chunks": True, "processes": 4}),
+    ):
+        out_h5 = tmp_path / name.replace(" ", "_").replace(",", "") / "out_master.h5"
+        out_h5.parent.mkdir()
+        start = time.perf_counter()
+        h5rewrite.rewrite(master_h5, out_h5, **kwargs)
+        timings[name] = time.perf_counter() - start
+
+    with capsys.disabled():
+        print(
+            "\nRewriting 400 512x512 images: "
+            + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items())
+        )
@@ -1,6 +1,12 @@
 from __future__ import annotations
 
 import datetime
+from unittest import mock
+
+import ispyb.sqlalchemy as models
+import pytest
+import sqlalchemy
+import sqlalchemy.orm
 
 from dlstbx import crud, schemas
 
@@ -33,6 +39,11 @@ def test_get_blsample(db_session):
     assert sample.name == "XPDF-2"
 
 
+def test_get_proposal_for_dcid(db_session):
+    proposal = crud.get_proposal_for_dcid(993677, db_session)
+    assert proposal.proposalId
+
+
 def test_get_dcids_for_sample_id(db_session):
     assert crud.get_dcids_for_sample_id(374695, db_session) == [993677, 6017405]
 
@@ -137,3 +148,149 @@ def test_insert_dimple_results(db_session):
         session=db_session,
     )
     assert db_mxmrrun.mxMRRunId
+
+
+def test_upsert_quality_indicators(db_session):
+    dcid = 993677
+    assert crud.upsert_quality_indicators(
+        [
+            {"dataCollectionId": dcid, "imageNumber": 1, "spotTotal": 10},
+            {"dataCollectionId": dcid, "imageNumber": 2, "spotTotal": 20},
+        ],
+        db_session,
+    )
+    # Existing values are only overwritten where new values are given
+    crud.upsert_quality_indicators(
+        [
+            {
+                "dataCollectionId": dcid,
+                "imageNumber": 2,
+                "spotTotal": None,
+                "dozor_score": 1.5,
+            }
+        ],
+        db_session,
+    )
+    iqi = (
+        db_session.query(models.ImageQualityIndicators)
+        .filter(models.ImageQualityIndicators.dataCollectionId == dcid)
+        .filter(models.ImageQualityIndicators.imageNumber == 2)
+        .one()
+    )
+    assert iqi.spotTotal == 20
+    assert iqi.dozor_score == 1.5
+
+
+def test_create_processing_job(db_session):
+    dcid = 993677
+    jobid = crud.create_processing_job(
+        db_session,
+        dcid=dcid,
+        display_name="xia2.multiplex",
+        recipe="postprocessing-xia2-multiplex",
+        comments="triggered by test",
+        automatic=True,
+        parameters=[("data", "foo.expt;foo.refl"), ("data", "bar.expt;bar.refl")],
+        sweeps=[(dcid, 1, 3600), (1066786, 1, 1800)],
+    )
+    pj = (
+        db_session.query(models.ProcessingJob)
+        .filter(models.ProcessingJob.processingJobId == jobid)
+        .one()
+    )
+    assert pj.dataCollectionId == dcid
+    assert pj.recipe == "postprocessing-xia2-multiplex"
+    assert pj.automatic
+    assert sorted(
+        (p.parameterKey, p.parameterValue) for p in pj.ProcessingJobParameters
+    ) == [("data", "bar.expt;bar.refl"), ("data", "foo.expt;foo.refl")]
+    assert sorted(
+        (s.dataCollectionId, s.startImage, s.endImage)
+        for s in pj.ProcessingJobImageSweep
+    ) == [(dcid, 1, 3600), (1066786, 1, 1800)]
+
+
+@pytest.fixture
+def detector_session_factory():
+    # A minimal stand-in for the Detector table, as the ISPyB column types
+    # can not be created in SQLite
+    engine = sqlalchemy.create_engine("sqlite://", poolclass=sqlalchemy.pool.StaticPool)
+    columns = ", ".join(
+        f'"{c.name}"' + (" PRIMARY KEY" if c.primary_key else "")
+        for c in models.Detector.__table__.c
+    )
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f"CREATE TABLE Detector ({columns})")
+    session_factory = sqlalchemy.orm.sessionmaker(bind=engine)
+    with session_factory() as session:
+        session.add(models.Detector(detectorId=4, detectorModel="Excalibur"))
+        session.commit()
+    statements = []
+    sqlalchemy.event.listen(
+        engine,
+        "before_cursor_execute",
+        lambda conn, cursor, statement, *args: statements.append(statement),
+    )
+    yield session_factory, statements
+    engine.dispose()
+
+
+def test_entity_cache(detector_session_factory):
+    session_factory, statements = detector_session_factory
+    metrics = mock.Mock()
+    cache = crud.EntityCache(metrics=metrics)
+
+    with session_factory() as session:
+        det = crud.get_detector(4, session, cache=cache)
+        assert det.detectorModel == "Excalibur"
+        session.commit()
+    assert len(statements) == 1
+
+    # A hit is attached to the new session without querying the database,
+    # and changes made to it do not leak into the cache
+    with session_factory() as session:
+        det = crud.get_detector(4, session, cache=cache)
+        assert det in session
+        assert det.detectorModel == "Excalibur"
+        det.detectorModel = "Eiger2 X 4M"
+        session.rollback()
+    with session_factory() as session:
+        assert crud.get_detector(4, session, cache=cache).detectorModel == "Excalibur"
+    assert len(statements) == 1
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    # Unknown entities are not cached
+    with session_factory() as session:
+        assert crud.get_detector(5, session, cache=cache) is None
+        assert crud.get_detector(5, session, cache=cache) is None
+    assert len(statements) == 3
+    assert len(cache) == 1
+
+    cache.invalidate("detector", 4)
+    with session_factory() as session:
+        crud.get_detector(4, session, cache=cache)
+    assert len(statements) == 4
+
+    metrics.record_metric.assert_any_call(
+        "zocalo_ispyb_cache_requests_total", ["detector", "hit"]
+    )
+    metrics.record_metric.assert_any_call(
+        "zocalo_ispyb_cache_requests_total", ["detector", "miss"]
+    )
+
+
+def test_entity_cache_expiry_and_size_limit(detector_session_factory):
+    session_factory, statements = detector_session_factory
+    cache = crud.EntityCache(maxsize=2, ttl=60)
+    with session_factory() as session:
+        with mock.patch("time.monotonic", return_value=1000):
+            for key in range(3):
+                cache.get("value", key, session, lambda: f"value {key}")
+        assert len(cache) == 2
+        with mock.patch("time.monotonic", return_value=1030):
+            assert cache.get("value", 2, session, lambda: "reloaded") == "value 2"
+        with mock.patch("time.monotonic", return_value=1070):
+            assert cache.get("value", 2, session, lambda: "reloaded") == "reloaded"
+            assert cache.get("value", 0, session, lambda: "reloaded") == "reloaded"
+    cache.invalidate("value")
+    assert len(cache) == 0
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import os
+
+import pytest
+
+from dlstbx.util import inotify
+
+
+@pytest.fixture
+def events():
+    try:
+        directory_events = inotify.DirectoryEvents()
+    except (AttributeError, OSError):
+        pytest.skip("inotify not available")
+    yield directory_events
+    directory_events.close()
+
+
+def test_directory_events(events, tmp_path):
+    if inotify.filesystem_type(tmp_path) not in inotify.LOCAL_FILESYSTEMS:
+        pytest.skip("inotify not supported for temporary directory")
+    (tmp_path / "existing").write_text("content")
+    assert events.has_arrived(tmp_path / "existing") is True
+    assert events.has_arrived(tmp_path / "new") is False
+    assert events.watched_directories == 1
+
+    (tmp_path / "new").write_text("content")
+    assert events.has_arrived(tmp_path / "new") is True
+    os.rename(tmp_path / "new", tmp_path / "renamed")
+    assert events.has_arrived(tmp_path / "new") is False
+    assert events.has_arrived(tmp_path / "renamed") is True
+    (tmp_path / "existing").unlink()
+    assert events.has_arrived(tmp_path / "existing") is False
+
+    # Subdirectories are not reported as files
+    (tmp_path / "subdir").mkdir()
+    assert events.has_arrived(tmp_path / "subdir") is False
+
+    # Directories that do not exist can not be watched yet
+    assert events.has_arrived(tmp_path / "missing" / "file") is None
+
+    # Idle directories are no longer watched
+    events.max_idle = 0
+    events.process_events()
+    assert events.watched_directories == 0
+
+
+def test_unsupported_filesystem_falls_back(events, tmp_path, mocker):
+    mocker.patch.object(inotify, "filesystem_type", return_value="gpfs")
+    (tmp_path / "file").write_text("content")
+    assert events.has_arrived(tmp_path / "file") is None
+    assert events.watched_directories == 0
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import pytest
+
+from dlstbx.util.memory_transport import MemoryBroker, MemoryTransport
+
+
+@pytest.fixture
+def broker():
+    broker = MemoryBroker()
+    yield broker
+    broker.stop()
+
+
+@pytest.fixture
+def transports(broker):
+    transports = [MemoryTransport(broker) for _ in range(2)]
+    for transport in transports:
+        transport.connect()
+    yield transports
+    for transport in transports:
+        transport.disconnect()
+
+
+def test_delayed_messages_are_delivered_in_order_of_due_time(broker, transports):
+    sender, receiver = transports
+    received = []
+    receiver.subscribe("queue", lambda header, message: received.append(message))
+    for n in range(3):
+        sender.send("queue", {"n": n}, delay=0.05 * (3 - n))
+    assert broker.wait_until_idle(timeout=5)
+    assert received == [{"n": 2}, {"n": 1}, {"n": 0}]
+
+
+def test_queue_messages_are_shared_and_broadcasts_copied(broker, transports):
+    received = {0: [], 1: []}
+    for i, transport in enumerate(transports):
+        transport.subscribe(
+            "queue", lambda header, message, i=i: received[i].append(message)
+        )
+        transport.subscribe_broadcast(
+            "topic", lambda header, message, i=i: received[i].append(message)
+        )
+    for n in range(4):
+        transports[0].send("queue", n)
+    transports[0].broadcast("topic", "all")
+    assert broker.wait_until_idle(timeout=5)
+    assert sorted(received[0] + received[1], key=str) == [0, 1, 2, 3, "all", "all"]
+    assert received[0].count("all") == received[1].count("all") == 1
+    assert len(received[0]) == len(received[1]) == 3
+
+
+def test_transactions_prefetch_and_redelivery(broker, transports):
+    sender, receiver = transports
+    received, held = [], []
+
+    def callback(header, message):
+        received.append(message)
+        if message == 0 and received.count(0) == 1:
+            receiver.nack(header)
+        elif message == 1:
+            held.append(header)
+        else:
+            receiver.ack(header)
+
+    receiver.subscribe("queue", callback, acknowledgement=True, prefetch_count=1)
+    txn = sender.transaction_begin()
+    for n in range(3):
+        sender.send("queue", n, transaction=txn)
+    assert broker.wait_until_idle(timeout=5)
+    assert received == []
+    sender.transaction_commit(txn)
+    assert broker.wait_until_idle(timeout=5)
+    # Message 1 is not acknowledged, so message 2 is not delivered
+    assert received == [0, 0, 1]
+    assert broker.statistics["redelivered"] == 1
+
+    txn = receiver.transaction_begin()
+    receiver.ack(held[0], transaction=txn)
+    receiver.transaction_abort(txn)
+    assert broker.wait_until_idle(timeout=5)
+    assert received == [0, 0, 1]
+    receiver.ack(held[0])
+    assert broker.wait_until_idle(timeout=5)
+    assert received == [0, 0, 1, 2]
+
+
+def test_listeners_see_decoded_messages(broker, transports):
+    sender, receiver = transports
+    seen = []
+    broker.add_listener("queue", lambda *args: seen.append(args))
+    receiver.subscribe("queue", lambda header, message: None)
+    sender.send("queue", {"key": "value"}, headers={"custom": 1})
+    assert broker.wait_until_idle(timeout=5)
+    ((destination, header, message),) = seen
+    assert destination == "queue"
+    assert header["custom"] == 1
+    assert message == {"key": "value"}
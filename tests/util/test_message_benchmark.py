@@ -0,0 +1,39 @@
+from __future__ import annotations
+
+import pytest
+
+from dlstbx.util.message_benchmark import MessageStatistics, end_of_run, stamp
+
+
+def test_message_statistics():
+    statistics = MessageStatistics("run")
+    messages = [stamp("run", sequence, "XX") for sequence in range(5)]
+    for message in messages:
+        message["sent"] = 100.0
+    for i, message in enumerate((messages[0], messages[2], messages[1], messages[2])):
+        statistics.record(message, received_at=100.5 + i)
+    assert not statistics.complete
+    assert statistics.lost == 0
+
+    statistics.record(end_of_run("run", 5))
+    assert statistics.complete
+    summary = statistics.summary()
+    assert summary["received"] == 3
+    assert summary["lost"] == 2
+    assert summary["duplicates"] == 1
+    assert summary["reordered"] == 1
+    assert summary["seconds"] == pytest.approx(2.5)
+    assert summary["megabytes_per_second"] == pytest.approx(6 / 2.5 / 1e6)
+    assert summary["latency"]["count"] == 3
+    assert summary["latency"]["p50"] == pytest.approx(1.5)
+    assert summary["latency"]["max"] == pytest.approx(2.5)
+
+
+def test_empty_run():
+    statistics = MessageStatistics("run")
+    statistics.record(end_of_run("run", 2))
+    summary = statistics.summary()
+    assert summary["received"] == 0
+    assert summary["lost"] == 2
+    assert summary["messages_per_second"] is None
+    assert summary["latency"] == {"count": 0}
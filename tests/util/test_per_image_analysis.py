@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+import pathlib
+
+import pytest
+
+from dlstbx.util.per_image_analysis import (
+    PerImageAnalysisParameters,
+    do_per_image_analysis,
+    do_per_image_analysis_batch,
+)
+
+
+@pytest.mark.parametrize("nproc", [1, 2])
+def test_batch_matches_individual_images(dials_data, nproc):
+    image = pathlib.Path(dials_data("vmxi_thaumatin") / "image_15799_master.h5")
+    params = PerImageAnalysisParameters(d_min=4, scan_range=(1, 4))
+    batched = do_per_image_analysis_batch(image, params, nproc=nproc)
+    assert sorted(batched) == [1, 2, 3, 4]
+
+    for image_number, results in batched.items():
+        _, _, individual = do_per_image_analysis(
+            image,
+            params.model_copy(update={"scan_range": (image_number, image_number)}),
+        )
+        assert results.n_spots_total > 0
+        assert results.model_dump() == pytest.approx(individual.model_dump())
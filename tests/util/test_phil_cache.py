@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+import libtbx.phil
+
+from dlstbx.util.phil_cache import PhilParameterCache
+
+phil_scope = libtbx.phil.parse(
+    """
+    method = *fft1d fft3d
+      .type = choice
+    max_lattices = 1
+      .type = int
+    """
+)
+
+
+def test_phil_parameter_cache():
+    def customise(params):
+        params.max_lattices = 2
+
+    cache = PhilParameterCache(phil_scope, maxsize=1)
+    params = cache.get(2, customise)
+    assert params.method == "fft1d"
+    assert params.max_lattices == 2
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    # Returned parameters are independent copies of the cached parameters
+    params.method = "fft3d"
+    params = cache.get(2, customise)
+    assert params.method == "fft1d"
+    assert params.max_lattices == 2
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # Least recently used parameters are discarded
+    assert cache.get(None).max_lattices == 1
+    cache.get(2, customise)
+    assert (cache.hits, cache.misses) == (1, 3)
@@ -0,0 +1,29 @@
+from __future__ import annotations
+
+import sys
+
+import pytest
+
+from dlstbx.util.plugins import LazyPlugins, entry_points
+
+
+def test_lazy_plugins_only_load_on_lookup(monkeypatch):
+    monkeypatch.delitem(sys.modules, "dlstbx.services.images", raising=False)
+    services = LazyPlugins("workflows.services")
+    assert "DLSImages" in services
+    assert "DLSImages" in set(services)
+    assert len(services) == len(entry_points("workflows.services"))
+    assert "dlstbx.services.images" not in sys.modules
+
+    images = services["DLSImages"]
+    assert images.__name__ == "DLSImages"
+    assert services["DLSImages"] is images
+
+    assert "no-such-service" not in services
+    assert services.get("no-such-service") is None
+    with pytest.raises(KeyError):
+        services["no-such-service"]
+
+
+def test_entry_points_are_cached():
+    assert entry_points("workflows.services") is entry_points("workflows.services")
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import json
+import time
 from unittest import mock
 
 import numpy as np
@@ -165,3 +166,46 @@ def test_gridscan3d_for_multipin_sample():
         # check that the results are JSON-serializable
         json.dumps(result_d)
         assert result_d == expected_results[result_num]
+
+
+def _multipin_grid(n_crystals: int, size: int = 100):
+    # Synthetic pair of size x size grid scans of a multi-sample pin with
+    # n_crystals crystals evenly spaced along the pin
+    rng = np.random.default_rng(n_crystals)
+    well_width = size // n_crystals
+    data = (np.zeros((size, size), dtype=int), np.zeros((size, size), dtype=int))
+    for i in range(n_crystals):
+        x = slice(i * well_width + 1, (i + 1) * well_width - 1)
+        for d in data:
+            centre = rng.integers(5, size - 5)
+            d[x, centre - 2 : centre + 3] = rng.integers(10, 100)
+    multipin_sample_ids = {i + 1: 1000 + i for i in range(n_crystals)}
+    well_limits = [
+        (float(i * well_width), float((i + 1) * well_width)) for i in range(n_crystals)
+    ]
+    return data, multipin_sample_ids, well_limits
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("n_crystals", [1, 5, 10, 25])
+def test_gridscan3d_multipin_benchmark(n_crystals):
+    data, multipin_sample_ids, well_limits = _multipin_grid(n_crystals)
+    t0 = time.perf_counter()
+    results = dlstbx.util.xray_centering_3d.gridscan3d(
+        data,
+        threshold=0.25,
+        threshold_absolute=3,
+        sample_id=1000,
+        plot=False,
+        multipin_sample_ids=multipin_sample_ids,
+        well_limits=well_limits,
+    )
+    runtime = time.perf_counter() - t0
+    print(f"gridscan3d on 100x100x100 grid with {n_crystals} crystals: {runtime:.3f}s")
+
+    assert len(results) == n_crystals
+    assert sorted(r.sample_id for r in results) == sorted(multipin_sample_ids.values())
+    for result in results:
+        ((x0, y0, z0), (x1, y1, z1)) = result.bounding_box
+        assert result.n_voxels == (x1 - x0) * (y1 - y0) * (z1 - z0)
+        assert result.total_count == result.max_count * result.n_voxels
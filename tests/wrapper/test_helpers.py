@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import logging
+import os
+from unittest import mock
+
+from dlstbx.wrapper import helpers
+
+logger = logging.getLogger(__name__)
+
+
+def test_copy_results(tmp_path):
+    working_directory = tmp_path / "tmp" / "job" / "run"
+    results_directory = tmp_path / "results" / "job" / "run"
+    (working_directory / "sub").mkdir(parents=True)
+    (working_directory / "xia2.txt").write_text(
+        f"Output in {working_directory}\nScratch in /tmp/1234-abcd/run\n"
+    )
+    (working_directory / "sub" / "data.mtz").write_bytes(
+        b"\0" + os.fsencode(working_directory)
+    )
+    (working_directory / ".recipewrap").write_text("{}")
+    (working_directory / "link.txt").symlink_to(working_directory / "xia2.txt")
+
+    helpers.copy_results(
+        str(working_directory),
+        str(results_directory),
+        [".recipewrap"],
+        "1234-abcd",
+        logger,
+    )
+
+    assert (results_directory / "xia2.txt").read_text() == (
+        f"Output in {results_directory}\nScratch in {results_directory.parent}/run\n"
+    )
+    # Binary files are copied unchanged
+    assert (results_directory / "sub" / "data.mtz").read_bytes() == (
+        b"\0" + os.fsencode(working_directory)
+    )
+    assert not (results_directory / ".recipewrap").exists()
+    assert os.readlink(results_directory / "link.txt") == str(
+        working_directory / "xia2.txt"
+    )
+
+
+def test_copy_tree_follows_symlinks(tmp_path):
+    source = tmp_path / "DataFiles"
+    (source / "sub").mkdir(parents=True)
+    (source / "sub" / "data.mtz").write_text("mtz")
+    (tmp_path / "outside").mkdir()
+    (tmp_path / "outside" / "xia2.log").write_text("log")
+    (source / "link.mtz").symlink_to(source / "sub" / "data.mtz")
+    (source / "outside").symlink_to(tmp_path / "outside")
+
+    linked = tmp_path / "linked"
+    helpers.copy_tree(source, linked)
+    assert os.readlink(linked / "link.mtz") == str(source / "sub" / "data.mtz")
+    assert (linked / "outside").is_symlink()
+
+    copied = tmp_path / "copied"
+    statistics = helpers.copy_tree(source, copied, symlinks=False)
+    assert statistics.files == 3
+    assert not (copied / "link.mtz").is_symlink()
+    assert (copied / "link.mtz").read_text() == "mtz"
+    assert not (copied / "outside").is_symlink()
+    assert (copied / "outside" / "xia2.log").read_text() == "log"
+
+
+def test_copy_files_reports_statistics(tmp_path):
+    sources = []
+    for i in range(20):
+        source = tmp_path / f"{i}.txt"
+        source.write_text("x" * i)
+        sources.append(source)
+    destination = tmp_path / "copy"
+    destination.mkdir()
+
+    statistics = helpers.copy_files((s, destination / s.name) for s in sources)
+    assert statistics.files == 20
+    assert statistics.bytes == sum(range(20))
+    assert statistics.files_per_second > 0
+    assert sorted(p.name for p in destination.iterdir()) == sorted(
+        s.name for s in sources
+    )
+
+
+def test_fix_tmp_paths_in_logs(tmp_path):
+    working_directory = tmp_path / "tmp" / "job" / "run"
+    results_directory = tmp_path / "results" / "job" / "run"
+    results_directory.mkdir(parents=True)
+    log = results_directory / "big_ep.log"
+    log.write_text(f"{working_directory}/phaser.log\n")
+    unchanged = results_directory / "other.log"
+    unchanged.write_text("nothing to see\n")
+
+    binary = results_directory / "data.mtz"
+    binary.write_bytes(b"\0" + os.fsencode(working_directory))
+
+    helpers.fix_tmp_paths_in_logs(working_directory, results_directory, logger)
+    assert log.read_text() == f"{results_directory}/phaser.log\n"
+    assert unchanged.read_text() == "nothing to see\n"
+    assert binary.read_bytes() == b"\0" + os.fsencode(working_directory)
+
+
+def test_fix_acl_mask_runs_setfacl_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(helpers, "SETFACL_BATCH_SIZE", 2)
+    results_directory = tmp_path / "results"
+    (results_directory / "sub").mkdir(parents=True)
+    for name in ("a", "b", "sub/c"):
+        (results_directory / name).touch()
+
+    with mock.patch.object(helpers.subprocess, "run") as run:
+        run.return_value.returncode = 0
+        helpers.fix_acl_mask(tmp_path, "results", logger)
+
+    calls = [c.args[0] for c in run.call_args_list]
+    assert [c[:4] for c in calls] == [
+        ["setfacl", "-m", "m:rwx", "--"],
+        ["setfacl", "-m", "m:rw", "--"],
+        ["setfacl", "-m", "m:rw", "--"],
+    ]
+    assert sorted(calls[0][4:]) == sorted(
+        [str(results_directory), str(results_directory / "sub")]
+    )
+    assert sorted(calls[1][4:] + calls[2][4:]) == sorted(
+        str(results_directory / name) for name in ("a", "b", "sub/c")
+    )
+
+
+def test_fix_acl_mask_continues_after_failed_batch(tmp_path, monkeypatch):
+    monkeypatch.setattr(helpers, "SETFACL_BATCH_SIZE", 1)
+    results_directory = tmp_path / "results"
+    results_directory.mkdir()
+    for name in ("a", "b", "c"):
+        (results_directory / name).touch()
+
+    with mock.patch.object(helpers.subprocess, "run") as run:
+        run.return_value.returncode = 1
+        assert not helpers._setfacl(
+            "m:rw", [str(results_directory / n) for n in "abc"], tmp_path
+        )
+    assert run.call_count == 3